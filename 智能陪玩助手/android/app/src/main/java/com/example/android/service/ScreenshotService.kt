@@ -51,6 +51,9 @@ class ScreenshotService : Service() {
         private const val TAG = "ScreenshotService"
         private const val UPLOAD_URL = "http://%s/api/v3/bots/chat/completions"
         private const val SCREENSHOT_INTERVAL = 3000L
+        private const val MIN_SCREENSHOT_INTERVAL = 1000L
+        private const val MAX_SCREENSHOT_INTERVAL = 60000L
+        private const val NEXT_CAPTURE_DELAY_HEADER = "X-Next-Capture-Delay-Ms"
         private const val VIRTUAL_DISPLAY_NAME = "ScreenshotService"
         private const val MAX_UPLOAD_RETRIES = 3
         private const val UPLOAD_RETRY_DELAY = 1000L
@@ -65,6 +68,9 @@ class ScreenshotService : Service() {
     private var isCapturing = false
     private var isProcessingRequest = false
     private var isPlayingAudio = false
+    // 服务端建议的下一次截图间隔，由上传线程写入、主线程读取
+    @Volatile
+    private var nextCaptureDelay = SCREENSHOT_INTERVAL
     private var screenWidth = 0
     private var screenHeight = 0
     private var screenDensity = 0
@@ -264,6 +270,7 @@ class ScreenshotService : Service() {
     private fun startPeriodicScreenshot() {
         if (isCapturing) return
         isCapturing = true
+        nextCaptureDelay = SCREENSHOT_INTERVAL
 
         // 确保 ImageReader 和 VirtualDisplay 都已创建
         setupScreenCapture()
@@ -286,8 +293,8 @@ class ScreenshotService : Service() {
                     takeScreenshot()
                 }
                 
-                // 无论是否处理了截图，都按固定间隔继续检查
-                handler.postDelayed(this, SCREENSHOT_INTERVAL)
+                // 按服务端建议的间隔继续（负载高或画面静止时放慢）
+                handler.postDelayed(this, nextCaptureDelay)
             }
         })
         Log.d(TAG, "Periodic screenshot started")
@@ -428,6 +435,10 @@ class ScreenshotService : Service() {
                     Log.d("ScreenshotService", "ScreenshotService: " + contextId)
                     val response = okHttpClient.newCall(request).execute()
                     val responseCode = response.code
+                    response.header(NEXT_CAPTURE_DELAY_HEADER)?.toLongOrNull()?.let {
+                        nextCaptureDelay = it.coerceIn(MIN_SCREENSHOT_INTERVAL, MAX_SCREENSHOT_INTERVAL)
+                        Log.d(TAG, "Next capture delay: $nextCaptureDelay ms")
+                    }
 
                     if (response.isSuccessful) {
                         Log.d(TAG, "Upload successful")
@@ -0,0 +1,54 @@
+"""
+对比多次压测结果（load_test.py 的 JSON 输出）
+
+用法：
+    python benchmark/compare.py benchmark/results/workers1.json benchmark/results/workers4.json
+"""
+
+import json
+import sys
+
+METRICS = ["chat_ttfc", "chat_ttfa", "screenshot_ack", "asr_first_result", "server_loop_lag_max"]
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(paths) -> int:
+    if not paths:
+        print(__doc__)
+        return 1
+    runs = [(p, load(p)) for p in paths]
+    print(f"{'run':<32}{'clients':>8}{'chats/s':>10}{'shots/s':>10}{'err%':>8}", end="")
+    for name in METRICS:
+        print(f"{name + ' p95':>26}", end="")
+    print(f"{'server cpu%':>14}{'workers cpu%':>14}")
+    for path, result in runs:
+        label = result["meta"].get("label") or path
+        duration = result["config"]["duration"] or 1
+        counters = result.get("counters", {})
+        # 对话与截图请求中失败（503 限流、超时、断连）的比例；chats/s、shots/s 为完成的请求数。
+        # chat_empty（没有内容块的回复）已计入 chats，不算失败
+        failed = sum(
+            n for name, n in result.get("errors", {}).items()
+            if name.startswith(("chat_", "screenshot_")) and name != "chat_empty"
+        )
+        requests = counters.get("chats", 0) + counters.get("screenshots", 0) + failed
+        print(f"{label[:31]:<32}{result['config']['clients']:>8}"
+              f"{counters.get('chats', 0) / duration:>10.2f}{counters.get('screenshots', 0) / duration:>10.2f}"
+              f"{failed / max(requests, 1) * 100:>8.1f}", end="")
+        for name in METRICS:
+            value = result["latency"].get(name, {}).get("p95_ms")
+            print(f"{'-' if value is None else f'{value:.1f}ms':>26}", end="")
+        # --server-pid 指向的进程（多进程模式下为前置路由）与其子进程的 CPU 占用，单核为 100%
+        cpu = result.get("cpu") or {}
+        for key in ("server_percent", "children_percent"):
+            print(f"{'-' if cpu.get(key) is None else cpu[key]:>14}", end="")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+"""
+会话历史内存占用：ArkMessage 对象 对比 紧凑记录（history.Record）
+
+用法：
+    python benchmark/history_memory.py                       # 默认 10000 个会话 × 200 条消息
+    python benchmark/history_memory.py --sessions 2000 --messages 400 --hot 180
+
+用 tracemalloc 统计构造全部会话历史后新增的内存；未安装 arkitect 时以普通 dict 作为对照。
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import history  # noqa: E402
+
+
+def make_message(i):
+    if i % 3 == 0:
+        return {
+            "role": "assistant",
+            "content": f"视频帧描述：第 {i} 帧，角色站在城门前，血量还剩一半，右上角有任务提示，"
+                       "左下角的小地图显示附近有两个敌人正在靠近，背包里还有三瓶药水。" * 2,
+        }
+    if i % 3 == 1:
+        return {"role": "user", "content": f"第 {i} 句：这个 boss 要怎么打？"}
+    return {"role": "assistant", "content": f"第 {i} 句回复：先躲开它的冲锋，等技能冷却再输出哦～"}
+
+
+def measure(build, sessions, messages):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = [build(messages) for _ in range(sessions)]
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    gc.collect()
+    return current, elapsed
+
+
+def build_records(messages):
+    records = []
+    for i in range(messages):
+        records.append(history.Record.from_message(make_message(i)))
+        history.compress_cold(records)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比会话历史的内存占用")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--hot", type=int, default=history.HOT_MESSAGES, help="保持不压缩的最近消息数")
+    args = parser.parse_args(argv)
+    history.HOT_MESSAGES = args.hot
+
+    try:
+        from arkitect.types.llm.model import ArkMessage
+
+        baseline_name = "ArkMessage"
+
+        def build_baseline(messages):
+            return [ArkMessage(**make_message(i)) for i in range(messages)]
+    except ImportError:
+        baseline_name = "dict（未安装 arkitect）"
+
+        def build_baseline(messages):
+            return [make_message(i) for i in range(messages)]
+
+    total = args.sessions * args.messages
+    print(f"{args.sessions} 个会话 × {args.messages} 条消息，最近 {args.hot} 条不压缩\n")
+    print(f"{'存储方式':<24} {'内存 MB':>10} {'每条字节':>10} {'构造 s':>8}")
+    for name, build in ((baseline_name, build_baseline), ("history.Record", build_records)):
+        used, elapsed = measure(build, args.sessions, args.messages)
+        print(f"{name:<24} {used / 2**20:>10.1f} {used / total:>10.0f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
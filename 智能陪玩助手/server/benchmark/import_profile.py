@@ -0,0 +1,56 @@
+"""
+导入耗时分析：在子进程中以 -X importtime 导入 main，按累计耗时列出最慢的模块
+
+用法：
+    python benchmark/import_profile.py            # 默认列出前 25 个
+    python benchmark/import_profile.py --top 50
+    python benchmark/import_profile.py --module arkitect.core.component.tts
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def profile(module: str):
+    """返回 [(累计微秒, 自身微秒, 模块名)]，按累计耗时降序"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise SystemExit(f"导入 {module} 失败：\n" + "\n".join(tail[-20:]))
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+    return sorted(rows, reverse=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分析 HGDoll 服务端的导入耗时")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    rows = profile(args.module)
+    total = next((c for c, _, name in rows if name.strip() == args.module), rows[0][0] if rows else 0)
+    print(f"import {args.module}: {total / 1000:.1f} ms（共 {len(rows)} 个模块）\n")
+    print(f"{'累计 ms':>10} {'自身 ms':>10}  模块")
+    for cumulative, self_us, name in rows[:args.top]:
+        print(f"{cumulative / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
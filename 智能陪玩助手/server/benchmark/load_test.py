@@ -0,0 +1,555 @@
+"""
+HGDoll 端到端压测工具
+
+模拟 N 个 Web 插件客户端同时在线，每个客户端：
+1. 按固定间隔上传截图（同 background.js 的 uploadScreenshot）
+2. 周期性发送流式聊天（同 background.js 的 sendChatMessage）
+3. 可选：通过 /ws/asr 以实时速率推送 PCM 音频（同 content.js 的录音上行）
+
+--transport session 时截图与对话改走单条 /ws/session 长连接，用于对比逐请求 HTTP 的开销。
+
+统计 p50/p95/p99 的首包时延、首音频时延、截图确认时延、服务端事件循环延迟、RSS 与 CPU 占用，
+并将结果写入 JSON 文件，便于不同版本之间对比。多进程模式下 --server-pid 传前置路由进程，
+CPU 占用分别统计路由进程本身与其子进程（各 worker）。
+
+用法：
+    python benchmark/load_test.py --base-url http://127.0.0.1:8888 --clients 20 --duration 60 \\
+        --output benchmark/results/run.json --server-pid $(pgrep -f "src/main.py")
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import aiohttp
+
+CHAT_PATH = "/api/v3/bots/chat/completions"
+PING_PATH = "/v1/ping"
+LOOP_PATH = "/debug/loop"
+ASR_PATH = "/ws/asr"
+SESSION_PATH = "/ws/session"
+BOT_MODEL = "bot-20241114164326-xlcc91"
+PROACTIVE_TEXT = "根据你刚才看到的画面，和我聊聊吧"
+
+ASR_SAMPLE_RATE = 16000
+ASR_CHUNK_MS = 100  # content.js 每 100ms 左右上送一次 PCM
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """线性插值百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """将一组采样（秒）汇总为毫秒统计"""
+    def ms(v):
+        return None if v is None else round(v * 1000, 2)
+
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(max(values)) if values else None,
+    }
+
+
+def read_rss_bytes(pid: int) -> Optional[int]:
+    """从 /proc/<pid>/status 读取常驻内存（仅 Linux）"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+def read_cpu_seconds(pid: int) -> Optional[float]:
+    """从 /proc/<pid>/stat 读取累计 CPU 时间（用户态 + 内核态，仅 Linux）"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as f:
+            # 进程名可能含空格，从最后一个右括号之后开始数字段
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def child_pids(pid: int) -> List[int]:
+    """进程的直接子进程（多进程模式下即各 worker）"""
+    pids: List[int] = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", encoding="utf-8") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return pids
+
+
+def cpu_snapshot(pid: int) -> Dict[str, float]:
+    """服务端进程与其子进程各自的累计 CPU 时间"""
+    own = read_cpu_seconds(pid)
+    children = [read_cpu_seconds(child) for child in child_pids(pid)]
+    return {
+        "server": own or 0.0,
+        "children": sum(c for c in children if c is not None),
+    }
+
+
+class Recorder:
+    """收集各项采样与错误计数"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {
+            "chat_ttfc": [],
+            "chat_ttfa": [],
+            "chat_total": [],
+            "screenshot_ack": [],
+            "asr_first_result": [],
+            "ping_latency": [],
+            "server_loop_lag_max": [],
+        }
+        self.errors: Dict[str, int] = {}
+        self.rss: List[int] = []
+        self.counters: Dict[str, int] = {}
+
+    def add(self, name: str, value: float) -> None:
+        self.samples[name].append(value)
+
+    def error(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+class PluginClient:
+    """单个模拟插件客户端"""
+
+    # 为 True 时由服务端决定何时主动发言（proactive.py），客户端不再按截图数触发
+    server_proactive = False
+
+    def __init__(self, index: int, args, session: aiohttp.ClientSession, recorder: Recorder, image_b64: str):
+        self.index = index
+        self.args = args
+        self.session = session
+        self.recorder = recorder
+        self.image_b64 = image_b64
+        self.context_id = str(uuid.uuid4())
+        self.headers = {"Content-Type": "application/json", "X-Context-Id": self.context_id}
+
+    async def run(self, deadline: float) -> None:
+        # 错开启动时间，避免所有客户端在同一时刻发请求
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        await self.chat("应用初始化")
+        tasks = [asyncio.create_task(self.screenshot_loop(deadline))]
+        if self.args.chat_interval > 0:
+            tasks.append(asyncio.create_task(self.chat_loop(deadline)))
+        if self.args.asr:
+            tasks.append(asyncio.create_task(self.asr_loop(deadline)))
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def screenshot_loop(self, deadline: float) -> None:
+        count = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            hint = await self.upload_screenshot()
+            count += 1
+            # 同插件：每 N 次截图后主动发起一次对话
+            if not self.server_proactive and self.args.proactive_every > 0 and count % self.args.proactive_every == 0:
+                asyncio.create_task(self.chat(PROACTIVE_TEXT))
+            elapsed = time.monotonic() - started
+            # 同插件：按服务端建议的间隔安排下一次截图（--fixed-interval 时忽略）
+            interval = self.args.screenshot_interval
+            if hint is not None and not self.args.fixed_interval:
+                interval = min(60.0, max(1.0, hint / 1000))
+            await asyncio.sleep(max(0.0, interval - elapsed))
+
+    async def chat_loop(self, deadline: float) -> None:
+        await asyncio.sleep(random.uniform(0, self.args.chat_interval))
+        while time.monotonic() < deadline:
+            await self.chat(f"测试消息 {self.index}-{int(time.time())}")
+            await asyncio.sleep(self.args.chat_interval)
+
+    async def upload_screenshot(self) -> Optional[int]:
+        """上传一帧截图，返回服务端建议的下一次截图间隔（毫秒）"""
+        body = {
+            "model": BOT_MODEL,
+            "stream": False,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": ""},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{self.image_b64}"}},
+                ],
+            }],
+        }
+        t0 = time.monotonic()
+        try:
+            async with self.session.post(self.args.base_url + CHAT_PATH, json=body, headers=self.headers) as resp:
+                await resp.read()
+                hint = resp.headers.get("X-Next-Capture-Delay-Ms")
+                if resp.status != 200:
+                    self.recorder.error(f"screenshot_http_{resp.status}")
+                    return None
+            self.recorder.add("screenshot_ack", time.monotonic() - t0)
+            self.recorder.incr("screenshots")
+            return int(hint) if hint and hint.isdigit() else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.error(f"screenshot_{type(e).__name__}")
+            return None
+
+    async def chat(self, text: str) -> None:
+        body = {
+            "model": BOT_MODEL,
+            "stream": True,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": text}]}],
+        }
+        if self.args.chat_with_frame:
+            body["messages"][0]["content"].append(
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{self.image_b64}"}}
+            )
+        t0 = time.monotonic()
+        first_chunk = None
+        first_audio = None
+        try:
+            async with self.session.post(self.args.base_url + CHAT_PATH, json=body, headers=self.headers) as resp:
+                if resp.status != 200:
+                    await resp.read()
+                    self.recorder.error(f"chat_http_{resp.status}")
+                    return
+                async for raw in resp.content:
+                    line = raw.decode("utf-8", "ignore").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        continue
+                    now = time.monotonic()
+                    if first_chunk is None:
+                        first_chunk = now
+                    if first_audio is None and '"data"' in payload:
+                        try:
+                            chunk = json.loads(payload)
+                            delta = chunk["choices"][0].get("delta") or {}
+                            if (delta.get("audio") or {}).get("data"):
+                                first_audio = now
+                        except (ValueError, KeyError, IndexError):
+                            pass
+            total = time.monotonic() - t0
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.error(f"chat_{type(e).__name__}")
+            return
+        self.recorder.incr("chats")
+        self.recorder.add("chat_total", total)
+        if first_chunk is not None:
+            self.recorder.add("chat_ttfc", first_chunk - t0)
+        else:
+            self.recorder.error("chat_empty")
+        if first_audio is not None:
+            self.recorder.add("chat_ttfa", first_audio - t0)
+
+    async def asr_loop(self, deadline: float) -> None:
+        ws_url = self.args.base_url.replace("http://", "ws://").replace("https://", "wss://") + ASR_PATH
+        chunk_bytes = ASR_SAMPLE_RATE * 2 * ASR_CHUNK_MS // 1000
+        # 低幅度噪声，模拟有人说话的 PCM
+        pcm = bytes(random.getrandbits(8) & 0x0F for _ in range(chunk_bytes))
+        audio_b64 = base64.b64encode(pcm).decode()
+        while time.monotonic() < deadline:
+            try:
+                async with self.session.ws_connect(ws_url) as ws:
+                    self.recorder.incr("asr_sessions")
+                    t0 = time.monotonic()
+                    got_first = asyncio.Event()
+
+                    async def reader():
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                continue
+                            if not got_first.is_set() and '"text"' in msg.data:
+                                self.recorder.add("asr_first_result", time.monotonic() - t0)
+                                got_first.set()
+                            self.recorder.incr("asr_messages")
+
+                    reader_task = asyncio.create_task(reader())
+                    seq = 0
+                    utterance_end = min(deadline, time.monotonic() + self.args.asr_utterance)
+                    while time.monotonic() < utterance_end and not ws.closed:
+                        seq += 1
+                        await ws.send_str(json.dumps({"audio_data": audio_b64, "sequence": seq}))
+                        self.recorder.incr("asr_chunks")
+                        await asyncio.sleep(ASR_CHUNK_MS / 1000)
+                    reader_task.cancel()
+                    await asyncio.gather(reader_task, return_exceptions=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.recorder.error(f"asr_{type(e).__name__}")
+            await asyncio.sleep(self.args.asr_pause)
+
+
+class SessionClient(PluginClient):
+    """通过 /ws/session 单连接收发截图与对话（--transport session，不含 ASR）"""
+
+    server_proactive = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.image_bytes = base64.b64decode(self.image_b64)
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        # 服务端按收到的顺序确认截图、按发起的顺序执行对话轮次，因此用 FIFO 对应请求与响应
+        self.frame_acks: Deque[asyncio.Future] = deque()
+        self.pending_turns: Deque[dict] = deque()
+        self.turns: Dict[int, dict] = {}
+
+    async def run(self, deadline: float) -> None:
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        url = self.args.base_url.replace("http://", "ws://").replace("https://", "wss://")
+        url += f"{SESSION_PATH}?context_id={self.context_id}"
+        try:
+            async with self.session.ws_connect(url, max_msg_size=0) as ws:
+                self.ws = ws
+                reader = asyncio.create_task(self.read_loop())
+                await self.chat("应用初始化")
+                tasks = [asyncio.create_task(self.screenshot_loop(deadline))]
+                if self.args.chat_interval > 0:
+                    tasks.append(asyncio.create_task(self.chat_loop(deadline)))
+                await asyncio.gather(*tasks, return_exceptions=True)
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.error(f"session_{type(e).__name__}")
+
+    async def read_loop(self) -> None:
+        async for msg in self.ws:
+            now = time.monotonic()
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                state = self.turns.get(int.from_bytes(msg.data[1:5], "big"))
+                if state is not None and state["first_audio"] is None:
+                    state["first_audio"] = now
+                continue
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            event = data.get("event")
+            if data["type"] == "transcript" and data.get("source") == "bot":
+                state = self.turns.get(data["turn"])
+                if state is not None and state["first_chunk"] is None:
+                    state["first_chunk"] = now
+            elif event == "turn_start" and data.get("source") == "proactive":
+                self.recorder.incr("proactive_pushed")
+            elif event == "turn_start" and data.get("source") == "chat" and self.pending_turns:
+                self.turns[data["turn"]] = self.pending_turns.popleft()
+            elif event == "turn_end":
+                state = self.turns.pop(data["turn"], None)
+                if state is not None and not state["done"].done():
+                    state["done"].set_result(None)
+            elif event == "capture_delay" or (event == "error" and "截图" in data.get("message", "")):
+                if self.frame_acks:
+                    ack = self.frame_acks.popleft()
+                    if not ack.done():
+                        ack.set_result(data.get("ms"))
+
+    async def upload_screenshot(self) -> Optional[int]:
+        ack = asyncio.get_running_loop().create_future()
+        self.frame_acks.append(ack)
+        t0 = time.monotonic()
+        try:
+            await self.ws.send_bytes(b"\x01" + self.image_bytes)
+            hint = await asyncio.wait_for(ack, self.args.request_timeout)
+        except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError) as e:
+            self.recorder.error(f"screenshot_{type(e).__name__}")
+            return None
+        self.recorder.add("screenshot_ack", time.monotonic() - t0)
+        self.recorder.incr("screenshots")
+        return hint
+
+    async def chat(self, text: str) -> None:
+        state = {"first_chunk": None, "first_audio": None, "done": asyncio.get_running_loop().create_future()}
+        self.pending_turns.append(state)
+        t0 = time.monotonic()
+        try:
+            await self.ws.send_str(json.dumps({"type": "chat", "text": text}, ensure_ascii=False))
+            await asyncio.wait_for(state["done"], self.args.request_timeout)
+        except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError) as e:
+            self.recorder.error(f"chat_{type(e).__name__}")
+            return
+        self.recorder.incr("chats")
+        self.recorder.add("chat_total", time.monotonic() - t0)
+        if state["first_chunk"] is not None:
+            self.recorder.add("chat_ttfc", state["first_chunk"] - t0)
+        else:
+            self.recorder.error("chat_empty")
+        if state["first_audio"] is not None:
+            self.recorder.add("chat_ttfa", state["first_audio"] - t0)
+
+
+async def monitor(args, session: aiohttp.ClientSession, recorder: Recorder, deadline: float) -> None:
+    """
+    周期性采样服务端状态：
+    - /v1/ping 往返时延：服务端为单进程事件循环，ping 排队时间即近似事件循环延迟
+    - /debug/loop 上报的服务端事件循环延迟（服务端自身采样）
+    - 服务端进程 RSS（需 --server-pid，且与服务端在同一台机器）
+    """
+    while time.monotonic() < deadline:
+        t0 = time.monotonic()
+        try:
+            async with session.get(args.base_url + PING_PATH) as resp:
+                await resp.read()
+            recorder.add("ping_latency", time.monotonic() - t0)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            recorder.error("ping")
+        try:
+            async with session.get(args.base_url + LOOP_PATH) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    # 多进程模式下前置路由汇总各 worker 的结果，取最慢的一个
+                    reports = data["workers"] if "workers" in data else [data]
+                    lags = [r["lag_ms"]["max"] for r in reports if r.get("lag_ms", {}).get("max") is not None]
+                    if lags:
+                        recorder.add("server_loop_lag_max", max(lags) / 1000)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            recorder.error("debug_loop")
+        if args.server_pid:
+            rss = read_rss_bytes(args.server_pid)
+            if rss is not None:
+                recorder.rss.append(rss)
+        await asyncio.sleep(args.sample_interval)
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    image_b64 = base64.b64encode(os.urandom(args.image_kb * 1024)).decode()
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        deadline = time.monotonic() + args.duration
+        client_cls = SessionClient if args.transport == "session" else PluginClient
+        clients = [client_cls(i, args, session, recorder, image_b64) for i in range(args.clients)]
+        started = time.time()
+        cpu_before = cpu_snapshot(args.server_pid) if args.server_pid else None
+        await asyncio.gather(
+            monitor(args, session, recorder, deadline),
+            *(c.run(deadline) for c in clients),
+        )
+        finished = time.time()
+        cpu_after = cpu_snapshot(args.server_pid) if args.server_pid else None
+
+    cpu = {}
+    if cpu_before and cpu_after:
+        wall = max(finished - started, 1e-6)
+        # 百分比以单核为 100%
+        cpu = {
+            "server_percent": round((cpu_after["server"] - cpu_before["server"]) / wall * 100, 1),
+            "children_percent": round((cpu_after["children"] - cpu_before["children"]) / wall * 100, 1),
+        }
+
+    return {
+        "meta": {
+            "started_at": started,
+            "finished_at": finished,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "label": args.label,
+        },
+        "config": {
+            "base_url": args.base_url,
+            "transport": args.transport,
+            "clients": args.clients,
+            "duration": args.duration,
+            "screenshot_interval": args.screenshot_interval,
+            "fixed_interval": args.fixed_interval,
+            "chat_interval": args.chat_interval,
+            "proactive_every": args.proactive_every,
+            "asr": args.asr,
+            "image_kb": args.image_kb,
+        },
+        "latency": {name: summarize(values) for name, values in recorder.samples.items()},
+        "rss": {
+            "samples": len(recorder.rss),
+            "max_bytes": max(recorder.rss) if recorder.rss else None,
+            "last_bytes": recorder.rss[-1] if recorder.rss else None,
+        },
+        "cpu": cpu,
+        "counters": recorder.counters,
+        "errors": recorder.errors,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"\n== HGDoll 压测结果 ({result['config']['clients']} clients, {result['config']['duration']}s) ==")
+    print(f"{'metric':<20}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, s in result["latency"].items():
+        def fmt(v):
+            return "-" if v is None else f"{v:.1f}"
+        print(f"{name:<20}{s['count']:>8}{fmt(s['p50_ms']):>10}{fmt(s['p95_ms']):>10}"
+              f"{fmt(s['p99_ms']):>10}{fmt(s['max_ms']):>10}")
+    if result["rss"]["max_bytes"]:
+        print(f"server RSS max: {result['rss']['max_bytes'] / 1024 / 1024:.1f} MiB")
+    if result["cpu"]:
+        print(f"server CPU: {result['cpu']['server_percent']}%  children CPU: {result['cpu']['children_percent']}%")
+    print(f"counters: {result['counters']}")
+    if result["errors"]:
+        print(f"errors: {result['errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HGDoll 端到端压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8888")
+    parser.add_argument("--transport", choices=("http", "session"), default="http",
+                        help="http：同插件的逐请求 POST；session：单条 /ws/session 长连接")
+    parser.add_argument("--clients", type=int, default=10, help="并发模拟的插件客户端数量")
+    parser.add_argument("--duration", type=float, default=60, help="压测时长（秒）")
+    parser.add_argument("--ramp-up", type=float, default=3, help="客户端启动的随机错开时间（秒）")
+    parser.add_argument("--screenshot-interval", type=float, default=3, help="截图上传间隔（秒），同插件默认值")
+    parser.add_argument("--fixed-interval", action="store_true", help="忽略服务端的 X-Next-Capture-Delay-Ms，固定间隔截图")
+    parser.add_argument("--chat-interval", type=float, default=20, help="用户主动聊天间隔（秒），0 表示不发")
+    parser.add_argument("--chat-with-frame", action="store_true",
+                        help="聊天消息附带当前截图（仅 http），用于对比 HGDOLL_VISION_CHAT 开关的首包时延")
+    parser.add_argument("--proactive-every", type=int, default=5, help="每 N 次截图触发一次主动对话，0 表示关闭")
+    parser.add_argument("--asr", action="store_true", help="同时通过 /ws/asr 推送 PCM 音频")
+    parser.add_argument("--asr-utterance", type=float, default=4, help="每段语音时长（秒）")
+    parser.add_argument("--asr-pause", type=float, default=6, help="两段语音之间的间隔（秒）")
+    parser.add_argument("--image-kb", type=int, default=120, help="模拟截图大小（KB，编码前）")
+    parser.add_argument("--request-timeout", type=float, default=30, help="单请求超时，同插件 CHAT_TIMEOUT_MS")
+    parser.add_argument("--sample-interval", type=float, default=1, help="服务端状态采样间隔（秒）")
+    parser.add_argument("--server-pid", type=int, default=0, help="服务端进程 PID，用于采样 RSS")
+    parser.add_argument("--label", default="", help="本次运行的标签，写入结果文件")
+    parser.add_argument("--output", default="", help="结果 JSON 输出路径")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+使用模拟上游（LLM / VLM / TTS / ASR）启动 HGDoll 服务端
+
+所有上游调用被替换为延迟可配的本地实现，服务端自身的代码路径（上下文存储、
+流式输出、ASR 代理等）保持不变。用于在无 API Key、无外网的环境下压测服务端本身的开销。
+
+用法：
+    python benchmark/mock_upstreams.py --port 8888 --llm-first-token-ms 300 --tts-connect-ms 80
+    python benchmark/load_test.py --base-url http://127.0.0.1:8888 --server-pid <pid>
+
+    # 多进程模式（前置路由 + N 个 worker），用于验证随核数的扩展性
+    python benchmark/mock_upstreams.py --port 8888 --workers 4
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import gzip
+import json
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import main  # noqa: E402
+from arkitect.types.llm.model import ArkChatCompletionChunk, ArkChatResponse  # noqa: E402
+
+MOCK_REPLY = "哇，这波操作太帅了！我们继续加油吧！"
+MOCK_FRAME_DESCRIPTION = "这是一个斗地主游戏的出牌界面\n玩家当前是地主身份\n手牌区域显示有炸弹和顺子"
+MOCK_FRAME_STATE = json.dumps(
+    {"game": "斗地主", "phase": "出牌阶段", "role": "地主", "resources": {"手牌": "12张", "炸弹": "1个"}},
+    ensure_ascii=False,
+)
+
+
+class MockSettings:
+    llm_first_token_ms = 300
+    llm_token_ms = 20
+    vlm_ms = 800
+    vlm_first_token_ms = 500
+    tts_connect_ms = 80
+    tts_first_audio_ms = 150
+    audio_chunk_bytes = 4096
+    asr_result_every = 10
+
+
+def _chunk(content: str, finish: bool = False) -> ArkChatCompletionChunk:
+    return ArkChatCompletionChunk.model_validate({
+        "id": "mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "mock",
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": content},
+            "finish_reason": "stop" if finish else None,
+        }],
+    })
+
+
+class MockChatModel:
+    """替代 BaseChatLanguageModel：按配置延迟吐出固定回复"""
+
+    def __init__(self, model: str = "", messages=None, parameters=None, **kwargs):
+        self.model = model
+        self.messages = messages or []
+
+    async def astream(self):
+        # 带图片的对话（vision_chat 的单次 VLM 调用）按 VLM 的首 token 时延
+        with_image = bool(self.messages) and isinstance(self.messages[-1].content, list)
+        first_token_ms = MockSettings.vlm_first_token_ms if with_image else MockSettings.llm_first_token_ms
+        await asyncio.sleep(first_token_ms / 1000)
+        tokens = [MOCK_REPLY[i:i + 2] for i in range(0, len(MOCK_REPLY), 2)]
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(MockSettings.llm_token_ms / 1000)
+            yield _chunk(token, finish=(i == len(tokens) - 1))
+
+    async def arun(self):
+        await asyncio.sleep(MockSettings.vlm_ms / 1000)
+        # 结构化画面状态模式（scene_state.py）下返回状态 JSON
+        structured = main.scene_state.ENABLED
+        return ArkChatResponse.model_validate({
+            "id": "mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": MOCK_FRAME_STATE if structured else MOCK_FRAME_DESCRIPTION},
+                "finish_reason": "stop",
+            }],
+        })
+
+
+class MockTTSClient:
+    """替代 AsyncTTSClient：每段文本产出一块假音频"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def init(self):
+        await asyncio.sleep(MockSettings.tts_connect_ms / 1000)
+
+    async def tts(self, source, stream: bool = True):
+        first = True
+        async for chunk in source:
+            text = chunk.choices[0].delta.content if chunk.choices else ""
+            if first:
+                await asyncio.sleep(MockSettings.tts_first_audio_ms / 1000)
+                first = False
+            yield text, os.urandom(MockSettings.audio_chunk_bytes)
+
+    async def close(self):
+        pass
+
+
+async def mock_create_bot_audio_responses(tts_output, request):
+    """替代 create_bot_audio_responses：把 (文本, 音频) 转为带 audio 的响应"""
+    transcript = []
+    audio = []
+    async for text, data in tts_output:
+        if request.stream:
+            yield ArkChatCompletionChunk.model_validate({
+                "id": "mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "audio": {
+                        "id": "mock", "transcript": text, "data": base64.b64encode(data).decode(),
+                    }},
+                }],
+            })
+        else:
+            transcript.append(text)
+            audio.append(data)
+    if not request.stream:
+        yield ArkChatResponse.model_validate({
+            "id": "mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None, "audio": {
+                    "id": "mock",
+                    "transcript": "".join(transcript),
+                    "data": base64.b64encode(b"".join(audio)).decode(),
+                    "expires_at": int(time.time()) + 3600,
+                }},
+                "finish_reason": "stop",
+            }],
+        })
+
+
+def _asr_server_response(text: str, definite: bool, sequence: int) -> bytes:
+    payload = gzip.compress(json.dumps({"result": [{"text": text, "definite": definite}]}).encode())
+    header = bytes([
+        (0x01 << 4) | 0x01,
+        (0x09 << 4) | 0x01,  # FULL_SERVER_RESPONSE | POS_SEQUENCE
+        (0x01 << 4) | 0x01,  # JSON | GZIP
+        0x00,
+    ])
+    return header + struct.pack(">I", sequence) + struct.pack(">I", len(payload)) + payload
+
+
+async def mock_asr_handler(ws, *args):
+    """模拟 Doubao 流式 ASR：每 N 个音频包返回一次中间结果，随后给出最终结果"""
+    import websockets.exceptions
+
+    chunks = 0
+    try:
+        await ws.recv()  # 初始化消息
+        async for _ in ws:
+            chunks += 1
+            if chunks % MockSettings.asr_result_every == 0:
+                definite = chunks % (MockSettings.asr_result_every * 3) == 0
+                await ws.send(_asr_server_response("你好呀", definite, chunks))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+def install(settings: argparse.Namespace) -> None:
+    """把模拟上游注入 main 模块"""
+    MockSettings.llm_first_token_ms = settings.llm_first_token_ms
+    MockSettings.llm_token_ms = settings.llm_token_ms
+    MockSettings.vlm_ms = settings.vlm_ms
+    MockSettings.vlm_first_token_ms = settings.vlm_first_token_ms
+    MockSettings.tts_connect_ms = settings.tts_connect_ms
+    MockSettings.tts_first_audio_ms = settings.tts_first_audio_ms
+    main.BaseChatLanguageModel = MockChatModel
+    main.AsyncTTSClient = MockTTSClient
+    main.create_bot_audio_responses = mock_create_bot_audio_responses
+    main.ASR_URL = f"ws://127.0.0.1:{settings.asr_port}"
+    # 模拟上游不走 HTTP，不需要共享连接池与预建连接
+    main.model_client.ENABLED = False
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以模拟上游启动 HGDoll 服务端")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--asr-port", type=int, default=18765)
+    parser.add_argument("--llm-first-token-ms", type=float, default=300)
+    parser.add_argument("--llm-token-ms", type=float, default=20)
+    parser.add_argument("--vlm-ms", type=float, default=800)
+    parser.add_argument("--vlm-first-token-ms", type=float, default=500, help="带图对话流式 VLM 的首 token 时延")
+    parser.add_argument("--tts-connect-ms", type=float, default=80)
+    parser.add_argument("--tts-first-audio-ms", type=float, default=150)
+    parser.add_argument("--workers", type=int, default=1, help="大于 1 时以多进程模式启动（见 src/cluster.py）")
+    return parser.parse_args(argv)
+
+
+def run_server(args: argparse.Namespace, index: int, port: int) -> None:
+    """启动一个使用模拟上游的服务进程；多进程模式下每个 worker 使用独立的模拟 ASR 端口"""
+    import uvicorn
+    import websockets
+
+    args.asr_port += index
+    install(args)
+    app = main.create_app()
+
+    async def start_mock_asr():
+        app.state.mock_asr = await websockets.serve(mock_asr_handler, "127.0.0.1", args.asr_port)
+
+    app.router.on_startup.append(start_mock_asr)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.workers > 1:
+        import cluster
+
+        cluster.serve(args.port, args.workers, host="127.0.0.1", target=functools.partial(run_server, args))
+    else:
+        print(f"模拟上游服务启动在 http://127.0.0.1:{args.port} (pid={os.getpid()})")
+        run_server(args, 0, args.port)
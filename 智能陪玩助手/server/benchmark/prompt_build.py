@@ -0,0 +1,114 @@
+"""
+对话请求体组装耗时：SDK 构造（ArkChatRequest 校验 + model_dump + json.dumps）对比拼接缓存字节（chat_body）
+
+用法：
+    python benchmark/prompt_build.py
+    python benchmark/prompt_build.py --lengths 10,60,180,360 --repeat 500
+
+未安装 arkitect 时只测拼接方式，以及不经 pydantic 的「字典 + json.dumps」作为参照。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import chat_body  # noqa: E402
+
+SYSTEM_PROMPT = "你是一个陪用户玩游戏的虚拟伙伴。" * 40
+PARAMETERS = {"temperature": 0.8, "stream_options": {"include_usage": True}}
+
+
+def make_history(n):
+    history = []
+    for i in range(n):
+        if i % 3 == 0:
+            history.append({"role": "assistant", "content": f"视频帧描述：第 {i} 帧，角色站在城门前，血量还剩一半，右上角有任务提示。"})
+        elif i % 3 == 1:
+            history.append({"role": "user", "content": f"第 {i} 句：这个 boss 要怎么打？"})
+        else:
+            history.append({"role": "assistant", "content": f"第 {i} 句回复：先躲开它的冲锋，等技能冷却再输出哦～"})
+    return history
+
+
+def timeit(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def bench_spliced(history, repeat):
+    serialized = [chat_body.encode_message(m) for m in history]
+    user = {"role": "user", "content": "现在该往哪走？"}
+
+    def build():
+        chat_body.build(
+            "ep-llm",
+            [chat_body.system_message(SYSTEM_PROMPT), *serialized, chat_body.encode_message(user)],
+            PARAMETERS,
+        )
+
+    return timeit(build, repeat)
+
+
+def bench_dict_json(history, repeat):
+    user = {"role": "user", "content": "现在该往哪走？"}
+
+    def build():
+        body = {"model": "ep-llm", "stream": True, **PARAMETERS}
+        body["messages"] = [{"role": "system", "content": SYSTEM_PROMPT}] + list(history) + [user]
+        json.dumps(body, ensure_ascii=False).encode()
+
+    return timeit(build, repeat)
+
+
+def bench_sdk(history, repeat):
+    from arkitect.types.llm.model import ArkChatRequest, ArkMessage
+
+    messages = [ArkMessage(**m) for m in history]
+
+    def build():
+        request = ArkChatRequest(
+            stream=True,
+            model="ep-llm",
+            messages=[ArkMessage(role="system", content=SYSTEM_PROMPT)] + messages
+            + [ArkMessage(role="user", content="现在该往哪走？")],
+            **PARAMETERS,
+        )
+        json.dumps(request.get_chat_request(), ensure_ascii=False, default=str).encode()
+
+    return timeit(build, repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比对话请求体的组装耗时")
+    parser.add_argument("--lengths", default="10,30,60,120,180")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    try:
+        import arkitect  # noqa: F401
+        has_sdk = True
+    except ImportError:
+        has_sdk = False
+        print("未安装 arkitect，跳过 SDK 构造方式\n")
+
+    print(f"序列化库：{'orjson' if chat_body.orjson is not None else 'json'}，中位数（µs）\n")
+    print(f"{'历史条数':>8} {'拼接':>10} {'dict+json':>10}" + (f" {'SDK':>10}" if has_sdk else ""))
+    for n in (int(x) for x in args.lengths.split(",")):
+        history = make_history(n)
+        row = f"{n:>8} {bench_spliced(history, args.repeat):>10.1f} {bench_dict_json(history, args.repeat):>10.1f}"
+        if has_sdk:
+            row += f" {bench_sdk(history, args.repeat):>10.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+ASR 输入音频的服务端转换开销：每路音频流每秒音频消耗的 CPU 时间，以及单核可承载的流数
+
+用法：
+    python benchmark/resample_cost.py
+    python benchmark/resample_cost.py --seconds 30 --packet-ms 256 --taps 16,24,32
+
+按插件的发包节奏（默认每包 256ms）把合成的语音样信号逐包送入 audio_input.AudioConverter，
+统计 pcm16 / f32 各采样率以及 WebM/Opus（需要 PyAV）的转换耗时。需要安装 numpy。
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import audio_input  # noqa: E402
+
+np = audio_input.load_numpy()
+
+
+def speech_like(rate, seconds, channels=1):
+    """几个谐波叠加并做音节状包络，频谱大致像人声"""
+    t = np.arange(int(rate * seconds)) / rate
+    pitch = 160 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    mono = (0.2 * signal * envelope).astype(np.float32)
+    return np.repeat(mono[:, None], channels, axis=1).reshape(-1)
+
+
+def packets(data, bytes_per_second, packet_ms):
+    size = int(bytes_per_second * packet_ms / 1000)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def encode_webm(samples):
+    import av
+
+    buffer = io.BytesIO()
+    container = av.open(buffer, "w", format="webm")
+    stream = container.add_stream("libopus", rate=48000)
+    stream.layout = "mono"
+    for i in range(0, len(samples), 960):
+        frame = av.AudioFrame.from_ndarray(samples[None, i:i + 960], format="flt", layout="mono")
+        frame.sample_rate = 48000
+        frame.pts = i
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return buffer.getvalue()
+
+
+def run_case(fmt, payload, bytes_per_second, seconds, packet_ms):
+    converter = audio_input.AudioConverter(fmt)
+    chunks = packets(payload, bytes_per_second, packet_ms)
+    started = time.perf_counter()
+    out = sum(len(converter.convert_sync(chunk)) for chunk in chunks)
+    cost = (time.perf_counter() - started) / seconds
+    return cost, len(payload) / seconds, out / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASR 输入音频的服务端转换开销")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--packet-ms", type=int, default=256)
+    parser.add_argument("--taps", default=str(audio_input.TAPS_PER_PHASE))
+    args = parser.parse_args(argv)
+    if np is None:
+        sys.exit("需要安装 numpy")
+
+    print(f"音频 {args.seconds:.0f} 秒，每包 {args.packet_ms}ms\n")
+    print(f"{'输入':<22} {'抽头':>4} {'CPU ms/音频秒':>14} {'单核流数':>9} {'上行 KB/s':>10}")
+    for taps in (int(x) for x in args.taps.split(",")):
+        audio_input.TAPS_PER_PHASE = taps
+        cases = []
+        for rate, channels in ((48000, 1), (48000, 2), (44100, 1)):
+            samples = speech_like(rate, args.seconds, channels)
+            cases.append((f"f32 {rate}Hz x{channels}", audio_input.InputFormat("f32", rate, channels),
+                          samples.astype("<f4").tobytes(), rate * channels * 4))
+            cases.append((f"pcm16 {rate}Hz x{channels}", audio_input.InputFormat("pcm16", rate, channels),
+                          audio_input.to_pcm16(samples), rate * channels * 2))
+        if audio_input.load_av() is not None:
+            webm = encode_webm(speech_like(48000, args.seconds))
+            cases.append(("webm/opus 48kHz", audio_input.InputFormat("webm", 48000, 1), webm, len(webm) / args.seconds))
+        else:
+            print("未安装 PyAV，跳过 WebM/Opus")
+        for name, fmt, payload, bytes_per_second in cases:
+            cost, uplink, _ = run_case(fmt, payload, bytes_per_second, args.seconds, args.packet_ms)
+            print(f"{name:<22} {taps:>4} {cost * 1000:>14.2f} {1 / cost:>9.0f} {uplink / 1024:>10.1f}")
+    print(f"\n参照：客户端自行重采样为 16kHz 单声道 pcm16 时上行 {16000 * 2 / 1024:.1f} KB/s（base64 再 ×4/3），服务端不做转换")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+会话历史检索的开销与收益：后台索引耗时、请求路径上的检索时延，以及每轮提示词中历史部分的缩减
+
+用法：
+    python benchmark/retrieval_cost.py
+    python benchmark/retrieval_cost.py --messages 180,600,2000 --recent 40 --top-k 8 --queries 200
+
+按 history_memory.py 的方式合成「画面描述 + 一问一答」交替的会话历史，并在最早的一轮埋入一条事实，
+检查以它为问题时能否被检索回来。原窗口按 prompt_layout.WINDOW 条计算。需要安装 numpy。
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import history  # noqa: E402
+import prompt_layout  # noqa: E402
+import retrieval  # noqa: E402
+
+SCENES = ["斗地主的出牌界面", "麻将的摸牌阶段", "MOBA 团战", "RPG 背包界面", "策略游戏的城建界面", "FPS 的决赛圈"]
+QUESTIONS = ["这把怎么打", "刚才那波团战", "背包里还有药吗", "地主是谁", "下一步该干嘛", "我刚才说的英雄"]
+
+
+def make_history(n):
+    records = [
+        history.Record.from_message({"role": "user", "content": "我最喜欢的英雄是鲁班七号，记住哦"}),
+        history.Record.from_message({"role": "assistant", "content": "记住啦，鲁班七号！"}),
+    ]
+    i = 0
+    while len(records) < n:
+        scene = SCENES[i % len(SCENES)]
+        records.append(history.Record.from_message({
+            "role": "assistant",
+            "content": f"视频帧描述：第 {i} 帧，这是一个{scene}，角色站在城门前，血量还剩一半，右上角有任务提示，"
+                       "左下角的小地图显示附近有两个敌人正在靠近，背包里还有三瓶药水。",
+        }))
+        if i % 3 == 0:
+            records.append(history.Record.from_message({"role": "user", "content": f"{random.choice(QUESTIONS)}？"}))
+            records.append(history.Record.from_message({"role": "assistant", "content": f"{scene}的话，先稳住再说，加油！"}))
+        i += 1
+    return records[:n]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_case(n, args):
+    records = make_history(n)
+    index = retrieval.RetrievalIndex(embedder=retrieval.load_embedder(args.model), recent=args.recent, top_k=args.top_k)
+    started = time.perf_counter()
+    index.schedule("bench", records)
+    await index.drain()
+    index_seconds = time.perf_counter() - started
+    units = len(index._sessions["bench"].units)
+
+    start = max(0, n + 1 - prompt_layout.WINDOW)
+    latencies, window_bytes, sent_bytes = [], 0, 0
+    for q in range(args.queries):
+        query = random.choice(QUESTIONS)
+        t0 = time.perf_counter()
+        selected = await index.select("bench", records, start, query)
+        latencies.append(time.perf_counter() - t0)
+        window_bytes += sum(len(r.serialized) for r in records[start:])
+        sent_bytes += sum(len(records[i].serialized) for i in (selected or range(start, n)))
+    recalled = await index.select("bench", records, start, "我最喜欢的英雄是谁")
+    return {
+        "messages": n,
+        "units": units,
+        "index_ms_per_unit": index_seconds * 1000 / max(units, 1),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "window_kb": window_bytes / args.queries / 1024,
+        "sent_kb": sent_bytes / args.queries / 1024,
+        "recalled": bool(recalled) and recalled[0] == 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="会话历史检索的开销与收益")
+    parser.add_argument("--messages", default="180,600,2000", help="会话历史条数，逗号分隔")
+    parser.add_argument("--recent", type=int, default=retrieval.RECENT)
+    parser.add_argument("--top-k", type=int, default=retrieval.TOP_K)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--model", default=retrieval.EMBEDDING_MODEL, help="sentence-transformers 模型，默认用哈希向量")
+    args = parser.parse_args(argv)
+    if retrieval.load_numpy() is None:
+        sys.exit("需要安装 numpy")
+    random.seed(0)
+
+    print(f"最近 {args.recent} 条 + top-{args.top_k}，原窗口 {prompt_layout.WINDOW} 条\n")
+    print(f"{'历史条数':>8} {'单元':>6} {'索引 ms/单元':>12} {'检索 p50':>9} {'检索 p95':>9} "
+          f"{'窗口 KB':>8} {'检索 KB':>8} {'缩减':>6} {'召回埋点':>8}")
+    for n in (int(x) for x in args.messages.split(",")):
+        r = asyncio.run(run_case(n, args))
+        print(f"{r['messages']:>8} {r['units']:>6} {r['index_ms_per_unit']:>12.3f} {r['p50_ms']:>7.2f}ms "
+              f"{r['p95_ms']:>7.2f}ms {r['window_kb']:>8.1f} {r['sent_kb']:>8.1f} "
+              f"{1 - r['sent_kb'] / r['window_kb']:>6.0%} {'是' if r['recalled'] else '否':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+对话接口的准入控制与降级
+
+对话接口原先对并发没有任何限制：一波突发请求会无限制地创建任务、TTS 客户端和上游调用，
+直到所有请求一起超时（插件的 CHAT_TIMEOUT_MS 为 30 秒）。这里按「先降级、再拒绝」的顺序控制负载：
+
+1. 进行中的对话流达到 HGDOLL_TTS_MAX_STREAMS 时，新的对话只返回文字，不建立 TTS 连接
+2. 进行中的请求达到全局上限的 HGDOLL_FRAME_SHED_RATIO 时，截图直接丢弃，不做画面分析
+3. 进行中的请求达到全局上限（HGDOLL_MAX_IN_FLIGHT）时返回 503，
+   单个会话进行中的请求达到 HGDOLL_MAX_IN_FLIGHT_PER_CONTEXT 时返回 429，都带 Retry-After
+
+拒绝在 ASGI 中间件中完成，不解析请求体、不进入 arkitect 的处理流程；/ws/session 的对话轮次走同一套计数。
+降级与拒绝分别计数到 hgdoll_degraded_total 与 hgdoll_admission_rejected_total。
+
+环境变量：
+    HGDOLL_MAX_IN_FLIGHT              全局进行中的请求上限，默认 256
+    HGDOLL_MAX_IN_FLIGHT_PER_CONTEXT  单个会话进行中的请求上限，默认 4
+    HGDOLL_TTS_MAX_STREAMS            同时合成语音的对话流上限，超过后只回复文字，默认 64
+    HGDOLL_FRAME_SHED_RATIO           进行中请求占全局上限的比例达到该值时丢弃截图，默认 0.75
+    HGDOLL_RETRY_AFTER_S              503 响应的 Retry-After 秒数，默认 2（429 固定为 1）
+"""
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import cadence
+import metrics
+
+MAX_IN_FLIGHT = int(os.environ.get("HGDOLL_MAX_IN_FLIGHT", "256"))
+MAX_IN_FLIGHT_PER_CONTEXT = int(os.environ.get("HGDOLL_MAX_IN_FLIGHT_PER_CONTEXT", "4"))
+TTS_MAX_STREAMS = int(os.environ.get("HGDOLL_TTS_MAX_STREAMS", "64"))
+FRAME_SHED_RATIO = float(os.environ.get("HGDOLL_FRAME_SHED_RATIO", "0.75"))
+RETRY_AFTER_SECONDS = int(os.environ.get("HGDOLL_RETRY_AFTER_S", "2"))
+CONTEXT_RETRY_AFTER_SECONDS = 1
+
+ADMISSION_IN_FLIGHT = metrics.gauge(
+    "hgdoll_admission_in_flight",
+    "Admitted requests currently in progress",
+)
+CHAT_STREAMS = metrics.gauge(
+    "hgdoll_chat_streams",
+    "Chat replies currently streaming",
+    ("mode",),
+)
+ADMISSION_REJECTED = metrics.counter(
+    "hgdoll_admission_rejected_total",
+    "Requests rejected before processing",
+    ("reason",),
+)
+DEGRADED = metrics.counter(
+    "hgdoll_degraded_total",
+    "Requests served in a cheaper mode because of load",
+    ("action",),
+)
+
+
+class Rejected(Exception):
+    """请求未被准入；status 为对应的 HTTP 状态码"""
+
+    def __init__(self, reason: str, status: int, retry_after: int):
+        super().__init__(f"admission rejected: {reason}")
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """全局与按会话的并发预算（只在事件循环线程中访问，无需加锁）"""
+
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_per_context: int = MAX_IN_FLIGHT_PER_CONTEXT,
+        tts_max_streams: int = TTS_MAX_STREAMS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_per_context = max_per_context
+        self.tts_max_streams = tts_max_streams
+        self.in_flight = 0
+        self.tts_streams = 0
+        self.text_streams = 0
+        self._per_context: Dict[str, int] = {}
+
+    def acquire(self, context_id: Optional[str]) -> None:
+        """占用一个请求名额，满额时抛出 Rejected；成功后调用方必须调用 release"""
+        if self.in_flight >= self.max_in_flight:
+            ADMISSION_REJECTED.inc(reason="global")
+            raise Rejected("global", 503, RETRY_AFTER_SECONDS)
+        if context_id and self._per_context.get(context_id, 0) >= self.max_per_context:
+            ADMISSION_REJECTED.inc(reason="context")
+            raise Rejected("context", 429, CONTEXT_RETRY_AFTER_SECONDS)
+        self.in_flight += 1
+        if context_id:
+            self._per_context[context_id] = self._per_context.get(context_id, 0) + 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def release(self, context_id: Optional[str]) -> None:
+        self.in_flight -= 1
+        if context_id:
+            remaining = self._per_context.get(context_id, 1) - 1
+            if remaining > 0:
+                self._per_context[context_id] = remaining
+            else:
+                self._per_context.pop(context_id, None)
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def shed_frame(self) -> bool:
+        """进行中的请求较多时放弃画面分析，把预算留给对话"""
+        if self.in_flight >= self.max_in_flight * FRAME_SHED_RATIO:
+            DEGRADED.inc(action="skip_frame")
+            return True
+        return False
+
+    def start_chat(self) -> bool:
+        """开始一轮对话回复，返回是否合成语音；调用方结束时必须调用 end_chat 并传入同一个值"""
+        with_tts = self.tts_streams < self.tts_max_streams
+        if with_tts:
+            self.tts_streams += 1
+        else:
+            self.text_streams += 1
+            DEGRADED.inc(action="text_only")
+        self._update_streams()
+        return with_tts
+
+    def end_chat(self, with_tts: bool) -> None:
+        if with_tts:
+            self.tts_streams -= 1
+        else:
+            self.text_streams -= 1
+        self._update_streams()
+
+    def _update_streams(self) -> None:
+        CHAT_STREAMS.set(self.tts_streams, mode="tts")
+        CHAT_STREAMS.set(self.text_streams, mode="text_only")
+
+
+def rejection_response(rejected: Rejected) -> Tuple[int, list, bytes]:
+    """(状态码, 响应头, 响应体)，响应体沿用方舟的错误格式"""
+    body = json.dumps({
+        "error": {
+            "code": "ServerOverloaded" if rejected.status == 503 else "TooManyRequests",
+            "message": "服务繁忙，请稍后重试",
+            "type": rejected.reason,
+        }
+    }, ensure_ascii=False).encode()
+    headers = [
+        (b"content-type", b"application/json; charset=utf-8"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(rejected.retry_after).encode()),
+    ]
+    return rejected.status, headers, body
+
+
+class AdmissionMiddleware:
+    """ASGI 中间件：对话/截图接口在进入处理流程前占用名额，满额时立即返回 429/503"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != cadence.CHAT_PATH:
+            return await self.app(scope, receive, send)
+        context_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-context-id":
+                context_id = value.decode("latin-1")
+                break
+        try:
+            self.controller.acquire(context_id)
+        except Rejected as rejected:
+            status, headers, body = rejection_response(rejected)
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(context_id)
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
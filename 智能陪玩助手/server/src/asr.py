@@ -0,0 +1,240 @@
+"""
+Doubao 流式 ASR 二进制协议
+
+/ws/asr 代理与 /ws/session 共用：
+
+    | 4 字节头 | 4 字节序号（大端） | 4 字节负载长度（大端） | 负载 |
+
+头部四个字节依次为 version|header_size、message_type|flags、serialization|compression、保留位。
+初始化消息的负载是 gzip 压缩的 JSON，音频包的负载是原始 PCM（16kHz / 16bit / 单声道）。
+
+识别参数按 Profile（音频格式、模型、end_window_size、result_type）组织，编码好的初始化消息按 Profile 缓存，
+不再每个连接重新序列化、压缩。客户端建立连接时可以选择预设（/ws/asr?profile=fast，
+/ws/session 的 asr_start 消息带 "profile"）并覆盖 end_window_size / result_type。
+每个 Profile 的出结果耗时（最后一段有声音频发出到收到最终结果）记录到 hgdoll_asr_finalization_seconds。
+
+环境变量：
+    HGDOLL_ASR_PROFILE     未指定时使用的预设，默认 default
+    HGDOLL_ASR_VOICE_PEAK  判断音频包有声的采样峰值（16bit），默认 1000
+"""
+
+import asyncio
+import functools
+import gzip
+import json
+import os
+import struct
+import time
+import uuid
+from typing import Dict, NamedTuple, Optional
+
+import metrics
+
+RESOURCE_ID = "volc.bigasr.sauc.duration"
+CONNECT_TIMEOUT = 10
+VOICE_PEAK = int(os.environ.get("HGDOLL_ASR_VOICE_PEAK", "1000"))
+
+# message_type
+FULL_CLIENT_REQUEST = 0b0001
+AUDIO_ONLY_REQUEST = 0b0010
+FULL_SERVER_RESPONSE = 0b1001
+SERVER_ACK = 0b1011
+
+_INIT_HEADER = bytes([
+    (0x01 << 4) | 0x01,                  # version | header_size
+    (FULL_CLIENT_REQUEST << 4) | 0x01,   # FULL_CLIENT_REQUEST | POS_SEQUENCE
+    (0x01 << 4) | 0x01,                  # JSON | GZIP
+    0x00,                                # reserved
+])
+_AUDIO_HEADER = bytes([
+    (0x01 << 4) | 0x01,                  # version | header_size
+    (AUDIO_ONLY_REQUEST << 4) | 0x01,    # AUDIO_ONLY_REQUEST | POS_SEQUENCE
+    (0x00 << 4) | 0x00,                  # NO_SERIAL | NO_COMPRESS (0, not 2!)
+    0x00,                                # reserved
+])
+_SEQUENCE_SIZE = struct.Struct(">II")
+
+AUDIO_FORMATS = ("pcm", "wav", "ogg")
+RESULT_TYPES = ("single", "full")
+MIN_END_WINDOW_MS = 200
+MAX_END_WINDOW_MS = 2000
+
+ASR_SESSIONS = metrics.counter(
+    "hgdoll_asr_sessions_total",
+    "ASR upstream sessions by recognition profile",
+    ("profile", "end_window_ms"),
+)
+ASR_FINALIZATION = metrics.histogram(
+    "hgdoll_asr_finalization_seconds",
+    "Time from the last voiced audio packet to the final ASR result",
+    ("profile", "end_window_ms"),
+    buckets=(0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0),
+)
+
+
+class Profile(NamedTuple):
+    """一组识别参数；name 只用于指标标签"""
+
+    name: str = "default"
+    audio_format: str = "pcm"
+    model_name: str = "bigmodel"
+    end_window_size: int = 600
+    result_type: str = "single"
+
+
+# end_window_size 越小，说完话后越快给出最终结果，但停顿稍长就会被切成两句
+PROFILES: Dict[str, Profile] = {
+    "default": Profile(),
+    "fast": Profile(name="fast", end_window_size=300),
+    "patient": Profile(name="patient", end_window_size=1000),
+}
+DEFAULT_PROFILE = PROFILES.get(os.environ.get("HGDOLL_ASR_PROFILE", "default"), PROFILES["default"])
+
+
+def resolve_profile(
+    name: Optional[str] = None,
+    end_window_size=None,
+    result_type: Optional[str] = None,
+    audio_format: Optional[str] = None,
+) -> Profile:
+    """
+    按客户端的选择确定本次连接的识别参数：先取预设，再应用覆盖项；参数无效时抛出 ValueError。
+    end_window_size 取整到 100ms，限制在 [200, 2000]，指标标签的取值因此是有限的
+    """
+    if name:
+        if name not in PROFILES:
+            raise ValueError(f"未知的 ASR 配置 {name}，可选 {', '.join(PROFILES)}")
+        profile = PROFILES[name]
+    else:
+        profile = DEFAULT_PROFILE
+    if end_window_size not in (None, ""):
+        try:
+            window = int(round(int(end_window_size) / 100) * 100)
+        except (TypeError, ValueError):
+            raise ValueError(f"end_window_size 应为整数毫秒，实际为 {end_window_size!r}")
+        if not MIN_END_WINDOW_MS <= window <= MAX_END_WINDOW_MS:
+            raise ValueError(f"end_window_size 应在 {MIN_END_WINDOW_MS}~{MAX_END_WINDOW_MS} 毫秒之间")
+        profile = profile._replace(end_window_size=window)
+    if result_type:
+        if result_type not in RESULT_TYPES:
+            raise ValueError(f"result_type 应为 {' / '.join(RESULT_TYPES)}")
+        profile = profile._replace(result_type=result_type)
+    if audio_format:
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"音频格式应为 {' / '.join(AUDIO_FORMATS)}")
+        profile = profile._replace(audio_format=audio_format)
+    return profile
+
+
+def init_payload(profile: Profile = DEFAULT_PROFILE) -> dict:
+    return {
+        "user": {"uid": "HGDOLL_WEB_PLUGIN"},
+        "audio": {
+            "format": profile.audio_format,
+            "sample_rate": 16000,
+            "bits": 16,
+            "channel": 1,
+        },
+        "request": {
+            "model_name": profile.model_name,
+            "result_type": profile.result_type,
+            "show_utterances": True,
+            "end_window_size": profile.end_window_size,
+            "force_to_speech_time": 1500,
+        },
+    }
+
+
+INIT_PAYLOAD = init_payload(PROFILES["default"])
+
+
+@functools.lru_cache(maxsize=256)
+def init_message(sequence: int = 1, profile: Profile = DEFAULT_PROFILE) -> bytes:
+    """FULL_CLIENT_REQUEST：gzip 压缩的 JSON 初始化参数（按 Profile 缓存编码结果）"""
+    payload = gzip.compress(json.dumps(init_payload(profile)).encode())
+    return _INIT_HEADER + _SEQUENCE_SIZE.pack(sequence, len(payload)) + payload
+
+
+def audio_message(audio: bytes, sequence: int) -> bytes:
+    """AUDIO_ONLY_REQUEST：原始 PCM，不序列化、不压缩"""
+    return b"".join((_AUDIO_HEADER, _SEQUENCE_SIZE.pack(sequence, len(audio)), audio))
+
+
+def is_voiced(pcm: bytes, peak: int = VOICE_PEAK) -> bool:
+    """粗略判断 16bit PCM 音频包是否有声：隔 8 个采样取一个，峰值超过阈值即认为有声"""
+    if len(pcm) < 2:
+        return False
+    samples = memoryview(pcm[: len(pcm) & ~1]).cast("h")[::8]
+    return max(samples) > peak or -min(samples) > peak
+
+
+class FinalizationTimer:
+    """记录一个 ASR 连接最后一段有声音频的发送时间，收到最终结果时统计出结果耗时"""
+
+    def __init__(self, profile: Profile):
+        self.labels = {"profile": profile.name, "end_window_ms": str(profile.end_window_size)}
+        self._voiced_at: Optional[float] = None
+        ASR_SESSIONS.inc(**self.labels)
+
+    def on_audio(self, pcm: bytes) -> None:
+        if is_voiced(pcm):
+            self._voiced_at = time.perf_counter()
+
+    def on_result(self, result: dict) -> None:
+        if result.get("is_final") and result.get("text") and self._voiced_at is not None:
+            ASR_FINALIZATION.observe(time.perf_counter() - self._voiced_at, **self.labels)
+            self._voiced_at = None
+
+
+def parse_response(data: bytes) -> Optional[dict]:
+    """解析 Doubao ASR 二进制协议响应"""
+    if len(data) < 4:
+        return None
+
+    message_type = (data[1] >> 4) & 0x0F
+
+    if message_type == FULL_SERVER_RESPONSE:
+        if len(data) > 12:
+            payload_size = struct.unpack(">I", data[8:12])[0]
+            payload_bytes = data[12:12 + payload_size]
+            try:
+                # 尝试 gzip 解压
+                payload = json.loads(gzip.decompress(payload_bytes))
+            except Exception:
+                try:
+                    payload = json.loads(payload_bytes)
+                except Exception:
+                    return None
+
+            # 提取识别结果
+            text = ""
+            is_final = False
+            if "result" in payload and payload["result"]:
+                text = payload["result"][0].get("text", "")
+                is_final = payload["result"][0].get("definite", False)
+            elif "text" in payload:
+                text = payload["text"]
+                is_final = payload.get("definite", False)
+
+            return {"text": text, "is_final": is_final}
+
+    elif message_type == SERVER_ACK:
+        return {"type": "ack"}
+
+    return None
+
+
+async def connect(url: str, app_id: str, access_token: str, profile: Profile = DEFAULT_PROFILE):
+    """连接 Doubao ASR 并发送该 Profile 的初始化消息，返回 websockets 连接"""
+    import websockets
+
+    # X-Api-Connect-Id 必须是 UUID 格式（参考 Android 端 AsrService.kt）
+    headers = {
+        "X-Api-App-Key": app_id,
+        "X-Api-Access-Key": access_token,
+        "X-Api-Resource-Id": RESOURCE_ID,
+        "X-Api-Connect-Id": str(uuid.uuid4()),
+    }
+    upstream = await asyncio.wait_for(websockets.connect(url, additional_headers=headers), timeout=CONNECT_TIMEOUT)
+    await upstream.send(init_message(1, profile))
+    return upstream
@@ -0,0 +1,329 @@
+"""
+ASR 输入音频的格式协商、解码与重采样
+
+Doubao ASR 只接收 16kHz / 16bit / 单声道 PCM，原先每个客户端都要自己重采样（content.js 在浏览器里做）。
+现在 /ws/asr 代理接受客户端的原生格式，在服务端转换：
+
+    input_format   pcm16（16bit 小端整数）| f32（32bit 小端浮点，Web Audio 的原生格式）| webm（MediaRecorder 的 Opus-in-WebM）
+    input_rate     采样率，如 48000 / 44100 / 16000；webm 固定为 Opus 的 48000
+    channels       声道数，多声道按平均值混成单声道
+
+- 重采样：NumPy 向量化的多相（polyphase）FIR 重采样器，按 16000 / 输入采样率约分出有理倍数 up / down，
+  每个输出采样只计算一个相位的 K 个抽头（不做先插零再抽取的无用乘法）；跨包保留 K-1 个历史采样，流式输出无接缝
+- 解码：WebM 容器在本模块中增量解析（只取 SimpleBlock / Block 中的 Opus 包），Opus 由 PyAV 解码
+- 线程：解码与重采样都在独立的线程池中执行，不占用事件循环；同一连接的音频包按顺序提交，输出顺序不变
+
+NumPy 与 PyAV 都是可选依赖：客户端直接发送 16kHz 单声道 pcm16 时不做任何转换；
+缺少依赖时对应格式在协商阶段被拒绝。两者导入较慢（合计约 150ms），在第一次需要转换时才导入，
+不拖慢进程启动；服务 ready 后由 startup.warm_up 在后台预先导入（见 startup.WARM_UP_MODULES）。
+
+环境变量：
+    HGDOLL_AUDIO_WORKERS        解码 / 重采样线程数，默认 min(4, CPU 数)
+    HGDOLL_RESAMPLE_TAPS        每个相位的滤波器抽头数，默认 24
+"""
+
+import asyncio
+import concurrent.futures
+import importlib
+import os
+from math import gcd
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import metrics
+
+# 由 load_numpy / load_av 在第一次需要时赋值
+np: Any = None
+av: Any = None
+_imported: Dict[str, Any] = {}
+
+TARGET_RATE = 16000
+FORMATS = ("pcm16", "f32", "webm")
+OPUS_RATE = 48000
+MAX_CHANNELS = 8
+WORKERS = int(os.environ.get("HGDOLL_AUDIO_WORKERS", str(min(4, os.cpu_count() or 1))))
+TAPS_PER_PHASE = int(os.environ.get("HGDOLL_RESAMPLE_TAPS", "24"))
+
+AUDIO_CONVERT_SECONDS = metrics.histogram(
+    "hgdoll_audio_convert_seconds",
+    "Time spent decoding and resampling one client audio packet",
+    ("format",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+AUDIO_INPUT_BYTES = metrics.counter(
+    "hgdoll_audio_input_bytes_total",
+    "Client audio bytes received before conversion",
+    ("format",),
+)
+
+
+def _optional_import(name: str):
+    """导入可选依赖，缺少时返回 None；结果缓存，缺少的依赖不重复尝试"""
+    if name not in _imported:
+        try:
+            _imported[name] = importlib.import_module(name)
+        except ImportError:  # pragma: no cover - 取决于部署环境
+            _imported[name] = None
+    return _imported[name]
+
+
+def load_numpy():
+    global np
+    if np is None:
+        np = _optional_import("numpy")
+    return np
+
+
+def load_av():
+    global av
+    if av is None:
+        av = _optional_import("av")
+    return av
+
+
+class InputFormat(NamedTuple):
+    format: str = "pcm16"
+    rate: int = TARGET_RATE
+    channels: int = 1
+
+    @property
+    def passthrough(self) -> bool:
+        return self.format == "pcm16" and self.rate == TARGET_RATE and self.channels == 1
+
+
+def negotiate(input_format: Optional[str] = None, input_rate=None, channels=None) -> InputFormat:
+    """按客户端声明确定输入格式；格式无效或缺少所需依赖时抛出 ValueError"""
+    fmt = input_format or "pcm16"
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的音频格式 {fmt}，可选 {' / '.join(FORMATS)}")
+    try:
+        rate = int(input_rate) if input_rate not in (None, "") else (OPUS_RATE if fmt == "webm" else TARGET_RATE)
+        count = int(channels) if channels not in (None, "") else 1
+    except (TypeError, ValueError):
+        raise ValueError("input_rate / channels 应为整数")
+    if not 8000 <= rate <= 192000:
+        raise ValueError(f"采样率 {rate} 超出范围（8000~192000）")
+    if not 1 <= count <= MAX_CHANNELS:
+        raise ValueError(f"声道数 {count} 超出范围（1~{MAX_CHANNELS}）")
+    result = InputFormat(fmt, OPUS_RATE if fmt == "webm" else rate, count)
+    if not result.passthrough and load_numpy() is None:
+        raise ValueError("服务端未安装 numpy，只能接收 16kHz 单声道 pcm16")
+    if fmt == "webm" and load_av() is None:
+        raise ValueError("服务端未安装 PyAV（pip install av），无法解码 WebM/Opus")
+    return result
+
+
+# ---------- 多相重采样 ----------
+
+def design_filter(up: int, down: int, taps_per_phase: int = TAPS_PER_PHASE):
+    """Kaiser 窗 sinc 低通，截止频率取输入、输出奈奎斯特频率中较低者；返回 (up, taps_per_phase) 的相位矩阵"""
+    load_numpy()
+    n = up * taps_per_phase
+    cutoff = 0.5 / max(up, down) * 0.95
+    t = np.arange(n) - (n - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n, 8.0)
+    h *= up / h.sum()
+    # 第 p 个相位取 h[p], h[p + up], h[p + 2up], ...
+    return h.reshape(taps_per_phase, up).T.astype(np.float32)
+
+
+class PolyphaseResampler:
+    """流式有理倍数重采样（单声道 float32）；同一实例只能按顺序调用"""
+
+    def __init__(self, in_rate: int, out_rate: int = TARGET_RATE, taps_per_phase: int = TAPS_PER_PHASE):
+        g = gcd(in_rate, out_rate)
+        self.up = out_rate // g
+        self.down = in_rate // g
+        self.taps = taps_per_phase
+        self._phases = design_filter(self.up, self.down, taps_per_phase)
+        # 缓冲区保留 taps-1 个历史采样；_offset 为缓冲区首个采样的绝对序号（开头补零）
+        self._buffer = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._offset = -(taps_per_phase - 1)
+        self._next = 0
+        self._k = np.arange(taps_per_phase)
+
+    def process(self, samples) -> "np.ndarray":
+        buffer = np.concatenate((self._buffer, np.asarray(samples, dtype=np.float32)))
+        end = self._offset + len(buffer) - 1  # 已有的最后一个输入采样的绝对序号
+        last = ((end + 1) * self.up - 1) // self.down
+        if last < self._next:
+            self._buffer = buffer
+            return np.zeros(0, dtype=np.float32)
+        n = np.arange(self._next, last + 1, dtype=np.int64)
+        position = n * self.down
+        index = position // self.up - self._offset
+        phase = position % self.up
+        # 每个输出采样：输入 x[i], x[i-1], ..., x[i-K+1] 与对应相位的 K 个抽头做点积
+        window = buffer[index[:, None] - self._k[None, :]]
+        out = np.einsum("ij,ij->i", window, self._phases[phase])
+        self._next = last + 1
+        keep = self.taps - 1
+        self._offset += len(buffer) - keep
+        self._buffer = buffer[len(buffer) - keep:].copy()
+        return out
+
+
+def to_pcm16(samples) -> bytes:
+    load_numpy()
+    return np.clip(np.rint(samples * 32768.0), -32768, 32767).astype("<i2").tobytes()
+
+
+# ---------- WebM 增量解析 ----------
+
+_EBML_MASTER = {
+    0x18538067,  # Segment
+    0x1F43B675,  # Cluster
+    0xA0,        # BlockGroup
+}
+_EBML_BLOCKS = {0xA3, 0xA1}  # SimpleBlock, Block
+_UNKNOWN_SIZE = -1
+
+
+def _read_vint(data, pos: int, keep_marker: bool):
+    """读取 EBML 变长整数，返回 (值, 新位置)；数据不足时返回 None"""
+    if pos >= len(data):
+        return None
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("无效的 EBML 变长整数")
+    if pos + length > len(data):
+        return None
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == mask - 1
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+        all_ones = all_ones and b == 0xFF
+    if not keep_marker and all_ones:
+        value = _UNKNOWN_SIZE
+    return value, pos + length
+
+
+class WebmDemuxer:
+    """从 MediaRecorder 的 WebM 字节流中增量取出第一条音轨的帧（不处理 lacing，MediaRecorder 不使用）"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._skip = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self._data += chunk
+        frames = []
+        pos = 0
+        data = self._data
+        while True:
+            if self._skip:
+                step = min(self._skip, len(data) - pos)
+                pos += step
+                self._skip -= step
+                if self._skip:
+                    break
+            header = _read_vint(data, pos, keep_marker=True)
+            if header is None:
+                break
+            element_id, after_id = header
+            size_field = _read_vint(data, after_id, keep_marker=False)
+            if size_field is None:
+                break
+            size, body = size_field
+            if element_id in _EBML_MASTER or size == _UNKNOWN_SIZE:
+                pos = body
+            elif element_id in _EBML_BLOCKS:
+                if body + size > len(data):
+                    break
+                track = _read_vint(data, body, keep_marker=False)
+                if track is None:
+                    raise ValueError("无效的 WebM 数据块")
+                # 轨道号之后是 2 字节时间码与 1 字节标志
+                frames.append(bytes(data[track[1] + 3:body + size]))
+                pos = body + size
+            else:
+                pos = body
+                self._skip = size
+        del self._data[:pos]
+        return frames
+
+
+# ---------- 转换器 ----------
+
+class AudioConverter:
+    """单个连接的输入转换：客户端原生音频 → 16kHz / 16bit / 单声道 PCM"""
+
+    def __init__(self, fmt: InputFormat):
+        if not fmt.passthrough:
+            load_numpy()
+            if fmt.format == "webm":
+                load_av()
+        self.format = fmt
+        self._resampler = (
+            PolyphaseResampler(fmt.rate) if not fmt.passthrough and fmt.rate != TARGET_RATE else None
+        )
+        self._demuxer = WebmDemuxer() if fmt.format == "webm" else None
+        self._decoder = av.CodecContext.create("opus", "r") if self._demuxer is not None else None
+        # 原始 PCM 按整帧（采样宽度 × 声道数）处理，不完整的尾部留到下一包
+        self._frame_bytes = (4 if fmt.format == "f32" else 2) * fmt.channels
+        self._pending = b""
+
+    def convert_sync(self, data: bytes) -> bytes:
+        """在工作线程中执行"""
+        if self.format.passthrough:
+            return data
+        if self._demuxer is not None:
+            samples = self._decode_opus(self._demuxer.feed(data))
+        else:
+            if self._pending:
+                data = self._pending + data
+            usable = len(data) - len(data) % self._frame_bytes
+            self._pending = data[usable:]
+            if self.format.format == "f32":
+                samples = np.frombuffer(data, dtype="<f4", count=usable // 4)
+            else:
+                samples = np.frombuffer(data, dtype="<i2", count=usable // 2).astype(np.float32) / 32768.0
+            samples = self._downmix(samples)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        return to_pcm16(samples)
+
+    def _downmix(self, samples):
+        channels = self.format.channels
+        if channels == 1:
+            return samples
+        return samples.reshape(-1, channels).mean(axis=1)
+
+    def _decode_opus(self, packets: List[bytes]):
+        chunks = []
+        for packet in packets:
+            for frame in self._decoder.decode(av.Packet(packet)):
+                pcm = frame.to_ndarray().astype(np.float32)
+                if frame.format.name.startswith("s16"):
+                    pcm /= 32768.0
+                # 平面格式为 (声道, 采样)，交错格式为 (1, 采样 × 声道)
+                if frame.format.is_planar:
+                    chunks.append(pcm.mean(axis=0))
+                else:
+                    channels = len(frame.layout.channels)
+                    chunks.append(pcm.reshape(-1, channels).mean(axis=1))
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+    async def convert(self, data: bytes) -> bytes:
+        AUDIO_INPUT_BYTES.inc(len(data), format=self.format.format)
+        if self.format.passthrough:
+            return data
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        pcm = await loop.run_in_executor(get_executor(), self.convert_sync, data)
+        AUDIO_CONVERT_SECONDS.observe(loop.time() - started, format=self.format.format)
+        return pcm
+
+
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="hgdoll-audio")
+    return _executor
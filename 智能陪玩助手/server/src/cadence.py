@@ -0,0 +1,219 @@
+"""
+自适应截图节奏：由服务端计算下一次截图的建议间隔
+
+插件和 Android 端原先以固定间隔上传截图，不论服务端是否来得及分析、画面是否变化。
+这里在截图请求的响应头中返回 X-Next-Capture-Delay-Ms，客户端据此安排下一次截图：
+
+    delay = 基础间隔 × 负载系数 × 画面变化系数 × 活跃系数，再限制在 [最小, 最大] 之间
+
+- 负载系数：进行中的 summarize_image（VLM 分析）数量超过目标并发后线性放大
+- 画面变化系数：相邻两帧描述的差异度做指数滑动平均，画面静止时间隔最多放大到 2 倍
+- 活跃系数：最近有对话的会话缩短间隔，保持对画面的及时感知
+
+同时在服务端削峰：同一会话上一帧仍在分析、或全局进行中的分析已达上限时，新截图直接丢弃
+（计数到 hgdoll_frames_shed_total），不再堆积 summarize_image 任务。
+
+环境变量：
+    HGDOLL_CAPTURE_BASE_MS       基础间隔，默认 3000
+    HGDOLL_CAPTURE_MIN_MS        最小间隔，默认 1500
+    HGDOLL_CAPTURE_MAX_MS        最大间隔，默认 15000
+    HGDOLL_VLM_TARGET_IN_FLIGHT  开始放大间隔的进行中分析数，默认 8
+    HGDOLL_VLM_MAX_IN_FLIGHT     进行中分析数上限，超过即丢帧，默认 32
+"""
+
+import difflib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+
+HEADER = "X-Next-Capture-Delay-Ms"
+CHAT_PATH = "/api/v3/bots/chat/completions"
+
+BASE_MS = int(os.environ.get("HGDOLL_CAPTURE_BASE_MS", "3000"))
+MIN_MS = int(os.environ.get("HGDOLL_CAPTURE_MIN_MS", "1500"))
+MAX_MS = int(os.environ.get("HGDOLL_CAPTURE_MAX_MS", "15000"))
+TARGET_IN_FLIGHT = int(os.environ.get("HGDOLL_VLM_TARGET_IN_FLIGHT", "8"))
+MAX_IN_FLIGHT = int(os.environ.get("HGDOLL_VLM_MAX_IN_FLIGHT", "32"))
+
+CHANGE_SMOOTHING = 0.3     # 画面变化率 EWMA 的新样本权重
+ACTIVE_WINDOW = 30.0       # 最近这么多秒内有对话视为活跃
+ACTIVE_FACTOR = 0.75
+MAX_TRACKED = 10000
+
+FRAMES_SHED = metrics.counter(
+    "hgdoll_frames_shed_total",
+    "Screenshots dropped without VLM analysis to shed load",
+    ("reason",),
+)
+VLM_IN_FLIGHT = metrics.gauge(
+    "hgdoll_vlm_in_flight",
+    "summarize_image calls currently running",
+)
+CAPTURE_DELAY = metrics.histogram(
+    "hgdoll_capture_delay_seconds",
+    "Next capture delay suggested to clients",
+    buckets=(1.5, 2, 3, 4, 6, 8, 10, 15, 30),
+)
+
+
+class _Session:
+    __slots__ = ("in_flight", "last_description", "change_rate", "last_chat")
+
+    def __init__(self):
+        self.in_flight = False
+        self.last_description: Optional[str] = None
+        # 初始按「画面在变化」处理，避免会话刚开始就放慢截图
+        self.change_rate = 1.0
+        self.last_chat = 0.0
+
+
+class CadenceController:
+    """按会话维护截图节奏所需的状态（只在事件循环线程中访问，无需加锁）"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+    def _session(self, context_id: str) -> _Session:
+        session = self._sessions.get(context_id)
+        if session is None:
+            session = self._sessions[context_id] = _Session()
+            if len(self._sessions) > MAX_TRACKED:
+                self._evict(context_id)
+        else:
+            self._sessions.move_to_end(context_id)
+        return session
+
+    def _evict(self, keep: str) -> None:
+        """淘汰最久未使用且没有分析在进行的会话；淘汰进行中的会话会让它的名额永远无法释放"""
+        for key, session in self._sessions.items():
+            if key != keep and not session.in_flight:
+                del self._sessions[key]
+                return
+        # 全部都在分析中（只在 MAX_TRACKED 小于并发上限时出现）：淘汰最久的并归还名额
+        self._sessions.popitem(last=False)
+        self.in_flight -= 1
+        VLM_IN_FLIGHT.set(self.in_flight)
+
+    def admit_frame(self, context_id: str) -> bool:
+        """决定是否分析这一帧；返回 True 时调用方必须在分析结束后调用 frame_done（通常经由 FrameSlot，保证只释放一次）"""
+        session = self._session(context_id)
+        if session.in_flight:
+            FRAMES_SHED.inc(reason="session_busy")
+            return False
+        if self.in_flight >= MAX_IN_FLIGHT:
+            FRAMES_SHED.inc(reason="overloaded")
+            return False
+        session.in_flight = True
+        self.in_flight += 1
+        VLM_IN_FLIGHT.set(self.in_flight)
+        return True
+
+    def frame_done(self, context_id: str, description: Optional[str] = None,
+                   novelty: Optional[float] = None) -> Optional[float]:
+        """
+        一帧分析结束，返回该帧相对上一帧的差异度（0~1，会话第一帧为 1）；
+        description 为空表示分析失败，不更新画面变化率并返回 None。
+        调用方已经算出差异度（结构化画面状态的变化项，见 scene_state.py）时传入 novelty，不再比较文本
+        """
+        session = self._session(context_id)
+        if session.in_flight:
+            session.in_flight = False
+            self.in_flight -= 1
+            VLM_IN_FLIGHT.set(self.in_flight)
+        if description is None:
+            return None
+        if novelty is None:
+            novelty = 1.0
+            if session.last_description is not None:
+                novelty = 1.0 - difflib.SequenceMatcher(None, session.last_description, description).ratio()
+        if session.last_description is not None:
+            session.change_rate += CHANGE_SMOOTHING * (novelty - session.change_rate)
+        session.last_description = description
+        return novelty
+
+    def overloaded(self) -> bool:
+        """进行中的画面分析已超过目标并发"""
+        return self.in_flight >= TARGET_IN_FLIGHT
+
+    def touch_chat(self, context_id: str) -> None:
+        self._session(context_id).last_chat = time.monotonic()
+
+    def next_delay_ms(self, context_id: str) -> int:
+        session = self._session(context_id)
+        load = 1.0 + max(0, self.in_flight - TARGET_IN_FLIGHT) / max(1, TARGET_IN_FLIGHT)
+        # 变化率 1 → 系数 1，变化率 0（画面静止）→ 系数 2
+        stillness = 2.0 - min(1.0, session.change_rate * 2)
+        activity = ACTIVE_FACTOR if time.monotonic() - session.last_chat < ACTIVE_WINDOW else 1.0
+        delay = int(min(MAX_MS, max(MIN_MS, BASE_MS * load * stillness * activity)))
+        CAPTURE_DELAY.observe(delay / 1000)
+        return delay
+
+
+class FrameSlot:
+    """
+    admit_frame 占用的一个分析名额，只释放一次：分析结束时由 finish 带上描述释放；
+    分析任务在第一次执行前就被取消（协程的 finally 不会运行）或在进入 try 之前出错时，
+    由任务的完成回调 release 兜底。按名额而不是按会话判断是否已释放，不会误放同一会话之后新占用的名额
+    """
+
+    __slots__ = ("controller", "context_id", "released")
+
+    def __init__(self, controller: "CadenceController", context_id: str):
+        self.controller = controller
+        self.context_id = context_id
+        self.released = False
+
+    def finish(self, description: Optional[str] = None, novelty: Optional[float] = None) -> Optional[float]:
+        """释放名额并更新画面变化率，参数与返回值同 CadenceController.frame_done；已释放时返回 None"""
+        if self.released:
+            return None
+        self.released = True
+        return self.controller.frame_done(self.context_id, description, novelty=novelty)
+
+    def release(self, *_) -> None:
+        """不带描述释放（视为分析失败）；可直接作为 asyncio 任务的完成回调"""
+        self.finish()
+
+
+class CadenceMiddleware:
+    """ASGI 中间件：在截图/对话接口的响应头中附加下一次截图的建议间隔"""
+
+    def __init__(self, app, controller: CadenceController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != CHAT_PATH:
+            return await self.app(scope, receive, send)
+        context_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-context-id":
+                context_id = value.decode("latin-1")
+                break
+        if not context_id:
+            return await self.app(scope, receive, send)
+
+        async def send_with_hint(message):
+            if message["type"] == "http.response.start":
+                delay = self.controller.next_delay_ms(context_id)
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (HEADER.lower().encode(), str(delay).encode())
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_hint)
+
+
+_controller: Optional[CadenceController] = None
+
+
+def get_controller() -> CadenceController:
+    global _controller
+    if _controller is None:
+        _controller = CadenceController()
+    return _controller
@@ -0,0 +1,274 @@
+"""
+客户端断开时沿调用链取消上游流
+
+浏览器插件中止请求（sendChatMessage 的 AbortController）或 Android 客户端掉线后，服务端原先要等到
+下一次写响应失败才察觉，期间 LLM 流与 TTS WebSocket 继续生成到结束；非流式请求则完全察觉不到。这里：
+
+- DisconnectMiddleware：对话/截图接口由中间件独占 ASGI receive，收到 http.disconnect 且响应尚未发送完时
+  立即取消请求处理任务；取消沿 model_calling → TTS → LLM 迭代器传递，各层的 finally 关闭各自的上游连接
+- UpstreamStream：在独立任务中读取 LLM 流。TTS 客户端在自己创建的任务里消费文本流，外部无法取消；
+  关闭 UpstreamStream 时取消读取任务（CancelledError 直接抛入正在等待的上游迭代器，立即关闭 HTTP 流），
+  并让 TTS 的发送任务随之结束
+- 经 /ws/session 提交的画面分析（summarize_image）按会话登记；该会话长连接断开且没有新连接时一并取消。
+  经 HTTP 提交的截图（插件只把长连接当作推送通道，断线后会重连）与连接无关，分析照常完成，描述仍写入历史
+
+被中断的流按「完整回复的平均长度 − 已生成长度」估算节省的 token 与语音秒数，
+分别计数到 hgdoll_cancel_saved_tokens_total 与 hgdoll_cancel_saved_audio_seconds_total（估算值，
+平均长度取已完成回复的指数移动平均；尚无完成的回复时不计节省）。
+
+环境变量：
+    HGDOLL_SPEECH_CHARS_PER_S  估算语音时长用的语速（字/秒），默认 4.5
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Set
+
+import cadence
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SPEECH_CHARS_PER_SECOND = float(os.environ.get("HGDOLL_SPEECH_CHARS_PER_S", "4.5"))
+AVERAGE_ALPHA = 0.1
+
+CLIENT_DISCONNECTS = metrics.counter(
+    "hgdoll_client_disconnects_total",
+    "Requests whose client went away before the response finished",
+)
+UPSTREAM_CANCELLED = metrics.counter(
+    "hgdoll_upstream_cancelled_total",
+    "Upstream streams closed before they finished",
+    ("stream", "reason"),
+)
+SAVED_TOKENS = metrics.counter(
+    "hgdoll_cancel_saved_tokens_total",
+    "Estimated completion tokens not generated because the stream was closed early",
+    ("stream",),
+)
+SAVED_AUDIO_SECONDS = metrics.counter(
+    "hgdoll_cancel_saved_audio_seconds_total",
+    "Estimated seconds of speech not synthesized because the stream was closed early",
+)
+
+
+# ---------- 节省量估算 ----------
+
+class _Average:
+    """指数移动平均；没有样本时为 None"""
+
+    def __init__(self, alpha: float = AVERAGE_ALPHA):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def add(self, sample: float) -> None:
+        if self.value is None:
+            self.value = float(sample)
+        else:
+            self.value += self.alpha * (sample - self.value)
+
+
+_tokens: Dict[str, _Average] = {}
+_chars = _Average()
+
+
+def _average_tokens(stream: str) -> _Average:
+    average = _tokens.get(stream)
+    if average is None:
+        average = _tokens[stream] = _Average()
+    return average
+
+
+def record_completed(stream: str, tokens: int, chars: int = 0) -> None:
+    """记录一次完整生成的回复长度，作为估算节省量的基准"""
+    if tokens > 0:
+        _average_tokens(stream).add(tokens)
+    if stream == "llm" and chars > 0:
+        _chars.add(chars)
+
+
+def record_interrupted(
+    stream: str,
+    reason: str,
+    tokens: int = 0,
+    chars: int = 0,
+    finished: bool = False,
+    spoken_chars: int = 0,
+    with_audio: bool = False,
+) -> None:
+    """
+    记录一次被中断的回复：tokens / chars 为上游已生成的长度，finished 表示上游其实已生成完毕，
+    spoken_chars 为已合成并发出的语音对应的字数
+    """
+    UPSTREAM_CANCELLED.inc(stream=stream, reason=reason)
+    average = _average_tokens(stream).value
+    if not finished and average is not None:
+        saved = average - tokens
+        if saved > 0:
+            SAVED_TOKENS.inc(saved, stream=stream)
+    if with_audio:
+        total = chars if finished else max(chars, _chars.value or 0)
+        unspoken = total - spoken_chars
+        if unspoken > 0:
+            SAVED_AUDIO_SECONDS.inc(unspoken / SPEECH_CHARS_PER_SECOND)
+
+
+# ---------- LLM 流 ----------
+
+_END = object()
+
+
+class UpstreamStream:
+    """
+    在独立任务中读取上游流并转交给消费方（TTS 发送任务或 model_calling 自身）；
+    aclose 立即取消读取任务，上游迭代器在当前等待点收到 CancelledError 并关闭连接
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.tokens = 0
+        self.chars = 0
+        self.finished = False
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self._measure(item)
+                self._queue.put_nowait(item)
+            self.finished = True
+            self._queue.put_nowait(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._queue.put_nowait(e)
+
+    def _measure(self, item: Any) -> None:
+        usage = getattr(item, "usage", None)
+        completion_tokens = getattr(usage, "completion_tokens", None) if usage else None
+        if completion_tokens:
+            self.tokens = completion_tokens
+            return
+        choices = getattr(item, "choices", None)
+        if choices:
+            content = getattr(getattr(choices[0], "delta", None), "content", None)
+            if content:
+                # 流式输出大致每个分片一个 token；末尾带 usage 时以其为准
+                self.tokens += 1
+                self.chars += len(content)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self.closed:
+            # 消费方是 TTS 客户端自己创建的任务时，让它随之结束
+            raise asyncio.CancelledError()
+        item = await self._queue.get()
+        if self.closed:
+            raise asyncio.CancelledError()
+        if item is _END:
+            self._queue.put_nowait(_END)
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def aclose(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # 唤醒仍在等待的消费方
+        self._queue.put_nowait(_END)
+
+
+# ---------- 后台画面分析 ----------
+
+_background: Dict[str, Set[asyncio.Task]] = {}
+
+
+def track_background(context_id: str, task: "asyncio.Task") -> None:
+    """登记经 /ws/session 提交的后台画面分析任务，完成后自动移除"""
+    tasks = _background.setdefault(context_id, set())
+    tasks.add(task)
+
+    def _done(t, context_id=context_id):
+        remaining = _background.get(context_id)
+        if remaining is not None:
+            remaining.discard(t)
+            if not remaining:
+                del _background[context_id]
+
+    task.add_done_callback(_done)
+
+
+def cancel_background(context_id: str, reason: str = "disconnect") -> int:
+    """客户端已离开：取消该会话仍在进行的画面分析，返回取消的任务数"""
+    tasks = _background.pop(context_id, set())
+    cancelled = 0
+    for t in tasks:
+        if not t.done():
+            t.cancel()
+            cancelled += 1
+            record_interrupted("vlm", reason)
+    if cancelled:
+        logger.info(f"已取消会话 {context_id} 的 {cancelled} 个画面分析任务")
+    return cancelled
+
+
+# ---------- ASGI 中间件 ----------
+
+class DisconnectMiddleware:
+    """ASGI 中间件：对话/截图接口的客户端断开后立即取消请求处理"""
+
+    def __init__(self, app, paths: Sequence[str] = (cadence.CHAT_PATH,)):
+        self.app = app
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        inbox: asyncio.Queue = asyncio.Queue()
+        response_done = False
+        disconnected = False
+
+        async def send_wrapper(message):
+            nonlocal response_done
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_done = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, inbox.get, send_wrapper))
+
+        async def watch():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                inbox.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_done and not app_task.done():
+                        disconnected = True
+                        CLIENT_DISCONNECTS.inc()
+                        app_task.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await app_task
+        except (asyncio.CancelledError, Exception):
+            # 客户端已断开：取消产生的异常不再向上抛，也没有人接收响应
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
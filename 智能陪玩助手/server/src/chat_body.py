@@ -0,0 +1,61 @@
+"""
+对话请求体的增量拼装
+
+原先每轮对话都要把窗口内最多 180 条 ArkMessage 重新做 pydantic 校验（ArkChatRequest）、
+model_dump 成字典，再由 SDK 整体 json.dumps 成请求体，耗时随历史长度线性增长。
+会话历史只追加不修改，因此每条消息在写入上下文时序列化一次（utils.CoroutineSafeMap.append），
+组装请求时直接拼接缓存好的字节：
+
+    {"model":...,"stream":true,...,"messages":[<system>,<history[start:]...>,<user>]}
+
+system 提示词的序列化结果按内容缓存；每轮只需序列化本轮的用户消息和少量请求参数。
+安装了 orjson 时使用 orjson 序列化，否则回退为标准库 json。
+
+环境变量：
+    HGDOLL_SPLICED_PROMPT  0 关闭拼接请求体，回退为 SDK 构造请求，默认 1
+"""
+
+import functools
+import json
+import os
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+
+ENABLED = os.environ.get("HGDOLL_SPLICED_PROMPT", "1") != "0"
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_message(message: Any) -> bytes:
+    """单条消息的 JSON 字节，与 SDK 发送的字段一致（去掉值为 None 的字段）"""
+    if not isinstance(message, dict):
+        message = message.model_dump(exclude_none=True)
+    return dumps(message)
+
+
+@functools.lru_cache(maxsize=32)
+def system_message(prompt: str) -> bytes:
+    return dumps({"role": "system", "content": prompt})
+
+
+def build(model: str, messages: Iterable[bytes], parameters: Optional[Dict[str, Any]] = None) -> bytes:
+    """拼接流式对话请求体；messages 为已序列化的消息"""
+    head = {"model": model, "stream": True}
+    if parameters:
+        head.update({k: v for k, v in parameters.items() if k not in ("model", "messages", "stream")})
+    # 去掉结尾的 "}"，接上 messages 数组
+    return dumps(head)[:-1] + b',"messages":[' + b",".join(messages) + b"]}"
@@ -0,0 +1,454 @@
+"""
+多进程服务模式：前置路由进程 + N 个 worker 进程，按 X-Context-Id 一致性哈希保持会话粘性
+
+会话历史保存在各进程内存中的 CoroutineSafeMap 里，多个 worker 直接共享端口会让同一会话的
+请求落到不同进程、各自持有不相交的历史。这里由前置进程在 HTTP 层解析请求头，
+把同一个 X-Context-Id 的请求始终转发到同一个 worker：
+
+    客户端 ──> 前置路由（对外端口） ──> worker i（127.0.0.1:内部端口+i，独立事件循环）
+
+- 路由粒度是「请求」而不是「连接」：同一个 keep-alive 连接上的请求可以去往不同 worker
+  （插件/客户端都不做 HTTP pipelining，新请求到达时上一个响应一定已经结束）
+- WebSocket（/ws/asr 等）在握手后切换为双向透传并固定在所选 worker 上；ASR 代理不持有
+  会话状态，没有 X-Context-Id（或 ?context_id=）时分配给当前连接最少的 worker
+- worker 异常退出会被重新拉起，哈希环不变，因此会话映射不变（内存历史会丢失，开启会话快照时从快照恢复）
+- GET /cluster/status 由前置进程直接应答，返回各 worker 的存活与连接数
+- 进程级的监控与调试接口（FANOUT_PATHS：/metrics、/debug/status、/debug/loop、/debug/prompts 及其 reload）
+  不带会话 ID，由前置进程并发请求所有 worker 后合并：/metrics 的每个样本加上 worker 标签，
+  JSON 接口返回 {"workers": [{"worker": i, ...该 worker 的响应}, ...]}；
+  /debug/status/{context_id} 按路径中的会话 ID 路由到持有该会话的 worker
+- 任何请求带上 ?worker=N 时直接转发给第 N 个 worker，不做合并，用于查看单个进程
+
+用法：HGDOLL_WORKERS=4 python src/main.py
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEAD_BYTES = 64 * 1024
+VIRTUAL_NODES = 160
+CONNECT_RETRY_SECONDS = 10
+PIPE_CHUNK = 64 * 1024
+STATUS_PATH = "/cluster/status"
+CONTEXT_STATUS_PREFIX = "/debug/status/"
+# 按进程统计的接口：汇总所有 worker 的结果
+FANOUT_PATHS = {
+    ("GET", "/metrics"),
+    ("GET", "/debug/status"),
+    ("GET", "/debug/loop"),
+    ("GET", "/debug/prompts"),
+    ("POST", "/debug/prompts/reload"),
+}
+FANOUT_TIMEOUT_SECONDS = 5
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes: Sequence[int], replicas: int = VIRTUAL_NODES):
+        self._ring: List[Tuple[int, int]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def get(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class RequestHead:
+    """解析后的 HTTP 请求头"""
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        lines = raw.decode("latin-1").split("\r\n")
+        self.method, self.target, self.version = (lines[0].split(" ", 2) + ["", ""])[:3]
+        self.headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                self.headers[name.strip().lower()] = value.strip()
+
+    @property
+    def path(self) -> str:
+        return urlsplit(self.target).path
+
+    @property
+    def query(self) -> Dict[str, List[str]]:
+        return parse_qs(urlsplit(self.target).query)
+
+    @property
+    def context_id(self) -> Optional[str]:
+        value = self.headers.get("x-context-id")
+        if value:
+            return value
+        path = self.path
+        if path.startswith(CONTEXT_STATUS_PREFIX) and len(path) > len(CONTEXT_STATUS_PREFIX):
+            return unquote(path[len(CONTEXT_STATUS_PREFIX):])
+        return (self.query.get("context_id") or [None])[0]
+
+    @property
+    def worker(self) -> Optional[int]:
+        """?worker=N 指定的 worker 序号"""
+        value = (self.query.get("worker") or [None])[0]
+        try:
+            return int(value) if value is not None else None
+        except ValueError:
+            return None
+
+    @property
+    def is_upgrade(self) -> bool:
+        return "upgrade" in self.headers.get("connection", "").lower()
+
+    @property
+    def content_length(self) -> Optional[int]:
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            return None
+        try:
+            return int(self.headers.get("content-length", "0"))
+        except ValueError:
+            return None
+
+
+async def read_head(reader: asyncio.StreamReader) -> Optional[RequestHead]:
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("HTTP 请求头过大")
+    return RequestHead(raw)
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, close_writer: bool = True) -> None:
+    try:
+        while True:
+            data = await reader.read(PIPE_CHUNK)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        if close_writer:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+
+def parse_head(raw: bytes) -> Tuple[int, Dict[str, str]]:
+    """解析 HTTP/1.1 响应头，返回 (状态码, 小写名称的响应头)"""
+    lines = raw.decode("latin-1").rstrip("\r\n").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+def _add_label(sample: str, worker: int) -> str:
+    """Prometheus 样本行加上 worker 标签：name{a="1"} 3 → name{worker="0",a="1"} 3"""
+    label = f'worker="{worker}"'
+    brace = sample.find("{")
+    space = sample.find(" ")
+    if brace != -1 and (space == -1 or brace < space):
+        inner_start = brace + 1
+        separator = "" if sample[inner_start] == "}" else ","
+        return sample[:inner_start] + label + separator + sample[inner_start:]
+    return sample[:space] + "{" + label + "}" + sample[space:]
+
+
+def merge_metrics(texts: Sequence[Tuple[int, str]]) -> str:
+    """
+    合并各 worker 的 Prometheus 文本：同一指标的 HELP / TYPE 只保留一份，
+    样本加 worker 标签后归到同一组下（exposition 格式要求同一指标的样本连续出现）
+    """
+    families: Dict[str, Tuple[List[str], List[str]]] = {}
+    for worker, text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = parts[2]
+                    headers, _ = families.setdefault(family, ([], []))
+                    if line not in headers:
+                        headers.append(line)
+                continue
+            name = line.split("{", 1)[0].split(" ", 1)[0]
+            key = family if family is not None and name.startswith(family) else name
+            families.setdefault(key, ([], []))[1].append(_add_label(line, worker))
+    lines: List[str] = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class Router:
+    """前置路由：按请求选择 worker 并转发字节流"""
+
+    def __init__(self, worker_ports: Sequence[int], host: str = "127.0.0.1"):
+        self.worker_ports = list(worker_ports)
+        self.host = host
+        self.ring = HashRing(range(len(self.worker_ports)))
+        self.active: List[int] = [0] * len(self.worker_ports)
+        self.routed: List[int] = [0] * len(self.worker_ports)
+        self.alive: List[bool] = [True] * len(self.worker_ports)
+
+    async def fetch(self, index: int, head: RequestHead, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """单独向一个 worker 发送请求并读取完整响应（Connection: close）"""
+        reader, writer = await self._connect(index)
+        try:
+            writer.write(
+                f"{head.method} {head.target} HTTP/1.1\r\nhost: 127.0.0.1\r\nconnection: close\r\n"
+                f"content-length: {len(body)}\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+            status, headers = parse_head(await reader.readuntil(b"\r\n\r\n"))
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                body = bytearray()
+                while True:
+                    line = await reader.readuntil(b"\r\n")
+                    size = int(line.split(b";")[0], 16)
+                    body += (await reader.readexactly(size + 2))[:size]
+                    if size == 0:
+                        break
+                return status, headers, bytes(body)
+            if "content-length" in headers:
+                return status, headers, await reader.readexactly(int(headers["content-length"]))
+            return status, headers, await reader.read()
+        finally:
+            writer.close()
+
+    async def fan_out(self, head: RequestHead, body: bytes) -> Tuple[int, str, bytes]:
+        """向所有 worker 发送同一个请求并合并结果，返回 (状态码, content-type, 响应体)"""
+
+        async def one(index: int):
+            try:
+                return await asyncio.wait_for(self.fetch(index, head, body), FANOUT_TIMEOUT_SECONDS)
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError) as e:
+                return e
+
+        results = await asyncio.gather(*(one(i) for i in range(len(self.worker_ports))))
+        if head.path == "/metrics":
+            texts = [(i, r[2].decode("utf-8", "replace")) for i, r in enumerate(results)
+                     if not isinstance(r, Exception) and r[0] == 200]
+            return 200, "text/plain; version=0.0.4", merge_metrics(texts).encode()
+        workers = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                workers.append({"worker": i, "error": f"{type(result).__name__}: {result}"})
+                continue
+            status, _, payload = result
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                data = {"body": payload.decode("utf-8", "replace")}
+            entry = {"worker": i, "status": status}
+            entry.update(data if isinstance(data, dict) else {"body": data})
+            workers.append(entry)
+        ok = all("error" not in w and w["status"] < 400 for w in workers)
+        return 200 if ok else 502, "application/json", json.dumps({"workers": workers}, ensure_ascii=False).encode()
+
+    def pick(self, context_id: Optional[str]) -> int:
+        if context_id:
+            return self.ring.get(context_id)
+        return min(range(len(self.worker_ports)), key=lambda i: self.active[i])
+
+    async def _connect(self, index: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        deadline = time.monotonic() + CONNECT_RETRY_SECONDS
+        while True:
+            try:
+                return await asyncio.open_connection(self.host, self.worker_ports[index], limit=MAX_HEAD_BYTES)
+            except OSError:
+                # worker 仍在启动或正在被重启
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        # 每个客户端连接上按 worker 复用上游连接，并各自有一个 worker→客户端 的回传任务
+        upstreams: Dict[int, Tuple[asyncio.StreamWriter, asyncio.Task]] = {}
+        try:
+            while True:
+                head = await read_head(client_reader)
+                if head is None:
+                    break
+                if head.path == STATUS_PATH:
+                    self._write_status(client_writer)
+                    await client_writer.drain()
+                    continue
+                worker = head.worker
+                if worker is not None and not 0 <= worker < len(self.worker_ports):
+                    self._write_response(client_writer, 404, "application/json",
+                                         json.dumps({"error": f"no worker {worker}"}).encode())
+                    await client_writer.drain()
+                    continue
+                if worker is None and (head.method, head.path) in FANOUT_PATHS and head.content_length is not None:
+                    body = await client_reader.readexactly(head.content_length)
+                    self._write_response(client_writer, *(await self.fan_out(head, body)))
+                    await client_writer.drain()
+                    continue
+
+                index = worker if worker is not None else self.pick(head.context_id)
+                self.routed[index] += 1
+                upstream = upstreams.get(index)
+                if upstream is None or upstream[1].done():
+                    reader, writer = await self._connect(index)
+                    # worker 关闭空闲连接时不能连带关闭客户端连接，其他 worker 可能正在回传响应
+                    pump = asyncio.create_task(_pipe(reader, client_writer, close_writer=False))
+                    upstream = upstreams[index] = (writer, pump)
+                writer = upstream[0]
+                writer.write(head.raw)
+
+                length = head.content_length
+                if head.is_upgrade or length is None:
+                    # WebSocket 或分块请求体：剩余字节全部透传到该 worker
+                    self.active[index] += 1
+                    uplink = asyncio.create_task(_pipe(client_reader, writer))
+                    try:
+                        await writer.drain()
+                        # 任一方向结束即整体结束
+                        await asyncio.wait({uplink, upstream[1]}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        uplink.cancel()
+                        self.active[index] -= 1
+                    return
+
+                remaining = length
+                while remaining > 0:
+                    chunk = await client_reader.read(min(PIPE_CHUNK, remaining))
+                    if not chunk:
+                        return
+                    writer.write(chunk)
+                    remaining -= len(chunk)
+                await writer.drain()
+        except (ConnectionError, ValueError, OSError) as e:
+            logger.debug(f"cluster router: 连接结束 ({type(e).__name__}: {e})")
+        finally:
+            for writer, pump in upstreams.values():
+                try:
+                    writer.close()
+                except Exception:
+                    pass
+                pump.cancel()
+            try:
+                client_writer.close()
+            except Exception:
+                pass
+
+    def status(self) -> dict:
+        return {
+            "workers": [
+                {"index": i, "port": port, "alive": self.alive[i],
+                 "active_streams": self.active[i], "routed_requests": self.routed[i]}
+                for i, port in enumerate(self.worker_ports)
+            ]
+        }
+
+    def _write_status(self, writer: asyncio.StreamWriter) -> None:
+        self._write_response(writer, 200, "application/json", json.dumps(self.status()).encode())
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes) -> None:
+        reason = {200: "OK", 404: "Not Found", 502: "Bad Gateway"}.get(status, "")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\ncontent-type: {content_type}\r\n"
+            f"content-length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+
+def run_worker(index: int, port: int) -> None:
+    """worker 进程入口：构建完整 app 并只监听本机内部端口"""
+    import uvicorn
+
+    # 会话快照等按 worker 区分的本地状态使用该序号（见 snapshot.snapshot_path）
+    os.environ["HGDOLL_WORKER_INDEX"] = str(index)
+
+    import main
+
+    uvicorn.run(main.create_app(), host="127.0.0.1", port=port, log_level="warning")
+
+
+WorkerTarget = Callable[[int, int], None]
+
+
+def serve(
+    port: int,
+    workers: int,
+    host: str = "0.0.0.0",
+    internal_base_port: Optional[int] = None,
+    target: WorkerTarget = run_worker,
+) -> None:
+    """启动前置路由与 worker 进程，阻塞直到收到退出信号"""
+    base = internal_base_port or int(os.environ.get("HGDOLL_WORKER_BASE_PORT", str(port + 1000)))
+    worker_ports = [base + i for i in range(workers)]
+    ctx = multiprocessing.get_context("spawn")
+    processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def spawn(i: int) -> None:
+        proc = ctx.Process(target=target, args=(i, worker_ports[i]), name=f"hgdoll-worker-{i}", daemon=True)
+        proc.start()
+        processes[i] = proc
+
+    for i in range(workers):
+        spawn(i)
+
+    router = Router(worker_ports)
+
+    async def supervise() -> None:
+        while True:
+            await asyncio.sleep(1)
+            for i, proc in enumerate(processes):
+                router.alive[i] = bool(proc and proc.is_alive())
+                if not router.alive[i]:
+                    logger.warning(f"cluster: worker {i} 已退出 (exitcode={proc.exitcode if proc else None})，重新启动")
+                    spawn(i)
+
+    async def run() -> None:
+        server = await asyncio.start_server(router.handle, host, port, limit=MAX_HEAD_BYTES, reuse_address=True)
+        supervisor = asyncio.create_task(supervise())
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        print(f"服务启动在 http://{host}:{port} ({workers} workers, 内部端口 {worker_ports[0]}-{worker_ports[-1]})")
+        async with server:
+            await stop.wait()
+        supervisor.cancel()
+
+    try:
+        asyncio.run(run())
+    finally:
+        for proc in processes:
+            if proc and proc.is_alive():
+                proc.terminate()
+        for proc in processes:
+            if proc:
+                proc.join(timeout=5)
@@ -0,0 +1,98 @@
+"""
+会话历史的紧凑存储记录
+
+会话历史原先直接保存 pydantic ArkMessage 对象，每条消息除了内容本身，还要背负 pydantic 实例、
+__dict__ 和若干字段对象的开销；画面描述动辄数百字，上万个会话 × 数百条消息时对象开销占了大头。
+这里每条消息只保存一个 __slots__ 对象：
+
+- role_id：角色在 ROLES 中的下标（小整数，全局共享）
+- data：消息的 JSON 字节，与组装请求体时拼接的内容相同（见 chat_body），不再另存一份
+- compressed：data 是否为 zlib 压缩后的字节
+
+窗口只会向前移动（见 prompt_layout），超出最大窗口的旧消息不会再发送给模型，
+写入新消息时把它们压缩保存；只在组装请求或调试查看时才解码或转换为 ArkMessage。
+
+环境变量：
+    HGDOLL_HISTORY_COMPRESS            0 关闭旧消息压缩，默认 1
+    HGDOLL_HISTORY_COMPRESS_MIN_BYTES  小于该字节数的消息不压缩，默认 256
+    HGDOLL_HISTORY_HOT                 最近多少条消息保持不压缩，默认等于提示词窗口大小
+"""
+
+import os
+import sys
+import zlib
+from typing import Any, Dict, Optional
+
+import chat_body
+import prompt_layout
+
+COMPRESS = os.environ.get("HGDOLL_HISTORY_COMPRESS", "1") != "0"
+COMPRESS_MIN_BYTES = int(os.environ.get("HGDOLL_HISTORY_COMPRESS_MIN_BYTES", "256"))
+HOT_MESSAGES = int(os.environ.get("HGDOLL_HISTORY_HOT", str(prompt_layout.WINDOW)))
+COMPRESS_LEVEL = 6
+
+ROLES = ("system", "user", "assistant", "tool")
+_ROLE_IDS = {role: i for i, role in enumerate(ROLES)}
+UNKNOWN_ROLE = -1
+
+
+class Record:
+    """一条历史消息；创建后不再修改（压缩时生成新记录替换），可以安全地交给后台线程读取"""
+
+    __slots__ = ("role_id", "data", "compressed")
+
+    def __init__(self, role_id: int, data: bytes, compressed: bool = False):
+        self.role_id = role_id
+        self.data = data
+        self.compressed = compressed
+
+    @classmethod
+    def from_message(cls, message: Any) -> "Record":
+        role = message["role"] if isinstance(message, dict) else message.role
+        # orjson 返回的 bytes 可能带有未收缩的缓冲区，长期保存前复制成紧凑的一份
+        data = bytes(memoryview(chat_body.encode_message(message)))
+        return cls(_ROLE_IDS.get(role, UNKNOWN_ROLE), data)
+
+    @property
+    def serialized(self) -> bytes:
+        return zlib.decompress(self.data) if self.compressed else self.data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return chat_body.loads(self.serialized)
+
+    @property
+    def role(self) -> str:
+        if self.role_id == UNKNOWN_ROLE:
+            return self.to_dict()["role"]
+        return ROLES[self.role_id]
+
+    @property
+    def content(self) -> Any:
+        return self.to_dict().get("content")
+
+    def compressed_copy(self) -> Optional["Record"]:
+        """压缩后的新记录；已压缩、太短或压缩后没有变小时返回 None"""
+        if self.compressed or len(self.data) < COMPRESS_MIN_BYTES:
+            return None
+        packed = zlib.compress(self.data, COMPRESS_LEVEL)
+        if len(packed) >= len(self.data):
+            return None
+        return Record(self.role_id, packed, True)
+
+    def nbytes(self) -> int:
+        """记录本身与内容字节占用的内存"""
+        return sys.getsizeof(self) + sys.getsizeof(self.data)
+
+
+def compress_cold(records: list, backlog: bool = False) -> None:
+    """
+    新消息写入后调用：刚滑出最近 HOT_MESSAGES 条的那一条不会再发送，压缩保存；
+    backlog=True 时压缩所有更早的消息（整体替换会话历史时使用）
+    """
+    if not COMPRESS or len(records) <= HOT_MESSAGES:
+        return
+    cold = len(records) - HOT_MESSAGES
+    for i in range(cold) if backlog else (cold - 1,):
+        packed = records[i].compressed_copy()
+        if packed is not None:
+            records[i] = packed
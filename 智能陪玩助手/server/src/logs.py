@@ -0,0 +1,213 @@
+"""
+非阻塞结构化日志
+
+热点路径（default_model_calling / chat_with_vlm / summarize_image / _save_context）
+原先直接 print 到 stdout，当 stdout 是接日志采集器的管道时，写满即阻塞整个事件循环。
+这里改为：
+
+    logger.info(...)  →  QueueHandler（事件循环线程，只做入队）
+                      →  后台写线程 QueueListener  →  JSON 行写入 stdout
+
+- 队列有上限，满了直接丢弃并计数，绝不阻塞调用方
+- 自动附带 context_id / request_id（来自 arkitect 的 get_headers / get_reqid）
+- 按 logger 配置采样率与限速，用于逐帧日志（hgdoll.frame）
+
+环境变量：
+    HGDOLL_LOG_LEVEL       默认 INFO
+    HGDOLL_LOG_FORMAT      json（默认）或 text
+    HGDOLL_LOG_QUEUE_SIZE  队列上限，默认 10000
+    HGDOLL_LOG_SAMPLING    逐 logger 采样率，如 "hgdoll.frame=0.2"
+    HGDOLL_LOG_RATE        逐 logger 每秒条数上限，如 "hgdoll.frame=5,hgdoll.chat=50"
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+
+DEFAULT_SAMPLING = "hgdoll.frame=1"
+DEFAULT_RATE = "hgdoll.frame=5"
+
+LOG_DROPPED = metrics.counter(
+    "hgdoll_log_dropped_total",
+    "Log records dropped by sampling, rate limiting or a full queue",
+    ("reason",),
+)
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _parse_mapping(spec: str) -> Dict[str, float]:
+    result = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            result[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return result
+
+
+def _lookup(mapping: Dict[str, float], name: str) -> Optional[float]:
+    """按 logger 层级向上查找配置，hgdoll.frame.vlm 会命中 hgdoll.frame"""
+    while name:
+        if name in mapping:
+            return mapping[name]
+        name = name.rpartition(".")[0]
+    return None
+
+
+class RequestContextFilter(logging.Filter):
+    """在调用线程中附加 context_id / request_id（入队前执行，contextvars 仍然有效）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "context_id", None) is None:
+            record.context_id = None
+            try:
+                from arkitect.utils.context import get_headers
+
+                record.context_id = (get_headers() or {}).get("X-Context-Id")
+            except Exception:
+                pass
+        if getattr(record, "request_id", None) is None:
+            record.request_id = None
+            try:
+                from arkitect.utils.context import get_reqid
+
+                record.request_id = get_reqid() or None
+            except Exception:
+                pass
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称采样 + 令牌桶限速；WARNING 及以上总是放行"""
+
+    def __init__(self, sampling: Dict[str, float], rates: Dict[str, float]):
+        super().__init__()
+        self.sampling = sampling
+        self.rates = rates
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        ratio = _lookup(self.sampling, record.name)
+        if ratio is not None and ratio < 1 and random.random() >= ratio:
+            LOG_DROPPED.inc(reason="sampled")
+            return False
+        rate = _lookup(self.rates, record.name)
+        if rate is not None and not self._take(record.name, rate):
+            LOG_DROPPED.inc(reason="rate_limited")
+            return False
+        return True
+
+    def _take(self, name: str, rate: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [rate, now]
+            tokens = min(rate, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+            return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，extra 字段原样带出"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key in _STANDARD_ATTRS or key.startswith("_") or value is None:
+                continue
+            entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃而不是阻塞；格式化推迟到写线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只合并 msg % args，格式化（json.dumps）留给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(reason="queue_full")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging(stream=None) -> None:
+    """安装队列日志管线（可重复调用，只生效一次）"""
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    level = os.environ.get("HGDOLL_LOG_LEVEL", "INFO").upper()
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(
+        maxsize=int(os.environ.get("HGDOLL_LOG_QUEUE_SIZE", "10000"))
+    )
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    if os.environ.get("HGDOLL_LOG_FORMAT", "json") == "text":
+        writer.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    else:
+        writer.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(
+        _parse_mapping(os.environ.get("HGDOLL_LOG_SAMPLING", DEFAULT_SAMPLING)),
+        _parse_mapping(os.environ.get("HGDOLL_LOG_RATE", DEFAULT_RATE)),
+    ))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    _handler = handler
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """停止后台写线程并刷出剩余日志"""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
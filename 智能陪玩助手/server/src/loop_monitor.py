@@ -0,0 +1,196 @@
+"""
+事件循环延迟监控与阻塞检测
+
+服务端是单个 asyncio 进程，任何同步耗时操作（gzip、json.dumps、大段 base64、print 等）
+都会卡住所有玩家的音频流。本模块提供：
+
+1. LoopLagMonitor：周期性 sleep 并测量实际唤醒的延迟，写入 hgdoll_event_loop_lag_seconds
+2. 阻塞检测（可选）：独立的看门狗线程检查循环心跳，一旦超过阈值未更新，
+   就对事件循环线程做栈采样，并记录当时正在运行的 Task / 协程（如 asr_proxy、summarize_image）
+
+看门狗只依赖心跳与 sys._current_frames()，因此在 uvloop 下同样可用。
+
+环境变量：
+    HGDOLL_LOOP_LAG_INTERVAL_MS   延迟采样间隔，默认 250
+    HGDOLL_SLOW_CALLBACK_MS       阻塞检测阈值，未设置或为 0 时关闭
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Dict, List, Optional
+
+import metrics
+
+LAG_INTERVAL = float(os.environ.get("HGDOLL_LOOP_LAG_INTERVAL_MS", "250")) / 1000
+SLOW_CALLBACK_THRESHOLD = float(os.environ.get("HGDOLL_SLOW_CALLBACK_MS", "0")) / 1000
+MAX_STACK_SAMPLES = 5
+MAX_EVENTS = 50
+
+LOOP_LAG = metrics.histogram(
+    "hgdoll_event_loop_lag_seconds",
+    "Delay between the scheduled and actual wake-up of the loop lag sampler",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_LAG_MAX = metrics.gauge(
+    "hgdoll_event_loop_lag_max_seconds",
+    "Largest loop lag observed in the last sampling window",
+)
+LOOP_BLOCKED = metrics.counter(
+    "hgdoll_event_loop_blocked_total",
+    "Times the event loop was held longer than HGDOLL_SLOW_CALLBACK_MS",
+    ("coroutine",),
+)
+LOOP_BLOCKED_SECONDS = metrics.histogram(
+    "hgdoll_event_loop_blocked_seconds",
+    "Duration of detected event loop stalls",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+def _describe_task(task: Optional[asyncio.Task]) -> Dict[str, str]:
+    if task is None:
+        return {"task": "", "coroutine": "<callback>"}
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", None) or type(coro).__name__
+    return {"task": task.get_name(), "coroutine": name.replace(".<locals>", "")}
+
+
+class LoopLagMonitor:
+    """事件循环延迟采样器 + 阻塞看门狗"""
+
+    def __init__(self, interval: float = LAG_INTERVAL, slow_threshold: float = SLOW_CALLBACK_THRESHOLD):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.recent_lags: Deque[float] = collections.deque(maxlen=max(1, int(60 / max(interval, 0.01))))
+        self.events: Deque[dict] = collections.deque(maxlen=MAX_EVENTS)
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._sample(), name="loop_lag_monitor")
+        if self.slow_threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self) -> None:
+        window_max = 0.0
+        window_start = time.monotonic()
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - scheduled - self.interval)
+            self.recent_lags.append(lag)
+            LOOP_LAG.observe(lag)
+            window_max = max(window_max, lag)
+            if now - window_start >= 10:
+                LOOP_LAG_MAX.set(window_max)
+                window_max = 0.0
+                window_start = now
+
+    def _watch(self) -> None:
+        """看门狗线程：心跳超时即视为事件循环被阻塞，对循环线程做栈采样"""
+        poll = max(self.slow_threshold / 4, 0.005)
+        stall: Optional[dict] = None
+        while not self._stopped.wait(poll):
+            beat = self._heartbeat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue > self.slow_threshold:
+                if stall is None or stall["_beat"] != beat:
+                    if stall is not None:
+                        self._finish(stall)
+                    stall = self._begin(beat, overdue)
+                if len(stall["stacks"]) < MAX_STACK_SAMPLES:
+                    stack = self._sample_stack()
+                    if stack and (not stall["stacks"] or stall["stacks"][-1] != stack):
+                        stall["stacks"].append(stack)
+            elif stall is not None:
+                self._finish(stall)
+                stall = None
+
+    def _begin(self, beat: float, overdue: float) -> dict:
+        task = None
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            pass
+        info = _describe_task(task)
+        return {
+            "_beat": beat,
+            "_started": time.monotonic() - overdue,
+            "detected_at": time.time(),
+            "task": info["task"],
+            "coroutine": info["coroutine"],
+            "stacks": [],
+        }
+
+    def _finish(self, stall: dict) -> None:
+        duration = time.monotonic() - stall.pop("_started")
+        stall.pop("_beat", None)
+        stall["duration_ms"] = round(duration * 1000, 1)
+        self.events.append(stall)
+        LOOP_BLOCKED.inc(coroutine=stall["coroutine"])
+        LOOP_BLOCKED_SECONDS.observe(duration)
+
+    def _sample_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        summary = traceback.extract_stack(frame, limit=12)
+        return [f"{f.filename}:{f.lineno} {f.name}" for f in summary]
+
+    def snapshot(self) -> dict:
+        lags = sorted(self.recent_lags)
+
+        def pct(p: float) -> Optional[float]:
+            if not lags:
+                return None
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 2)
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "slow_callback_threshold_ms": self.slow_threshold * 1000 if self.slow_threshold > 0 else None,
+            "lag_ms": {
+                "samples": len(lags),
+                "p50": pct(0.50),
+                "p99": pct(0.99),
+                "max": round(lags[-1] * 1000, 2) if lags else None,
+            },
+            "slow_events": list(self.events),
+        }
+
+
+_monitor: Optional[LoopLagMonitor] = None
+
+
+def get_monitor() -> LoopLagMonitor:
+    global _monitor
+    if _monitor is None:
+        _monitor = LoopLagMonitor()
+    return _monitor
@@ -13,20 +13,40 @@
 Video Analyser: Realtime vision and speech analysis
 """
 
+import startup  # 最先导入：记录进程启动时刻，其余重量级模块延迟加载
+
 import asyncio
-import datetime
+import base64
 import logging
 import os
 import json
-import gzip
-import struct
+import time
 from typing import AsyncIterable, List, Optional, Tuple, Union
 
+import admission
+import asr
+import audio_input
+import cadence
+import cancellation
+import chat_body
+import logs
+import loop_monitor
+import metrics
+import model_client
+import proactive
 import prompt
+import prompt_layout
+import prompt_registry
+import relay
+import retrieval
+import scene_state
+import session
+import snapshot
+import turns
 import utils
+import vision_chat
 from config import LLM_ENDPOINT, VLM_ENDPOINT, TTS_ACCESS_TOKEN, TTS_APP_ID, ASR_APP_ID, ASR_ACCESS_TOKEN
 
-from arkitect.core.component.llm import BaseChatLanguageModel
 from arkitect.types.llm.model import (
     ArkChatCompletionChunk,
     ArkChatParameters,
@@ -35,37 +55,31 @@ from arkitect.types.llm.model import (
     ArkMessage,
     Response,
 )
-from volcenginesdkarkruntime.types.chat.chat_completion_content_part_text_param import (
-    ChatCompletionContentPartTextParam,
-)
-from arkitect.core.component.tts import (
-    AudioParams,
-    ConnectionParams,
-    AsyncTTSClient,
-    create_bot_audio_responses,
-)
-from arkitect.launcher.local.serve import launch_serve
 from arkitect.telemetry.trace import task
 from arkitect.utils.context import get_headers, get_reqid
 
-FRAME_DESCRIPTION_PREFIX = "视频帧描述："
-LAST_HISTORY_MESSAGES = 180  # truncate history messages to 180
-
+# 重量级组件延迟到第一次使用时导入，服务 ready 后由 startup.warm_up 在后台预热
+BaseChatLanguageModel = startup.lazy_import("arkitect.core.component.llm", "BaseChatLanguageModel")
+AsyncTTSClient = startup.lazy_import("arkitect.core.component.tts", "AsyncTTSClient")
+AudioParams = startup.lazy_import("arkitect.core.component.tts", "AudioParams")
+ConnectionParams = startup.lazy_import("arkitect.core.component.tts", "ConnectionParams")
+create_bot_audio_responses = startup.lazy_import("arkitect.core.component.tts", "create_bot_audio_responses")
 
-def _is_text_part(part) -> bool:
-    """Check if a content part is a text part (compatible with dict or pydantic model)."""
-    if isinstance(part, dict):
-        return part.get("type") == "text"
-    return hasattr(part, "text") and hasattr(part, "type")
+FRAME_DESCRIPTION_PREFIX = "视频帧描述："
+ASR_URL = os.environ.get("ASR_URL", "wss://openspeech.bytedance.com/api/v3/sauc/bigmodel")
+# /ws/asr 代理两个方向的队列长度与队列满时的策略（见 relay.py）；插件约每 256ms 发送一包音频，20 包约 5 秒
+ASR_UPLINK_QUEUE = int(os.environ.get("HGDOLL_ASR_UPLINK_QUEUE", "20"))
+ASR_UPLINK_POLICY = os.environ.get("HGDOLL_ASR_UPLINK_POLICY", relay.DROP_OLDEST)
+ASR_DOWNLINK_QUEUE = int(os.environ.get("HGDOLL_ASR_DOWNLINK_QUEUE", "64"))
+ASR_DOWNLINK_POLICY = os.environ.get("HGDOLL_ASR_DOWNLINK_POLICY", relay.BLOCK)
 
+startup.mark("imports")
 
-def _get_text(part) -> str:
-    """Get text from a content part (compatible with dict or pydantic model)."""
-    if isinstance(part, dict):
-        return part.get("text", "")
-    return getattr(part, "text", "")
 
 logger = logging.getLogger(__name__)
+# 逐请求 / 逐帧日志使用独立 logger，便于分别采样和限速（见 logs.py）
+chat_logger = logging.getLogger("hgdoll.chat")
+frame_logger = logging.getLogger("hgdoll.frame")
 
 
 @task(watch_io=False)
@@ -75,15 +89,80 @@ async def get_request_messages_for_llm(
     request: ArkChatRequest,
     prompt: str,
 ) -> List[ArkMessage]:
-    request_messages = await contexts.get_history(context_id)
-    if isinstance(request.messages[-1].content, list):
-        assert _is_text_part(request.messages[-1].content[0])
-        text = _get_text(request.messages[-1].content[0])
+    messages, _, _ = await _layout_request_messages(contexts, context_id, request, prompt)
+    return messages
+
+
+async def _layout_request_messages(
+    contexts: utils.Storage,
+    context_id: str,
+    request: ArkChatRequest,
+    prompt: str,
+) -> Tuple[List[ArkMessage], int, int]:
+    """返回 [system] + 窗口内历史 + [user]，以及窗口起点与冻结块边界（历史中的绝对下标）"""
+    records = await contexts.get_records(context_id)
+    start, frozen_end = prompt_layout.get_layout().span(context_id, len(records) + 1)
+    history = await _history_records(context_id, records, start, request)
+    if history is None:
+        history = records[start:]
     else:
-        text = request.messages[-1].content
-    request_messages = request_messages + [ArkMessage(role="user", content=text)]
-    request_messages = request_messages[-LAST_HISTORY_MESSAGES:]
-    return [ArkMessage(role="system", content=prompt)] + request_messages
+        # 检索到的历史每轮不同，没有可冻结的前缀
+        frozen_end = start
+    # 只把窗口内的记录转换为 ArkMessage
+    messages = [ArkMessage(role="system", content=prompt)]
+    messages += [utils.to_message(r) for r in history]
+    scene = _scene_message(context_id)
+    if scene is not None:
+        messages.append(ArkMessage(**scene))
+    messages.append(ArkMessage(role="user", content=_request_text(request)))
+    return messages, start, frozen_end
+
+
+def _scene_message(context_id: str) -> Optional[dict]:
+    """结构化画面状态模式下的「当前状态 + 最近变化」，放在本轮用户消息之前（见 scene_state.py）"""
+    if not scene_state.ENABLED:
+        return None
+    text = scene_state.get_store().render(context_id)
+    if text is None:
+        return None
+    return {"role": "assistant", "content": FRAME_DESCRIPTION_PREFIX + text}
+
+
+async def _history_records(context_id: str, records, start: int, request: ArkChatRequest):
+    """开启检索时返回最近历史加检索到的较早记录（见 retrieval.py）；未开启或无法检索时返回 None，按原窗口发送"""
+    if not retrieval.ENABLED:
+        return None
+    with metrics.span("retrieval"):
+        selected = await retrieval.get_index().select(context_id, records, start, _request_text(request))
+    return None if selected is None else [records[i] for i in selected]
+
+
+async def _spliced_request_body(
+    contexts: utils.Storage,
+    context_id: str,
+    request: ArkChatRequest,
+    prompt: str,
+    parameters: ArkChatParameters,
+) -> bytes:
+    """与 _layout_request_messages 相同的窗口，直接拼接历史记录写入时序列化好的 JSON 字节"""
+    records = await contexts.get_records(context_id)
+    user = chat_body.encode_message({"role": "user", "content": _request_text(request)})
+    start, _ = prompt_layout.get_layout().span(context_id, len(records) + 1)
+    history = await _history_records(context_id, records, start, request)
+    if history is None:
+        history = records[start:]
+    scene = _scene_message(context_id)
+    scene = [chat_body.encode_message(scene)] if scene is not None else []
+    return chat_body.build(
+        LLM_ENDPOINT,
+        [chat_body.system_message(prompt), *(r.serialized for r in history), *scene, user],
+        parameters.model_dump(exclude_none=True, exclude_unset=True),
+    )
+
+
+def _request_text(request: ArkChatRequest) -> str:
+    # 带图片的消息只取文字部分，图片由 vision_chat 路由处理
+    return vision_chat.split_content(request.messages[-1].content)[0]
 
 
 @task(watch_io=False)
@@ -93,9 +172,10 @@ async def chat_with_vlm(
 ) -> Tuple[bool, Optional[AsyncIterable[ArkChatCompletionChunk]]]:
     vlm = BaseChatLanguageModel(
         model=VLM_ENDPOINT,
-        messages=[ArkMessage(role="system", content=prompt.VLM_CHAT_PROMPT)]
+        messages=[ArkMessage(role="system", content=prompt_registry.get_registry().get("vlm_chat").text)]
         + [request.messages[-1]],
         parameters=parameters,
+        **model_client.client_kwargs(),
     )
 
     iterator = vlm.astream()
@@ -106,7 +186,7 @@ async def chat_with_vlm(
     second_resp = await iterator.__anext__()
     if second_resp.choices and second_resp.choices[0].delta.content != "":
         message += second_resp.choices[0].delta.content
-    print("message：", message)
+    chat_logger.debug("VLM 首段回复", extra={"vlm_head": message})
     if message.startswith("不知道"):
         return False, None
     async def stream_vlm_outputs():
@@ -122,24 +202,154 @@ async def chat_with_vlm(
 async def llm_answer(
     contexts, context_id, request, parameters: ArkChatParameters
 ) -> Tuple[bool, Optional[AsyncIterable[ArkChatCompletionChunk]]]:
-    request_messages = await get_request_messages_for_llm(
-        contexts, context_id, request, prompt.LLM_PROMPT
+    # 需要 usage 统计缓存命中；客户端自己没有要求时，统计完不再往下游转发
+    forward_usage = bool(parameters.stream_options)
+    if not forward_usage:
+        parameters = parameters.model_copy(update={"stream_options": {"include_usage": True}})
+
+    # 按会话当前的游戏变体选用提示词（见 prompt_registry.py）
+    system_prompt = prompt_registry.get_registry().get("llm", context_id)
+    iterator = None
+    if chat_body.ENABLED and not prompt_layout.CONTEXT_CACHE and model_client.raw_chat_available():
+        with metrics.span("prompt_assembly"):
+            body = await _spliced_request_body(contexts, context_id, request, system_prompt.text, parameters)
+        iterator = _spliced_astream(body)
+    else:
+        with metrics.span("prompt_assembly"):
+            request_messages, start, frozen_end = await _layout_request_messages(
+                contexts, context_id, request, system_prompt.text
+            )
+        if prompt_layout.CONTEXT_CACHE:
+            iterator = await _context_cached_astream(
+                context_id, request_messages, start, frozen_end, parameters
+            )
+    if iterator is None:
+        llm = BaseChatLanguageModel(
+            model=LLM_ENDPOINT,
+            messages=request_messages,
+            parameters=parameters,
+            **model_client.client_kwargs(),
+        )
+        iterator = llm.astream()
+    with metrics.span("llm_first_token"):
+        first_resp = await iterator.__anext__()
+
+    async def stream_llm_outputs():
+        try:
+            async for resp in _prepend(first_resp, iterator):
+                if resp.usage:
+                    cached, uncached = prompt_layout.record_usage(resp.usage)
+                    prompt_registry.record_usage(system_prompt, resp.usage)
+                    chat_logger.info(
+                        "提示词 token 统计",
+                        extra={"context_id": context_id, "cached_tokens": cached, "uncached_tokens": uncached},
+                    )
+                    if not resp.choices and not forward_usage:
+                        continue
+                yield resp
+        finally:
+            # 提前停止读取（被取代、客户端断开）时关闭上游流，释放连接
+            await iterator.aclose()
+
+    return True, stream_llm_outputs()
+
+
+@task(watch_io=False)
+async def vision_answer(
+    contexts, context_id, request, parameters: ArkChatParameters, images: List[dict]
+) -> AsyncIterable[ArkChatCompletionChunk]:
+    """一次流式 VLM 调用回答带画面的一轮：人设提示词 + 窗口内历史 + 本轮文字与图片（见 vision_chat.py）"""
+    system_prompt = prompt_registry.get_registry().get("vlm_chat", context_id)
+    with metrics.span("prompt_assembly"):
+        request_messages, _, _ = await _layout_request_messages(
+            contexts, context_id, request, system_prompt.text
+        )
+    request_messages[-1] = ArkMessage(
+        role="user", content=vision_chat.user_content(request_messages[-1].content, images)
     )
-    llm = BaseChatLanguageModel(
-        model=LLM_ENDPOINT,
+    vlm = BaseChatLanguageModel(
+        model=VLM_ENDPOINT,
         messages=request_messages,
         parameters=parameters,
+        **model_client.client_kwargs(),
     )
+    iterator = vlm.astream()
+    with metrics.span("vision_first_token"):
+        first_resp = await iterator.__anext__()
 
-    iterator = llm.astream()
-    first_resp = await iterator.__anext__()
+    async def stream_vlm_outputs():
+        try:
+            async for resp in _prepend(first_resp, iterator):
+                if resp.usage:
+                    prompt_registry.record_usage(system_prompt, resp.usage)
+                yield resp
+        finally:
+            await iterator.aclose()
 
-    async def stream_llm_outputs():
-        yield first_resp
-        async for resp in iterator:
-            yield resp
+    return stream_vlm_outputs()
 
-    return True, stream_llm_outputs()
+
+async def _two_hop_summary(contexts, context_id, request, parameters, images: List[dict]) -> None:
+    """对照路径：先等 VLM 把本轮自带的画面写成描述存入历史，再交给 LLM；该会话已有一帧在分析时不再重复分析"""
+    controller = cadence.get_controller()
+    if not controller.admit_frame(context_id):
+        return
+    slot = cadence.FrameSlot(controller, context_id)
+    frame_request = request.model_copy(update={
+        "messages": [ArkMessage(role="user", content=[{"type": "text", "text": ""}, *images])],
+    })
+    try:
+        await summarize_image(contexts, frame_request, parameters, context_id, slot)
+    except Exception as e:
+        logger.error(f"[Chat] 画面分析失败，按已有描述回答: {e}")
+    finally:
+        slot.release()
+
+
+def _spliced_astream(body: bytes):
+    # 关闭返回的迭代器时同时关闭上游响应（见 model_client.stream_chat_as）
+    return model_client.stream_chat_as(body, lambda event: ArkChatCompletionChunk(**event))
+
+
+async def _prepend(first, iterator):
+    yield first
+    async for resp in iterator:
+        yield resp
+
+
+async def _context_cached_astream(
+    context_id: str,
+    request_messages: List[ArkMessage],
+    start: int,
+    frozen_end: int,
+    parameters: ArkChatParameters,
+):
+    """
+    通过 Ark 上下文缓存发送请求：system + 冻结块建成 common_prefix 上下文，只发送之后的消息；
+    缓存不可用时返回 None，由调用方走普通请求
+    """
+    prefix, tail = prompt_layout.split(request_messages, frozen_end - start)
+    client = model_client.get_ark_client()
+    # 历史只追加，冻结块由窗口起点与边界唯一确定；system 提示词变化时也要重建
+    key = (start, frozen_end, hash(prefix[0].content))
+    ark_context_id = await prompt_layout.get_context_cache().lookup(
+        client, LLM_ENDPOINT, context_id, key, prefix
+    )
+    if ark_context_id is None:
+        return None
+    stream = await client.context.completions.create(
+        context_id=ark_context_id,
+        model=LLM_ENDPOINT,
+        messages=[m.model_dump(exclude_none=True) for m in tail],
+        stream=True,
+        **parameters.model_dump(exclude_none=True, exclude_unset=True),
+    )
+
+    async def iterator():
+        async for resp in stream:
+            yield ArkChatCompletionChunk(**resp.__dict__)
+
+    return iterator()
 
 
 @task(watch_io=False)
@@ -162,7 +372,12 @@ async def chat_with_branches(
     request: ArkChatRequest,
     parameters: ArkChatParameters,
     context_id: str,
+    chat_route: Optional[vision_chat.Route] = None,
 ) -> AsyncIterable[Union[ArkChatCompletionChunk, ArkChatResponse]]:
+    if chat_route is not None and chat_route.path == vision_chat.VISION:
+        return await vision_answer(contexts, context_id, request, parameters, chat_route.images)
+    if chat_route is not None and chat_route.path == vision_chat.TWO_HOP:
+        await _two_hop_summary(contexts, context_id, request, parameters, chat_route.images)
 
     llm_task = asyncio.create_task(
         chat_with_llm(contexts, request, parameters, context_id)
@@ -179,32 +394,89 @@ async def summarize_image(
     request: ArkChatRequest,
     parameters: ArkChatParameters,
     context_id: str,
+    slot: cadence.FrameSlot,
 ):
     """
     Summarize the image and append the summary to the context.
+    slot 为 cadence.admit_frame 占用的分析名额，分析结束时释放
     """
+    # 结构化画面状态模式下 VLM 只输出紧凑 JSON，合并进会话状态而不是写入历史（见 scene_state.py）
+    registry = prompt_registry.get_registry()
+    system_prompt = registry.get("vlm_state" if scene_state.ENABLED else "vlm", context_id)
     request_messages = [
-        ArkMessage(role="system", content=prompt.VLM_PROMPT)
+        ArkMessage(role="system", content=system_prompt.text)
     ] + request.messages
-    vlm = BaseChatLanguageModel(
-        model=VLM_ENDPOINT,
-        messages=request_messages,
-        parameters=parameters,
+    description = novelty = update = None
+    try:
+        vlm = BaseChatLanguageModel(
+            model=VLM_ENDPOINT,
+            messages=request_messages,
+            parameters=parameters,
+            **model_client.client_kwargs(),
+        )
+        with metrics.span("summarize_image"):
+            resp = await vlm.arun()
+        description = message = resp.choices[0].message.content
+        if resp.usage:
+            cancellation.record_completed("vlm", resp.usage.completion_tokens)
+            prompt_registry.record_usage(system_prompt, resp.usage)
+        if scene_state.ENABLED:
+            update = scene_state.get_store().update(context_id, message)
+        # 按这一帧识别出的游戏类型选择该会话之后使用的提示词变体；结构化状态按合并后的 game 字段判断
+        state = scene_state.get_store().get(context_id) if update is not None else None
+        registry.note_scene(context_id, state.fields.get("game", "") if state is not None else message)
+    finally:
+        # 无论成功与否都释放该会话的分析名额（见 cadence.FrameSlot）
+        novelty = slot.finish(description, novelty=update.novelty if update is not None else None)
+    frame_logger.info(
+        "图片分析完成",
+        extra={"description_len": len(message), "description_head": message[:80]},
     )
-    resp = await vlm.arun()
-    message = resp.choices[0].message.content
-    print("图片分析结果：", message)
-    message = FRAME_DESCRIPTION_PREFIX + message
-    await contexts.append(context_id, ArkMessage(role="assistant", content=message))
+    if update is None:
+        # 自由文本描述（或无法解析的状态 JSON）照旧写入历史
+        message = FRAME_DESCRIPTION_PREFIX + message
+        await contexts.append(context_id, ArkMessage(role="assistant", content=message))
+    elif update.changes:
+        frame_logger.debug("画面状态变化", extra={"changes": scene_state.describe(update.changes)})
+    # 画面描述入库后再判断是否主动发言，生成时能看到这一帧
+    proactive.get_scheduler().on_frame(context_id, novelty)
+
+
+def _new_tts_client(reqid: str):
+    return AsyncTTSClient(
+        connection_params=ConnectionParams(
+            speaker="zh_female_meilinvyou_emo_v2_mars_bigtts",
+            audio_params=AudioParams(
+                format="mp3",
+                sample_rate=24000,
+            ),
+        ),
+        access_key=TTS_ACCESS_TOKEN,
+        app_key=TTS_APP_ID,
+        conn_id=reqid,
+        log_id=reqid,
+    )
+
+
+async def _timed_tts_init(tts_client):
+    """建立 TTS 连接并记录握手耗时"""
+    with metrics.span("tts_connect"):
+        await tts_client.init()
 
 
 async def _save_context(contexts, context_id, user_text, bot_message):
     """在异步任务中保存上下文历史，避免在 async generator 的 post-yield 代码中丢失"""
     try:
-        print(f"[Chat] context_id={context_id} 回复内容: {bot_message[:100]}{'...' if len(bot_message) > 100 else ''}")
-        await contexts.append(context_id, ArkMessage(role="user", content=user_text))
-        await contexts.append(context_id, ArkMessage(role="assistant", content=bot_message))
-        print(f"[Chat] context_id={context_id} 上下文已保存 (user + assistant)")
+        chat_logger.info(
+            "保存对话上下文",
+            extra={"context_id": context_id, "reply_len": len(bot_message), "reply_head": bot_message[:100]},
+        )
+        with metrics.span("save_context"):
+            await contexts.append(context_id, ArkMessage(role="user", content=user_text))
+            # 等待首个 token 时被取代的一轮没有回复，只保存用户消息
+            if bot_message:
+                await contexts.append(context_id, ArkMessage(role="assistant", content=bot_message))
+        chat_logger.debug("上下文已保存 (user + assistant)", extra={"context_id": context_id})
     except Exception as e:
         logger.error(f"[Chat] 保存上下文失败: {e}")
 
@@ -213,128 +485,331 @@ async def _save_context(contexts, context_id, user_text, bot_message):
 async def default_model_calling(
     request: ArkChatRequest,
 ) -> AsyncIterable[Union[ArkChatCompletionChunk, ArkChatResponse]]:
-    # local in-memory storage should be changed to other storage in production
     context_id: Optional[str] = get_headers().get("X-Context-Id", None)
-    print("context_id：", context_id)
     assert context_id is not None
+    stream = model_calling(request, context_id, get_reqid())
+    try:
+        async for resp in stream:
+            yield resp
+    finally:
+        # 框架关闭外层生成器时同步关闭内层，保证其 finally 中的上下文保存立即执行
+        await stream.aclose()
+
+
+@task(watch_io=False)
+async def model_calling(
+    request: ArkChatRequest,
+    context_id: str,
+    reqid: str,
+    cancel_on_disconnect: bool = False,
+) -> AsyncIterable[Union[ArkChatCompletionChunk, ArkChatResponse]]:
+    """
+    截图分析与对话的核心流程，不依赖 HTTP 请求上下文；
+    HTTP 接口（default_model_calling）与 /ws/session 共用。
+    cancel_on_disconnect 为 True 时（/ws/session 提交的截图），画面分析随该会话长连接断开而取消
+    """
+    request_start = time.perf_counter()
+    # local in-memory storage should be changed to other storage in production
     contexts: utils.Storage = utils.CoroutineSafeMap.get_instance_sync()
-    if not await contexts.contains(context_id):
-        await contexts.set(context_id, utils.Context())
+    with metrics.span("context_lookup"):
+        if not await contexts.contains(context_id):
+            await contexts.set(context_id, utils.Context())
 
-    # If a list is passed and the first text is empty
+    # If a list is passed and the text is empty
     # Use VLM to summarize the image asynchronously and return immediately
-    is_image = (
-        isinstance(request.messages[-1].content, list)
-        and _is_text_part(request.messages[-1].content[0])
-        and _get_text(request.messages[-1].content[0]) == ""
-    )
-    print("is_image", is_image)
+    user_text, images = vision_chat.split_content(request.messages[-1].content)
+    is_image = isinstance(request.messages[-1].content, list) and user_text == ""
+    (frame_logger if is_image else chat_logger).debug("收到请求", extra={"is_image": is_image})
+    metrics.REQUESTS.inc(kind="image" if is_image else "chat")
     parameters = ArkChatParameters(**request.__dict__)
     if is_image:
-        _ = asyncio.create_task(
-            summarize_image(contexts, request, parameters, context_id)
-        )
+        # 即使下面丢帧不做分析，这一帧也可供紧随其后的对话直接带图回答
+        vision_chat.get_frames().remember(context_id, images)
+        # 同一会话上一帧仍在分析或全局分析已满时直接丢帧，客户端按响应头放慢截图；
+        # 整体请求较多时也不再分析画面，把预算留给对话
+        if admission.get_controller().shed_frame():
+            return
+        controller = cadence.get_controller()
+        if controller.admit_frame(context_id):
+            slot = cadence.FrameSlot(controller, context_id)
+            task = asyncio.create_task(summarize_image(contexts, request, parameters, context_id, slot))
+            # 任务在第一次执行前被取消（会话断开、进程退出）时协程的 finally 不会运行，由完成回调兜底释放名额
+            task.add_done_callback(slot.release)
+            if cancel_on_disconnect:
+                # 经长连接提交的画面分析按会话登记，连接断开后一并取消（见 cancellation.py）；
+                # HTTP 提交的分析与任何连接无关，照常完成
+                cancellation.track_background(context_id, task)
+        return
+    cadence.get_controller().touch_chat(context_id)
+    proactive.get_scheduler().on_user_activity(context_id)
+
+    # 同一会话的新一轮取代进行中的上一轮；内容相同的并发请求直接跟随进行中那一轮的输出
+    sequencer = turns.get_sequencer()
+    turn, following = sequencer.begin(context_id, (user_text, bool(request.stream)))
+    if following:
+        chat_logger.info("与进行中的对话内容相同，合并到该轮输出")
+        async for resp in turn.follow():
+            yield resp
         return
 
-    # Extract user text BEFORE the yields (post-yield code may not run in async generators)
-    user_text = ""
-    if isinstance(request.messages[-1].content, list) and _is_text_part(
-        request.messages[-1].content[0]
-    ):
-        user_text = _get_text(request.messages[-1].content[0])
-    elif isinstance(request.messages[-1].content, str):
-        user_text = request.messages[-1].content
+    # 有当前画面时一次 VLM 调用直接回答，否则走纯文本 LLM（见 vision_chat.py）
+    chat_route = vision_chat.route(context_id, images)
+    upstream = "vlm_chat" if chat_route.path == vision_chat.VISION else "llm"
+
+    # 同时合成语音的对话流已满时只回复文字，不再建立 TTS 连接
+    with_tts = admission.get_controller().start_chat()
 
     # Initialize TTS connection asynchronously before launching LLM request to reduce latency
     tts_client = None
     tts_init_ok = False
-    try:
-        tts_client = AsyncTTSClient(
-            connection_params=ConnectionParams(
-                speaker="zh_female_meilinvyou_emo_v2_mars_bigtts",
-                audio_params=AudioParams(
-                    format="mp3",
-                    sample_rate=24000,
-                ),
-            ),
-            access_key=TTS_ACCESS_TOKEN,
-            app_key=TTS_APP_ID,
-            conn_id=get_reqid(),
-            log_id=get_reqid(),
-        )
-        connection_task = asyncio.create_task(tts_client.init())
-    except Exception as tts_init_err:
-        logger.error(f"初始化 TTS 客户端失败: {tts_init_err}")
-        connection_task = None
+    connection_task = None
+    response_iter = None
+    audio_stream = None
+    # 回复未完整输出时的原因：superseded / disconnect（见 cancellation.py）
+    interrupted = None
+    # Use mutable list to collect message during yields
+    message_parts = []
+    first_audio_seen = False
 
-    # Use LLM and VLM to answer user's question
-    print(f"[Chat] context_id={context_id} 开始 LLM 请求...")
     try:
-        response_iter = await chat_with_branches(contexts, request, parameters, context_id)
-    except Exception as llm_err:
-        logger.error(f"[Chat] LLM 请求失败: {llm_err}")
-        if tts_client:
+        if with_tts:
             try:
-                await tts_client.close()
-            except Exception:
-                pass
-        raise
-
-    # Wait for TTS connection
-    if connection_task:
+                tts_client = _new_tts_client(reqid)
+                connection_task = asyncio.create_task(_timed_tts_init(tts_client))
+            except Exception as tts_init_err:
+                logger.error(f"初始化 TTS 客户端失败: {tts_init_err}")
+                metrics.TTS_FALLBACKS.inc(reason="init")
+
+        # Use LLM and VLM to answer user's question
+        chat_logger.info("开始 LLM 请求", extra={"path": chat_route.path, "route_reason": chat_route.reason})
+        model_start = time.perf_counter()
         try:
-            await connection_task
-            tts_init_ok = True
-        except Exception as tts_conn_err:
-            logger.error(f"[Chat] TTS 连接失败: {tts_conn_err}，将返回纯文本响应")
-
-    # Use mutable list to collect message during yields
-    message_parts = []
+            llm_stream = await turn.guard(
+                chat_with_branches(contexts, request, parameters, context_id, chat_route)
+            )
+            vision_chat.FIRST_TOKEN_SECONDS.observe(time.perf_counter() - model_start, path=chat_route.path)
+        except turns.Superseded:
+            chat_logger.info("等待首个 token 时被新一轮对话取代，已取消上游请求")
+            interrupted = "superseded"
+            return
+        except Exception as llm_err:
+            logger.error(f"[Chat] LLM 请求失败: {llm_err}")
+            raise
 
-    try:
+        # Wait for TTS connection
+        if connection_task:
+            try:
+                await connection_task
+                tts_init_ok = True
+            except Exception as tts_conn_err:
+                logger.error(f"[Chat] TTS 连接失败: {tts_conn_err}，将返回纯文本响应")
+                metrics.TTS_FALLBACKS.inc(reason="connect")
+
+        # LLM 流在独立任务中读取，客户端断开或被取代时可以立即关闭（TTS 的发送任务无法从外部取消）
+        response_iter = cancellation.UpstreamStream(llm_stream)
         if tts_init_ok and tts_client:
             # Normal path: TTS + audio response
             try:
                 tts_stream_output = tts_client.tts(response_iter, stream=request.stream)
-                async for resp in create_bot_audio_responses(tts_stream_output, request):
+                audio_stream = create_bot_audio_responses(tts_stream_output, request)
+                async for resp in audio_stream:
+                    if not first_audio_seen:
+                        first_audio_seen = True
+                        metrics.observe_stage("first_audio_chunk", time.perf_counter() - request_start)
                     if isinstance(resp, ArkChatCompletionChunk):
                         if len(resp.choices) > 0 and hasattr(resp.choices[0].delta, "audio"):
                             message_parts.append(resp.choices[0].delta.audio.get("transcript", ""))
                     else:
                         if len(resp.choices) > 0 and resp.choices[0].message.audio:
                             message_parts.append(resp.choices[0].message.audio.transcript)
+                    turn.publish(resp)
                     yield resp
+                    if turn.superseded:
+                        break
             except Exception as tts_err:
                 logger.error(f"[Chat] TTS 处理异常: {tts_err}，尝试回退到纯文本")
+                metrics.TTS_FALLBACKS.inc(reason="stream")
                 async for resp in response_iter:
                     if isinstance(resp, ArkChatCompletionChunk):
                         if resp.choices and resp.choices[0].delta.content:
                             message_parts.append(resp.choices[0].delta.content)
+                    turn.publish(resp)
                     yield resp
-            finally:
-                try:
-                    await tts_client.close()
-                except Exception:
-                    pass
+                    if turn.superseded:
+                        break
         else:
             # Fallback: no TTS, return text-only LLM response
-            logger.warning("[Chat] TTS 不可用，返回纯文本响应")
+            if with_tts:
+                logger.warning("[Chat] TTS 不可用，返回纯文本响应")
             async for resp in response_iter:
                 if isinstance(resp, ArkChatCompletionChunk):
                     if resp.choices and resp.choices[0].delta.content:
                         message_parts.append(resp.choices[0].delta.content)
+                turn.publish(resp)
                 yield resp
-            if tts_client:
-                try:
-                    await tts_client.close()
-                except Exception:
-                    pass
+                if turn.superseded:
+                    break
+        if turn.superseded:
+            chat_logger.info("回复被新一轮对话取代，已停止输出")
+            interrupted = "superseded"
+    except (asyncio.CancelledError, GeneratorExit):
+        # 请求任务被取消（DisconnectMiddleware 检测到客户端断开）或响应生成器被提前关闭
+        interrupted = "superseded" if turn.superseded else "disconnect"
+        raise
     finally:
+        # 被取代、出错或客户端断开时同样要关闭 TTS / LLM 流、归还对话名额
+        if connection_task and not connection_task.done():
+            connection_task.cancel()
+        if response_iter is not None:
+            await response_iter.aclose()
+        if audio_stream is not None:
+            try:
+                await audio_stream.aclose()
+            except Exception:
+                pass
+        if tts_client:
+            try:
+                await tts_client.close()
+            except Exception:
+                pass
+        sequencer.end(context_id, turn)
+        admission.get_controller().end_chat(with_tts)
+        metrics.observe_stage("stream_total", time.perf_counter() - request_start)
+        # 用户沉默时间从回复结束时算起
+        proactive.get_scheduler().on_user_activity(context_id)
         # CRITICAL: Use asyncio.ensure_future in finally block to reliably save context
         # This runs even when the async generator is closed via aclose() by the framework
+        # 按轮次顺序保存：先等上一轮写完历史
         bot_message = "".join(message_parts)
-        if bot_message or user_text:
-            asyncio.ensure_future(_save_context(contexts, context_id, user_text, bot_message))
+        if interrupted is not None:
+            chat_logger.info(f"回复未完整输出（{interrupted}），已关闭上游流")
+            cancellation.record_interrupted(
+                upstream,
+                interrupted,
+                tokens=response_iter.tokens if response_iter else 0,
+                chars=response_iter.chars if response_iter else 0,
+                finished=response_iter.finished if response_iter else False,
+                spoken_chars=len(bot_message) if tts_init_ok else 0,
+                with_audio=tts_init_ok,
+            )
+        elif response_iter is not None and response_iter.finished:
+            cancellation.record_completed(upstream, response_iter.tokens, response_iter.chars)
+        save = _save_context(contexts, context_id, user_text, bot_message) if bot_message or user_text else None
+        asyncio.ensure_future(turn.save_in_order(save))
+
+SESSION_MODEL = "hgdoll-session"
+
+
+async def session_frame(context_id: str, image: bytes) -> None:
+    """/ws/session 截图：构造与 HTTP 截图接口相同的请求，交给 model_calling 提交分析"""
+    data_url = "data:image/jpeg;base64," + base64.b64encode(image).decode()
+    request = ArkChatRequest(
+        model=SESSION_MODEL,
+        stream=False,
+        messages=[ArkMessage(role="user", content=[
+            {"type": "text", "text": ""},
+            {"type": "image_url", "image_url": {"url": data_url}},
+        ])],
+    )
+    async for _ in model_calling(request, context_id, "", cancel_on_disconnect=True):
+        pass
+
+
+async def session_chat(context_id: str, text: str, reqid: str) -> AsyncIterable[Tuple[str, bytes]]:
+    """/ws/session 对话：把 model_calling 的流式响应拆成 (回复文字, MP3 音频)"""
+    request = ArkChatRequest(
+        model=SESSION_MODEL,
+        stream=True,
+        messages=[ArkMessage(role="user", content=text)],
+    )
+    # 与 HTTP 接口共用并发预算（HTTP 请求由 admission.AdmissionMiddleware 占用名额）
+    controller = admission.get_controller()
+    controller.acquire(context_id)
+    stream = model_calling(request, context_id, reqid)
+    try:
+        async for resp in stream:
+            part = _chunk_part(resp)
+            if part is not None:
+                yield part
+    finally:
+        await stream.aclose()
+        controller.release(context_id)
+
+
+def _chunk_part(resp) -> Optional[Tuple[str, bytes]]:
+    """把一个流式响应块拆成 (文字, MP3 音频)；非流式响应或空块返回 None"""
+    if not isinstance(resp, ArkChatCompletionChunk) or not resp.choices:
+        return None
+    delta = resp.choices[0].delta
+    audio = getattr(delta, "audio", None)
+    if audio:
+        data = audio.get("data")
+        return audio.get("transcript", ""), base64.b64decode(data) if data else b""
+    if delta.content:
+        return delta.content, b""
+    return None
+
+
+async def proactive_reply(context_id: str, reqid: str) -> Optional[List[Tuple[str, bytes]]]:
+    """
+    基于已存储的会话上下文生成一句主动发言，并提前合成好 TTS（见 proactive.py）；
+    模型认为没有值得说的内容时返回 None
+    """
+    contexts: utils.Storage = utils.CoroutineSafeMap.get_instance_sync()
+    request = ArkChatRequest(
+        model=SESSION_MODEL,
+        stream=True,
+        messages=[
+            ArkMessage(role="user", content=prompt_registry.get_registry().get("proactive", context_id).text)
+        ],
+    )
+    messages = await get_request_messages_for_llm(
+        contexts, context_id, request, prompt_registry.get_registry().get("llm", context_id).text
+    )
+    llm = BaseChatLanguageModel(
+        model=LLM_ENDPOINT,
+        messages=messages,
+        parameters=ArkChatParameters(**request.__dict__),
+        **model_client.client_kwargs(),
+    )
+    with metrics.span("proactive_generate"):
+        chunks = [chunk async for chunk in llm.astream()]
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices).strip()
+    if not text or prompt.PROACTIVE_SKIP in text:
+        return None
+
+    async def replay():
+        for chunk in chunks:
+            yield chunk
+
+    # 推送前合成完整音频，推送时不再等待 TTS
+    tts_client = None
+    try:
+        tts_client = _new_tts_client(reqid)
+        await _timed_tts_init(tts_client)
+        with metrics.span("proactive_tts"):
+            parts = []
+            async for resp in create_bot_audio_responses(tts_client.tts(replay(), stream=True), request):
+                part = _chunk_part(resp)
+                if part is not None:
+                    parts.append(part)
+        return parts or [(text, b"")]
+    except Exception as e:
+        logger.error(f"[Proactive] TTS 合成失败: {e}，仅推送文字")
+        metrics.TTS_FALLBACKS.inc(reason="proactive")
+        return [(text, b"")]
+    finally:
+        if tts_client:
+            try:
+                await tts_client.close()
+            except Exception:
+                pass
+
+
+async def remember_proactive(context_id: str, text: str) -> None:
+    """主动发言推送成功后写入会话历史（不写入触发用的提示词）"""
+    contexts: utils.Storage = utils.CoroutineSafeMap.get_instance_sync()
+    await contexts.append(context_id, ArkMessage(role="assistant", content=text))
 
 
 @task(watch_io=False)
@@ -349,11 +824,12 @@ def setup_web_plugin(app):
     """为 FastAPI 应用添加 Web 插件支持（CORS + WebSocket ASR 代理 + 调试端点）"""
     from fastapi import WebSocket as FastAPIWebSocket, WebSocketDisconnect
     from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import JSONResponse
-    import websockets
-    import websockets.exceptions
-    import base64
+    from fastapi.responses import JSONResponse, PlainTextResponse
 
+    # 对话/截图接口的客户端断开后立即取消请求处理、关闭上游流（见 cancellation.py）；最先添加，位于最内层
+    app.add_middleware(cancellation.DisconnectMiddleware)
+    # 对话/截图接口满额时直接返回 429/503（见 admission.py）；先添加，位于 CORS 之内，拒绝响应同样带跨域头
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission.get_controller())
     # 添加 CORS 中间件，允许浏览器插件跨域请求
     app.add_middleware(
         CORSMiddleware,
@@ -363,36 +839,184 @@ def setup_web_plugin(app):
         allow_headers=["*"],
         expose_headers=["*"],
     )
+    # 截图接口响应头附带 X-Next-Capture-Delay-Ms（见 cadence.py）
+    app.add_middleware(cadence.CadenceMiddleware, controller=cadence.get_controller())
+
+    async def start_loop_monitor():
+        loop_monitor.get_monitor().start()
+        # startup 事件之后 uvicorn 立即绑定端口，/v1/ping 即可应答；重量级模块在后台导入
+        startup.mark("ready")
+        startup.warm_up_in_background()
+
+    async def stop_loop_monitor():
+        await loop_monitor.get_monitor().stop()
+
+    async def start_model_pool():
+        # 后台预建到方舟的连接，第一个截图/对话请求不必等待 TLS 握手
+        app.state.model_pool_warm_up = asyncio.create_task(model_client.warm_up())
+
+    async def stop_model_pool():
+        app.state.model_pool_warm_up.cancel()
+        await model_client.aclose()
+
+    async def start_snapshot():
+        # 从上次的会话快照恢复上下文，之后把存储的每次变更写入追加日志（见 snapshot.py）
+        path = snapshot.snapshot_path()
+        if not path:
+            return
+        contexts = utils.CoroutineSafeMap.get_instance_sync()
+        if os.path.exists(path):
+            started = time.perf_counter()
+            try:
+                entries = await asyncio.get_running_loop().run_in_executor(None, snapshot.load, path)
+                restored = await contexts.restore(entries)
+                logger.info(f"snapshot: 已从 {path} 恢复 {restored} 个会话，耗时 {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"snapshot: 恢复会话快照失败，另存为 {path}.corrupt: {e}")
+                os.replace(path, f"{path}.corrupt")
+        journal = snapshot.Journal(path)
+        utils.CoroutineSafeMap.journal = journal
+        journal.start(utils.CoroutineSafeMap.snapshot_state)
+
+    async def stop_snapshot():
+        journal, utils.CoroutineSafeMap.journal = utils.CoroutineSafeMap.journal, None
+        if journal is not None:
+            # 正常退出时写出一份完整快照，下次启动只需读取压缩后的日志
+            await journal.close(utils.CoroutineSafeMap.snapshot_state())
+
+    app.router.on_startup.append(start_loop_monitor)
+    app.router.on_startup.append(start_model_pool)
+    app.router.on_startup.append(start_snapshot)
+    app.router.on_shutdown.append(stop_loop_monitor)
+    app.router.on_shutdown.append(stop_model_pool)
+    app.router.on_shutdown.append(stop_snapshot)
+
+    def _context_summary(ctx: utils.Context, last_n: int) -> dict:
+        history = ctx.history
+        return {
+            "history_length": len(history),
+            "content_bytes": ctx.content_bytes,
+            "expire_at": ctx.expire_at,
+            "last_messages": [
+                {"role": m.role, "content": (m.content[:80] + '...') if isinstance(m.content, str) and len(m.content) > 80 else m.content}
+                for m in history[-last_n:]
+            ] if last_n > 0 else []
+        }
 
     @app.get("/debug/status")
-    async def debug_status():
-        """调试端点：检查服务状态和上下文信息"""
+    async def debug_status(cursor: str = "", limit: int = 20, last: int = 3):
+        """
+        调试端点：服务状态 + 会话分页
+        聚合计数由存储层增量维护，读取不获取存储锁；会话详情按 key 游标分页，
+        用 next_cursor 继续翻页，limit=0 时只返回聚合数据
+        """
         contexts = utils.CoroutineSafeMap.get_instance_sync()
-        keys = await contexts.keys()
+        limit = max(0, min(limit, 200))
+        last = max(0, min(last, 20))
+        keys, next_cursor = contexts.page(cursor, limit) if limit else ([], None)
         context_info = {}
         for key in keys:
-            history = await contexts.get_history(key)
-            context_info[key] = {
-                "history_length": len(history),
-                "last_messages": [
-                    {"role": m.role, "content": (m.content[:80] + '...') if isinstance(m.content, str) and len(m.content) > 80 else m.content}
-                    for m in history[-3:]
-                ] if history else []
-            }
+            ctx = contexts.peek(key)
+            if ctx is not None:
+                context_info[key] = _context_summary(ctx, last)
         return JSONResponse({
             "status": "running",
-            "active_contexts": len(keys),
+            **contexts.stats(),
+            "event_loop": loop_monitor.get_monitor().snapshot()["lag_ms"],
             "contexts": context_info,
+            "next_cursor": next_cursor,
         })
 
+    @app.get("/debug/status/{context_id}")
+    async def debug_context(context_id: str, last: int = 3):
+        """调试端点：按 X-Context-Id 查询单个会话"""
+        ctx = utils.CoroutineSafeMap.get_instance_sync().peek(context_id)
+        if ctx is None:
+            return JSONResponse({"error": "context not found"}, status_code=404)
+        return JSONResponse({"context_id": context_id, **_context_summary(ctx, max(0, min(last, 50)))})
+
+    @app.get("/debug/loop")
+    async def debug_loop():
+        """调试端点：事件循环延迟统计与最近的阻塞事件（含栈采样）"""
+        return JSONResponse(loop_monitor.get_monitor().snapshot())
+
+    @app.get("/debug/prompts")
+    async def debug_prompts():
+        """调试端点：已加载的提示词版本、长度与变体关键词（见 prompt_registry.py）"""
+        return JSONResponse({"prompts": prompt_registry.get_registry().snapshot()})
+
+    @app.post("/debug/prompts/reload")
+    async def debug_prompts_reload():
+        """调试端点：立即重新加载 HGDOLL_PROMPT_DIR 中的提示词，不需要重启服务"""
+        registry = prompt_registry.get_registry()
+        ok = registry.reload()
+        return JSONResponse({"reloaded": ok, "prompts": registry.snapshot()}, status_code=200 if ok else 500)
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        """Prometheus 指标端点：各阶段耗时直方图与计数器"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.websocket("/ws/session")
+    async def session_endpoint(websocket: FastAPIWebSocket, context_id: str = ""):
+        """
+        会话长连接：截图、对话、语音与服务端推送复用一条 WebSocket（协议见 session.py）
+        """
+        context_id = context_id or websocket.headers.get("x-context-id", "")
+        if not context_id:
+            await websocket.close(code=1008, reason="missing context_id")
+            return
+        await websocket.accept()
+        contexts = utils.CoroutineSafeMap.get_instance_sync()
+        if not await contexts.contains(context_id):
+            await contexts.set(context_id, utils.Context())
+
+        conn = session.Session(
+            websocket,
+            context_id,
+            on_frame=session_frame,
+            on_chat=session_chat,
+            asr_url=ASR_URL,
+            asr_app_id=ASR_APP_ID,
+            asr_access_token=ASR_ACCESS_TOKEN,
+        )
+        session.register(conn)
+        logger.info("session: 客户端已连接", extra={"context_id": context_id})
+        try:
+            await conn.run()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            session.unregister(conn)
+            # 客户端没有重新连上：经这条连接提交、不再需要的画面分析直接取消
+            if session.get_session(context_id) is None:
+                cancellation.cancel_background(context_id)
+            logger.info("session: 连接已关闭", extra={"context_id": context_id})
+
     @app.websocket("/ws/asr")
-    async def asr_proxy(websocket: FastAPIWebSocket, app_id: str = "", access_token: str = ""):
+    async def asr_proxy(
+        websocket: FastAPIWebSocket,
+        app_id: str = "",
+        access_token: str = "",
+        profile: str = "",
+        end_window_size: str = "",
+        result_type: str = "",
+        input_format: str = "",
+        input_rate: str = "",
+        channels: str = "",
+    ):
         """
         WebSocket ASR 代理端点
         浏览器插件 → 本服务器 → Doubao ASR 服务
         解决浏览器无法直接携带自定义Header连接ASR WebSocket的问题
+        profile / end_window_size / result_type 选择识别参数（见 asr.py）；
+        input_format / input_rate / channels 声明客户端发送的音频格式，由服务端解码、重采样（见 audio_input.py）。
+        音频可以放在 JSON 的 audio_data（base64）中，也可以直接以二进制帧发送
         """
         await websocket.accept()
+        # websockets 在第一次 ASR 连接时才导入（通常已被后台预热）
+        import websockets
+        import websockets.exceptions
 
         # 优先使用 query 参数，为空则回退到 config.py 配置
         effective_app_id = app_id or ASR_APP_ID
@@ -403,134 +1027,104 @@ def setup_web_plugin(app):
             logger.error("ASR proxy: ASR 凭证缺失，请配置 ASR_APP_ID 和 ASR_ACCESS_TOKEN")
             await websocket.send_json({"error": "ASR 凭证未配置"})
             return
+        try:
+            asr_profile = asr.resolve_profile(profile, end_window_size, result_type)
+            converter = audio_input.AudioConverter(audio_input.negotiate(input_format, input_rate, channels))
+        except ValueError as profile_err:
+            await websocket.send_json({"error": "ASR 参数无效", "detail": str(profile_err)})
+            return
+        finalization = asr.FinalizationTimer(asr_profile)
 
-        import uuid
-        ASR_URL = "wss://openspeech.bytedance.com/api/v3/sauc/bigmodel"
         asr_ws = None
-        forward_task = None
 
         try:
-            # 连接到 Doubao ASR 服务（携带认证 Header）
-            # X-Api-Connect-Id 必须是 UUID 格式（参考 Android 端 AsrService.kt）
-            connect_id = str(uuid.uuid4())
-            extra_headers = {
-                "X-Api-App-Key": effective_app_id,
-                "X-Api-Access-Key": effective_access_token,
-                "X-Api-Resource-Id": "volc.bigasr.sauc.duration",
-                "X-Api-Connect-Id": connect_id,
-            }
-            logger.info(f"ASR proxy: 连接 Doubao ASR, connect_id={connect_id}")
+            # 连接到 Doubao ASR 服务（携带认证 Header）并发送初始化消息
+            logger.info("ASR proxy: 连接 Doubao ASR")
             try:
-                asr_ws = await asyncio.wait_for(
-                    websockets.connect(ASR_URL, additional_headers=extra_headers),
-                    timeout=10,
-                )
+                asr_ws = await asr.connect(ASR_URL, effective_app_id, effective_access_token, asr_profile)
             except (asyncio.TimeoutError, Exception) as conn_err:
                 logger.error(f"ASR proxy: 连接 Doubao ASR 服务失败: {conn_err}")
                 await websocket.send_json({"error": "无法连接 ASR 服务", "detail": str(conn_err)})
                 return
-            logger.info("ASR proxy: 已连接到 Doubao ASR 服务")
-
-            # 发送 ASR 初始化消息
-            init_payload = {
-                "user": {"uid": "HGDOLL_WEB_PLUGIN"},
-                "audio": {
-                    "format": "pcm",
-                    "sample_rate": 16000,
-                    "bits": 16,
-                    "channel": 1,
-                },
-                "request": {
-                    "model_name": "bigmodel",
-                    "result_type": "single",
-                    "show_utterances": True,
-                    "end_window_size": 600,
-                    "force_to_speech_time": 1500,
-                },
-            }
-
-            # 构建二进制协议消息
-            payload_bytes = gzip.compress(json.dumps(init_payload).encode())
-            header = bytes([
-                (0x01 << 4) | 0x01,  # version | header_size
-                (0x01 << 4) | 0x01,  # FULL_CLIENT_REQUEST | POS_SEQUENCE
-                (0x01 << 4) | 0x01,  # JSON | GZIP
-                0x00,                # reserved
-            ])
-            seq_bytes = struct.pack(">I", 1)
-            size_bytes = struct.pack(">I", len(payload_bytes))
-            init_msg = header + seq_bytes + size_bytes + payload_bytes
-            await asr_ws.send(init_msg)
-            logger.info("ASR proxy: 初始化消息已发送")
+            logger.info("ASR proxy: 已连接到 Doubao ASR 服务，初始化消息已发送")
 
+            # 两个方向各自「读取 → 有界队列 → 写出」，上游发送慢时不会挡住浏览器方向的接收（见 relay.py）
+            uplink = relay.BoundedQueue("asr_uplink", ASR_UPLINK_QUEUE, ASR_UPLINK_POLICY)
+            downlink = relay.BoundedQueue("asr_downlink", ASR_DOWNLINK_QUEUE, ASR_DOWNLINK_POLICY)
+            # 序号在发送时分配，丢弃积压的旧音频后仍然连续（初始化消息占用 1）
             sequence = 1
-
-            async def forward_asr_to_browser():
-                """将 ASR 服务的响应转发给浏览器"""
+            upstream_messages = asr_ws.__aiter__()
+
+            async def read_browser():
+                """浏览器 → 队列：音频转换为 16kHz 单声道 PCM 后入队（压缩格式不能丢包，转换在入队前完成）"""
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
+                    if message.get("bytes") is not None:
+                        audio_bytes = message["bytes"]
+                    else:
+                        try:
+                            msg = json.loads(message.get("text") or "")
+                        except json.JSONDecodeError:
+                            logger.warning(f"ASR proxy: 收到无效 JSON 消息")
+                            continue
+                        if "audio_data" not in msg:
+                            continue
+                        audio_bytes = base64.b64decode(msg["audio_data"])
+                    pcm = await converter.convert(audio_bytes)
+                    if pcm:
+                        return pcm, len(pcm)
+
+            async def send_upstream(audio_bytes):
+                nonlocal sequence
+                sequence += 1
+                finalization.on_audio(audio_bytes)
                 try:
-                    async for msg in asr_ws:
+                    await asr_ws.send(asr.audio_message(audio_bytes, sequence))
+                except websockets.exceptions.ConnectionClosed:
+                    logger.warning("ASR proxy: ASR 上游已断开，无法发送音频")
+                    await websocket.send_json({"error": "ASR 连接已断开"})
+                    raise
+
+            async def read_upstream():
+                """ASR 服务 → 队列：解析二进制协议响应"""
+                try:
+                    while True:
+                        msg = await upstream_messages.__anext__()
                         if isinstance(msg, bytes):
-                            # 解析二进制协议响应
-                            result = parse_asr_response(msg)
+                            result = asr.parse_response(msg)
                             if result:
-                                await websocket.send_json(result)
+                                finalization.on_result(result)
+                                return result, len(msg)
                         elif isinstance(msg, str):
-                            await websocket.send_text(msg)
+                            return msg, len(msg)
+                except StopAsyncIteration:
+                    return None
                 except (websockets.exceptions.ConnectionClosed, KeyError) as cc:
                     # KeyError can occur in websockets 16.x when ASR server uses
                     # non-standard close codes with binary protocol
                     logger.info(f"ASR proxy: ASR 上游连接已关闭 ({type(cc).__name__}: {cc})")
-                except asyncio.CancelledError:
-                    pass  # 正常取消，不需要日志
-                except Exception as e:
-                    logger.warning(f"ASR proxy: 转发响应异常: {type(e).__name__}: {e}")
+                    return None
 
-            # 启动 ASR→浏览器 的转发任务
-            forward_task = asyncio.create_task(forward_asr_to_browser())
+            async def send_browser(result):
+                if isinstance(result, str):
+                    await websocket.send_text(result)
+                else:
+                    await websocket.send_json(result)
 
-            # 浏览器→ASR 的转发循环
-            while True:
-                data = await websocket.receive_text()
-                try:
-                    msg = json.loads(data)
-                except json.JSONDecodeError:
-                    logger.warning(f"ASR proxy: 收到无效 JSON 消息")
-                    continue
-
-                if "audio_data" in msg:
-                    # 将 base64 PCM 数据转为二进制发送到 ASR
-                    audio_bytes = base64.b64decode(msg["audio_data"])
-                    sequence = msg.get("sequence", sequence + 1)
-
-                    # 构建音频数据包（AUDIO_ONLY_REQUEST）
-                    audio_header = bytes([
-                        (0x01 << 4) | 0x01,  # version | header_size
-                        (0x02 << 4) | 0x01,  # AUDIO_ONLY_REQUEST | POS_SEQUENCE
-                        (0x00 << 4) | 0x00,  # NO_SERIAL | NO_COMPRESS (0, not 2!)
-                        0x00,                # reserved
-                    ])
-                    seq_bytes = struct.pack(">I", sequence)
-                    audio_size = struct.pack(">I", len(audio_bytes))
-                    audio_msg = audio_header + seq_bytes + audio_size + audio_bytes
-                    try:
-                        await asr_ws.send(audio_msg)
-                    except websockets.exceptions.ConnectionClosed:
-                        logger.warning("ASR proxy: ASR 上游已断开，无法发送音频")
-                        await websocket.send_json({"error": "ASR 连接已断开"})
-                        break
+            await relay.run_pumps(
+                relay.pump(read_browser, send_upstream, uplink),
+                relay.pump(read_upstream, send_browser, downlink),
+            )
 
         except WebSocketDisconnect:
             logger.info("ASR proxy: 浏览器客户端断开")
+        except websockets.exceptions.ConnectionClosed:
+            logger.info("ASR proxy: ASR 上游已断开")
         except Exception as e:
             logger.error(f"ASR proxy: 异常: {type(e).__name__}: {e}")
         finally:
-            # 取消转发任务
-            if forward_task and not forward_task.done():
-                forward_task.cancel()
-                try:
-                    await forward_task
-                except asyncio.CancelledError:
-                    pass
             if asr_ws:
                 try:
                     await asr_ws.close()
@@ -539,51 +1133,13 @@ def setup_web_plugin(app):
             logger.info("ASR proxy: 连接已清理")
 
 
-def parse_asr_response(data: bytes) -> dict:
-    """解析 Doubao ASR 二进制协议响应"""
-    if len(data) < 4:
-        return None
-
-    header_byte1 = data[1]
-    message_type = (header_byte1 >> 4) & 0x0F
-
-    if message_type == 0b1001:  # FULL_SERVER_RESPONSE
-        if len(data) > 12:
-            payload_size = struct.unpack(">I", data[8:12])[0]
-            payload_bytes = data[12:12 + payload_size]
-            try:
-                # 尝试 gzip 解压
-                decompressed = gzip.decompress(payload_bytes)
-                payload = json.loads(decompressed)
-            except Exception:
-                try:
-                    payload = json.loads(payload_bytes)
-                except Exception:
-                    return None
-
-            # 提取识别结果
-            text = ""
-            is_final = False
-            if "result" in payload and payload["result"]:
-                text = payload["result"][0].get("text", "")
-                is_final = payload["result"][0].get("definite", False)
-            elif "text" in payload:
-                text = payload["text"]
-                is_final = payload.get("definite", False)
-
-            return {"text": text, "is_final": is_final}
-
-    elif message_type == 0b1011:  # SERVER_ACK
-        return {"type": "ack"}
-
-    return None
+# 兼容旧调用方，协议实现见 asr.py
+parse_asr_response = asr.parse_response
 
 
-if __name__ == "__main__":
-    port = os.getenv("_FAAS_RUNTIME_PORT")
-    run_port = int(port) if port else 8888
-
-    # 使用 BotServer 创建 app 并添加 Web 插件支持
+def create_app():
+    """构建 BotServer 并挂载 Web 插件支持，返回 FastAPI app"""
+    logs.setup_logging()
     from arkitect.launcher.local.serve import (
         BotServer, load_function, get_runner, get_endpoint_config,
         get_default_client_configs, setup_tracing,
@@ -605,6 +1161,25 @@ if __name__ == "__main__":
         clients=get_default_client_configs(),
     )
     setup_web_plugin(server.app)
+    proactive.get_scheduler().configure(proactive_reply, remember_proactive)
+    startup.mark("app_created")
+    return server.app
+
+
+if __name__ == "__main__":
+    port = os.getenv("_FAAS_RUNTIME_PORT")
+    run_port = int(port) if port else 8888
+
+    # 多进程模式：前置路由按 X-Context-Id 将会话固定到某个 worker（见 cluster.py）
+    workers = int(os.getenv("HGDOLL_WORKERS", "1"))
+    if workers > 1:
+        import cluster
+
+        cluster.serve(run_port, workers)
+        raise SystemExit(0)
+
+    # 使用 BotServer 创建 app 并添加 Web 插件支持
+    app = create_app()
 
     import uvicorn
     import socket
@@ -631,4 +1206,4 @@ if __name__ == "__main__":
             sys.exit(1)
 
     print(f"服务启动在 http://0.0.0.0:{run_port}")
-    uvicorn.run(server.app, host="0.0.0.0", port=run_port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=run_port)
\ No newline at end of file
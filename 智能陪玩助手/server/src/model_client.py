@@ -0,0 +1,273 @@
+"""
+方舟模型调用的共享 HTTP 连接池
+
+chat_with_vlm / llm_answer / summarize_image 每次调用都会新建 BaseChatLanguageModel，
+这里为它们提供同一个长生命周期的 AsyncArk 客户端（底层是一个 httpx.AsyncClient），
+使截图分析与对话请求复用已建立的 TLS 连接：
+
+- 连接池大小、keep-alive 数量与过期时间可配置
+- 安装了 h2 时启用 HTTP/2，多个流式请求复用同一条连接
+- 服务 ready 后预先建立连接（warm_up），第一个请求不必等待 TLS 握手
+- 连接池指标：新建连接数、TLS 握手耗时、进行中请求数、池内活跃/空闲连接数
+- stream_chat：直接发送已拼接好的请求体（见 chat_body），跳过 SDK 的逐条校验与序列化
+
+环境变量：
+    HGDOLL_HTTP_POOL              0 关闭共享连接池，回退为 arkitect 默认客户端，默认 1
+    HGDOLL_HTTP_MAX_CONNECTIONS   连接池上限，默认 100
+    HGDOLL_HTTP_MAX_KEEPALIVE     保持的空闲连接数上限，默认 20
+    HGDOLL_HTTP_KEEPALIVE_EXPIRY  空闲连接保持秒数，默认 120
+    HGDOLL_HTTP2                  auto（默认，安装了 h2 即启用）/ 1 / 0
+    HGDOLL_HTTP_TIMEOUT           读超时秒数，默认 600（流式输出可能较长）
+    HGDOLL_HTTP_WARM_CONNECTIONS  启动时预建的连接数，默认 2（HTTP/2 下 1 条即可）
+    ARK_BASE_URL                  方舟 API 地址
+    ARK_API_KEY                   方舟 API Key（stream_chat 使用；未配置时对话走 SDK）
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("HGDOLL_HTTP_POOL", "1") != "0"
+ARK_BASE_URL = os.environ.get("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+ARK_API_KEY = os.environ.get("ARK_API_KEY", "")
+MAX_CONNECTIONS = int(os.environ.get("HGDOLL_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.environ.get("HGDOLL_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.environ.get("HGDOLL_HTTP_KEEPALIVE_EXPIRY", "120"))
+READ_TIMEOUT = float(os.environ.get("HGDOLL_HTTP_TIMEOUT", "600"))
+CONNECT_TIMEOUT = 10.0
+WARM_CONNECTIONS = int(os.environ.get("HGDOLL_HTTP_WARM_CONNECTIONS", "2"))
+
+HTTP_CONNECTIONS_OPENED = metrics.counter(
+    "hgdoll_http_connections_opened_total",
+    "New TCP connections opened to model endpoints",
+    ("host",),
+)
+HTTP_TLS_SECONDS = metrics.histogram(
+    "hgdoll_http_tls_handshake_seconds",
+    "TLS handshake duration for new model endpoint connections",
+    ("host",),
+)
+HTTP_REQUESTS = metrics.counter(
+    "hgdoll_http_requests_total",
+    "Requests sent through the shared model HTTP client",
+    ("host", "http_version", "reused"),
+)
+HTTP_IN_FLIGHT = metrics.gauge(
+    "hgdoll_http_requests_in_flight",
+    "Requests whose response body has not been fully consumed yet",
+)
+HTTP_POOL_CONNECTIONS = metrics.gauge(
+    "hgdoll_http_pool_connections",
+    "Connections held by the shared pool",
+    ("state",),
+)
+
+
+def http2_enabled() -> bool:
+    setting = os.environ.get("HGDOLL_HTTP2", "auto").lower()
+    if setting == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return setting in ("1", "true", "yes")
+
+
+def _make_trace(host: str, state: Dict[str, Any]):
+    """httpcore trace 回调：区分新建连接与复用连接，并记录 TLS 握手耗时"""
+
+    async def trace(event: str, info: Dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.complete":
+            state["reused"] = False
+            HTTP_CONNECTIONS_OPENED.inc(host=host)
+        elif event == "connection.start_tls.started":
+            state["tls_started"] = time.perf_counter()
+        elif event == "connection.start_tls.complete" and "tls_started" in state:
+            HTTP_TLS_SECONDS.observe(time.perf_counter() - state["tls_started"], host=host)
+
+    return trace
+
+
+def _build_transport():
+    import httpx
+
+    class InstrumentedTransport(httpx.AsyncHTTPTransport):
+        """在 httpx 传输层统计连接复用与池占用"""
+
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            host = request.url.host
+            state: Dict[str, Any] = {"reused": True}
+            request.extensions = {**request.extensions, "trace": _make_trace(host, state)}
+            HTTP_IN_FLIGHT.inc()
+            try:
+                response = await super().handle_async_request(request)
+            except BaseException:
+                HTTP_IN_FLIGHT.dec()
+                self._update_pool_gauges()
+                raise
+            HTTP_REQUESTS.inc(
+                host=host,
+                http_version=response.extensions.get("http_version", b"").decode() or "unknown",
+                reused=str(state["reused"]).lower(),
+            )
+            self._update_pool_gauges()
+            close = response.stream.aclose
+
+            async def aclose() -> None:
+                # 流式响应读完（或被取消）时连接才归还到池中
+                try:
+                    await close()
+                finally:
+                    HTTP_IN_FLIGHT.dec()
+                    self._update_pool_gauges()
+
+            response.stream.aclose = aclose
+            return response
+
+        def _update_pool_gauges(self) -> None:
+            try:
+                connections = self._pool.connections
+            except AttributeError:
+                return
+            idle = sum(1 for c in connections if c.is_idle())
+            HTTP_POOL_CONNECTIONS.set(idle, state="idle")
+            HTTP_POOL_CONNECTIONS.set(len(connections) - idle, state="active")
+
+    return InstrumentedTransport(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+_http_client = None
+_ark_client = None
+
+
+def get_http_client():
+    """进程内共享的 httpx.AsyncClient（首次调用时创建）"""
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            transport=_build_transport(),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+    return _http_client
+
+
+def get_ark_client():
+    """使用共享连接池的 AsyncArk 客户端"""
+    global _ark_client
+    if _ark_client is None:
+        from volcenginesdkarkruntime import AsyncArk
+
+        _ark_client = AsyncArk(base_url=ARK_BASE_URL, http_client=get_http_client())
+    return _ark_client
+
+
+def client_kwargs() -> Dict[str, Any]:
+    """传给 BaseChatLanguageModel 的额外参数；关闭共享连接池时为空，使用 arkitect 默认客户端"""
+    if not ENABLED:
+        return {}
+    return {"client": get_ark_client()}
+
+
+class UpstreamError(RuntimeError):
+    """方舟接口返回错误状态或错误事件"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def raw_chat_available() -> bool:
+    return ENABLED and bool(ARK_API_KEY)
+
+
+async def stream_chat(body: bytes, headers: Optional[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    POST 已序列化的流式对话请求体到 /chat/completions，逐个产出 SSE data 事件解析出的字典
+    """
+    import chat_body
+
+    request_headers = {
+        "Authorization": f"Bearer {ARK_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    if headers:
+        request_headers.update(headers)
+    client = get_http_client()
+    async with client.stream(
+        "POST", f"{ARK_BASE_URL.rstrip('/')}/chat/completions", content=body, headers=request_headers
+    ) as response:
+        if response.status_code >= 400:
+            detail = (await response.aread()).decode("utf-8", "replace")
+            raise UpstreamError(response.status_code, detail[:500])
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = chat_body.loads(data)
+            if "error" in event:
+                raise UpstreamError(response.status_code, str(event["error"])[:500])
+            yield event
+
+
+async def stream_chat_as(
+    body: bytes, convert: Callable[[Dict[str, Any]], Any], headers: Optional[Dict[str, str]] = None
+) -> AsyncIterator[Any]:
+    """
+    stream_chat 的每个事件经 convert 转换后产出。关闭本生成器时同步关闭内层生成器，
+    立即释放上游响应与连接池中的连接，而不是等到垃圾回收时才由异步生成器的终结钩子关闭
+    """
+    events = stream_chat(body, headers)
+    try:
+        async for event in events:
+            yield convert(event)
+    finally:
+        await events.aclose()
+
+
+async def warm_up(url: str = ARK_BASE_URL, connections: int = WARM_CONNECTIONS) -> int:
+    """
+    预先建立到方舟的连接：发送轻量请求，不关心状态码（401/404 同样完成了 TLS 握手）。
+    返回成功建立的连接数
+    """
+    if not ENABLED or connections <= 0:
+        return 0
+    client = get_http_client()
+    if http2_enabled():
+        connections = 1
+
+    async def probe() -> bool:
+        try:
+            await client.head(url, timeout=CONNECT_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning(f"model_client: 预建连接 {url} 失败: {e}")
+            return False
+
+    started = time.perf_counter()
+    opened = sum(await asyncio.gather(*(probe() for _ in range(connections))))
+    logger.info(f"model_client: 已预建 {opened} 条连接到 {url}，耗时 {time.perf_counter() - started:.2f}s")
+    return opened
+
+
+async def aclose() -> None:
+    """关闭共享连接池（服务停止时调用）"""
+    global _http_client, _ark_client
+    client, _http_client, _ark_client = _http_client, None, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,170 @@
+"""
+服务端主动发言调度
+
+插件原先每上传 5 张截图就发送一句固定文本「根据你刚才看到的画面，和我聊聊吧」，
+走完整的对话接口，不论画面有没有变化都要多一次 HTTP 往返、重建提示词并调用 LLM/TTS。
+这里改为服务端根据以下条件决定是否主动说话：
+
+- 画面变化：自上次发言（或用户上次说话）以来各帧差异度之和达到阈值
+- 用户沉默：距用户上次说话超过一定时间，避免打断
+- 发言间隔：距上次主动发言超过最小间隔
+- 负载：画面分析积压或主动发言生成数达到上限时不发言
+
+满足条件时基于已存储的会话上下文生成回复并提前合成好 TTS，生成期间用户说了话、
+会话正忙或连接已断开时直接丢弃；只有通过 /ws/session 连接的会话才会收到推送。
+
+环境变量：
+    HGDOLL_PROACTIVE             0 关闭服务端主动发言，默认 1
+    HGDOLL_PROACTIVE_NOVELTY     触发发言的累计画面差异度，默认 0.8
+    HGDOLL_PROACTIVE_SILENCE_S   用户沉默多少秒后才可发言，默认 8
+    HGDOLL_PROACTIVE_INTERVAL_S  两次主动发言的最小间隔秒数，默认 20
+    HGDOLL_PROACTIVE_MAX_ACTIVE  同时生成中的主动发言上限，默认 4
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+import cadence
+import metrics
+import session
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("HGDOLL_PROACTIVE", "1") != "0"
+NOVELTY_THRESHOLD = float(os.environ.get("HGDOLL_PROACTIVE_NOVELTY", "0.8"))
+SILENCE_SECONDS = float(os.environ.get("HGDOLL_PROACTIVE_SILENCE_S", "8"))
+MIN_INTERVAL_SECONDS = float(os.environ.get("HGDOLL_PROACTIVE_INTERVAL_S", "20"))
+MAX_ACTIVE = int(os.environ.get("HGDOLL_PROACTIVE_MAX_ACTIVE", "4"))
+
+PROACTIVE_TURNS = metrics.counter(
+    "hgdoll_proactive_total",
+    "Proactive reply attempts by outcome",
+    ("outcome",),
+)
+
+Part = Tuple[str, bytes]
+# (context_id, reqid) -> 已合成好的 [(文字, 音频)]，模型认为没有值得说的内容时返回 None
+Generator = Callable[[str, str], Awaitable[Optional[List[Part]]]]
+# (context_id, 回复文字) -> 推送成功后写入会话历史
+Recorder = Callable[[str, str], Awaitable[None]]
+
+
+class _State:
+    __slots__ = ("novelty", "last_user", "last_spoken", "generating")
+
+    def __init__(self, now: float):
+        self.novelty = 0.0
+        self.last_user = now
+        self.last_spoken = 0.0
+        self.generating = False
+
+
+class ProactiveScheduler:
+    """按会话累计画面变化与用户活动，决定何时主动发言（只在事件循环线程中访问）"""
+
+    def __init__(self, generate: Optional[Generator] = None, remember: Optional[Recorder] = None):
+        self.generate = generate
+        self.remember = remember
+        self.active = 0
+        self._states: "OrderedDict[str, _State]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def configure(self, generate: Generator, remember: Recorder) -> None:
+        self.generate = generate
+        self.remember = remember
+
+    def _state(self, context_id: str) -> _State:
+        state = self._states.get(context_id)
+        if state is None:
+            state = self._states[context_id] = _State(time.monotonic())
+            if len(self._states) > cadence.MAX_TRACKED:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(context_id)
+        return state
+
+    def on_user_activity(self, context_id: str) -> None:
+        """用户说话（或收到对用户的回复）：重新计算沉默时间，已累计的画面变化视为已聊过"""
+        state = self._state(context_id)
+        state.last_user = time.monotonic()
+        state.novelty = 0.0
+
+    def on_frame(self, context_id: str, novelty: Optional[float]) -> Optional[asyncio.Task]:
+        """一帧分析完成后调用；满足条件时启动后台生成并返回其任务"""
+        if novelty is None:
+            return None
+        state = self._state(context_id)
+        state.novelty += novelty
+        if self._blocked_reason(context_id, state) is not None:
+            return None
+        state.generating = True
+        self.active += 1
+        t = asyncio.create_task(self._speak(context_id, state))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+        return t
+
+    def _blocked_reason(self, context_id: str, state: _State) -> Optional[str]:
+        now = time.monotonic()
+        if not ENABLED or self.generate is None:
+            return "disabled"
+        if state.generating:
+            return "generating"
+        if state.novelty < NOVELTY_THRESHOLD:
+            return "no_change"
+        if now - state.last_user < SILENCE_SECONDS:
+            return "user_active"
+        if now - state.last_spoken < MIN_INTERVAL_SECONDS:
+            return "too_soon"
+        conn = session.get_session(context_id)
+        if conn is None or conn.closed:
+            return "no_session"
+        if conn.busy:
+            return "session_busy"
+        if self.active >= MAX_ACTIVE or cadence.get_controller().overloaded():
+            PROACTIVE_TURNS.inc(outcome="shed")
+            return "overloaded"
+        return None
+
+    async def _speak(self, context_id: str, state: _State) -> None:
+        started = time.monotonic()
+        # 本次发言覆盖目前为止的画面变化；生成期间的新画面继续累计
+        state.novelty = 0.0
+        try:
+            parts = await self.generate(context_id, f"{context_id}-proactive-{int(started * 1000)}")
+            if not parts:
+                PROACTIVE_TURNS.inc(outcome="skipped")
+                return
+            if state.last_user > started:
+                PROACTIVE_TURNS.inc(outcome="user_spoke")
+                return
+            conn = session.get_session(context_id)
+            if conn is None or not await conn.push_turn(parts, source="proactive"):
+                PROACTIVE_TURNS.inc(outcome="not_delivered")
+                return
+            state.last_spoken = time.monotonic()
+            PROACTIVE_TURNS.inc(outcome="pushed")
+            if self.remember is not None:
+                await self.remember(context_id, "".join(text for text, _ in parts))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            PROACTIVE_TURNS.inc(outcome="error")
+            logger.error(f"proactive: 主动发言失败: {e}", extra={"context_id": context_id})
+        finally:
+            state.generating = False
+            self.active -= 1
+
+
+_scheduler: Optional[ProactiveScheduler] = None
+
+
+def get_scheduler() -> ProactiveScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ProactiveScheduler()
+    return _scheduler
@@ -0,0 +1,212 @@
+"""
+提示词前缀复用：让每轮对话的 [system + 历史] 前缀尽量保持不变
+
+原先每轮都取 history[-180:]，历史超过 180 条后窗口每轮滑动一条，
+请求的开头随之变化，上游的前缀缓存（Ark 自动前缀缓存 / 上下文缓存）完全无法命中。
+这里改为按会话记录窗口起点，并且只在窗口超长时一次性前移一大步：
+
+    窗口起点固定 → [system][history[start:] ...][user]，前缀逐轮只追加
+    超过 HGDOLL_PROMPT_WINDOW 条 → 起点前移，保留最近 WINDOW - ROLL_STEP 条
+
+这样两次前移之间的 ROLL_STEP 轮对话共享同一个前缀。会话历史只追加不删除（见 utils.Context），
+窗口起点用绝对下标记录即可。
+
+开启 HGDOLL_ARK_CONTEXT_CACHE 时，还会把「system + 冻结的历史块」通过 Ark 上下文缓存
+（context.create，mode=common_prefix）建成缓存，之后每轮只发送冻结块之后的新消息；
+冻结块在窗口前移或未缓存部分超过 ROLL_STEP 条时重建。缓存创建失败时回退为普通请求。
+
+每次请求结束后从 usage.prompt_tokens_details.cached_tokens 统计命中缓存与未命中的提示词 token 数。
+
+环境变量：
+    HGDOLL_PROMPT_WINDOW                   窗口最多保留的消息数（含本轮用户消息），默认 180
+    HGDOLL_PROMPT_ROLL_STEP                窗口每次前移的消息数，默认 60
+    HGDOLL_ARK_CONTEXT_CACHE               1 开启 Ark 上下文缓存，默认 0
+    HGDOLL_ARK_CONTEXT_CACHE_TTL           上下文缓存有效期（秒），默认 3600
+    HGDOLL_ARK_CONTEXT_CACHE_MIN_MESSAGES  冻结块至少包含多少条历史才建缓存，默认 20
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WINDOW = int(os.environ.get("HGDOLL_PROMPT_WINDOW", "180"))
+ROLL_STEP = min(int(os.environ.get("HGDOLL_PROMPT_ROLL_STEP", "60")), WINDOW - 1)
+CONTEXT_CACHE = os.environ.get("HGDOLL_ARK_CONTEXT_CACHE", "0") == "1"
+CONTEXT_CACHE_TTL = int(os.environ.get("HGDOLL_ARK_CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_MIN_MESSAGES = int(os.environ.get("HGDOLL_ARK_CONTEXT_CACHE_MIN_MESSAGES", "20"))
+MAX_TRACKED = 10000
+
+PROMPT_TOKENS = metrics.counter(
+    "hgdoll_prompt_tokens_total",
+    "LLM prompt tokens by upstream cache status",
+    ("kind",),
+)
+WINDOW_ROLLS = metrics.counter(
+    "hgdoll_prompt_window_rolls_total",
+    "Times a conversation's prompt window start moved forward",
+)
+CONTEXT_CACHE_EVENTS = metrics.counter(
+    "hgdoll_context_cache_total",
+    "Ark context cache lookups by outcome",
+    ("outcome",),
+)
+
+
+class _Window:
+    __slots__ = ("start", "frozen_end")
+
+    def __init__(self):
+        self.start = 0
+        self.frozen_end = 0
+
+
+class PromptLayout:
+    """按会话维护窗口起点与冻结块边界（只在事件循环线程中访问，无需加锁）"""
+
+    def __init__(self, window: int = WINDOW, roll_step: int = ROLL_STEP):
+        self.window = window
+        self.roll_step = roll_step
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+
+    def _window(self, context_id: str) -> _Window:
+        w = self._windows.get(context_id)
+        if w is None:
+            w = self._windows[context_id] = _Window()
+            if len(self._windows) > MAX_TRACKED:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(context_id)
+        return w
+
+    def span(self, context_id: str, size: int) -> Tuple[int, int]:
+        """
+        size 为历史加本轮用户消息的条数，返回 (start, frozen_end)：
+        本轮发送 messages[start:]，其中 messages[start:frozen_end] 为冻结块（不含本轮用户消息）
+        """
+        w = self._window(context_id)
+        if w.start > size or w.frozen_end > size:
+            # 会话被重建（历史变短），从头开始
+            w.start = w.frozen_end = 0
+        history = size - 1
+        rolled = False
+        if size - w.start > self.window:
+            w.start = size - (self.window - self.roll_step)
+            rolled = True
+            WINDOW_ROLLS.inc()
+        if rolled or history - w.frozen_end >= self.roll_step:
+            w.frozen_end = max(w.start, history)
+        return w.start, w.frozen_end
+
+    def forget(self, context_id: str) -> None:
+        self._windows.pop(context_id, None)
+
+
+def cached_tokens(usage: Any) -> Tuple[int, int]:
+    """从 usage 中取出 (命中缓存, 未命中) 的提示词 token 数；字段缺失时按未命中计"""
+    if usage is None:
+        return 0, 0
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    cached = min(cached, prompt_tokens)
+    return cached, prompt_tokens - cached
+
+
+def record_usage(usage: Any) -> Tuple[int, int]:
+    cached, uncached = cached_tokens(usage)
+    if cached:
+        PROMPT_TOKENS.inc(cached, kind="cached")
+    if uncached:
+        PROMPT_TOKENS.inc(uncached, kind="uncached")
+    return cached, uncached
+
+
+class _CacheEntry:
+    __slots__ = ("key", "ark_context_id", "expires_at")
+
+    def __init__(self, key: tuple, ark_context_id: str, expires_at: float):
+        self.key = key
+        self.ark_context_id = ark_context_id
+        self.expires_at = expires_at
+
+
+class ContextCache:
+    """每个会话最多保留一个 Ark common_prefix 上下文，冻结块变化时重建"""
+
+    def __init__(self, ttl: int = CONTEXT_CACHE_TTL, min_messages: int = CONTEXT_CACHE_MIN_MESSAGES):
+        self.ttl = ttl
+        self.min_messages = min_messages
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+
+    async def lookup(
+        self,
+        client: Any,
+        model: str,
+        context_id: str,
+        key: tuple,
+        prefix: Sequence[Any],
+    ) -> Optional[str]:
+        """返回可用的 Ark 上下文 ID；冻结块太短或创建失败时返回 None，由调用方走普通请求"""
+        if len(prefix) - 1 < self.min_messages:
+            CONTEXT_CACHE_EVENTS.inc(outcome="too_short")
+            return None
+        now = time.monotonic()
+        entry = self._entries.get(context_id)
+        if entry is not None and entry.key == key and entry.expires_at > now:
+            self._entries.move_to_end(context_id)
+            CONTEXT_CACHE_EVENTS.inc(outcome="hit")
+            return entry.ark_context_id
+        try:
+            resp = await client.context.create(
+                model=model,
+                mode="common_prefix",
+                messages=[_dump(m) for m in prefix],
+                ttl=self.ttl,
+            )
+        except Exception as e:
+            CONTEXT_CACHE_EVENTS.inc(outcome="error")
+            logger.warning(f"prompt_layout: 创建上下文缓存失败，回退为普通请求: {e}", extra={"context_id": context_id})
+            self._entries.pop(context_id, None)
+            return None
+        CONTEXT_CACHE_EVENTS.inc(outcome="created")
+        # 提前一分钟视为过期，避免请求途中缓存失效
+        self._entries[context_id] = _CacheEntry(key, resp.id, now + max(0, self.ttl - 60))
+        self._entries.move_to_end(context_id)
+        if len(self._entries) > MAX_TRACKED:
+            self._entries.popitem(last=False)
+        return resp.id
+
+
+def _dump(message: Any) -> dict:
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(exclude_none=True)
+
+
+def split(messages: List[Any], frozen: int) -> Tuple[List[Any], List[Any]]:
+    """按冻结块边界拆分 [system] + 窗口消息，frozen 为前缀中的历史条数"""
+    return messages[: frozen + 1], messages[frozen + 1:]
+
+
+_layout: Optional[PromptLayout] = None
+_context_cache: Optional[ContextCache] = None
+
+
+def get_layout() -> PromptLayout:
+    global _layout
+    if _layout is None:
+        _layout = PromptLayout()
+    return _layout
+
+
+def get_context_cache() -> ContextCache:
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = ContextCache()
+    return _context_cache
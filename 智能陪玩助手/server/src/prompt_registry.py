@@ -0,0 +1,274 @@
+"""
+提示词注册表
+
+各处原先直接引用 prompt.py 中的常量：每个场景都发送同一份通用提示词，改一个字也要重启服务。
+注册表在加载时把全部提示词编译成最终文本并按内容计算版本号，请求路径上只做一次字典查找：
+
+- 名称：vlm（画面分析）、vlm_state（结构化画面状态）、vlm_chat（带画面对话）、llm（对话）、proactive（主动发言）
+- 变体：按游戏类型准备的精简版本（prompt.VARIANTS，如斗地主），每个变体带一组关键词。
+  每帧画面描述（或结构化状态中的 game 字段）出现某个变体的关键词时，该会话之后的请求改用这个变体；
+  变体没有提供的名称继续使用通用版本（default）
+- 覆盖：HGDOLL_PROMPT_DIR 目录下的 `<名称>.<变体>.txt` 覆盖或新增提示词，如 llm.default.txt、vlm.斗地主.txt；
+  文件第一行可以写 `keywords: 关键词1, 关键词2` 声明变体的关键词。文本按 string.Template 编译，
+  可以引用 $PROACTIVE_SKIP
+- 热加载：每隔 HGDOLL_PROMPT_RELOAD_S 秒检查一次目录中文件的修改时间，有变化时整体重新编译后替换；
+  也可以 POST /debug/prompts/reload 立即重新加载。编译失败时保留原来的版本
+
+切换变体会改变 system 消息，上游前缀缓存（见 prompt_layout）在切换后的第一轮失效一次。
+每个变体实际发送的提示词 token 数从上游返回的 usage 中统计，见 hgdoll_prompt_variant_tokens。
+
+只在事件循环线程中访问，无需加锁。
+
+环境变量：
+    HGDOLL_PROMPT_DIR          覆盖提示词的目录，默认不使用
+    HGDOLL_PROMPT_RELOAD_S     检查目录变化的最小间隔（秒），0 表示每次取用都检查，默认 5
+    HGDOLL_PROMPT_VARIANTS     1 按画面选择游戏变体，0 始终使用通用版本，默认 1
+"""
+
+import hashlib
+import logging
+import os
+import string
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import metrics
+import prompt
+
+logger = logging.getLogger(__name__)
+
+PROMPT_DIR = os.environ.get("HGDOLL_PROMPT_DIR", "")
+RELOAD_INTERVAL = float(os.environ.get("HGDOLL_PROMPT_RELOAD_S", "5"))
+VARIANTS_ENABLED = os.environ.get("HGDOLL_PROMPT_VARIANTS", "1") == "1"
+MAX_CONTEXTS = 10000
+
+DEFAULT = "default"
+BUILTIN = {
+    "vlm": prompt.VLM_PROMPT,
+    "vlm_state": prompt.VLM_STATE_PROMPT,
+    "vlm_chat": prompt.VLM_CHAT_PROMPT,
+    "llm": prompt.LLM_PROMPT,
+    "proactive": prompt.PROACTIVE_PROMPT,
+}
+# 模板中可以引用的变量
+SUBSTITUTIONS = {"PROACTIVE_SKIP": prompt.PROACTIVE_SKIP}
+KEYWORDS_PREFIX = "keywords:"
+
+PROMPT_SELECTIONS = metrics.counter(
+    "hgdoll_prompt_selections_total",
+    "Prompts handed out by the registry, by name and variant",
+    ("name", "variant"),
+)
+PROMPT_TOKENS = metrics.histogram(
+    "hgdoll_prompt_variant_tokens",
+    "Upstream prompt tokens of requests built on each prompt variant",
+    ("name", "variant"),
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+TEMPLATE_CHARS = metrics.gauge(
+    "hgdoll_prompt_template_chars",
+    "Characters of each compiled prompt template",
+    ("name", "variant"),
+)
+PROMPT_RELOADS = metrics.counter(
+    "hgdoll_prompt_reloads_total",
+    "Prompt registry reloads, by outcome",
+    ("outcome",),
+)
+
+
+class Prompt(NamedTuple):
+    name: str
+    variant: str
+    text: str
+    # 内容哈希的前 8 位，文本不变时版本不变
+    version: str
+    # builtin 或覆盖文件路径
+    source: str
+
+
+def compile_template(raw: str) -> str:
+    """把模板中的变量替换为最终文本；未知的 $ 引用原样保留"""
+    return string.Template(raw).safe_substitute(SUBSTITUTIONS)
+
+
+def make_prompt(name: str, variant: str, raw: str, source: str = "builtin") -> Prompt:
+    text = compile_template(raw)
+    version = hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+    return Prompt(name, variant, text, version, source)
+
+
+def read_override(path: str) -> Tuple[str, Tuple[str, ...]]:
+    """读取覆盖文件，返回 (模板文本, 关键词)；第一行为 keywords: 时作为变体的关键词"""
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+    first, _, rest = raw.partition("\n")
+    if first.strip().lower().startswith(KEYWORDS_PREFIX):
+        words = first.strip()[len(KEYWORDS_PREFIX):].replace("，", ",").split(",")
+        return rest, tuple(w.strip() for w in words if w.strip())
+    return raw, ()
+
+
+class PromptRegistry:
+    """编译好的提示词与每个会话当前的游戏变体"""
+
+    def __init__(
+        self,
+        directory: str = PROMPT_DIR,
+        reload_interval: float = RELOAD_INTERVAL,
+        variants_enabled: bool = VARIANTS_ENABLED,
+        max_contexts: int = MAX_CONTEXTS,
+    ):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.variants_enabled = variants_enabled
+        self.max_contexts = max_contexts
+        self._prompts: Dict[Tuple[str, str], Prompt] = {}
+        self._keywords: Dict[str, Tuple[str, ...]] = {}
+        self._signature: Tuple = ()
+        self._checked_at = 0.0
+        self._scenes: "OrderedDict[str, str]" = OrderedDict()
+        self.reload()
+
+    def _scan(self) -> Tuple:
+        """覆盖目录中 .txt 文件的 (文件名, 修改时间, 大小)，用于判断是否需要重新加载"""
+        if not self.directory:
+            return ()
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def _build(self, signature: Tuple) -> Tuple[Dict[Tuple[str, str], Prompt], Dict[str, Tuple[str, ...]]]:
+        prompts = {(name, DEFAULT): make_prompt(name, DEFAULT, raw) for name, raw in BUILTIN.items()}
+        keywords: Dict[str, Tuple[str, ...]] = {}
+        for variant, spec in prompt.VARIANTS.items():
+            keywords[variant] = tuple(spec["keywords"])
+            for name in BUILTIN:
+                if name in spec:
+                    prompts[(name, variant)] = make_prompt(name, variant, spec[name])
+        for filename, _, _ in signature:
+            name, _, variant = filename[:-len(".txt")].partition(".")
+            if name not in BUILTIN or not variant:
+                logger.warning(f"忽略无法识别的提示词文件: {filename}")
+                continue
+            path = os.path.join(self.directory, filename)
+            raw, words = read_override(path)
+            prompts[(name, variant)] = make_prompt(name, variant, raw, source=path)
+            if words:
+                keywords[variant] = words
+        return prompts, keywords
+
+    def reload(self) -> bool:
+        """重新扫描覆盖目录并编译全部提示词；失败时保留原来的版本并返回 False"""
+        try:
+            signature = self._scan()
+            prompts, keywords = self._build(signature)
+        except (OSError, UnicodeDecodeError) as e:
+            PROMPT_RELOADS.inc(outcome="error")
+            logger.warning(f"加载提示词失败，继续使用原来的版本: {e}")
+            if not self._prompts:
+                # 启动时目录不可用：先使用内置提示词，目录恢复后由 maybe_reload 加载
+                self._prompts, self._keywords = self._build(())
+            return False
+        changed = [
+            key for key, p in prompts.items()
+            if self._prompts and (key not in self._prompts or self._prompts[key].version != p.version)
+        ]
+        self._prompts, self._keywords, self._signature = prompts, keywords, signature
+        for (name, variant), p in prompts.items():
+            TEMPLATE_CHARS.set(len(p.text), name=name, variant=variant)
+        PROMPT_RELOADS.inc(outcome="ok")
+        if changed:
+            logger.info(
+                "提示词已更新",
+                extra={"changed": [f"{name}.{variant}" for name, variant in changed]},
+            )
+        return True
+
+    def maybe_reload(self, now: Optional[float] = None) -> bool:
+        """距上次检查超过 reload_interval 且覆盖目录有变化时重新加载"""
+        if not self.directory:
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        try:
+            signature = self._scan()
+        except OSError as e:
+            PROMPT_RELOADS.inc(outcome="error")
+            logger.warning(f"检查提示词目录失败: {e}")
+            return False
+        if signature == self._signature:
+            return False
+        return self.reload()
+
+    def classify(self, text: str) -> str:
+        """画面描述对应的变体：第一个关键词出现在描述中的变体，没有时为通用版本"""
+        for variant, words in self._keywords.items():
+            if any(word in text for word in words):
+                return variant
+        return DEFAULT
+
+    def note_scene(self, context_id: str, text: Optional[str]) -> str:
+        """根据最新一帧的画面描述记录会话当前的变体，返回该变体"""
+        variant = self.classify(text or "") if self.variants_enabled else DEFAULT
+        if variant == DEFAULT:
+            self._scenes.pop(context_id, None)
+            return variant
+        self._scenes[context_id] = variant
+        self._scenes.move_to_end(context_id)
+        if len(self._scenes) > self.max_contexts:
+            self._scenes.popitem(last=False)
+        return variant
+
+    def variant(self, context_id: Optional[str]) -> str:
+        if not self.variants_enabled or not context_id:
+            return DEFAULT
+        return self._scenes.get(context_id, DEFAULT)
+
+    def get(self, name: str, context_id: Optional[str] = None) -> Prompt:
+        """会话当前变体的提示词；变体没有提供该名称时使用通用版本"""
+        self.maybe_reload()
+        selected = self._prompts.get((name, self.variant(context_id))) or self._prompts[(name, DEFAULT)]
+        PROMPT_SELECTIONS.inc(name=name, variant=selected.variant)
+        return selected
+
+    def forget(self, context_id: str) -> None:
+        self._scenes.pop(context_id, None)
+
+    def snapshot(self) -> List[Dict]:
+        """调试端点：已加载的提示词版本"""
+        return [
+            {
+                "name": p.name,
+                "variant": p.variant,
+                "version": p.version,
+                "chars": len(p.text),
+                "source": p.source,
+                "keywords": list(self._keywords.get(p.variant, ())),
+            }
+            for p in sorted(self._prompts.values(), key=lambda p: (p.name, p.variant != DEFAULT, p.variant))
+        ]
+
+
+def record_usage(selected: Prompt, usage) -> None:
+    """记录基于该提示词的请求在上游实际消耗的提示词 token 数"""
+    tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    if tokens:
+        PROMPT_TOKENS.observe(tokens, name=selected.name, variant=selected.variant)
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def get_registry() -> PromptRegistry:
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
@@ -0,0 +1,157 @@
+"""
+双向转发的有界队列
+
+/ws/asr 代理原先在同一个循环里「收浏览器消息 → 解码 → 等待发送到 ASR」，上游发送慢时浏览器方向的接收跟着停住；
+反方向的转发任务也没有任何缓冲策略。现在每个方向拆成「读取 → 有界队列 → 写出」两个独立的泵，
+队列满时按方向选择策略：
+
+- drop_oldest：丢弃最旧的一条再放入（实时音频：积压的旧音频已没有意义，保证延迟与内存有界）
+- block：等待队列有空位（识别结果不能丢；读取方停下后由 TCP 流控把压力传回上游）
+
+各方向的消息数、字节数（吞吐）、当前队列深度与丢弃数分别计数到 hgdoll_relay_* 指标。
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple
+
+import metrics
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, BLOCK)
+
+RELAY_MESSAGES = metrics.counter(
+    "hgdoll_relay_messages_total",
+    "Messages relayed per direction",
+    ("direction",),
+)
+RELAY_BYTES = metrics.counter(
+    "hgdoll_relay_bytes_total",
+    "Payload bytes relayed per direction",
+    ("direction",),
+)
+RELAY_DROPPED = metrics.counter(
+    "hgdoll_relay_dropped_total",
+    "Messages dropped because the relay queue was full",
+    ("direction",),
+)
+RELAY_QUEUE_DEPTH = metrics.gauge(
+    "hgdoll_relay_queue_depth",
+    "Messages waiting in relay queues, summed over connections",
+    ("direction",),
+)
+
+
+class QueueClosed(Exception):
+    """队列已关闭且没有剩余消息"""
+
+
+class BoundedQueue:
+    """单个方向的有界队列；只在事件循环线程中使用"""
+
+    def __init__(self, direction: str, maxsize: int, policy: str = BLOCK):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的队列策略 {policy}，可选 {' / '.join(POLICIES)}")
+        self.direction = direction
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.closed = False
+        self._items: Deque[Tuple[Any, int]] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def put(self, item: Any, size: int = 0) -> bool:
+        """放入一条消息（size 为负载字节数，用于吞吐统计）；队列已关闭时返回 False"""
+        while len(self._items) >= self.maxsize and not self.closed:
+            if self.policy == DROP_OLDEST:
+                self._items.popleft()
+                RELAY_DROPPED.inc(direction=self.direction)
+                RELAY_QUEUE_DEPTH.dec(direction=self.direction)
+                break
+            self._not_full.clear()
+            await self._not_full.wait()
+        if self.closed:
+            return False
+        self._items.append((item, size))
+        RELAY_QUEUE_DEPTH.inc(direction=self.direction)
+        self._not_empty.set()
+        return True
+
+    async def get(self) -> Any:
+        """取出最早的一条消息；队列关闭且已取空时抛出 QueueClosed"""
+        while not self._items:
+            if self.closed:
+                raise QueueClosed()
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item, size = self._items.popleft()
+        RELAY_QUEUE_DEPTH.dec(direction=self.direction)
+        RELAY_MESSAGES.inc(direction=self.direction)
+        if size:
+            RELAY_BYTES.inc(size, direction=self.direction)
+        self._not_full.set()
+        return item
+
+    def close(self) -> None:
+        """不再接受新消息；剩余消息仍可取出，之后 get 抛出 QueueClosed"""
+        self.closed = True
+        self._not_empty.set()
+        self._not_full.set()
+
+    def discard(self) -> None:
+        """连接结束时丢弃剩余消息，归还队列深度计数"""
+        if self._items:
+            RELAY_QUEUE_DEPTH.dec(len(self._items), direction=self.direction)
+            self._items.clear()
+        self.close()
+
+
+async def pump(read: Callable[[], Awaitable[Optional[Tuple[Any, int]]]],
+               write: Callable[[Any], Awaitable[None]],
+               queue: BoundedQueue) -> None:
+    """
+    一个方向的转发：读取任务不断 read() 放入队列（返回 None 表示来源结束），当前任务从队列取出后 write()。
+    两端互不等待；来源结束后先把队列中剩余的消息发完再返回，读取端的异常在发完后抛出
+    """
+
+    async def reader():
+        try:
+            while True:
+                got = await read()
+                if got is None or not await queue.put(*got):
+                    return
+        finally:
+            queue.close()
+
+    reader_task = asyncio.ensure_future(reader())
+    try:
+        while True:
+            try:
+                item = await queue.get()
+            except QueueClosed:
+                break
+            await write(item)
+        await reader_task
+    finally:
+        reader_task.cancel()
+        queue.discard()
+
+
+async def run_pumps(*pumps: Awaitable) -> None:
+    """并发运行各个方向，任意一个方向结束（连接关闭或出错）即取消其余方向；第一个异常继续向上抛出"""
+    tasks = [asyncio.ensure_future(p) for p in pumps]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for t in done:
+        if not t.cancelled() and t.exception() is not None:
+            raise t.exception()
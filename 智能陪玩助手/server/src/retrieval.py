@@ -0,0 +1,368 @@
+"""
+按相关度检索的会话历史
+
+长会话每轮都要带上窗口内最多 HGDOLL_PROMPT_WINDOW（180）条历史，其中大部分是早已过时的画面描述。
+开启本功能后，每轮只发送最近 HGDOLL_RETRIEVAL_RECENT 条历史，再从更早的历史中按与本轮用户消息的
+相关度取回最多 HGDOLL_RETRIEVAL_TOP_K 条，按原有先后顺序插在最近历史之前：
+
+    [system][检索到的较早记录 ...][最近 RECENT 条][user]
+
+- 检索单元：一问一答（用户消息 + 紧随的回复）作为一条，单独的助手消息（画面描述、主动发言）各自一条
+- 向量：默认用字符 1-2 gram 哈希到 HGDOLL_RETRIEVAL_DIM 维的归一化词袋向量，不需要模型；
+  设置 HGDOLL_EMBEDDING_MODEL 时用 sentence-transformers 加载本地模型（可选依赖，加载失败时退回哈希向量）
+- 索引：每个会话一个 NumPy 矩阵，点积取 top-k；单个会话最多几千条，暴力点积在 1ms 内，不需要近似索引
+- 计算时机：历史的向量在后台线程中增量计算（每次检索后顺带调度），不在请求路径上；
+  最近 RECENT 条本来就会原样发送，索引落后几条不影响结果。请求路径上只计算本轮消息的向量并做一次点积
+
+检索到的前缀每轮都不同，会使上游前缀缓存失效（见 prompt_layout），因此默认关闭，
+历史较长、提示词 token 是主要开销时再开启。需要安装 numpy，缺少时按原窗口发送；
+numpy 在第一次检索时才导入，关闭本功能时不增加进程启动耗时。
+
+环境变量：
+    HGDOLL_RETRIEVAL              1 开启，默认 0
+    HGDOLL_RETRIEVAL_RECENT       原样发送的最近历史条数，默认 40
+    HGDOLL_RETRIEVAL_TOP_K        从更早的历史中取回的检索单元数，默认 8
+    HGDOLL_RETRIEVAL_DIM          哈希向量维度，默认 512
+    HGDOLL_RETRIEVAL_TIMEOUT_MS   本轮消息向量的计算超时，超时按原窗口发送，默认 200
+    HGDOLL_EMBEDDING_MODEL        本地 embedding 模型名称或路径（sentence-transformers），默认不使用
+"""
+
+import asyncio
+import bisect
+import concurrent.futures
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import metrics
+
+# 由 load_numpy 在第一次检索或建索引时赋值
+np = None
+_numpy_missing = False
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("HGDOLL_RETRIEVAL", "0") == "1"
+RECENT = int(os.environ.get("HGDOLL_RETRIEVAL_RECENT", "40"))
+TOP_K = int(os.environ.get("HGDOLL_RETRIEVAL_TOP_K", "8"))
+DIM = int(os.environ.get("HGDOLL_RETRIEVAL_DIM", "512"))
+TIMEOUT = float(os.environ.get("HGDOLL_RETRIEVAL_TIMEOUT_MS", "200")) / 1000
+EMBEDDING_MODEL = os.environ.get("HGDOLL_EMBEDDING_MODEL", "")
+BATCH = 32
+MAX_CONTEXTS = 10000
+
+RETRIEVAL_SECONDS = metrics.histogram(
+    "hgdoll_retrieval_seconds",
+    "Request-path retrieval latency: query embedding plus top-k search",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+RETRIEVAL_FALLBACKS = metrics.counter(
+    "hgdoll_retrieval_fallback_total",
+    "Turns sent with the plain window instead of retrieved history",
+    ("reason",),
+)
+INDEXED_UNITS = metrics.counter(
+    "hgdoll_retrieval_indexed_units_total",
+    "History units embedded into per-session indexes",
+)
+INDEX_SECONDS = metrics.histogram(
+    "hgdoll_retrieval_index_seconds",
+    "Background time spent embedding one batch of history units",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+PROMPT_BYTES = metrics.counter(
+    "hgdoll_retrieval_prompt_bytes_total",
+    "History bytes the plain window would have sent vs. bytes actually sent",
+    ("kind",),
+)
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return ""
+
+
+def load_numpy():
+    """导入 numpy 并缓存，缺少时返回 None"""
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover - 取决于部署环境
+            _numpy_missing = True
+        else:
+            np = numpy
+    return np
+
+
+class HashingEmbedder:
+    """字符 1-2 gram 哈希到固定维度、带符号的词袋向量；中文不分词也能按字面重合度衡量相关性"""
+
+    # 计算足够快，本轮消息直接在事件循环中计算，不经过线程池
+    inline = True
+
+    def __init__(self, dim: int = DIM):
+        load_numpy()
+        self.dim = dim
+
+    def _vector(self, text: str):
+        chars = [c for c in text.lower() if not c.isspace()]
+        grams = chars + [a + b for a, b in zip(chars, chars[1:])]
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if not grams:
+            return vec
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint32, count=len(grams))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, (hashes % self.dim).astype(np.intp), signs)
+        # 次线性词频，避免长画面描述中的高频字主导
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed(self, texts: Sequence[str]):
+        return np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+class ModelEmbedder:
+    """sentence-transformers 本地模型；第一次使用时在线程池中加载"""
+
+    inline = False
+
+    def __init__(self, name: str):
+        from sentence_transformers import SentenceTransformer
+
+        load_numpy()
+        self.model = SentenceTransformer(name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]):
+        if not texts:
+            return np.zeros((0, self.dim), np.float32)
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+def load_embedder(name: str = EMBEDDING_MODEL):
+    if name:
+        try:
+            return ModelEmbedder(name)
+        except Exception as e:
+            logger.warning(f"加载 embedding 模型 {name} 失败，改用哈希向量: {e}")
+    return HashingEmbedder()
+
+
+def build_units(records: Sequence, offset: int, pending: Optional[int]) -> Tuple[List[Tuple[int, ...]], List[str], Optional[int]]:
+    """
+    把 records（历史中从 offset 开始的一段）切分为检索单元，返回 (单元的历史下标, 单元文本, 尚未等到回复的用户消息下标)；
+    pending 为上一段末尾尚未等到回复的用户消息，它的文本不在本段中，由调用方补上。只读取记录，可以在后台线程中调用
+    """
+    units, texts = [], []
+    pending_text = ""
+    for i, record in enumerate(records, offset):
+        role = record.role
+        if role == "user":
+            if pending is not None:
+                # 没有等到回复的用户消息（被取代的一轮）单独成为一个单元
+                units.append((pending,))
+                texts.append(pending_text)
+            pending = i
+            pending_text = _text(record.content)
+        elif role == "assistant":
+            reply = _text(record.content)
+            if pending is not None:
+                units.append((pending, i))
+                texts.append(pending_text + "\n" + reply)
+                pending, pending_text = None, ""
+            else:
+                units.append((i,))
+                texts.append(reply)
+    return units, texts, pending
+
+
+class SessionIndex:
+    """一个会话的检索单元与向量；units 按最后一条消息的下标递增"""
+
+    __slots__ = ("vectors", "units", "ends", "next_record", "pending")
+
+    def __init__(self, dim: int):
+        load_numpy()
+        self.vectors = np.zeros((16, dim), dtype=np.float32)
+        self.units: List[Tuple[int, ...]] = []
+        self.ends: List[int] = []
+        self.next_record = 0
+        self.pending: Optional[int] = None
+
+    def add(self, units: List[Tuple[int, ...]], vectors) -> None:
+        size = len(self.units)
+        need = size + len(units)
+        if need > len(self.vectors):
+            grown = np.zeros((max(need, len(self.vectors) * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:size] = self.vectors[:size]
+            self.vectors = grown
+        self.vectors[size:need] = vectors
+        self.units.extend(units)
+        self.ends.extend(u[-1] for u in units)
+
+    def search(self, query, before: int, k: int) -> List[Tuple[int, ...]]:
+        """只在最后一条消息下标小于 before 的单元中取相关度最高的 k 个"""
+        eligible = bisect.bisect_left(self.ends, before)
+        if eligible == 0 or k <= 0:
+            return []
+        scores = self.vectors[:eligible] @ query
+        if eligible > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(eligible)
+        return [self.units[i] for i in top if scores[i] > 0]
+
+
+class RetrievalIndex:
+    """全部会话的检索索引；只在事件循环线程中访问，向量计算在单线程池中执行"""
+
+    def __init__(self, embedder=None, recent: int = RECENT, top_k: int = TOP_K,
+                 timeout: float = TIMEOUT, max_contexts: int = MAX_CONTEXTS):
+        self.recent = recent
+        self.top_k = top_k
+        self.timeout = timeout
+        self.max_contexts = max_contexts
+        self._embedder = embedder
+        self._sessions: "OrderedDict[str, SessionIndex]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._dirty: Dict[str, Sequence] = {}
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def _pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="hgdoll-embed")
+        return self._executor
+
+    async def _get_embedder(self):
+        if self._embedder is None:
+            loop = asyncio.get_running_loop()
+            self._embedder = await loop.run_in_executor(self._pool(), load_embedder)
+        return self._embedder
+
+    def _session(self, context_id: str, dim: int) -> SessionIndex:
+        index = self._sessions.get(context_id)
+        if index is None:
+            index = self._sessions[context_id] = SessionIndex(dim)
+            if len(self._sessions) > self.max_contexts:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(context_id)
+        return index
+
+    async def select(self, context_id: str, records: Sequence, start: int, query: str) -> Optional[List[int]]:
+        """
+        本轮要发送的历史下标（升序）：检索到的较早记录 + 最近 recent 条；历史不够长或无法检索时返回 None，
+        调用方按原窗口 records[start:] 发送。start 为原窗口起点，仅用于统计提示词缩减
+        """
+        if load_numpy() is None:
+            RETRIEVAL_FALLBACKS.inc(reason="no_numpy")
+            return None
+        total = len(records)
+        recent_start = max(0, total - self.recent)
+        if recent_start <= start:
+            # 历史还没有超出最近 recent 条，原窗口本来就更短
+            return None
+        self.schedule(context_id, records)
+        index = self._sessions.get(context_id)
+        if index is None or not index.units:
+            RETRIEVAL_FALLBACKS.inc(reason="not_indexed")
+            return None
+        started = time.perf_counter()
+        try:
+            embedder = self._embedder
+            if embedder.inline:
+                query_vec = embedder.embed([query])[0]
+            else:
+                loop = asyncio.get_running_loop()
+                query_vec = (await asyncio.wait_for(
+                    loop.run_in_executor(self._pool(), embedder.embed, [query]), self.timeout
+                ))[0]
+        except asyncio.TimeoutError:
+            RETRIEVAL_FALLBACKS.inc(reason="timeout")
+            return None
+        if len(query_vec) != index.vectors.shape[1]:
+            RETRIEVAL_FALLBACKS.inc(reason="dimension")
+            return None
+        picked = sorted({i for unit in index.search(query_vec, recent_start, self.top_k) for i in unit})
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - started)
+        selected = picked + list(range(recent_start, total))
+        PROMPT_BYTES.inc(sum(len(r.serialized) for r in records[start:]), kind="window")
+        PROMPT_BYTES.inc(sum(len(records[i].serialized) for i in selected), kind="sent")
+        return selected
+
+    def schedule(self, context_id: str, records: Sequence) -> None:
+        """在后台为尚未索引的历史计算向量；同一会话同时只有一个索引任务，期间的新请求合并为一次"""
+        task = self._tasks.get(context_id)
+        if task is not None and not task.done():
+            self._dirty[context_id] = records
+            return
+        self._tasks[context_id] = asyncio.ensure_future(self._run(context_id, records))
+
+    async def _run(self, context_id: str, records: Sequence) -> None:
+        try:
+            while records is not None:
+                await self._index(context_id, records)
+                records = self._dirty.pop(context_id, None)
+        except Exception as e:
+            logger.warning(f"会话历史索引失败: {e}", extra={"context_id": context_id})
+        finally:
+            self._tasks.pop(context_id, None)
+
+    async def _index(self, context_id: str, records: Sequence) -> None:
+        embedder = await self._get_embedder()
+        index = self._session(context_id, embedder.dim)
+        if index.next_record > len(records):
+            # 会话被重建（历史变短），重新索引
+            index = self._sessions[context_id] = SessionIndex(embedder.dim)
+        loop = asyncio.get_running_loop()
+        # 历史只追加，记录不可变，可以把切片交给后台线程
+        end = len(records)
+        while index.next_record < end:
+            stop = min(end, index.next_record + BATCH)
+            chunk = list(records[index.next_record:stop])
+            started = time.perf_counter()
+            units, vectors, pending = await loop.run_in_executor(
+                self._pool(), self._embed_chunk, embedder, records, chunk, index.next_record, index.pending
+            )
+            INDEX_SECONDS.observe(time.perf_counter() - started)
+            if self._sessions.get(context_id) is not index:
+                return
+            index.add(units, vectors)
+            index.next_record, index.pending = stop, pending
+            INDEXED_UNITS.inc(len(units))
+
+    @staticmethod
+    def _embed_chunk(embedder, records, chunk, offset, pending):
+        units, texts, pending_out = build_units(chunk, offset, pending)
+        # 跨批次的单元：用户消息的文本要回到它所在的记录读取
+        for n, unit in enumerate(units):
+            if unit[0] < offset:
+                texts[n] = _text(records[unit[0]].content) + texts[n]
+        return units, embedder.embed(texts), pending_out
+
+    def forget(self, context_id: str) -> None:
+        self._sessions.pop(context_id, None)
+        self._dirty.pop(context_id, None)
+
+    async def drain(self) -> None:
+        """等待当前的后台索引任务完成（测试与基准使用）"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+
+_index: Optional[RetrievalIndex] = None
+
+
+def get_index() -> RetrievalIndex:
+    global _index
+    if _index is None:
+        _index = RetrievalIndex()
+    return _index
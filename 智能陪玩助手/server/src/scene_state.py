@@ -0,0 +1,209 @@
+"""
+结构化的画面状态
+
+画面分析原先返回自由文本描述（prompt.VLM_PROMPT），每帧原样写入历史，之后每轮都随窗口重新发送给 LLM；
+相邻两帧是否变化也只能对整段文本做 difflib 比较。开启 HGDOLL_SCENE_STATE=1 后：
+
+- VLM 使用 prompt.VLM_STATE_PROMPT，只输出紧凑 JSON：game / phase / role / resources / hint / notes
+- 每个会话维护一个状态对象，逐帧增量合并：字段为 null 或空表示「看不出」，保留原值；
+  resources 按资源名逐项合并，值为 null 的资源被移除
+- 合并时得到本帧的变化（字段 → 原值、新值），差异度 = 变化项数 / 状态项数，直接交给 cadence 与 proactive，
+  不再做文本比较
+- 画面描述不再写入历史；组装提示词时在本轮用户消息之前插入一条「当前状态 + 最近 HGDOLL_SCENE_DELTAS 次变化」，
+  放在最后不会破坏前面 system + 历史的前缀缓存（见 prompt_layout）
+
+VLM 输出无法解析为 JSON 时，这一帧按原来的方式把文本写入历史，并计数到 hgdoll_scene_updates_total{outcome=unparsed}。
+
+只在事件循环线程中访问，无需加锁。
+
+环境变量：
+    HGDOLL_SCENE_STATE    1 开启结构化画面状态，默认 0
+    HGDOLL_SCENE_DELTAS   提示词中保留的最近变化次数，默认 5
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, NamedTuple, Optional, Tuple
+
+import metrics
+
+ENABLED = os.environ.get("HGDOLL_SCENE_STATE", "0") == "1"
+MAX_DELTAS = int(os.environ.get("HGDOLL_SCENE_DELTAS", "5"))
+MAX_CONTEXTS = 10000
+MAX_RESOURCES = 12
+MAX_VALUE_CHARS = 40
+
+# 字段与提示词中的中文名称，顺序即渲染顺序
+FIELDS = (("game", "游戏"), ("phase", "阶段"), ("role", "身份"), ("hint", "提示"), ("notes", "备注"))
+_LABELS = dict(FIELDS)
+_EMPTY = ("", "null", "none", "未知", "无法判断", "不确定")
+
+SCENE_UPDATES = metrics.counter(
+    "hgdoll_scene_updates_total",
+    "Frame analyses merged into the structured scene state, by outcome",
+    ("outcome",),
+)
+SCENE_PROMPT_CHARS = metrics.histogram(
+    "hgdoll_scene_prompt_chars",
+    "Characters of the scene state message added to a prompt",
+    buckets=(50, 100, 200, 300, 500, 800, 1200),
+)
+
+
+class Update(NamedTuple):
+    # 字段（资源为 "resources.名称"）→ (原值, 新值)；原值或新值为 None 表示新增或移除
+    changes: Dict[str, Tuple[Optional[str], Optional[str]]]
+    novelty: float
+
+
+def _clean(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    text = str(value).strip()
+    if text.lower() in _EMPTY:
+        return None
+    return text[:MAX_VALUE_CHARS]
+
+
+def parse(text: str) -> Dict[str, Any]:
+    """从 VLM 输出中取出状态 JSON；容忍前后的说明文字与 Markdown 代码块，无法解析时抛出 ValueError"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("没有找到 JSON 对象")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("画面状态不是 JSON 对象")
+    state: Dict[str, Any] = {}
+    for name, _ in FIELDS:
+        value = _clean(data.get(name))
+        if value is not None:
+            state[name] = value
+    resources = data.get("resources")
+    if isinstance(resources, dict):
+        state["resources"] = {
+            str(k)[:MAX_VALUE_CHARS]: (None if v is None else _clean(v))
+            for k, v in list(resources.items())[:MAX_RESOURCES]
+        }
+    if not state:
+        raise ValueError("画面状态没有任何字段")
+    return state
+
+
+class SceneState:
+    """一个会话的当前状态与最近几次变化"""
+
+    __slots__ = ("fields", "resources", "deltas", "frames")
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.resources: Dict[str, str] = {}
+        self.deltas: Deque[Tuple[float, Dict[str, Tuple[Optional[str], Optional[str]]]]] = deque(maxlen=MAX_DELTAS)
+        self.frames = 0
+
+    def merge(self, update: Dict[str, Any], now: Optional[float] = None) -> Update:
+        changes: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        for name, _ in FIELDS:
+            value = update.get(name)
+            if value is not None and self.fields.get(name) != value:
+                changes[name] = (self.fields.get(name), value)
+                self.fields[name] = value
+        for key, value in (update.get("resources") or {}).items():
+            old = self.resources.get(key)
+            if value is None:
+                if old is not None:
+                    changes["resources." + key] = (old, None)
+                    del self.resources[key]
+            elif old != value:
+                changes["resources." + key] = (old, value)
+                self.resources[key] = value
+        while len(self.resources) > MAX_RESOURCES:
+            del self.resources[next(iter(self.resources))]
+        first = self.frames == 0
+        self.frames += 1
+        if changes and not first:
+            self.deltas.append((time.time() if now is None else now, changes))
+        items = len(self.fields) + len(self.resources)
+        novelty = 1.0 if first else min(1.0, len(changes) / max(items, 1))
+        return Update(changes, novelty)
+
+    def render(self) -> str:
+        """当前状态与最近的变化，作为一条画面描述放进提示词"""
+        parts = [f"{label}：{self.fields[name]}" for name, label in FIELDS if name in self.fields]
+        if self.resources:
+            parts.append("资源：" + "，".join(f"{k} {v}" for k, v in self.resources.items()))
+        lines = ["当前画面状态：" + "；".join(parts)]
+        if self.deltas:
+            lines.append("最近的变化（由早到晚）：")
+            lines.extend("- " + describe(changes) for _, changes in self.deltas)
+        return "\n".join(lines)
+
+
+def _label(key: str) -> str:
+    if key.startswith("resources."):
+        return key[len("resources."):]
+    return _LABELS.get(key, key)
+
+
+def describe(changes: Dict[str, Tuple[Optional[str], Optional[str]]]) -> str:
+    """一次变化的简短文字，如「阶段：叫地主 → 出牌阶段；手牌：17张 → 12张」"""
+    parts = []
+    for key, (old, new) in changes.items():
+        if old is None:
+            parts.append(f"{_label(key)}：{new}")
+        elif new is None:
+            parts.append(f"{_label(key)}：{old} → 没有了")
+        else:
+            parts.append(f"{_label(key)}：{old} → {new}")
+    return "；".join(parts)
+
+
+class SceneStore:
+    """全部会话的画面状态，按最近使用淘汰"""
+
+    def __init__(self, max_contexts: int = MAX_CONTEXTS):
+        self.max_contexts = max_contexts
+        self._states: "OrderedDict[str, SceneState]" = OrderedDict()
+
+    def update(self, context_id: str, text: str) -> Optional[Update]:
+        """把一帧 VLM 输出合并进会话状态；无法解析时返回 None，由调用方按自由文本处理"""
+        try:
+            parsed = parse(text)
+        except ValueError:
+            SCENE_UPDATES.inc(outcome="unparsed")
+            return None
+        state = self._states.get(context_id)
+        if state is None:
+            state = self._states[context_id] = SceneState()
+            if len(self._states) > self.max_contexts:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(context_id)
+        result = state.merge(parsed)
+        SCENE_UPDATES.inc(outcome="changed" if result.changes else "unchanged")
+        return result
+
+    def render(self, context_id: str) -> Optional[str]:
+        state = self._states.get(context_id)
+        if state is None or not state.frames:
+            return None
+        text = state.render()
+        SCENE_PROMPT_CHARS.observe(len(text))
+        return text
+
+    def get(self, context_id: str) -> Optional[SceneState]:
+        return self._states.get(context_id)
+
+    def forget(self, context_id: str) -> None:
+        self._states.pop(context_id, None)
+
+
+_store: Optional[SceneStore] = None
+
+
+def get_store() -> SceneStore:
+    global _store
+    if _store is None:
+        _store = SceneStore()
+    return _store
@@ -0,0 +1,399 @@
+"""
+/ws/session：一个 WebSocket 连接承载一个会话的截图、对话与语音
+
+插件原先对每个会话使用三种通道：截图走 POST、对话走流式 POST、语音走 /ws/asr，
+每个 POST 都要经过 CORS、请求头解析与 ArkChatRequest 校验。/ws/session 在一条长连接上
+复用同一套存储、截图分析与 TTS 流程（main.model_calling），并允许服务端主动推送回复。
+
+连接：ws://<host>/ws/session?context_id=<X-Context-Id>（也可用 X-Context-Id 请求头）
+
+二进制消息：首字节为类型
+    0x01 frame      客户端 → 服务端   JPEG 截图原始字节
+    0x02 audio-in   客户端 → 服务端   PCM 音频（16kHz / 16bit / 单声道），需先 asr_start
+    0x03 audio-out  服务端 → 客户端   4 字节轮次号（大端）+ MP3 音频块
+
+文本消息：JSON，type 字段区分
+    客户端 → 服务端
+        {"type": "chat", "text": "..."}                      发起一轮对话
+        {"type": "frame", "image": "<base64 jpeg>"}          截图（文本形式）
+        {"type": "audio", "data": "<base64 pcm>"}            音频（文本形式）
+        {"type": "control", "action": "asr_start", "app_id": "", "access_token": "", "auto_reply": false,
+         "profile": "default" | "fast" | "patient", "end_window_size": 600, "result_type": "single"}  后三项可省略
+        {"type": "control", "action": "asr_stop"}
+        {"type": "control", "action": "ping"}
+    服务端 → 客户端
+        {"type": "transcript", "source": "user", "text": "...", "is_final": bool}   语音识别结果
+        {"type": "transcript", "source": "bot", "turn": n, "text": "..."}            回复文字（增量）
+        {"type": "control", "event": "ready" | "pong" | "turn_start" | "turn_end" | "capture_delay"
+                                     | "asr_started" | "asr_stopped" | "busy" | "error", ...}
+
+同一会话的对话轮次按顺序执行，新的用户消息取代尚未完成的上一轮（turn_end 带 "superseded": true）；auto_reply 为 true 时，语音识别出最终结果后由服务端直接发起对话。
+服务端主动发言（proactive.py）以 source 为 "proactive" 的轮次推送。
+服务繁忙、这一轮未被准入（admission.py）时发送 {"event": "busy", "turn": n, "status": 429 | 503, "retry_after": 秒}，
+与 HTTP 接口的 429/503 + Retry-After 对应，客户端稍后重试即可。
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import struct
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Sequence, Set, Tuple
+
+import admission
+import asr
+import cadence
+import metrics
+
+logger = logging.getLogger(__name__)
+
+KIND_FRAME = 0x01
+KIND_AUDIO_IN = 0x02
+KIND_AUDIO_OUT = 0x03
+
+SESSIONS_ACTIVE = metrics.gauge(
+    "hgdoll_sessions_active",
+    "Open /ws/session connections",
+)
+SESSION_MESSAGES = metrics.counter(
+    "hgdoll_session_messages_total",
+    "Messages exchanged over /ws/session",
+    ("direction", "kind"),
+)
+
+FrameHandler = Callable[[str, bytes], Awaitable[None]]
+# (context_id, 用户文本, reqid) -> 逐块产出 (回复文字, MP3 音频)
+ChatHandler = Callable[[str, str, str], AsyncIterator[Tuple[str, bytes]]]
+
+
+def encode_audio_out(turn: int, audio: bytes) -> bytes:
+    return bytes([KIND_AUDIO_OUT]) + struct.pack(">I", turn) + audio
+
+
+def decode_binary(data: bytes) -> Tuple[int, bytes]:
+    if not data:
+        raise ValueError("空的二进制消息")
+    return data[0], data[1:]
+
+
+class Session:
+    """一个 /ws/session 连接；websocket 只需提供 ASGI 风格的 receive / send_text / send_bytes"""
+
+    def __init__(
+        self,
+        websocket,
+        context_id: str,
+        on_frame: FrameHandler,
+        on_chat: ChatHandler,
+        asr_url: str = "",
+        asr_app_id: str = "",
+        asr_access_token: str = "",
+    ):
+        self.websocket = websocket
+        self.context_id = context_id
+        self.on_frame = on_frame
+        self.on_chat = on_chat
+        self.asr_url = asr_url
+        self.asr_app_id = asr_app_id
+        self.asr_access_token = asr_access_token
+        self.turn = 0
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+        self._turn_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self._asr_upstream = None
+        self._asr_sequence = 1
+        self._asr_reader: Optional[asyncio.Task] = None
+        self._asr_timer: Optional[asr.FinalizationTimer] = None
+        self._auto_reply = False
+        self._user_turn: Optional[asyncio.Task] = None
+        self._user_turn_text = ""
+
+    # ---------- 发送 ----------
+
+    async def _send(self, kind: str, text: Optional[str] = None, data: Optional[bytes] = None) -> bool:
+        if self.closed:
+            return False
+        try:
+            async with self._send_lock:
+                if data is not None:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(text)
+        except Exception as e:
+            # 客户端已断开：后续发送全部跳过，由 run() 的 finally 清理
+            logger.info(f"session: 发送失败，连接视为已关闭 ({type(e).__name__}: {e})")
+            self.closed = True
+            return False
+        SESSION_MESSAGES.inc(direction="out", kind=kind)
+        return True
+
+    async def send_json(self, message: dict) -> bool:
+        return await self._send(message.get("type", "unknown"), text=json.dumps(message, ensure_ascii=False))
+
+    async def send_audio(self, turn: int, audio: bytes) -> bool:
+        return await self._send("audio_out", data=encode_audio_out(turn, audio))
+
+    async def control(self, event: str, **fields) -> None:
+        await self.send_json({"type": "control", "event": event, **fields})
+
+    # ---------- 主循环 ----------
+
+    async def run(self) -> None:
+        """处理客户端消息直到连接断开"""
+        SESSIONS_ACTIVE.inc()
+        try:
+            await self.control("ready", context_id=self.context_id)
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self._on_binary(message["bytes"])
+                elif message.get("text") is not None:
+                    await self._on_text(message["text"])
+        finally:
+            await self.close()
+            SESSIONS_ACTIVE.dec()
+
+    async def close(self) -> None:
+        self.closed = True
+        for t in list(self._tasks):
+            t.cancel()
+        await self._stop_asr()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        t = asyncio.create_task(coro)
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+        return t
+
+    async def _on_binary(self, data: bytes) -> None:
+        try:
+            kind, payload = decode_binary(data)
+        except ValueError:
+            return
+        if kind == KIND_FRAME:
+            SESSION_MESSAGES.inc(direction="in", kind="frame")
+            await self._handle_frame(payload)
+        elif kind == KIND_AUDIO_IN:
+            SESSION_MESSAGES.inc(direction="in", kind="audio_in")
+            await self._handle_audio(payload)
+        else:
+            await self.control("error", message=f"未知的二进制消息类型 {kind}")
+
+    async def _on_text(self, text: str) -> None:
+        try:
+            message = json.loads(text)
+            kind = message["type"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            await self.control("error", message="无效的 JSON 消息")
+            return
+        if kind not in ("chat", "frame", "audio", "control"):
+            await self.control("error", message=f"未知的消息类型 {kind}")
+            return
+        SESSION_MESSAGES.inc(direction="in", kind=kind)
+        try:
+            if kind == "chat":
+                if message.get("text"):
+                    self.start_turn(message["text"], source="chat")
+            elif kind == "frame":
+                await self._handle_frame(base64.b64decode(message.get("image", "")))
+            elif kind == "audio":
+                await self._handle_audio(base64.b64decode(message.get("data", "")))
+            else:
+                await self._handle_control(message)
+        except ValueError:
+            await self.control("error", message="base64 数据无效")
+
+    # ---------- 截图 ----------
+
+    async def _handle_frame(self, image: bytes) -> None:
+        if not image:
+            return
+        try:
+            # 与 HTTP 截图接口相同：只负责提交，分析在后台任务中进行
+            await self.on_frame(self.context_id, image)
+        except Exception as e:
+            logger.error(f"session: 提交截图失败: {e}", extra={"context_id": self.context_id})
+            await self.control("error", message="截图处理失败")
+            return
+        await self.control("capture_delay", ms=cadence.get_controller().next_delay_ms(self.context_id))
+
+    # ---------- 对话 ----------
+
+    def start_turn(self, text: str, source: str = "chat") -> asyncio.Task:
+        """
+        开始一轮对话；同一会话的轮次按顺序执行。新的用户消息取代尚未完成的上一轮
+        （停止其 LLM / TTS 流），与进行中的一轮内容相同时不再重复发起
+        """
+        previous = self._user_turn
+        if previous is not None and not previous.done():
+            if text == self._user_turn_text:
+                return previous
+            previous.cancel()
+        self._user_turn_text = text
+        self._user_turn = self._spawn(self._run_turn(text, source))
+        return self._user_turn
+
+    async def _run_turn(self, text: str, source: str) -> None:
+        async with self._turn_lock:
+            self.turn += 1
+            turn = self.turn
+            reqid = f"{self.context_id}-{turn}"
+            await self.control("turn_start", turn=turn, source=source)
+            try:
+                async for reply, audio in self.on_chat(self.context_id, text, reqid):
+                    await self._send_part(turn, reply, audio)
+            except asyncio.CancelledError:
+                if not self.closed:
+                    await self.control("turn_end", turn=turn, superseded=True)
+                raise
+            except admission.Rejected as rejected:
+                # 削峰拒绝不是服务故障：按 HTTP 接口的 429/503 告知客户端稍后重试
+                logger.info(f"session: 服务繁忙，本轮未被准入: {rejected.reason}", extra={"context_id": self.context_id})
+                await self.control(
+                    "busy", turn=turn, status=rejected.status, retry_after=rejected.retry_after, reason=rejected.reason
+                )
+            except Exception as e:
+                logger.error(f"session: 对话失败: {e}", extra={"context_id": self.context_id})
+                await self.control("error", turn=turn, message="对话失败")
+            await self.control("turn_end", turn=turn)
+
+    async def _send_part(self, turn: int, reply: str, audio: bytes) -> None:
+        if reply:
+            await self.send_json({"type": "transcript", "source": "bot", "turn": turn, "text": reply})
+        if audio:
+            await self.send_audio(turn, audio)
+
+    @property
+    def busy(self) -> bool:
+        """有对话轮次正在进行或排队"""
+        return self._turn_lock.locked()
+
+    async def push_turn(self, parts: Sequence[Tuple[str, bytes]], source: str = "proactive") -> bool:
+        """
+        推送服务端已生成好的一轮回复（文字与音频都已就绪）；
+        会话正忙或连接已关闭时放弃并返回 False
+        """
+        if self.closed or self.busy:
+            return False
+        async with self._turn_lock:
+            self.turn += 1
+            turn = self.turn
+            await self.control("turn_start", turn=turn, source=source)
+            for reply, audio in parts:
+                await self._send_part(turn, reply, audio)
+            await self.control("turn_end", turn=turn)
+        return not self.closed
+
+    # ---------- 语音 ----------
+
+    async def _handle_control(self, message: dict) -> None:
+        action = message.get("action")
+        if action == "ping":
+            await self.control("pong")
+        elif action == "asr_start":
+            try:
+                profile = asr.resolve_profile(
+                    message.get("profile"), message.get("end_window_size"), message.get("result_type")
+                )
+            except ValueError as e:
+                await self.control("error", message=f"ASR 参数无效：{e}")
+                return
+            await self._start_asr(
+                message.get("app_id") or self.asr_app_id,
+                message.get("access_token") or self.asr_access_token,
+                bool(message.get("auto_reply")),
+                profile,
+            )
+        elif action == "asr_stop":
+            await self._stop_asr()
+            await self.control("asr_stopped")
+        else:
+            await self.control("error", message=f"未知的控制指令 {action}")
+
+    async def _start_asr(
+        self, app_id: str, access_token: str, auto_reply: bool, profile: asr.Profile = asr.DEFAULT_PROFILE
+    ) -> None:
+        await self._stop_asr()
+        if not app_id or not access_token:
+            await self.control("error", message="ASR 凭证未配置")
+            return
+        try:
+            self._asr_upstream = await asr.connect(self.asr_url, app_id, access_token, profile)
+        except Exception as e:
+            logger.error(f"session: 连接 Doubao ASR 服务失败: {e}", extra={"context_id": self.context_id})
+            await self.control("error", message="无法连接 ASR 服务")
+            return
+        self._asr_sequence = 1
+        self._asr_timer = asr.FinalizationTimer(profile)
+        self._auto_reply = auto_reply
+        self._asr_reader = self._spawn(self._read_asr(self._asr_upstream))
+        # 回告实际生效的识别参数
+        await self.control(
+            "asr_started",
+            profile=profile.name,
+            end_window_size=profile.end_window_size,
+            result_type=profile.result_type,
+        )
+
+    async def _stop_asr(self) -> None:
+        upstream, self._asr_upstream = self._asr_upstream, None
+        if self._asr_reader is not None:
+            self._asr_reader.cancel()
+            self._asr_reader = None
+        if upstream is not None:
+            try:
+                await upstream.close()
+            except Exception:
+                pass
+
+    async def _handle_audio(self, pcm: bytes) -> None:
+        if self._asr_upstream is None:
+            await self.control("error", message="ASR 未启动，请先发送 asr_start")
+            return
+        self._asr_sequence += 1
+        self._asr_timer.on_audio(pcm)
+        try:
+            await self._asr_upstream.send(asr.audio_message(pcm, self._asr_sequence))
+        except Exception as e:
+            logger.warning(f"session: ASR 上游已断开: {e}", extra={"context_id": self.context_id})
+            await self._stop_asr()
+            await self.control("error", message="ASR 连接已断开")
+
+    async def _read_asr(self, upstream) -> None:
+        try:
+            async for data in upstream:
+                if not isinstance(data, bytes):
+                    continue
+                result = asr.parse_response(data)
+                if not result or "text" not in result:
+                    continue
+                self._asr_timer.on_result(result)
+                await self.send_json({"type": "transcript", "source": "user", **result})
+                if result["is_final"] and result["text"] and self._auto_reply:
+                    self.start_turn(result["text"], source="voice")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 包括上游正常/异常关闭（websockets.ConnectionClosed）
+            logger.info(f"session: ASR 上游连接结束 ({type(e).__name__}: {e})")
+
+
+_sessions: Dict[str, Session] = {}
+
+
+def register(session: Session) -> None:
+    """登记会话的当前连接（同一 context_id 重连时以新连接为准）"""
+    _sessions[session.context_id] = session
+
+
+def unregister(session: Session) -> None:
+    if _sessions.get(session.context_id) is session:
+        del _sessions[session.context_id]
+
+
+def get_session(context_id: str) -> Optional[Session]:
+    """返回会话当前打开的连接，用于服务端主动推送"""
+    return _sessions.get(context_id)
@@ -0,0 +1,285 @@
+"""
+会话上下文的增量快照与启动恢复
+
+会话历史只保存在进程内存（utils.CoroutineSafeMap）中，每次发布或崩溃后所有玩家的上下文都会丢失。
+这里把上下文存储的每次变更记录到本地的追加日志，服务启动时重放日志恢复上下文：
+
+- 记录：存储层在事件循环中调用 Journal.set / append / delete，只把变更追加到内存队列
+  （历史记录不可变，入队的是对象引用，无需复制）
+- 写盘：每隔 HGDOLL_SNAPSHOT_INTERVAL_S 秒把队列整体交给单独的写盘线程，编码、写文件都不占用事件循环
+- 压缩：日志超过上次压缩后大小的 HGDOLL_SNAPSHOT_COMPACT_RATIO 倍时，在事件循环中对每个会话的历史列表
+  做一次浅复制（写时复制：之后的追加不影响这份快照），由写盘线程写出完整快照到临时文件，再原子替换日志
+- 恢复：启动时顺序读取日志；遇到写了一半或校验失败的帧即停止，之前的内容照常恢复
+
+日志格式：文件头 MAGIC，之后是若干帧
+
+    | op (1) | 负载长度 (4) | crc32 (4) | 负载 |
+
+    SET     key 长度 (2) | key | created_at (8, double)
+    APPEND  key 长度 (2) | key | role_id (1, 有符号) | compressed (1) | 消息 JSON 字节
+    DELETE  key 长度 (2) | key
+
+环境变量：
+    HGDOLL_SNAPSHOT_PATH            日志文件路径，为空时关闭快照（默认）；多进程模式下每个 worker 追加 .<序号>
+    HGDOLL_SNAPSHOT_INTERVAL_S      写盘间隔秒数，默认 1
+    HGDOLL_SNAPSHOT_FSYNC           1 每次写盘后 fsync，默认 0（只 flush 到操作系统）
+    HGDOLL_SNAPSHOT_COMPACT_RATIO   日志超过上次压缩后大小的多少倍时压缩，默认 2
+    HGDOLL_SNAPSHOT_COMPACT_MIN_MB  日志小于该大小时不压缩，默认 16
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import history
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PATH = os.environ.get("HGDOLL_SNAPSHOT_PATH", "")
+INTERVAL_SECONDS = float(os.environ.get("HGDOLL_SNAPSHOT_INTERVAL_S", "1"))
+FSYNC = os.environ.get("HGDOLL_SNAPSHOT_FSYNC", "0") == "1"
+COMPACT_RATIO = float(os.environ.get("HGDOLL_SNAPSHOT_COMPACT_RATIO", "2"))
+COMPACT_MIN_BYTES = int(float(os.environ.get("HGDOLL_SNAPSHOT_COMPACT_MIN_MB", "16")) * 2**20)
+
+MAGIC = b"HGDSNAP1"
+OP_SET = 1
+OP_APPEND = 2
+OP_DELETE = 3
+_FRAME = struct.Struct(">BII")
+_KEY = struct.Struct(">H")
+_CREATED = struct.Struct(">d")
+_RECORD = struct.Struct(">bB")
+
+SNAPSHOT_BYTES = metrics.counter(
+    "hgdoll_snapshot_bytes_written_total",
+    "Bytes written to the context snapshot log",
+)
+SNAPSHOT_WRITE_SECONDS = metrics.histogram(
+    "hgdoll_snapshot_write_seconds",
+    "Time the snapshot writer thread spent per batch",
+    ("kind",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+SNAPSHOT_BATCH = metrics.gauge(
+    "hgdoll_snapshot_batch_events",
+    "Context changes queued since the previous snapshot write",
+)
+SNAPSHOT_ERRORS = metrics.counter(
+    "hgdoll_snapshot_errors_total",
+    "Snapshot write failures",
+)
+
+# (key, created_at, records)
+Restored = Tuple[str, float, List[history.Record]]
+
+
+def snapshot_path(path: str = PATH) -> str:
+    """多进程模式下每个 worker 使用各自的日志文件（会话按 X-Context-Id 固定在同一个 worker 上）"""
+    worker = os.environ.get("HGDOLL_WORKER_INDEX")
+    if path and worker is not None:
+        return f"{path}.{worker}"
+    return path
+
+
+def _key(key: str) -> bytes:
+    raw = key.encode("utf-8")
+    return _KEY.pack(len(raw)) + raw
+
+
+def _frame(op: int, payload: bytes) -> bytes:
+    return _FRAME.pack(op, len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_set(key: str, created_at: float) -> bytes:
+    return _frame(OP_SET, _key(key) + _CREATED.pack(created_at))
+
+
+def encode_append(key: str, record: history.Record) -> bytes:
+    return _frame(OP_APPEND, _key(key) + _RECORD.pack(record.role_id, int(record.compressed)) + record.data)
+
+
+def encode_delete(key: str) -> bytes:
+    return _frame(OP_DELETE, _key(key))
+
+
+def iter_frames(f: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """逐帧读取；文件结尾不完整或校验失败时停止"""
+    while True:
+        head = f.read(_FRAME.size)
+        if len(head) < _FRAME.size:
+            return
+        op, length, crc = _FRAME.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning("snapshot: 日志末尾有不完整的帧，已忽略")
+            return
+        yield op, payload
+
+
+def load(path: str) -> List[Restored]:
+    """重放日志，返回仍然存在的会话"""
+    contexts: Dict[str, Tuple[float, List[history.Record]]] = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} 不是会话快照文件")
+        for op, payload in iter_frames(f):
+            (key_len,) = _KEY.unpack_from(payload)
+            offset = _KEY.size + key_len
+            key = payload[_KEY.size:offset].decode("utf-8")
+            if op == OP_SET:
+                (created_at,) = _CREATED.unpack_from(payload, offset)
+                contexts[key] = (created_at, [])
+            elif op == OP_APPEND:
+                entry = contexts.get(key)
+                if entry is None:
+                    continue
+                role_id, compressed = _RECORD.unpack_from(payload, offset)
+                entry[1].append(history.Record(role_id, payload[offset + _RECORD.size:], bool(compressed)))
+            elif op == OP_DELETE:
+                contexts.pop(key, None)
+    return [(key, created_at, records) for key, (created_at, records) in contexts.items()]
+
+
+class Journal:
+    """
+    存储层的变更日志。set / append / delete 只在事件循环线程中调用；
+    编码与写盘都在单独的写盘线程中按提交顺序执行
+    """
+
+    def __init__(self, path: str, interval: float = INTERVAL_SECONDS, fsync: bool = FSYNC):
+        self.path = path
+        self.interval = interval
+        self.fsync = fsync
+        self.size = 0
+        self.compacted_size = 0
+        self._needs_compact = False
+        self._pending: List[tuple] = []
+        self._file: Optional[BinaryIO] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="hgdoll-snapshot")
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- 事件循环线程 ----
+
+    def set(self, key: str, created_at: float, records: List[history.Record]) -> None:
+        self._pending.append((OP_SET, key, created_at))
+        for record in records:
+            self._pending.append((OP_APPEND, key, record))
+
+    def append(self, key: str, record: history.Record) -> None:
+        self._pending.append((OP_APPEND, key, record))
+
+    def delete(self, key: str) -> None:
+        self._pending.append((OP_DELETE, key))
+
+    def start(self, state_fn) -> None:
+        """启动定期写盘；state_fn 返回当前全部会话 [(key, created_at, records 浅复制)]，用于压缩"""
+        self._task = asyncio.create_task(self._run(state_fn))
+
+    async def _run(self, state_fn) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self._needs_compact or self.size >= max(COMPACT_MIN_BYTES, self.compacted_size * COMPACT_RATIO):
+                    await self.compact(state_fn(), loop)
+                else:
+                    await self.flush(loop)
+            except Exception as e:
+                # 这一批变更已从队列取出，下一轮用完整快照补齐
+                self._needs_compact = True
+                SNAPSHOT_ERRORS.inc()
+                logger.error(f"snapshot: 写入会话快照失败: {e}")
+
+    async def flush(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        events, self._pending = self._pending, []
+        SNAPSHOT_BATCH.set(len(events))
+        if events:
+            loop = loop or asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._write, events)
+
+    async def compact(self, state: List[Restored], loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """用当前全部会话重写日志；调用前尚未写盘的变更已包含在 state 中，直接丢弃"""
+        self._pending = []
+        self._needs_compact = False
+        loop = loop or asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._rewrite, state)
+
+    async def close(self, state: Optional[List[Restored]] = None) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            if state is not None:
+                await self.compact(state)
+            else:
+                await self.flush()
+        finally:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close_file)
+            self._executor.shutdown(wait=True)
+
+    # ---- 写盘线程 ----
+
+    def _open(self) -> BinaryIO:
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "ab")
+            if self._file.tell() == 0:
+                self._file.write(MAGIC)
+            self.size = self._file.tell()
+        return self._file
+
+    def _write(self, events: List[tuple]) -> None:
+        started = time.perf_counter()
+        chunks = []
+        for event in events:
+            op = event[0]
+            if op == OP_APPEND:
+                chunks.append(encode_append(event[1], event[2]))
+            elif op == OP_SET:
+                chunks.append(encode_set(event[1], event[2]))
+            else:
+                chunks.append(encode_delete(event[1]))
+        data = b"".join(chunks)
+        f = self._open()
+        f.write(data)
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        self.size += len(data)
+        SNAPSHOT_BYTES.inc(len(data))
+        SNAPSHOT_WRITE_SECONDS.observe(time.perf_counter() - started, kind="append")
+
+    def _rewrite(self, state: List[Restored]) -> None:
+        started = time.perf_counter()
+        tmp = f"{self.path}.tmp"
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            for key, created_at, records in state:
+                f.write(encode_set(key, created_at))
+                for record in records:
+                    f.write(encode_append(key, record))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        self._close_file()
+        os.replace(tmp, self.path)
+        self.size = self.compacted_size = size
+        SNAPSHOT_BYTES.inc(size)
+        SNAPSHOT_WRITE_SECONDS.observe(time.perf_counter() - started, kind="compact")
+        logger.info(f"snapshot: 已压缩会话快照 {len(state)} 个会话，{size / 2**20:.1f} MB，耗时 {time.perf_counter() - started:.2f}s")
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,107 @@
+"""
+冷启动优化：延迟导入 + 端口绑定后的后台预热 + 启动耗时指标
+
+TTS、LLM 组件和 ASR 代理依赖的 websockets 等模块不在 main.py 导入时加载，
+而是用 lazy_import 包一层：第一次调用时才导入真实对象。服务进入 ready 状态后，
+warm_up_in_background 在线程池中提前导入这些模块，因此通常第一个玩家也不必等待导入。
+
+启动各阶段耗时写入 hgdoll_startup_seconds{phase=...}：
+    imports      进程启动到 main.py 导入完成
+    app_created  进程启动到 FastAPI app 构建完成
+    ready        进程启动到 startup 事件（随后 uvicorn 绑定端口，/v1/ping 可用）
+    warm_up      后台预热完成
+
+导入耗时分析：python benchmark/import_profile.py
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Any, Iterable, Optional
+
+import metrics
+
+
+def _process_age() -> float:
+    """当前进程已运行的秒数（Linux 下读取 /proc，包含解释器自身的启动时间）"""
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="utf-8") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+STARTED_AT = time.monotonic() - _process_age()
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = metrics.gauge(
+    "hgdoll_startup_seconds",
+    "Seconds from process start to each cold-start phase",
+    ("phase",),
+)
+
+# 服务 ready 之后在后台预先导入的重量级模块
+WARM_UP_MODULES = (
+    "arkitect.core.component.llm",
+    "arkitect.core.component.tts",
+    "websockets",
+    # ASR 输入音频转换（audio_input.py）的可选依赖
+    "numpy",
+    "av",
+)
+
+
+def mark(phase: str) -> float:
+    """记录从进程启动到当前阶段的耗时"""
+    elapsed = time.monotonic() - STARTED_AT
+    STARTUP_SECONDS.set(elapsed, phase=phase)
+    return elapsed
+
+
+class lazy_import:
+    """
+    延迟导入的可调用对象：lazy_import("pkg.mod", "Name")(*args) 等价于 pkg.mod.Name(*args)，
+    但模块在第一次调用时才被导入
+    """
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+        self._target: Optional[Any] = None
+
+    def resolve(self) -> Any:
+        if self._target is None:
+            self._target = getattr(importlib.import_module(self.module), self.name)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"<lazy {self.module}.{self.name}>"
+
+
+def _import_all(modules: Iterable[str]) -> None:
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.info(f"startup: 跳过预热 {name}（未安装）: {e}")
+        except Exception as e:
+            logger.warning(f"startup: 预热导入 {name} 失败: {e}")
+
+
+async def warm_up(modules: Iterable[str] = WARM_UP_MODULES) -> None:
+    """在线程池中导入重量级模块，不阻塞事件循环"""
+    await asyncio.get_running_loop().run_in_executor(None, _import_all, tuple(modules))
+    logger.info(f"startup: 后台预热完成，耗时 {mark('warm_up'):.2f}s（自进程启动）")
+
+
+def warm_up_in_background(modules: Iterable[str] = WARM_UP_MODULES) -> asyncio.Task:
+    return asyncio.create_task(warm_up(modules), name="startup_warm_up")
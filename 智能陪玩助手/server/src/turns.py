@@ -0,0 +1,184 @@
+"""
+同一会话的对话轮次排序、取代与合并
+
+插件在上一轮对话尚未结束时可能再发起一轮（排队的用户消息、ASR 结果、重试），服务端会为同一个
+X-Context-Id 同时跑两条完整的 LLM + TTS 流水线，并且两轮的 _save_context 以任意顺序写入历史。
+这里按会话给对话轮次编号：
+
+- 取代：新的一轮开始时，同一会话中仍在进行的上一轮被标记为已取代；上一轮在等待首个 token 时
+  直接取消上游请求，已在输出时在下一个分片处停止并关闭 LLM / TTS 流，尽早归还上游并发
+- 合并：与进行中的一轮内容完全相同的请求（客户端重试、重复提交）不再调用模型，
+  而是从头重放那一轮已经输出的分片并跟随后续输出
+- 顺序保存：每一轮保存历史前先等待上一轮保存完成（最多 HGDOLL_TURN_SAVE_WAIT_S 秒），
+  被取代的一轮同样按顺序保存用户消息和已经输出的部分回复
+
+只在事件循环线程中访问，无需加锁。
+
+环境变量：
+    HGDOLL_TURN_SEQUENCING   1 开启轮次排序（默认），0 关闭
+    HGDOLL_TURN_SAVE_WAIT_S  保存历史时等待上一轮保存的最长秒数，默认 10
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Hashable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("HGDOLL_TURN_SEQUENCING", "1") == "1"
+SAVE_WAIT_SECONDS = float(os.environ.get("HGDOLL_TURN_SAVE_WAIT_S", "10"))
+MAX_CONTEXTS = 10000
+
+TURNS = metrics.counter(
+    "hgdoll_turns_total",
+    "Chat turns by outcome",
+    ("outcome",),
+)
+
+
+class Superseded(Exception):
+    """等待上游期间本轮被同一会话的新一轮取代"""
+
+
+class Turn:
+    """一轮对话：取代标记、已输出的分片（供合并的请求重放）以及保存顺序"""
+
+    def __init__(self, seq: int, key: Hashable, previous_saved: Optional[asyncio.Future]):
+        loop = asyncio.get_running_loop()
+        self.seq = seq
+        self.key = key
+        self.superseded = False
+        self.done = False
+        self.chunks: List[Any] = []
+        self.saved: asyncio.Future = loop.create_future()
+        self._previous_saved = previous_saved
+        self._changed = asyncio.Event()
+        self._cancelled = asyncio.Event()
+
+    def supersede(self) -> None:
+        self.superseded = True
+        self._cancelled.set()
+        self._notify()
+
+    async def guard(self, awaitable: Awaitable) -> Any:
+        """等待上游响应；期间被取代时取消上游请求并抛出 Superseded"""
+        task = asyncio.ensure_future(awaitable)
+        if self.superseded:
+            task.cancel()
+            raise Superseded()
+        waiter = asyncio.ensure_future(self._cancelled.wait())
+        try:
+            await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not task.done():
+                task.cancel()
+        if not task.done() or task.cancelled():
+            raise Superseded()
+        return task.result()
+
+    def publish(self, chunk: Any) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        """合并的请求：重放已输出的分片并跟随后续输出，直到本轮结束或被取代"""
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done or self.superseded:
+                return
+            await self._changed.wait()
+
+    async def save_in_order(self, save: Awaitable) -> None:
+        """等待上一轮保存完成后再保存本轮；save 为 None 时只标记本轮已保存"""
+        try:
+            if self._previous_saved is not None and not self._previous_saved.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._previous_saved), SAVE_WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning(f"[Turns] 等待第 {self.seq - 1} 轮保存超时，直接保存第 {self.seq} 轮")
+            self._previous_saved = None
+            if save is not None:
+                await save
+        finally:
+            if not self.saved.done():
+                self.saved.set_result(None)
+
+
+class _ContextTurns:
+    __slots__ = ("seq", "current", "last_saved")
+
+    def __init__(self):
+        self.seq = 0
+        self.current: Optional[Turn] = None
+        self.last_saved: Optional[asyncio.Future] = None
+
+
+class TurnSequencer:
+    """按会话分配对话轮次"""
+
+    def __init__(self, max_contexts: int = MAX_CONTEXTS, enabled: bool = ENABLED):
+        self.max_contexts = max_contexts
+        self.enabled = enabled
+        self._contexts: "OrderedDict[str, _ContextTurns]" = OrderedDict()
+
+    def begin(self, context_id: str, key: Hashable) -> Tuple[Turn, bool]:
+        """
+        开始一轮对话，返回 (turn, following)。following 为 True 表示与进行中的一轮相同，
+        调用方只需跟随 turn.follow() 的输出，不要调用模型，也不要保存历史
+        """
+        if not self.enabled:
+            return Turn(0, key, None), False
+        state = self._contexts.get(context_id)
+        if state is None:
+            state = self._contexts[context_id] = _ContextTurns()
+            while len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+        else:
+            self._contexts.move_to_end(context_id)
+        current = state.current
+        if current is not None and not current.done:
+            if current.key == key and not current.superseded:
+                TURNS.inc(outcome="coalesced")
+                return current, True
+            if not current.superseded:
+                current.supersede()
+                TURNS.inc(outcome="superseded")
+        state.seq += 1
+        turn = Turn(state.seq, key, state.last_saved)
+        state.current = turn
+        state.last_saved = turn.saved
+        return turn, False
+
+    def end(self, context_id: str, turn: Turn) -> None:
+        turn.finish()
+        if not turn.superseded:
+            TURNS.inc(outcome="completed")
+        state = self._contexts.get(context_id)
+        if state is not None and state.current is turn:
+            state.current = None
+
+
+_sequencer: Optional[TurnSequencer] = None
+
+
+def get_sequencer() -> TurnSequencer:
+    global _sequencer
+    if _sequencer is None:
+        _sequencer = TurnSequencer()
+    return _sequencer
@@ -10,22 +10,41 @@
 # limitations under the License. 
 
 import asyncio
+import bisect
 import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 from arkitect.types.llm.model import ArkMessage
 from arkitect.utils.common import Singleton
 
+import history as history_records
+
 STATE_IDLE = 0
 STATE_PENDING_FOR_RESPONSE = 1
 
 
+def message_size(message: ArkMessage) -> int:
+    """消息内容的 UTF-8 字节数（用于状态统计）"""
+    content = message.content
+    if isinstance(content, str):
+        return len(content.encode("utf-8"))
+    return 0
+
+
+def to_message(record: history_records.Record) -> ArkMessage:
+    """组装请求时才把紧凑记录转换为 ArkMessage"""
+    return ArkMessage(**record.to_dict())
+
+
 class Context:
     def __init__(self):
+        # history_records.Record 列表；CoroutineSafeMap.set 也接受 ArkMessage，写入时统一转换
         self.history = []
         self.state = STATE_IDLE
         self.expire_at = time.time() + 600
+        self.created_at = time.time()
+        self.content_bytes = 0
 
 
 class Storage(ABC):
@@ -44,6 +63,11 @@ class Storage(ABC):
     async def contains(cls, key: str) -> bool:
         pass
 
+    @classmethod
+    async def get_records(cls, key: str) -> List[history_records.Record]:
+        """紧凑历史记录；直接保存 ArkMessage 的存储实现每次现转"""
+        return [history_records.Record.from_message(m) for m in await cls.get_history(key)]
+
     @classmethod
     @abstractmethod
     async def set(cls, key: str, value: Context) -> None:
@@ -58,6 +82,12 @@ class Storage(ABC):
 class CoroutineSafeMap(Storage, Singleton):
     _lock = asyncio.Lock()
     _map: Dict[str, Context] = {}
+    # 增量维护的聚合计数与有序 key 索引，供 /debug/status 无锁读取和游标分页
+    _total_messages = 0
+    _total_bytes = 0
+    _sorted_keys: List[str] = []
+    # 变更日志（snapshot.Journal），开启会话快照时由 main 设置
+    journal = None
 
     def __init__(self):
         asyncio.create_task(self.cleanup())
@@ -69,6 +99,11 @@ class CoroutineSafeMap(Storage, Singleton):
 
     @classmethod
     async def get_history(cls, key: str) -> List[ArkMessage]:
+        return [to_message(r) for r in await cls.get_records(key)]
+
+    @classmethod
+    async def get_records(cls, key: str) -> List[history_records.Record]:
+        """会话历史的紧凑记录（只追加，调用方不要修改）"""
         async with cls._lock:
             ctx = cls._map.get(key)
             if ctx is None:
@@ -93,21 +128,45 @@ class CoroutineSafeMap(Storage, Singleton):
     @classmethod
     async def set(cls, key: str, value: Context) -> None:
         async with cls._lock:
+            if key in cls._map:
+                cls._forget(key)
+            else:
+                bisect.insort(cls._sorted_keys, key)
+            value.content_bytes = sum(message_size(m) for m in value.history)
+            value.history = [
+                m if isinstance(m, history_records.Record) else history_records.Record.from_message(m)
+                for m in value.history
+            ]
+            history_records.compress_cold(value.history, backlog=True)
+            if cls.journal is not None:
+                cls.journal.set(key, value.created_at, value.history)
             cls._map[key] = value
+            cls._total_messages += len(value.history)
+            cls._total_bytes += value.content_bytes
 
     @classmethod
     async def append(cls, key: str, value: ArkMessage) -> None:
+        # 在锁外序列化，不阻塞其他会话的读写
+        record = history_records.Record.from_message(value)
+        size = message_size(value)
         async with cls._lock:
             if key not in cls._map:
                 return
-            cls._map[key].history.append(value)
-            cls._map[key].expire_at = time.time() + 600
+            ctx = cls._map[key]
+            ctx.history.append(record)
+            history_records.compress_cold(ctx.history)
+            if cls.journal is not None:
+                cls.journal.append(key, record)
+            ctx.content_bytes += size
+            ctx.expire_at = time.time() + 600
+            cls._total_messages += 1
+            cls._total_bytes += size
 
     @classmethod
     async def delete(cls, key: str):
         async with cls._lock:
             if key in cls._map:
-                del cls._map[key]
+                cls._remove(key)
 
     @classmethod
     async def contains(cls, key: str) -> bool:
@@ -128,6 +187,71 @@ class CoroutineSafeMap(Storage, Singleton):
     async def clear(cls) -> None:
         async with cls._lock:
             cls._map.clear()
+            cls._sorted_keys.clear()
+            cls._total_messages = 0
+            cls._total_bytes = 0
+
+    @classmethod
+    def _forget(cls, key: str) -> None:
+        """从聚合计数中扣除 key 对应的上下文（调用方需持有锁）"""
+        ctx = cls._map[key]
+        cls._total_messages -= len(ctx.history)
+        cls._total_bytes -= ctx.content_bytes
+
+    @classmethod
+    def _remove(cls, key: str) -> None:
+        """删除 key 并同步聚合计数与有序索引（调用方需持有锁）"""
+        cls._forget(key)
+        del cls._map[key]
+        if cls.journal is not None:
+            cls.journal.delete(key)
+        index = bisect.bisect_left(cls._sorted_keys, key)
+        if index < len(cls._sorted_keys) and cls._sorted_keys[index] == key:
+            del cls._sorted_keys[index]
+
+    # 以下只读方法不获取锁：它们不包含 await，在单线程事件循环中天然是原子的，
+    # 监控抓取不会与聊天请求争抢存储锁。
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """O(1) 聚合统计"""
+        return {
+            "active_contexts": len(cls._map),
+            "total_messages": cls._total_messages,
+            "total_bytes": cls._total_bytes,
+        }
+
+    @classmethod
+    def peek(cls, key: str) -> Optional[Context]:
+        """不加锁读取单个上下文"""
+        return cls._map.get(key)
+
+    @classmethod
+    def snapshot_state(cls) -> List[Tuple[str, float, list]]:
+        """全部会话的 (key, created_at, 历史记录浅复制)，供快照线程在锁外读取"""
+        return [(key, ctx.created_at, list(ctx.history)) for key, ctx in cls._map.items()]
+
+    @classmethod
+    async def restore(cls, entries) -> int:
+        """启动时从快照恢复会话，返回恢复的会话数；已存在的会话不覆盖"""
+        restored = 0
+        for key, created_at, records in entries:
+            if key in cls._map:
+                continue
+            ctx = Context()
+            ctx.created_at = created_at
+            ctx.history = records
+            await cls.set(key, ctx)
+            restored += 1
+        return restored
+
+    @classmethod
+    def page(cls, cursor: str = "", limit: int = 20) -> Tuple[List[str], Optional[str]]:
+        """按 key 字典序游标分页，返回 (本页 keys, 下一页游标)"""
+        start = bisect.bisect_right(cls._sorted_keys, cursor) if cursor else 0
+        keys = cls._sorted_keys[start:start + limit]
+        has_more = start + limit < len(cls._sorted_keys)
+        return keys, (keys[-1] if keys and has_more else None)
 
     @classmethod
     async def cleanup(cls) -> None:
@@ -141,4 +265,4 @@ class CoroutineSafeMap(Storage, Singleton):
                     if current_time > entry.expire_at
                 ]
                 for key in keys_to_delete:
-                    del cls._map[key]
+                    cls._remove(key)
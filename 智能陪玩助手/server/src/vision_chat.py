@@ -0,0 +1,162 @@
+"""
+带画面的对话轮次：单次流式 VLM 调用
+
+原先只有「首个文本为空」的消息才被当作截图：截图在后台交给 VLM 生成描述写入历史，之后用户针对
+当前画面的提问走纯文本 LLM，读到的是可能已经过时的画面描述；文字与图片一起发来时图片被直接丢弃。
+这里为每一轮对话选择路径：
+
+- vision：本轮消息自带图片（可以多张，reason=fresh），或该会话最近一帧截图不超过
+  HGDOLL_VISION_CHAT_FRAME_AGE_S 秒（reason=recent）时，用一次流式 VLM 调用
+  （人设提示词 + 窗口内历史 + 本轮文字与图片）直接回答
+- two_hop：关闭本功能时自带图片的一轮先等 VLM 生成画面描述写入历史，再调用 LLM（作为时延对照）
+- text：没有可用画面，走原来的纯文本 LLM
+
+截图请求即使被 cadence / admission 丢弃不做分析，也会记为该会话的最近一帧。缓存只保留
+HGDOLL_VISION_CHAT_FRAME_AGE_S 秒内的帧，内存随活跃会话数而不是总会话数增长。
+
+只在事件循环线程中访问，无需加锁。
+
+环境变量：
+    HGDOLL_VISION_CHAT              1 开启（默认），0 关闭
+    HGDOLL_VISION_CHAT_FRAME_AGE_S  最近一帧截图在多少秒内视为当前画面，默认 5
+    HGDOLL_VISION_CHAT_MAX_IMAGES   单次调用最多附带的图片数（保留最后几张），默认 4
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import metrics
+
+ENABLED = os.environ.get("HGDOLL_VISION_CHAT", "1") != "0"
+FRAME_MAX_AGE = float(os.environ.get("HGDOLL_VISION_CHAT_FRAME_AGE_S", "5"))
+MAX_IMAGES = int(os.environ.get("HGDOLL_VISION_CHAT_MAX_IMAGES", "4"))
+MAX_CONTEXTS = 10000
+
+VISION = "vision"
+TWO_HOP = "two_hop"
+TEXT = "text"
+
+CHAT_ROUTES = metrics.counter(
+    "hgdoll_chat_route_total",
+    "Chat turns by model path and the reason it was chosen",
+    ("path", "reason"),
+)
+FIRST_TOKEN_SECONDS = metrics.histogram(
+    "hgdoll_chat_first_token_seconds",
+    "Time from starting the model call(s) of a chat turn to its first token, per path",
+    ("path",),
+)
+CHAT_IMAGES = metrics.histogram(
+    "hgdoll_vision_chat_images",
+    "Images attached to a single VLM chat call",
+    buckets=(1, 2, 3, 4, 6, 8),
+)
+
+
+class Route(NamedTuple):
+    path: str
+    reason: str
+    images: List[dict]
+
+
+def _part_type(part) -> str:
+    if isinstance(part, dict):
+        return part.get("type", "")
+    return getattr(part, "type", "") or ""
+
+
+def _as_dict(part) -> dict:
+    if isinstance(part, dict):
+        return part
+    return part.model_dump(exclude_none=True)
+
+
+def split_content(content) -> Tuple[str, List[dict]]:
+    """拆分一条消息的内容：返回拼接后的文字与全部图片（保持原顺序），兼容 dict 与 pydantic 对象"""
+    if content is None:
+        return "", []
+    if isinstance(content, str):
+        return content, []
+    texts, images = [], []
+    for part in content:
+        kind = _part_type(part)
+        if kind == "text":
+            texts.append(part.get("text", "") if isinstance(part, dict) else getattr(part, "text", ""))
+        elif kind == "image_url":
+            images.append(_as_dict(part))
+    return "".join(texts), images
+
+
+def user_content(text: str, images: List[dict]) -> List[dict]:
+    """VLM 调用中本轮的 user 消息：先图片后文字，图片只保留最后 MAX_IMAGES 张"""
+    images = images[-MAX_IMAGES:] if MAX_IMAGES > 0 else []
+    CHAT_IMAGES.observe(len(images))
+    return [*images, {"type": "text", "text": text}]
+
+
+class FrameCache:
+    """每个会话最近一帧截图的图片；超过 max_age 的帧在写入时顺带清理"""
+
+    def __init__(self, max_age: float = FRAME_MAX_AGE, max_contexts: int = MAX_CONTEXTS):
+        self.max_age = max_age
+        self.max_contexts = max_contexts
+        self._frames: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+
+    def remember(self, context_id: str, images: List[dict], now: Optional[float] = None) -> None:
+        if not images:
+            return
+        now = time.monotonic() if now is None else now
+        self._frames.pop(context_id, None)
+        self._frames[context_id] = (now, images)
+        # 按写入先后排列，最旧的在前
+        while self._frames:
+            oldest, (at, _) = next(iter(self._frames.items()))
+            if now - at <= self.max_age and len(self._frames) <= self.max_contexts:
+                break
+            del self._frames[oldest]
+
+    def recent(self, context_id: str, now: Optional[float] = None) -> Optional[List[dict]]:
+        """该会话 max_age 秒内的最近一帧；没有时返回 None"""
+        entry = self._frames.get(context_id)
+        if entry is None:
+            return None
+        now = time.monotonic() if now is None else now
+        if now - entry[0] > self.max_age:
+            del self._frames[context_id]
+            return None
+        return entry[1]
+
+    def forget(self, context_id: str) -> None:
+        self._frames.pop(context_id, None)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+def route(context_id: str, images: List[dict], enabled: Optional[bool] = None,
+          now: Optional[float] = None) -> Route:
+    """为一轮对话选择模型路径并计数；images 为本轮消息自带的图片"""
+    enabled = ENABLED if enabled is None else enabled
+    if images:
+        # 自带的图片同时作为该会话的最近一帧，紧随其后的追问也能看到
+        get_frames().remember(context_id, images, now)
+        result = Route(VISION if enabled else TWO_HOP, "fresh", images)
+    elif enabled and MAX_IMAGES > 0:
+        frame = get_frames().recent(context_id, now)
+        result = Route(VISION, "recent", frame) if frame else Route(TEXT, "no_frame", [])
+    else:
+        result = Route(TEXT, "disabled", [])
+    CHAT_ROUTES.inc(path=result.path, reason=result.reason)
+    return result
+
+
+_frames: Optional[FrameCache] = None
+
+
+def get_frames() -> FrameCache:
+    global _frames
+    if _frames is None:
+        _frames = FrameCache()
+    return _frames
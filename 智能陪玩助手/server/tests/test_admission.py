@@ -0,0 +1,141 @@
+"""
+HGDoll 准入控制测试
+测试全局/会话并发预算、先降级再拒绝的顺序，以及中间件返回的 429/503
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import admission
+import cadence
+
+
+class TestAdmissionController:
+    """并发预算"""
+
+    def test_global_limit_returns_503(self):
+        controller = admission.AdmissionController(max_in_flight=2, max_per_context=10)
+        controller.acquire("a")
+        controller.acquire("b")
+        before = admission.ADMISSION_REJECTED.value(reason="global")
+        with pytest.raises(admission.Rejected) as err:
+            controller.acquire("c")
+        assert err.value.status == 503
+        assert err.value.retry_after == admission.RETRY_AFTER_SECONDS
+        assert admission.ADMISSION_REJECTED.value(reason="global") == before + 1
+
+    def test_per_context_limit_returns_429(self):
+        controller = admission.AdmissionController(max_in_flight=10, max_per_context=2)
+        controller.acquire("a")
+        controller.acquire("a")
+        with pytest.raises(admission.Rejected) as err:
+            controller.acquire("a")
+        assert err.value.status == 429
+        controller.acquire("b")
+
+    def test_release_frees_budget(self):
+        controller = admission.AdmissionController(max_in_flight=1, max_per_context=1)
+        controller.acquire("a")
+        controller.release("a")
+        controller.acquire("a")
+        assert controller.in_flight == 1
+        controller.release("a")
+        assert controller.in_flight == 0
+        assert controller._per_context == {}
+
+    def test_requests_without_context_only_use_global_budget(self):
+        controller = admission.AdmissionController(max_in_flight=3, max_per_context=1)
+        controller.acquire(None)
+        controller.acquire(None)
+        controller.release(None)
+        assert controller.in_flight == 1
+
+    def test_frames_shed_before_rejecting(self, monkeypatch):
+        monkeypatch.setattr(admission, "FRAME_SHED_RATIO", 0.5)
+        controller = admission.AdmissionController(max_in_flight=4, max_per_context=10)
+        controller.acquire("a")
+        assert not controller.shed_frame()
+        controller.acquire("b")
+        assert controller.shed_frame()
+        # 截图被丢弃时对话仍然可以进入
+        controller.acquire("c")
+
+    def test_chat_degrades_to_text_only(self):
+        controller = admission.AdmissionController(tts_max_streams=1)
+        before = admission.DEGRADED.value(action="text_only")
+        assert controller.start_chat()
+        assert not controller.start_chat()
+        assert admission.DEGRADED.value(action="text_only") == before + 1
+        controller.end_chat(True)
+        controller.end_chat(False)
+        assert (controller.tts_streams, controller.text_streams) == (0, 0)
+        assert controller.start_chat()
+
+
+class TestAdmissionMiddleware:
+    """中间件"""
+
+    def _run(self, middleware, path=cadence.CHAT_PATH, headers=((b"x-context-id", b"ctx"),)):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(middleware({"type": "http", "path": path, "headers": list(headers)}, None, send))
+        return sent
+
+    def _app(self, seen):
+        async def app(scope, receive, send):
+            seen.append(scope["path"])
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        return app
+
+    def test_admitted_request_releases_slot(self):
+        seen = []
+        controller = admission.AdmissionController(max_in_flight=1)
+        sent = self._run(admission.AdmissionMiddleware(self._app(seen), controller))
+        assert sent[0]["status"] == 200
+        assert seen == [cadence.CHAT_PATH]
+        assert controller.in_flight == 0
+
+    def test_rejected_request_never_reaches_app(self):
+        seen = []
+        controller = admission.AdmissionController(max_in_flight=1)
+        controller.acquire("other")
+        sent = self._run(admission.AdmissionMiddleware(self._app(seen), controller))
+        assert seen == []
+        assert sent[0]["status"] == 503
+        headers = dict(sent[0]["headers"])
+        assert headers[b"retry-after"] == str(admission.RETRY_AFTER_SECONDS).encode()
+        assert json.loads(sent[1]["body"])["error"]["code"] == "ServerOverloaded"
+
+    def test_per_context_rejection(self):
+        controller = admission.AdmissionController(max_in_flight=10, max_per_context=1)
+        controller.acquire("ctx")
+        sent = self._run(admission.AdmissionMiddleware(self._app([]), controller))
+        assert sent[0]["status"] == 429
+        assert dict(sent[0]["headers"])[b"retry-after"] == b"1"
+
+    def test_other_paths_not_counted(self):
+        seen = []
+        controller = admission.AdmissionController(max_in_flight=0)
+        sent = self._run(admission.AdmissionMiddleware(self._app(seen), controller), path="/metrics")
+        assert sent[0]["status"] == 200
+        assert seen == ["/metrics"]
+
+    def test_slot_released_when_app_fails(self):
+        async def app(scope, receive, send):
+            raise RuntimeError("boom")
+
+        controller = admission.AdmissionController(max_in_flight=1)
+        with pytest.raises(RuntimeError):
+            self._run(admission.AdmissionMiddleware(app, controller))
+        assert controller.in_flight == 0
@@ -0,0 +1,85 @@
+"""
+HGDoll ASR 识别参数测试
+测试 Profile 的选择与校验、初始化消息缓存，以及出结果耗时统计
+"""
+
+import array
+import gzip
+import json
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import asr
+
+
+def payload(message):
+    size = struct.unpack(">I", message[8:12])[0]
+    return json.loads(gzip.decompress(message[12:12 + size]))
+
+
+def pcm(level, samples=320):
+    return array.array("h", [level, -level] * (samples // 2)).tobytes()
+
+
+class TestProfiles:
+    """识别参数"""
+
+    def test_default_profile(self):
+        assert asr.resolve_profile() == asr.DEFAULT_PROFILE
+        assert asr.init_payload(asr.PROFILES["default"]) == asr.INIT_PAYLOAD
+
+    def test_preset_and_overrides(self):
+        profile = asr.resolve_profile("fast", result_type="full")
+        assert (profile.name, profile.end_window_size, profile.result_type) == ("fast", 300, "full")
+        assert asr.resolve_profile(end_window_size="440").end_window_size == 400
+
+    @pytest.mark.parametrize("kwargs", [
+        {"name": "nope"},
+        {"end_window_size": "abc"},
+        {"end_window_size": 50},
+        {"end_window_size": 5000},
+        {"result_type": "partial"},
+        {"audio_format": "flac"},
+    ])
+    def test_invalid_choices(self, kwargs):
+        with pytest.raises(ValueError):
+            asr.resolve_profile(**kwargs)
+
+    def test_init_message_reflects_profile(self):
+        request = payload(asr.init_message(1, asr.resolve_profile("fast")))["request"]
+        assert request["end_window_size"] == 300
+        assert request["model_name"] == "bigmodel"
+
+    def test_init_message_cached(self):
+        profile = asr.resolve_profile("patient")
+        assert asr.init_message(1, profile) is asr.init_message(1, profile)
+        assert asr.init_message(1, profile) is not asr.init_message(1, asr.PROFILES["default"])
+
+
+class TestFinalization:
+    """出结果耗时"""
+
+    def test_voice_detection(self):
+        assert asr.is_voiced(pcm(5000))
+        assert not asr.is_voiced(pcm(10))
+        assert not asr.is_voiced(b"")
+
+    def test_observes_after_voiced_audio(self):
+        profile = asr.resolve_profile("fast")
+        timer = asr.FinalizationTimer(profile)
+        labels = {"profile": "fast", "end_window_ms": "300"}
+        before = asr.ASR_FINALIZATION.count(**labels)
+        timer.on_result({"text": "你好", "is_final": True})
+        timer.on_audio(pcm(5000))
+        timer.on_audio(pcm(10))
+        timer.on_result({"text": "你", "is_final": False})
+        timer.on_result({"text": "你好", "is_final": True})
+        # 同一段语音只统计一次
+        timer.on_result({"text": "你好", "is_final": True})
+        assert asr.ASR_FINALIZATION.count(**labels) == before + 1
+        assert asr.ASR_SESSIONS.value(**labels) >= 1
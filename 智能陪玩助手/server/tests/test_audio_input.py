@@ -0,0 +1,141 @@
+"""
+HGDoll ASR 输入音频转换测试
+测试格式协商、多相重采样的精度与分包一致性、多声道混音，以及 WebM/Opus 的增量解码
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import audio_input
+
+
+def sine(freq, rate, seconds=1.0, amplitude=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def decode(pcm):
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+
+class TestNegotiate:
+    """格式协商"""
+
+    def test_defaults_to_passthrough(self):
+        fmt = audio_input.negotiate()
+        assert fmt.passthrough
+        assert audio_input.negotiate("pcm16", "16000", "1").passthrough
+
+    def test_native_formats(self):
+        assert audio_input.negotiate("f32", "48000") == audio_input.InputFormat("f32", 48000, 1)
+        assert audio_input.negotiate("pcm16", 44100, 2) == audio_input.InputFormat("pcm16", 44100, 2)
+
+    def test_webm_rate_is_opus_rate(self):
+        if audio_input.load_av() is None:
+            pytest.skip("未安装 PyAV")
+        assert audio_input.negotiate("webm", "16000").rate == audio_input.OPUS_RATE
+
+    @pytest.mark.parametrize("args", [("flac",), ("f32", "abc"), ("f32", "1000"), ("f32", "48000", "0")])
+    def test_invalid(self, args):
+        with pytest.raises(ValueError):
+            audio_input.negotiate(*args)
+
+
+class TestResampler:
+    """多相重采样"""
+
+    @pytest.mark.parametrize("rate", [48000, 44100, 22050])
+    def test_tone_preserved(self, rate):
+        resampler = audio_input.PolyphaseResampler(rate)
+        out = resampler.process(sine(1000, rate))
+        assert len(out) == 16000
+        delay = (resampler.up * resampler.taps - 1) / 2 / resampler.down
+        t = (np.arange(len(out)) - delay) / 16000
+        expected = 0.5 * np.sin(2 * np.pi * 1000 * t)
+        assert np.abs(out[200:-200] - expected[200:-200]).max() < 1e-3
+
+    def test_aliasing_suppressed(self):
+        out = audio_input.PolyphaseResampler(48000).process(sine(12000, 48000))
+        assert np.abs(out[500:]).max() < 0.05
+
+    def test_chunked_matches_whole(self):
+        x = sine(440, 44100)
+        whole = audio_input.PolyphaseResampler(44100).process(x)
+        resampler = audio_input.PolyphaseResampler(44100)
+        chunked = np.concatenate([resampler.process(x[i:i + 1234]) for i in range(0, len(x), 1234)])
+        np.testing.assert_allclose(chunked, whole, atol=1e-6)
+
+
+class TestConverter:
+    """转换器"""
+
+    def test_passthrough_returns_input(self):
+        converter = audio_input.AudioConverter(audio_input.negotiate())
+        assert converter.convert_sync(b"\x01\x02") == b"\x01\x02"
+
+    def test_stereo_f32_split_mid_sample(self):
+        x = sine(500, 48000, 0.5)
+        stereo = np.stack([x, x], axis=1).reshape(-1).astype("<f4").tobytes()
+        converter = audio_input.AudioConverter(audio_input.negotiate("f32", 48000, 2))
+        # 分包边界落在采样中间
+        pcm = b"".join(converter.convert_sync(stereo[i:i + 1001]) for i in range(0, len(stereo), 1001))
+        out = decode(pcm)
+        assert abs(len(out) - 8000) <= 1
+        assert 0.45 < np.abs(out[500:-500]).max() < 0.55
+
+    def test_pcm16_resampled(self):
+        pcm = audio_input.to_pcm16(sine(300, 44100))
+        converter = audio_input.AudioConverter(audio_input.negotiate("pcm16", 44100))
+        assert len(decode(converter.convert_sync(pcm))) == 16000
+
+    def test_async_convert_uses_pool(self):
+        import asyncio
+
+        converter = audio_input.AudioConverter(audio_input.negotiate("f32", 48000))
+        pcm = asyncio.run(converter.convert(sine(300, 48000, 0.1).astype("<f4").tobytes()))
+        assert len(decode(pcm)) == 1600
+
+
+class TestWebm:
+    """WebM/Opus"""
+
+    def _encode(self, samples):
+        av = pytest.importorskip("av")
+        buffer = io.BytesIO()
+        container = av.open(buffer, "w", format="webm")
+        stream = container.add_stream("libopus", rate=48000)
+        stream.layout = "mono"
+        for i in range(0, len(samples), 960):
+            frame = av.AudioFrame.from_ndarray(samples[None, i:i + 960], format="flt", layout="mono")
+            frame.sample_rate = 48000
+            frame.pts = i
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+        container.close()
+        return buffer.getvalue()
+
+    def test_incremental_decode(self):
+        data = self._encode(sine(440, 48000, amplitude=0.3))
+        converter = audio_input.AudioConverter(audio_input.negotiate("webm"))
+        pcm = b"".join(converter.convert_sync(data[i:i + 700]) for i in range(0, len(data), 700))
+        out = decode(pcm)
+        assert 15000 < len(out) < 17000
+        assert 0.25 < np.abs(out[4000:12000]).max() < 0.35
+
+    def test_demuxer_waits_for_complete_block(self):
+        data = self._encode(sine(440, 48000, 0.2))
+        demuxer = audio_input.WebmDemuxer()
+        frames = []
+        for b in data:
+            frames += demuxer.feed(bytes([b]))
+        whole = audio_input.WebmDemuxer().feed(data)
+        assert frames == whole and len(whole) > 0
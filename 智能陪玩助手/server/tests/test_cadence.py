@@ -0,0 +1,157 @@
+"""
+HGDoll 自适应截图节奏测试
+测试丢帧削峰、建议间隔随负载/画面变化/活跃度的调整，以及响应头注入
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import cadence
+
+
+class TestCadenceController:
+    """截图节奏控制"""
+
+    def test_same_session_frame_shed_while_in_flight(self):
+        controller = cadence.CadenceController()
+        assert controller.admit_frame("ctx")
+        assert not controller.admit_frame("ctx")
+        assert controller.admit_frame("other")
+        controller.frame_done("ctx", "画面一")
+        assert controller.admit_frame("ctx")
+        assert controller.in_flight == 2
+
+    def test_global_limit_sheds(self, monkeypatch):
+        monkeypatch.setattr(cadence, "MAX_IN_FLIGHT", 2)
+        controller = cadence.CadenceController()
+        assert controller.admit_frame("a")
+        assert controller.admit_frame("b")
+        before = cadence.FRAMES_SHED.value(reason="overloaded")
+        assert not controller.admit_frame("c")
+        assert cadence.FRAMES_SHED.value(reason="overloaded") == before + 1
+
+    def test_failed_frame_releases_slot(self):
+        controller = cadence.CadenceController()
+        assert controller.admit_frame("ctx")
+        controller.frame_done("ctx", None)
+        assert controller.in_flight == 0
+        assert controller.admit_frame("ctx")
+
+    def test_eviction_keeps_in_flight_session(self, monkeypatch):
+        monkeypatch.setattr(cadence, "MAX_TRACKED", 2)
+        controller = cadence.CadenceController()
+        assert controller.admit_frame("busy")
+        controller.touch_chat("idle")
+        controller.touch_chat("new")
+        # 最久未使用的 busy 正在分析，淘汰的是 idle
+        assert "busy" in controller._sessions and "idle" not in controller._sessions
+        controller.frame_done("busy", "画面")
+        assert controller.in_flight == 0
+
+    def test_eviction_of_all_in_flight_releases_slots(self, monkeypatch):
+        monkeypatch.setattr(cadence, "MAX_TRACKED", 2)
+        controller = cadence.CadenceController()
+        for key in ("a", "b", "c"):
+            assert controller.admit_frame(key)
+        assert "a" not in controller._sessions
+        controller.frame_done("a", None)
+        controller.frame_done("b", None)
+        controller.frame_done("c", None)
+        assert controller.in_flight == 0
+
+    def test_slot_released_when_task_cancelled_before_start(self):
+        controller = cadence.CadenceController()
+        finished = []
+
+        async def analysis(slot):
+            try:
+                await asyncio.sleep(1)
+            finally:
+                finished.append(True)
+                slot.finish("画面")
+
+        async def scenario():
+            assert controller.admit_frame("ctx")
+            slot = cadence.FrameSlot(controller, "ctx")
+            task = asyncio.create_task(analysis(slot))
+            task.add_done_callback(slot.release)
+            # 任务还没开始执行就被取消：协程的 finally 不会运行
+            task.cancel()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return task
+
+        task = asyncio.run(scenario())
+        assert task.cancelled() and not finished
+        assert controller.in_flight == 0
+        assert controller.admit_frame("ctx")
+
+    def test_slot_released_once(self):
+        controller = cadence.CadenceController()
+        assert controller.admit_frame("ctx")
+        slot = cadence.FrameSlot(controller, "ctx")
+        assert slot.finish("画面") == 1.0
+        # 同一会话的下一帧已占用名额，上一帧的兜底释放不能放掉它
+        assert controller.admit_frame("ctx")
+        slot.release()
+        assert controller.in_flight == 1
+        assert not controller.admit_frame("ctx")
+
+    def test_static_scene_slows_down(self):
+        controller = cadence.CadenceController()
+        initial = controller.next_delay_ms("ctx")
+        for _ in range(10):
+            controller.admit_frame("ctx")
+            controller.frame_done("ctx", "斗地主出牌界面，玩家是地主")
+        assert controller.next_delay_ms("ctx") > initial
+        assert controller.next_delay_ms("ctx") <= cadence.MAX_MS
+
+    def test_given_novelty_skips_text_comparison(self):
+        controller = cadence.CadenceController()
+        controller.admit_frame("ctx")
+        assert controller.frame_done("ctx", '{"game": "斗地主"}', novelty=1.0) == 1.0
+        controller.admit_frame("ctx")
+        # 文本完全不同，但调用方给出的结构化差异度为 0
+        assert controller.frame_done("ctx", '{"phase": "出牌"}', novelty=0.0) == 0.0
+        assert controller._session("ctx").change_rate < 1.0
+
+    def test_load_slows_down_and_chat_speeds_up(self, monkeypatch):
+        monkeypatch.setattr(cadence, "TARGET_IN_FLIGHT", 2)
+        controller = cadence.CadenceController()
+        idle = controller.next_delay_ms("ctx")
+        for i in range(6):
+            controller.admit_frame(f"busy-{i}")
+        loaded = controller.next_delay_ms("ctx")
+        assert loaded > idle
+        controller.touch_chat("ctx")
+        assert controller.next_delay_ms("ctx") < loaded
+
+
+class TestCadenceMiddleware:
+    """响应头注入"""
+
+    def _run(self, path, headers):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = cadence.CadenceMiddleware(app, cadence.CadenceController())
+        scope = {"type": "http", "path": path, "headers": headers}
+        asyncio.run(middleware(scope, None, send))
+        return dict(sent[0]["headers"])
+
+    def test_header_added_for_chat_path(self):
+        headers = self._run(cadence.CHAT_PATH, [(b"x-context-id", b"ctx")])
+        assert int(headers[b"x-next-capture-delay-ms"]) == cadence.BASE_MS
+
+    def test_other_paths_untouched(self):
+        assert self._run("/v1/ping", [(b"x-context-id", b"ctx")]) == {}
+        assert self._run(cadence.CHAT_PATH, []) == {}
@@ -0,0 +1,263 @@
+"""
+HGDoll 断开取消测试
+测试客户端断开后中间件取消请求处理、上游流在读取中途被关闭、后台画面分析的取消以及节省量估算
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import cadence
+import cancellation
+
+
+def chunk(content=None, usage=None):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else [],
+        usage=usage,
+    )
+
+
+@pytest.fixture(autouse=True)
+def reset_averages(monkeypatch):
+    monkeypatch.setattr(cancellation, "_tokens", {})
+    monkeypatch.setattr(cancellation, "_chars", cancellation._Average())
+
+
+class TestUpstreamStream:
+    """上游流"""
+
+    def test_passes_items_and_counts(self):
+        async def source():
+            yield chunk("你好")
+            yield chunk("呀")
+            yield chunk(usage=SimpleNamespace(completion_tokens=5))
+
+        async def scenario():
+            stream = cancellation.UpstreamStream(source())
+            items = [item async for item in stream]
+            await stream.aclose()
+            return items, stream
+
+        items, stream = asyncio.run(scenario())
+        assert len(items) == 3
+        assert stream.finished
+        assert (stream.tokens, stream.chars) == (5, 3)
+
+    def test_aclose_cancels_pending_upstream_read(self):
+        closed = []
+
+        async def source():
+            try:
+                yield chunk("一")
+                await asyncio.sleep(10)
+                yield chunk("二")
+            finally:
+                closed.append(True)
+
+        async def scenario():
+            stream = cancellation.UpstreamStream(source())
+            first = await stream.__anext__()
+            started = asyncio.get_running_loop().time()
+            await stream.aclose()
+            return first, asyncio.get_running_loop().time() - started, stream
+
+        first, elapsed, stream = asyncio.run(scenario())
+        assert first.choices[0].delta.content == "一"
+        assert closed == [True]
+        assert elapsed < 0.1
+        assert not stream.finished
+
+    def test_waiting_consumer_ends_on_close(self):
+        async def source():
+            await asyncio.sleep(10)
+            yield chunk("x")
+
+        async def scenario():
+            stream = cancellation.UpstreamStream(source())
+
+            async def consume():
+                async for _ in stream:
+                    pass
+
+            consumer = asyncio.create_task(consume())
+            await asyncio.sleep(0)
+            await stream.aclose()
+            await asyncio.wait_for(asyncio.wait([consumer]), 1)
+            return consumer
+
+        consumer = asyncio.run(scenario())
+        assert consumer.cancelled()
+
+    def test_upstream_error_reaches_consumer(self):
+        async def source():
+            yield chunk("x")
+            raise RuntimeError("upstream")
+
+        async def scenario():
+            stream = cancellation.UpstreamStream(source())
+            try:
+                return [item async for item in stream]
+            finally:
+                await stream.aclose()
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(scenario())
+
+
+class TestSavings:
+    """节省量估算"""
+
+    def test_no_savings_without_baseline(self):
+        before = cancellation.SAVED_TOKENS.value(stream="llm")
+        cancellation.record_interrupted("llm", "disconnect", tokens=3)
+        assert cancellation.SAVED_TOKENS.value(stream="llm") == before
+
+    def test_tokens_and_audio_saved(self):
+        cancellation.record_completed("llm", tokens=100, chars=90)
+        tokens = cancellation.SAVED_TOKENS.value(stream="llm")
+        audio = cancellation.SAVED_AUDIO_SECONDS.value()
+        cancellation.record_interrupted("llm", "disconnect", tokens=40, chars=36, spoken_chars=9, with_audio=True)
+        assert cancellation.SAVED_TOKENS.value(stream="llm") == pytest.approx(tokens + 60)
+        assert cancellation.SAVED_AUDIO_SECONDS.value() == pytest.approx(
+            audio + 81 / cancellation.SPEECH_CHARS_PER_SECOND
+        )
+
+    def test_finished_upstream_saves_only_audio(self):
+        cancellation.record_completed("llm", tokens=100, chars=90)
+        tokens = cancellation.SAVED_TOKENS.value(stream="llm")
+        audio = cancellation.SAVED_AUDIO_SECONDS.value()
+        cancellation.record_interrupted(
+            "llm", "disconnect", tokens=50, chars=45, finished=True, spoken_chars=30, with_audio=True
+        )
+        assert cancellation.SAVED_TOKENS.value(stream="llm") == tokens
+        assert cancellation.SAVED_AUDIO_SECONDS.value() == pytest.approx(
+            audio + 15 / cancellation.SPEECH_CHARS_PER_SECOND
+        )
+
+
+class TestBackground:
+    """后台画面分析"""
+
+    def test_cancel_background(self):
+        async def scenario():
+            task = asyncio.create_task(asyncio.sleep(10))
+            cancellation.track_background("ctx", task)
+            before = cancellation.UPSTREAM_CANCELLED.value(stream="vlm", reason="disconnect")
+            assert cancellation.cancel_background("ctx") == 1
+            await asyncio.wait([task])
+            after = cancellation.UPSTREAM_CANCELLED.value(stream="vlm", reason="disconnect")
+            return task, after - before
+
+        task, delta = asyncio.run(scenario())
+        assert task.cancelled() and delta == 1
+        assert "ctx" not in cancellation._background
+
+    def test_finished_tasks_removed(self):
+        async def scenario():
+            task = asyncio.create_task(asyncio.sleep(0))
+            cancellation.track_background("done", task)
+            await task
+            await asyncio.sleep(0)
+            return cancellation.cancel_background("done")
+
+        assert asyncio.run(scenario()) == 0
+        assert "done" not in cancellation._background
+
+
+class TestDisconnectMiddleware:
+    """中间件"""
+
+    def _receive(self, disconnect_after):
+        messages = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+
+        return receive
+
+    def test_disconnect_cancels_app(self):
+        cleaned = []
+
+        async def app(scope, receive, send):
+            assert (await receive())["type"] == "http.request"
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            try:
+                while True:
+                    await send({"type": "http.response.body", "body": b"data", "more_body": True})
+                    await asyncio.sleep(0.01)
+            finally:
+                cleaned.append(True)
+
+        async def scenario():
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            middleware = cancellation.DisconnectMiddleware(app)
+            before = cancellation.CLIENT_DISCONNECTS.value()
+            await asyncio.wait_for(
+                middleware({"type": "http", "path": cadence.CHAT_PATH}, self._receive(0.03), send), 1
+            )
+            return cancellation.CLIENT_DISCONNECTS.value() - before
+
+        assert asyncio.run(scenario()) == 1
+        assert cleaned == [True]
+
+    def test_completed_response_not_counted(self):
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        async def scenario():
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            before = cancellation.CLIENT_DISCONNECTS.value()
+            await cancellation.DisconnectMiddleware(app)(
+                {"type": "http", "path": cadence.CHAT_PATH}, self._receive(0), send
+            )
+            return sent, cancellation.CLIENT_DISCONNECTS.value() - before
+
+        sent, delta = asyncio.run(scenario())
+        assert sent[-1]["body"] == b"ok"
+        assert delta == 0
+
+    def test_app_errors_propagate(self):
+        async def app(scope, receive, send):
+            raise RuntimeError("boom")
+
+        async def scenario():
+            async def send(message):
+                pass
+
+            await cancellation.DisconnectMiddleware(app)(
+                {"type": "http", "path": cadence.CHAT_PATH}, self._receive(10), send
+            )
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(scenario())
+
+    def test_other_paths_untouched(self):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(receive)
+
+        async def receive():
+            return {"type": "http.request"}
+
+        asyncio.run(cancellation.DisconnectMiddleware(app)({"type": "http", "path": "/metrics"}, receive, None))
+        assert seen == [receive]
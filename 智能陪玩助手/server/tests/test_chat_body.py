@@ -0,0 +1,57 @@
+"""
+HGDoll 对话请求体拼接测试
+测试缓存的消息字节拼接后与整体序列化的请求等价
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import chat_body
+
+
+class TestChatBody:
+    """请求体拼接"""
+
+    def test_spliced_body_equals_full_dump(self):
+        history = [
+            {"role": "assistant", "content": "视频帧描述：城门前"},
+            {"role": "user", "content": "怎么打 \"boss\"？\n"},
+        ]
+        body = chat_body.build(
+            "ep-llm",
+            [chat_body.system_message("系统提示"), *map(chat_body.encode_message, history)],
+            {"temperature": 0.5, "stream_options": {"include_usage": True}},
+        )
+        assert json.loads(body) == {
+            "model": "ep-llm",
+            "stream": True,
+            "temperature": 0.5,
+            "stream_options": {"include_usage": True},
+            "messages": [{"role": "system", "content": "系统提示"}] + history,
+        }
+
+    def test_parameters_cannot_override_messages(self):
+        body = chat_body.build("ep", [chat_body.system_message("s")], {"messages": [], "stream": False, "model": "x"})
+        payload = json.loads(body)
+        assert payload["model"] == "ep"
+        assert payload["stream"] is True
+        assert payload["messages"] == [{"role": "system", "content": "s"}]
+
+    def test_empty_parameters(self):
+        assert json.loads(chat_body.build("ep", [])) == {"model": "ep", "stream": True, "messages": []}
+
+    def test_encode_drops_none_fields_of_models(self):
+        class Message:
+            def model_dump(self, exclude_none=False):
+                data = {"role": "user", "content": "hi", "name": None}
+                return {k: v for k, v in data.items() if v is not None} if exclude_none else data
+
+        assert json.loads(chat_body.encode_message(Message())) == {"role": "user", "content": "hi"}
+
+    def test_json_fallback(self, monkeypatch):
+        monkeypatch.setattr(chat_body, "orjson", None)
+        assert json.loads(chat_body.dumps({"content": "你好"})) == {"content": "你好"}
+        assert chat_body.loads(b'{"a":1}') == {"a": 1}
@@ -50,10 +50,11 @@ def test_chat():
 def test_context_saved():
     print("\n=== Test 2: Context Saved ===")
     time.sleep(2)  # Wait for async context save
-    r = requests.get(f"{BASE}/debug/status", timeout=5)
+    r = requests.get(f"{BASE}/debug/status", params={"limit": 0}, timeout=5)
     data = r.json()
     print(f"  Active contexts: {data.get('active_contexts')}")
-    ctx = data.get("contexts", {}).get(CTX_ID, {})
+    r = requests.get(f"{BASE}/debug/status/{CTX_ID}", timeout=5)
+    ctx = r.json() if r.status_code == 200 else {}
     history_len = ctx.get("history_length", 0)
     print(f"  Context {CTX_ID}: history_length={history_len}")
     for m in ctx.get("last_messages", []):
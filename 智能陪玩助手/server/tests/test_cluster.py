@@ -0,0 +1,209 @@
+"""
+HGDoll 多进程模式测试
+测试一致性哈希的稳定性，以及前置路由在同一 keep-alive 连接上按 X-Context-Id 分发请求
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import cluster
+
+
+class TestHashRing:
+    """一致性哈希"""
+
+    def test_same_key_same_node(self):
+        ring = cluster.HashRing(range(4))
+        assert all(ring.get("ctx-42") == ring.get("ctx-42") for _ in range(10))
+
+    def test_keys_spread_over_nodes(self):
+        ring = cluster.HashRing(range(4))
+        counts = [0] * 4
+        for i in range(4000):
+            counts[ring.get(f"ctx-{i}")] += 1
+        assert min(counts) > 600, counts
+
+    def test_adding_node_moves_few_keys(self):
+        before = cluster.HashRing(range(4))
+        after = cluster.HashRing(range(5))
+        moved = sum(before.get(f"ctx-{i}") != after.get(f"ctx-{i}") for i in range(2000))
+        assert moved < 2000 * 0.35
+
+
+class TestRequestHead:
+    """请求头解析"""
+
+    def test_context_from_header_and_query(self):
+        head = cluster.RequestHead(b"POST /a HTTP/1.1\r\nX-Context-Id: abc\r\nContent-Length: 5\r\n\r\n")
+        assert head.context_id == "abc"
+        assert head.content_length == 5
+        ws = cluster.RequestHead(b"GET /ws/asr?context_id=xyz HTTP/1.1\r\nConnection: Upgrade\r\n\r\n")
+        assert ws.context_id == "xyz"
+        assert ws.is_upgrade
+        assert ws.path == "/ws/asr"
+
+
+async def _fake_worker(index):
+    """返回自身编号和收到的请求体的最小 HTTP 服务"""
+    async def handle(reader, writer):
+        while True:
+            head = await cluster.read_head(reader)
+            if head is None:
+                break
+            body = await reader.readexactly(head.content_length or 0)
+            payload = json.dumps({"worker": index, "body": body.decode()}).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: %d\r\n\r\n" % len(payload) + payload)
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def _request(reader, writer, context_id, body):
+    raw = body.encode()
+    writer.write(
+        f"POST /api HTTP/1.1\r\nHost: x\r\nX-Context-Id: {context_id}\r\nContent-Length: {len(raw)}\r\n\r\n".encode()
+        + raw
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = int([l for l in head.decode().split("\r\n") if l.lower().startswith("content-length")][0].split(":")[1])
+    return json.loads(await reader.readexactly(length))
+
+
+async def _get(reader, writer, target):
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    length = int(head.split("content-length: ")[1].split("\r\n")[0])
+    return int(head.split(" ")[1]), json.loads(await reader.readexactly(length))
+
+
+async def _with_router(workers, body):
+    """启动 workers 个假 worker 与前置路由，运行 body(router, reader, writer)"""
+    servers = [await _fake_worker(i) for i in range(workers)]
+    router = cluster.Router([port for _, port in servers])
+    front = await asyncio.start_server(router.handle, "127.0.0.1", 0)
+    reader, writer = await asyncio.open_connection("127.0.0.1", front.sockets[0].getsockname()[1])
+    try:
+        return router, await body(router, reader, writer)
+    finally:
+        writer.close()
+        front.close()
+        for server, _ in servers:
+            server.close()
+
+
+class TestRouter:
+    """前置路由"""
+
+    def test_routes_each_request_by_context(self):
+        async def scenario():
+            workers = [await _fake_worker(i) for i in range(3)]
+            router = cluster.Router([port for _, port in workers])
+            front = await asyncio.start_server(router.handle, "127.0.0.1", 0)
+            port = front.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            results = []
+            for ctx in ["alpha", "beta", "gamma", "alpha", "delta"]:
+                results.append((ctx, await _request(reader, writer, ctx, f"hello-{ctx}")))
+            writer.write(b"GET /cluster/status HTTP/1.1\r\nHost: x\r\n\r\n")
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.decode().split("content-length: ")[1].split("\r\n")[0])
+            status = json.loads(await reader.readexactly(length))
+            writer.close()
+            front.close()
+            for server, _ in workers:
+                server.close()
+            return router, results, status
+
+        router, results, status = asyncio.run(scenario())
+        for ctx, resp in results:
+            assert resp["worker"] == router.ring.get(ctx)
+            assert resp["body"] == f"hello-{ctx}"
+        assert sum(w["routed_requests"] for w in status["workers"]) == 5
+
+    def test_process_level_paths_fan_out(self):
+        async def body(router, reader, writer):
+            return await _get(reader, writer, "/debug/loop"), await _get(reader, writer, "/debug/prompts")
+
+        _, (loop, prompts) = asyncio.run(_with_router(3, body))
+        for status, merged in (loop, prompts):
+            assert status == 200
+            assert [w["worker"] for w in merged["workers"]] == [0, 1, 2]
+            assert all(w["status"] == 200 for w in merged["workers"])
+
+    def test_worker_query_pins_request(self):
+        async def body(router, reader, writer):
+            return [await _get(reader, writer, f"/debug/loop?worker={i}") for i in (2, 0, 5)]
+
+        _, results = asyncio.run(_with_router(3, body))
+        assert results[0] == (200, {"worker": 2, "body": ""})
+        assert results[1] == (200, {"worker": 0, "body": ""})
+        assert results[2][0] == 404
+
+    def test_context_status_routed_by_path(self):
+        async def body(router, reader, writer):
+            return [await _get(reader, writer, f"/debug/status/{ctx}") for ctx in ("alpha", "beta", "gamma")]
+
+        router, results = asyncio.run(_with_router(3, body))
+        for ctx, (status, resp) in zip(("alpha", "beta", "gamma"), results):
+            assert status == 200 and resp["worker"] == router.ring.get(ctx)
+
+
+class TestMerge:
+    """多 worker 结果合并"""
+
+    def test_metrics_grouped_with_worker_label(self):
+        text = (
+            "# HELP hgdoll_requests_total Requests\n"
+            "# TYPE hgdoll_requests_total counter\n"
+            'hgdoll_requests_total{path="/a"} 3\n'
+            "# HELP hgdoll_loop_lag_seconds Lag\n"
+            "# TYPE hgdoll_loop_lag_seconds histogram\n"
+            'hgdoll_loop_lag_seconds_bucket{le="0.1"} 1\n'
+            "hgdoll_loop_lag_seconds_count 1\n"
+        )
+        merged = cluster.merge_metrics([(0, text), (1, text)]).splitlines()
+        assert merged.count("# TYPE hgdoll_requests_total counter") == 1
+        assert merged[2:4] == [
+            'hgdoll_requests_total{worker="0",path="/a"} 3',
+            'hgdoll_requests_total{worker="1",path="/a"} 3',
+        ]
+        # 同一指标的样本连续出现在它的 HELP / TYPE 之后
+        assert merged[4:] == [
+            "# HELP hgdoll_loop_lag_seconds Lag",
+            "# TYPE hgdoll_loop_lag_seconds histogram",
+            'hgdoll_loop_lag_seconds_bucket{worker="0",le="0.1"} 1',
+            'hgdoll_loop_lag_seconds_count{worker="0"} 1',
+            'hgdoll_loop_lag_seconds_bucket{worker="1",le="0.1"} 1',
+            'hgdoll_loop_lag_seconds_count{worker="1"} 1',
+        ]
+
+    def test_add_label_to_empty_braces(self):
+        assert cluster._add_label("up{} 1", 3) == 'up{worker="3"} 1'
+
+    def test_fetch_chunked_response(self):
+        async def handle(reader, writer):
+            await cluster.read_head(reader)
+            writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n")
+            await writer.drain()
+
+        async def scenario():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            router = cluster.Router([server.sockets[0].getsockname()[1]])
+            head = cluster.RequestHead(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+            try:
+                return await router.fetch(0, head, b"")
+            finally:
+                server.close()
+
+        status, headers, body = asyncio.run(scenario())
+        assert status == 200 and body == b"hello world"
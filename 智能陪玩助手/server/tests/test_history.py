@@ -0,0 +1,80 @@
+"""
+HGDoll 紧凑历史记录测试
+测试记录与消息的互相转换、角色下标，以及窗口外旧消息的压缩
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import history
+
+LONG = "视频帧描述：角色站在城门前，血量还剩一半，右上角有任务提示。" * 10
+
+
+class TestRecord:
+    """单条记录"""
+
+    def test_round_trip(self):
+        record = history.Record.from_message({"role": "assistant", "content": "你好"})
+        assert record.role == "assistant"
+        assert record.content == "你好"
+        assert json.loads(record.serialized) == {"role": "assistant", "content": "你好"}
+        assert record.to_dict() == {"role": "assistant", "content": "你好"}
+
+    def test_role_is_small_int(self):
+        record = history.Record.from_message({"role": "user", "content": "x"})
+        assert record.role_id == history.ROLES.index("user")
+        assert not hasattr(record, "__dict__")
+
+    def test_unknown_role_read_from_payload(self):
+        record = history.Record.from_message({"role": "function", "content": "x"})
+        assert record.role_id == history.UNKNOWN_ROLE
+        assert record.role == "function"
+
+    def test_compress_keeps_content(self):
+        record = history.Record.from_message({"role": "assistant", "content": LONG})
+        packed = record.compressed_copy()
+        assert packed.compressed and not record.compressed
+        assert len(packed.data) < len(record.data)
+        assert packed.serialized == record.serialized
+        assert packed.content == LONG
+        assert packed.role == "assistant"
+        assert packed.compressed_copy() is None
+
+    def test_short_content_not_compressed(self):
+        record = history.Record.from_message({"role": "user", "content": "短"})
+        assert record.compressed_copy() is None
+
+
+class TestCompressCold:
+    """窗口外的旧消息压缩保存"""
+
+    def _records(self, n):
+        return [history.Record.from_message({"role": "assistant", "content": f"{i}{LONG}"}) for i in range(n)]
+
+    def test_only_messages_outside_hot_window(self, monkeypatch):
+        monkeypatch.setattr(history, "HOT_MESSAGES", 3)
+        records = []
+        originals = self._records(6)
+        for record in originals:
+            records.append(record)
+            history.compress_cold(records)
+        assert [r.compressed for r in records] == [True, True, True, False, False, False]
+        # 压缩替换为新记录，原记录保持不变
+        assert not any(r.compressed for r in originals)
+
+    def test_backlog(self, monkeypatch):
+        monkeypatch.setattr(history, "HOT_MESSAGES", 2)
+        records = self._records(5)
+        history.compress_cold(records, backlog=True)
+        assert [r.compressed for r in records] == [True, True, True, False, False]
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(history, "HOT_MESSAGES", 1)
+        monkeypatch.setattr(history, "COMPRESS", False)
+        records = self._records(4)
+        history.compress_cold(records, backlog=True)
+        assert not any(r.compressed for r in records)
@@ -0,0 +1,83 @@
+"""
+HGDoll 结构化日志测试
+测试 JSON 格式输出、采样/限速过滤，以及队列满时不阻塞
+"""
+
+import io
+import json
+import logging
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logs
+
+
+def _record(name="hgdoll.frame", level=logging.INFO, msg="帧分析", **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, None, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+class TestJsonFormatter:
+    """JSON 行格式"""
+
+    def test_extra_fields_included(self):
+        line = logs.JsonFormatter().format(_record(context_id="ctx-1", description_len=42))
+        data = json.loads(line)
+        assert data["msg"] == "帧分析"
+        assert data["logger"] == "hgdoll.frame"
+        assert data["context_id"] == "ctx-1"
+        assert data["description_len"] == 42
+
+    def test_none_fields_omitted(self):
+        data = json.loads(logs.JsonFormatter().format(_record(request_id=None)))
+        assert "request_id" not in data
+
+
+class TestSamplingFilter:
+    """采样与限速"""
+
+    def test_rate_limit_by_logger_prefix(self):
+        f = logs.SamplingFilter({}, {"hgdoll.frame": 3})
+        passed = sum(f.filter(_record("hgdoll.frame.vlm")) for _ in range(10))
+        assert passed == 3
+
+    def test_warnings_always_pass(self):
+        f = logs.SamplingFilter({"hgdoll.frame": 0}, {"hgdoll.frame": 0})
+        assert f.filter(_record(level=logging.WARNING))
+        assert not f.filter(_record(level=logging.INFO))
+
+    def test_other_loggers_unaffected(self):
+        f = logs.SamplingFilter({"hgdoll.frame": 0}, {})
+        assert all(f.filter(_record("hgdoll.chat")) for _ in range(5))
+
+    def test_parse_mapping(self):
+        assert logs._parse_mapping("hgdoll.frame=0.2, hgdoll.chat=50,bad") == {
+            "hgdoll.frame": 0.2,
+            "hgdoll.chat": 50.0,
+        }
+
+
+class TestQueueHandler:
+    """队列处理器"""
+
+    def test_full_queue_drops_without_blocking(self):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        before = logs.LOG_DROPPED.value(reason="queue_full")
+        handler.emit(_record())
+        handler.emit(_record())
+        assert logs.LOG_DROPPED.value(reason="queue_full") == before + 1
+
+    def test_pipeline_writes_json_lines(self):
+        stream = io.StringIO()
+        logs.setup_logging(stream=stream)
+        try:
+            logging.getLogger("hgdoll.chat").info("开始 LLM 请求", extra={"context_id": "ctx-2"})
+        finally:
+            logs.shutdown_logging()
+        lines = [json.loads(l) for l in stream.getvalue().splitlines()]
+        assert any(l["msg"] == "开始 LLM 请求" and l["context_id"] == "ctx-2" for l in lines)
@@ -0,0 +1,50 @@
+"""
+HGDoll 事件循环监控测试
+测试延迟采样以及阻塞检测能定位到占用事件循环的协程
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import loop_monitor
+
+
+class TestLoopLagMonitor:
+    """事件循环延迟监控"""
+
+    def test_lag_samples_collected(self):
+        async def run():
+            monitor = loop_monitor.LoopLagMonitor(interval=0.01)
+            monitor.start()
+            await asyncio.sleep(0.1)
+            await monitor.stop()
+            return monitor.snapshot()
+
+        snap = asyncio.run(run())
+        assert snap["lag_ms"]["samples"] > 0
+        assert snap["slow_callback_threshold_ms"] is None
+
+    def test_detects_blocking_coroutine(self):
+        async def blocking_summarize():
+            await asyncio.sleep(0.05)
+            time.sleep(0.3)  # 模拟同步 gzip / json 等阻塞操作
+
+        async def run():
+            monitor = loop_monitor.LoopLagMonitor(interval=0.01, slow_threshold=0.05)
+            monitor.start()
+            await asyncio.create_task(blocking_summarize())
+            await asyncio.sleep(0.1)
+            await monitor.stop()
+            return monitor.snapshot()
+
+        snap = asyncio.run(run())
+        events = snap["slow_events"]
+        assert events, "应检测到阻塞事件"
+        event = events[0]
+        assert "blocking_summarize" in event["coroutine"]
+        assert event["duration_ms"] >= 150
+        assert any("blocking_summarize" in line for stack in event["stacks"] for line in stack)
@@ -0,0 +1,77 @@
+"""
+HGDoll 指标模块测试
+测试 Counter / Gauge / Histogram 的累加逻辑、span 计时以及 Prometheus 文本导出
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import metrics
+
+
+class TestCounterAndGauge:
+    """计数器与仪表"""
+
+    def test_counter_inc_by_label(self):
+        c = metrics.counter("test_counter_total", "test counter", ("kind",))
+        c.inc(kind="chat")
+        c.inc(2, kind="chat")
+        c.inc(kind="image")
+        assert c.value(kind="chat") == 3
+        assert c.value(kind="image") == 1
+
+    def test_counter_rejects_wrong_labels(self):
+        c = metrics.counter("test_counter_labels_total", "test counter", ("kind",))
+        with pytest.raises(ValueError):
+            c.inc(stage="x")
+
+    def test_register_is_idempotent(self):
+        a = metrics.counter("test_same_total", "same")
+        b = metrics.counter("test_same_total", "same")
+        assert a is b
+        with pytest.raises(ValueError):
+            metrics.histogram("test_same_total", "same")
+
+    def test_gauge_set_and_dec(self):
+        g = metrics.gauge("test_gauge", "test gauge")
+        g.set(5)
+        g.dec()
+        assert g.value() == 4
+
+
+class TestHistogram:
+    """直方图分桶与导出"""
+
+    def test_observe_buckets(self):
+        h = metrics.histogram("test_hist_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+        h.observe(0.05, stage="a")
+        h.observe(0.5, stage="a")
+        h.observe(5, stage="a")
+        assert h.count(stage="a") == 3
+        assert h.sum(stage="a") == pytest.approx(5.55)
+
+        text = "\n".join(h.render())
+        assert 'test_hist_seconds_bucket{stage="a",le="0.1"} 1' in text
+        assert 'test_hist_seconds_bucket{stage="a",le="1"} 2' in text
+        assert 'test_hist_seconds_bucket{stage="a",le="+Inf"} 3' in text
+        assert 'test_hist_seconds_count{stage="a"} 3' in text
+
+    def test_span_records_stage(self):
+        before = metrics.STAGE_SECONDS.count(stage="unit_test_stage")
+        with metrics.span("unit_test_stage"):
+            pass
+        assert metrics.STAGE_SECONDS.count(stage="unit_test_stage") == before + 1
+
+    def test_span_counts_errors(self):
+        with pytest.raises(RuntimeError):
+            with metrics.span("unit_test_error"):
+                raise RuntimeError("boom")
+        assert metrics.STAGE_ERRORS.value(stage="unit_test_error") == 1
+
+    def test_render_has_type_lines(self):
+        text = metrics.render()
+        assert "# TYPE hgdoll_stage_seconds histogram" in text
+        assert text.endswith("\n")
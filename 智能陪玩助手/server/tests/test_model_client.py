@@ -0,0 +1,178 @@
+"""
+HGDoll 模型连接池测试
+测试共享 httpx 客户端复用连接，并正确统计新建连接、进行中请求与池占用
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+pytest.importorskip("httpx")
+
+import model_client
+
+
+async def _keep_alive_server():
+    """最简 HTTP/1.1 keep-alive 服务，记录建立的连接数"""
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], connections
+
+
+class TestSharedPool:
+    """共享连接池"""
+
+    def test_connections_reused(self, monkeypatch):
+        monkeypatch.setenv("HGDOLL_HTTP2", "0")
+
+        async def run():
+            server, port, connections = await _keep_alive_server()
+            url = f"http://127.0.0.1:{port}/"
+            opened_before = model_client.HTTP_CONNECTIONS_OPENED.value(host="127.0.0.1")
+            try:
+                client = model_client.get_http_client()
+                assert model_client.get_http_client() is client
+                for _ in range(3):
+                    resp = await client.get(url)
+                    assert resp.text == "ok"
+                idle = model_client.HTTP_POOL_CONNECTIONS.value(state="idle")
+                in_flight = model_client.HTTP_IN_FLIGHT.value()
+            finally:
+                await model_client.aclose()
+                server.close()
+                await server.wait_closed()
+            opened = model_client.HTTP_CONNECTIONS_OPENED.value(host="127.0.0.1") - opened_before
+            return len(connections), opened, idle, in_flight
+
+        n_server, opened, idle, in_flight = asyncio.run(run())
+        assert n_server == 1
+        assert opened == 1
+        assert idle == 1
+        assert in_flight == 0
+        assert model_client.HTTP_REQUESTS.value(host="127.0.0.1", http_version="HTTP/1.1", reused="true") >= 2
+
+    def test_warm_up_opens_connections(self, monkeypatch):
+        monkeypatch.setenv("HGDOLL_HTTP2", "0")
+
+        async def run():
+            server, port, connections = await _keep_alive_server()
+            try:
+                opened = await model_client.warm_up(f"http://127.0.0.1:{port}/", connections=2)
+            finally:
+                await model_client.aclose()
+                server.close()
+                await server.wait_closed()
+            return opened, len(connections)
+
+        assert asyncio.run(run()) == (2, 2)
+
+    def test_disabled_falls_back_to_default_client(self, monkeypatch):
+        monkeypatch.setattr(model_client, "ENABLED", False)
+        assert model_client.client_kwargs() == {}
+        assert asyncio.run(model_client.warm_up("http://127.0.0.1:1/")) == 0
+
+
+class TestStreamChat:
+    """直接发送拼接好的请求体并解析 SSE"""
+
+    def _client(self, handler):
+        import httpx
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_parses_events_until_done(self, monkeypatch):
+        seen = {}
+
+        def handler(request):
+            seen["url"] = str(request.url)
+            seen["auth"] = request.headers["authorization"]
+            seen["body"] = request.content
+            return __import__("httpx").Response(
+                200,
+                content=b'data: {"id":"1","choices":[{"delta":{"content":"\xe4\xbd\xa0"}}]}\n\n'
+                b'data: {"id":"1","choices":[],"usage":{"prompt_tokens":3}}\n\n'
+                b"data: [DONE]\n\n",
+                headers={"content-type": "text/event-stream"},
+            )
+
+        monkeypatch.setattr(model_client, "_http_client", self._client(handler))
+        monkeypatch.setattr(model_client, "ARK_BASE_URL", "https://ark.test/api/v3/")
+        monkeypatch.setattr(model_client, "ARK_API_KEY", "key")
+
+        async def run():
+            return [event async for event in model_client.stream_chat(b'{"model":"ep"}')]
+
+        events = asyncio.run(run())
+        assert [e["id"] for e in events] == ["1", "1"]
+        assert events[0]["choices"][0]["delta"]["content"] == "你"
+        assert events[1]["usage"]["prompt_tokens"] == 3
+        assert seen["url"] == "https://ark.test/api/v3/chat/completions"
+        assert seen["auth"] == "Bearer key"
+        assert seen["body"] == b'{"model":"ep"}'
+
+    def test_error_status_raises(self, monkeypatch):
+        import httpx
+
+        monkeypatch.setattr(
+            model_client, "_http_client", self._client(lambda request: httpx.Response(401, content=b"bad key"))
+        )
+
+        async def run():
+            async for _ in model_client.stream_chat(b"{}"):
+                pass
+
+        with pytest.raises(model_client.UpstreamError) as err:
+            asyncio.run(run())
+        assert err.value.status == 401
+
+    def test_closing_converted_stream_releases_response(self, monkeypatch):
+        import httpx
+
+        closed = []
+
+        class Events(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                for i in range(100):
+                    yield f'data: {{"id":"{i}"}}\n\n'.encode()
+                    await asyncio.sleep(0)
+
+            async def aclose(self):
+                closed.append(True)
+
+        monkeypatch.setattr(
+            model_client, "_http_client", self._client(lambda request: httpx.Response(200, stream=Events()))
+        )
+
+        async def run():
+            stream = model_client.stream_chat_as(b"{}", lambda event: event["id"])
+            first = await stream.__anext__()
+            await stream.aclose()
+            # 不让出事件循环：上游响应必须在 aclose 返回时已关闭，而不是等垃圾回收
+            return first, list(closed)
+
+        first, closed_at_return = asyncio.run(run())
+        assert first == "0"
+        assert closed_at_return == [True]
+
+    def test_requires_api_key(self, monkeypatch):
+        monkeypatch.setattr(model_client, "ARK_API_KEY", "")
+        assert not model_client.raw_chat_available()
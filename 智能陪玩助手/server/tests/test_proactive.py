@@ -0,0 +1,131 @@
+"""
+HGDoll 服务端主动发言测试
+测试触发条件（画面变化、用户沉默、会话连接）与生成期间用户说话时丢弃
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import proactive
+import session
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def quick(monkeypatch):
+    monkeypatch.setattr(proactive, "SILENCE_SECONDS", 0)
+    monkeypatch.setattr(proactive, "MIN_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(proactive, "NOVELTY_THRESHOLD", 0.5)
+
+
+def _connect(context_id):
+    ws = FakeWebSocket()
+    conn = session.Session(ws, context_id, on_frame=None, on_chat=None)
+    session.register(conn)
+    return conn, ws
+
+
+class TestProactiveScheduler:
+    """主动发言调度"""
+
+    def test_pushes_pre_synthesized_reply(self, quick):
+        remembered = []
+
+        async def generate(context_id, reqid):
+            return [("我看到你", b"a1"), ("拿到炸弹啦", b"a2")]
+
+        async def remember(context_id, text):
+            remembered.append((context_id, text))
+
+        async def run():
+            conn, ws = _connect("p1")
+            scheduler = proactive.ProactiveScheduler(generate, remember)
+            try:
+                assert scheduler.on_frame("p1", 0.3) is None  # 变化不够
+                task = scheduler.on_frame("p1", 0.3)
+                assert task is not None
+                await task
+            finally:
+                session.unregister(conn)
+            return ws.sent
+
+        sent = asyncio.run(run())
+        assert sent[0] == {"type": "control", "event": "turn_start", "turn": 1, "source": "proactive"}
+        assert sent[-1]["event"] == "turn_end"
+        assert session.encode_audio_out(1, b"a2") in sent
+        assert remembered == [("p1", "我看到你拿到炸弹啦")]
+
+    def test_requires_session_and_silence(self, quick, monkeypatch):
+        async def generate(context_id, reqid):
+            raise AssertionError("不应生成")
+
+        async def run():
+            scheduler = proactive.ProactiveScheduler(generate, None)
+            assert scheduler.on_frame("nobody", 1.0) is None
+            conn, _ = _connect("p2")
+            try:
+                monkeypatch.setattr(proactive, "SILENCE_SECONDS", 60)
+                scheduler.on_user_activity("p2")
+                assert scheduler.on_frame("p2", 1.0) is None
+            finally:
+                session.unregister(conn)
+
+        asyncio.run(run())
+
+    def test_discarded_when_user_speaks_during_generation(self, quick):
+        outcome = proactive.PROACTIVE_TURNS
+
+        async def run():
+            conn, ws = _connect("p3")
+            scheduler = proactive.ProactiveScheduler()
+
+            async def generate(context_id, reqid):
+                await asyncio.sleep(0.01)
+                scheduler.on_user_activity(context_id)
+                return [("迟到的话", b"")]
+
+            scheduler.configure(generate, None)
+            before = outcome.value(outcome="user_spoke")
+            try:
+                await scheduler.on_frame("p3", 1.0)
+            finally:
+                session.unregister(conn)
+            return ws.sent, outcome.value(outcome="user_spoke") - before, scheduler.active
+
+        sent, discarded, active = asyncio.run(run())
+        assert sent == []
+        assert discarded == 1
+        assert active == 0
+
+    def test_model_skip_not_pushed(self, quick):
+        async def generate(context_id, reqid):
+            return None
+
+        async def run():
+            conn, ws = _connect("p4")
+            scheduler = proactive.ProactiveScheduler(generate, None)
+            try:
+                await scheduler.on_frame("p4", 1.0)
+                # 一次生成后累计变化清零，下一帧变化不足时不再触发
+                assert scheduler.on_frame("p4", 0.1) is None
+            finally:
+                session.unregister(conn)
+            return ws.sent
+
+        assert asyncio.run(run()) == []
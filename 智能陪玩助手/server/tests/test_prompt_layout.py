@@ -0,0 +1,136 @@
+"""
+HGDoll 提示词前缀复用测试
+测试窗口按大步前移、冻结块边界、上下文缓存的复用与回退，以及 cached token 统计
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import prompt_layout
+
+
+class TestPromptLayout:
+    """窗口起点与冻结块"""
+
+    def test_short_history_keeps_everything(self):
+        layout = prompt_layout.PromptLayout(window=10, roll_step=4)
+        for size in range(1, 11):
+            start, _ = layout.span("ctx", size)
+            assert start == 0
+
+    def test_window_rolls_in_large_steps(self):
+        layout = prompt_layout.PromptLayout(window=10, roll_step=4)
+        starts = [layout.span("ctx", size)[0] for size in range(1, 20)]
+        # 超过 10 条时一次前移，只保留最近 6 条，之后 4 轮起点不变
+        assert starts[10] == 5
+        assert starts[10:15] == [5] * 5
+        assert starts[15] == 10
+        for size, start in zip(range(1, 20), starts):
+            assert size - start <= 10
+
+    def test_prefix_is_stable_between_rolls(self):
+        layout = prompt_layout.PromptLayout(window=10, roll_step=4)
+        history = [f"m{i}" for i in range(30)]
+        sent = []
+        for size in range(11, 16):
+            start, _ = layout.span("ctx", size)
+            sent.append(history[start:size])
+        # 相邻两轮中前一轮发送的内容是后一轮的前缀
+        for prev, cur in zip(sent, sent[1:]):
+            assert cur[: len(prev)] == prev
+
+    def test_frozen_block_moves_every_roll_step(self):
+        layout = prompt_layout.PromptLayout(window=100, roll_step=4)
+        frozen = [layout.span("ctx", size)[1] for size in range(1, 12)]
+        assert frozen == [0, 0, 0, 0, 4, 4, 4, 4, 8, 8, 8]
+        for size, end in zip(range(1, 12), frozen):
+            # 冻结块不包含本轮用户消息
+            assert end <= size - 1
+
+    def test_rebuilt_context_resets_window(self):
+        layout = prompt_layout.PromptLayout(window=10, roll_step=4)
+        for size in range(1, 16):
+            layout.span("ctx", size)
+        assert layout.span("ctx", 1) == (0, 0)
+
+    def test_sessions_are_independent(self):
+        layout = prompt_layout.PromptLayout(window=10, roll_step=4)
+        for size in range(1, 16):
+            layout.span("a", size)
+        assert layout.span("b", 3)[0] == 0
+
+
+class TestUsage:
+    """cached / uncached token 统计"""
+
+    def test_cached_tokens_from_details(self):
+        usage = SimpleNamespace(prompt_tokens=1000, prompt_tokens_details=SimpleNamespace(cached_tokens=768))
+        assert prompt_layout.cached_tokens(usage) == (768, 232)
+
+    def test_missing_details_counts_as_uncached(self):
+        assert prompt_layout.cached_tokens(SimpleNamespace(prompt_tokens=50)) == (0, 50)
+        assert prompt_layout.cached_tokens(None) == (0, 0)
+
+    def test_record_usage_updates_counter(self):
+        before_cached = prompt_layout.PROMPT_TOKENS.value(kind="cached")
+        before_uncached = prompt_layout.PROMPT_TOKENS.value(kind="uncached")
+        usage = SimpleNamespace(prompt_tokens=10, prompt_tokens_details=SimpleNamespace(cached_tokens=6))
+        prompt_layout.record_usage(usage)
+        assert prompt_layout.PROMPT_TOKENS.value(kind="cached") == before_cached + 6
+        assert prompt_layout.PROMPT_TOKENS.value(kind="uncached") == before_uncached + 4
+
+
+class _FakeContextAPI:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.created = []
+
+    async def create(self, model, mode, messages, ttl):
+        if self.fail:
+            raise RuntimeError("context api unavailable")
+        self.created.append((model, mode, messages, ttl))
+        return SimpleNamespace(id=f"ctx-{len(self.created)}")
+
+
+class TestContextCache:
+    """Ark 上下文缓存"""
+
+    def _prefix(self, n):
+        return [{"role": "system", "content": "sys"}] + [{"role": "user", "content": str(i)} for i in range(n)]
+
+    def test_reuses_context_for_same_block(self):
+        client = SimpleNamespace(context=_FakeContextAPI())
+        cache = prompt_layout.ContextCache(ttl=3600, min_messages=2)
+        first = asyncio.run(cache.lookup(client, "ep", "conv", (0, 4), self._prefix(4)))
+        second = asyncio.run(cache.lookup(client, "ep", "conv", (0, 4), self._prefix(4)))
+        assert first == second == "ctx-1"
+        assert client.context.created[0][1] == "common_prefix"
+
+    def test_new_block_creates_new_context(self):
+        client = SimpleNamespace(context=_FakeContextAPI())
+        cache = prompt_layout.ContextCache(ttl=3600, min_messages=2)
+        asyncio.run(cache.lookup(client, "ep", "conv", (0, 4), self._prefix(4)))
+        assert asyncio.run(cache.lookup(client, "ep", "conv", (0, 8), self._prefix(8))) == "ctx-2"
+
+    def test_short_block_skips_cache(self):
+        client = SimpleNamespace(context=_FakeContextAPI())
+        cache = prompt_layout.ContextCache(ttl=3600, min_messages=20)
+        assert asyncio.run(cache.lookup(client, "ep", "conv", (0, 4), self._prefix(4))) is None
+        assert client.context.created == []
+
+    def test_create_failure_falls_back(self):
+        client = SimpleNamespace(context=_FakeContextAPI(fail=True))
+        cache = prompt_layout.ContextCache(ttl=3600, min_messages=2)
+        before = prompt_layout.CONTEXT_CACHE_EVENTS.value(outcome="error")
+        assert asyncio.run(cache.lookup(client, "ep", "conv", (0, 4), self._prefix(4))) is None
+        assert prompt_layout.CONTEXT_CACHE_EVENTS.value(outcome="error") == before + 1
+
+    def test_split_keeps_system_in_prefix(self):
+        messages = ["sys", "h0", "h1", "h2", "user"]
+        prefix, tail = prompt_layout.split(messages, 2)
+        assert prefix == ["sys", "h0", "h1"]
+        assert tail == ["h2", "user"]
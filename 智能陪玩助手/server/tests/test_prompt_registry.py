@@ -0,0 +1,151 @@
+"""
+HGDoll 提示词注册表测试
+测试模板编译与版本号、按画面描述选择游戏变体、覆盖目录的热加载，以及按变体统计的提示词 token
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import prompt
+import prompt_registry
+
+
+def write(path, text, mtime=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class TestCompile:
+    """模板编译"""
+
+    def test_builtin_text_unchanged(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        assert registry.get("llm").text == prompt.LLM_PROMPT
+        assert registry.get("vlm").variant == prompt_registry.DEFAULT
+
+    def test_substitution(self):
+        assert prompt_registry.compile_template("没有时回复 $PROACTIVE_SKIP") == "没有时回复 " + prompt.PROACTIVE_SKIP
+        assert prompt_registry.compile_template("价格 $5 与 $unknown") == "价格 $5 与 $unknown"
+
+    def test_version_follows_content(self):
+        a = prompt_registry.make_prompt("llm", "default", "你好")
+        b = prompt_registry.make_prompt("llm", "x", "你好")
+        c = prompt_registry.make_prompt("llm", "default", "你好呀")
+        assert a.version == b.version != c.version
+        assert len(a.version) == 8
+
+
+class TestVariants:
+    """按画面选择变体"""
+
+    def test_classify(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        assert registry.classify("斗地主 出牌阶段\n玩家是地主") == "斗地主"
+        assert registry.classify("这是一个麻将游戏的摸牌阶段") == prompt_registry.DEFAULT
+
+    def test_scene_selects_shorter_prompt(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        registry.note_scene("ctx", "斗地主 叫地主阶段")
+        llm = registry.get("llm", "ctx")
+        assert llm.variant == "斗地主"
+        assert len(llm.text) < len(prompt.LLM_PROMPT)
+        # 其他会话不受影响
+        assert registry.get("llm", "other").variant == prompt_registry.DEFAULT
+
+    def test_missing_name_falls_back(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        registry.note_scene("ctx", "斗地主")
+        assert registry.get("vlm_chat", "ctx").variant == prompt_registry.DEFAULT
+
+    def test_scene_change_returns_to_default(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        registry.note_scene("ctx", "斗地主")
+        registry.note_scene("ctx", "这是视频网站的播放界面")
+        assert registry.get("llm", "ctx").variant == prompt_registry.DEFAULT
+
+    def test_disabled(self):
+        registry = prompt_registry.PromptRegistry(directory="", variants_enabled=False)
+        registry.note_scene("ctx", "斗地主")
+        assert registry.get("llm", "ctx").variant == prompt_registry.DEFAULT
+
+    def test_capacity(self):
+        registry = prompt_registry.PromptRegistry(directory="", max_contexts=2)
+        for i in range(3):
+            registry.note_scene(f"ctx{i}", "斗地主")
+        assert registry.variant("ctx0") == prompt_registry.DEFAULT
+        assert registry.variant("ctx2") == "斗地主"
+
+    def test_selection_counted(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        before = prompt_registry.PROMPT_SELECTIONS.value(name="proactive", variant="default")
+        registry.get("proactive")
+        assert prompt_registry.PROMPT_SELECTIONS.value(name="proactive", variant="default") == before + 1
+
+
+class TestOverrides:
+    """覆盖目录与热加载"""
+
+    def test_override_and_new_variant(self, tmp_path):
+        write(tmp_path / "llm.default.txt", "简短人设，空的时候回复 $PROACTIVE_SKIP")
+        write(tmp_path / "llm.麻将.txt", "keywords: 麻将，胡牌\n麻将陪玩")
+        write(tmp_path / "unknown.txt", "忽略")
+        registry = prompt_registry.PromptRegistry(directory=str(tmp_path))
+        assert registry.get("llm").text == "简短人设，空的时候回复 " + prompt.PROACTIVE_SKIP
+        assert registry.get("llm").source.endswith("llm.default.txt")
+        registry.note_scene("ctx", "这是一个麻将游戏")
+        assert registry.get("llm", "ctx").text == "麻将陪玩"
+
+    def test_hot_reload_on_change(self, tmp_path):
+        path = tmp_path / "vlm.default.txt"
+        write(path, "第一版", mtime=1000)
+        registry = prompt_registry.PromptRegistry(directory=str(tmp_path), reload_interval=5)
+        first = registry.get("vlm")
+        write(path, "第二版", mtime=2000)
+        now = registry._checked_at
+        # 检查间隔内不重新扫描
+        assert not registry.maybe_reload(now=now + 1)
+        assert registry._prompts[("vlm", "default")].text == "第一版"
+        assert registry.maybe_reload(now=now + 10)
+        second = registry._prompts[("vlm", "default")]
+        assert second.text == "第二版" and second.version != first.version
+        # 没有变化时不重新编译
+        assert not registry.maybe_reload(now=now + 20)
+
+    def test_removed_override_restores_builtin(self, tmp_path):
+        path = tmp_path / "llm.default.txt"
+        write(path, "临时人设")
+        registry = prompt_registry.PromptRegistry(directory=str(tmp_path), reload_interval=0)
+        assert registry.get("llm").text == "临时人设"
+        path.unlink()
+        assert registry.get("llm").text == prompt.LLM_PROMPT
+
+    def test_missing_directory_keeps_builtin(self, tmp_path):
+        before = prompt_registry.PROMPT_RELOADS.value(outcome="error")
+        registry = prompt_registry.PromptRegistry(directory=str(tmp_path / "missing"))
+        assert registry.get("llm").text == prompt.LLM_PROMPT
+        assert prompt_registry.PROMPT_RELOADS.value(outcome="error") > before
+
+    def test_snapshot(self, tmp_path):
+        write(tmp_path / "vlm.麻将.txt", "keywords: 麻将\n麻将画面")
+        registry = prompt_registry.PromptRegistry(directory=str(tmp_path))
+        entries = {(e["name"], e["variant"]): e for e in registry.snapshot()}
+        assert entries[("vlm", "麻将")]["keywords"] == ["麻将"]
+        assert entries[("llm", "default")]["chars"] == len(prompt.LLM_PROMPT)
+
+
+class TestUsage:
+    """按变体统计提示词 token"""
+
+    def test_record_usage(self):
+        registry = prompt_registry.PromptRegistry(directory="")
+        registry.note_scene("ctx", "斗地主")
+        selected = registry.get("llm", "ctx")
+        before = prompt_registry.PROMPT_TOKENS.count(name="llm", variant="斗地主")
+        prompt_registry.record_usage(selected, SimpleNamespace(prompt_tokens=900))
+        prompt_registry.record_usage(selected, None)
+        prompt_registry.record_usage(selected, SimpleNamespace(prompt_tokens=0))
+        assert prompt_registry.PROMPT_TOKENS.count(name="llm", variant="斗地主") == before + 1
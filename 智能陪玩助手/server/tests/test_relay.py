@@ -0,0 +1,144 @@
+"""
+HGDoll 双向转发测试
+测试有界队列的两种满队列策略、单方向转发的排空与异常，以及一个方向结束时取消另一个方向
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import relay
+
+
+class TestBoundedQueue:
+    """有界队列"""
+
+    def test_drop_oldest(self):
+        async def scenario():
+            queue = relay.BoundedQueue("test_drop", 2, relay.DROP_OLDEST)
+            for i in range(4):
+                assert await queue.put(i, 10)
+            queue.close()
+            items = []
+            while True:
+                try:
+                    items.append(await queue.get())
+                except relay.QueueClosed:
+                    return items
+
+        before = relay.RELAY_DROPPED.value(direction="test_drop")
+        assert asyncio.run(scenario()) == [2, 3]
+        assert relay.RELAY_DROPPED.value(direction="test_drop") == before + 2
+        assert relay.RELAY_QUEUE_DEPTH.value(direction="test_drop") == 0
+        assert relay.RELAY_BYTES.value(direction="test_drop") == 20
+
+    def test_block_waits_for_space(self):
+        async def scenario():
+            queue = relay.BoundedQueue("test_block", 1, relay.BLOCK)
+            await queue.put("a")
+            blocked = asyncio.create_task(queue.put("b"))
+            await asyncio.sleep(0.01)
+            assert not blocked.done()
+            assert await queue.get() == "a"
+            assert await blocked
+            return await queue.get()
+
+        assert asyncio.run(scenario()) == "b"
+
+    def test_close_releases_blocked_put(self):
+        async def scenario():
+            queue = relay.BoundedQueue("test_close", 1, relay.BLOCK)
+            await queue.put("a")
+            blocked = asyncio.create_task(queue.put("b"))
+            await asyncio.sleep(0)
+            queue.discard()
+            return await blocked, relay.RELAY_QUEUE_DEPTH.value(direction="test_close")
+
+        assert asyncio.run(scenario()) == (False, 0)
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            relay.BoundedQueue("x", 1, "drop_newest")
+
+
+class TestPump:
+    """单方向转发"""
+
+    def test_slow_writer_does_not_stall_reader(self):
+        received = []
+        written = []
+
+        async def scenario():
+            source = list(range(5))
+
+            async def read():
+                if not source:
+                    return None
+                item = source.pop(0)
+                received.append(item)
+                return item, 1
+
+            async def write(item):
+                await asyncio.sleep(0.02)
+                written.append(item)
+
+            queue = relay.BoundedQueue("test_pump", 10, relay.DROP_OLDEST)
+            task = asyncio.create_task(relay.pump(read, write, queue))
+            await asyncio.sleep(0.01)
+            # 写出端还在发第一条时，读取端已读完全部消息
+            assert received == [0, 1, 2, 3, 4]
+            await task
+
+        asyncio.run(scenario())
+        assert written == [0, 1, 2, 3, 4]
+
+    def test_reader_error_raised_after_drain(self):
+        written = []
+
+        async def scenario():
+            items = [("a", 1)]
+
+            async def read():
+                if items:
+                    return items.pop()
+                raise ConnectionError("browser gone")
+
+            async def write(item):
+                written.append(item)
+
+            await relay.pump(read, write, relay.BoundedQueue("test_err", 4))
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(scenario())
+        assert written == ["a"]
+
+
+class TestRunPumps:
+    """两个方向"""
+
+    def test_one_direction_ending_cancels_other(self):
+        cancelled = []
+
+        async def forever():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def finishes():
+            await asyncio.sleep(0)
+
+        asyncio.run(asyncio.wait_for(relay.run_pumps(forever(), finishes()), 1))
+        assert cancelled == [True]
+
+    def test_error_propagates(self):
+        async def fails():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(relay.run_pumps(fails(), asyncio.sleep(10)))
@@ -0,0 +1,168 @@
+"""
+HGDoll 会话历史检索测试
+测试检索单元的切分、哈希向量的相关性、后台增量索引，以及「最近历史 + 检索到的较早记录」的选择
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import history
+import retrieval
+
+FRAMES = [
+    "视频帧描述：这是一个斗地主游戏的出牌界面，玩家当前是地主身份",
+    "视频帧描述：这是一个麻将游戏的摸牌阶段，玩家坐在东风位置",
+    "视频帧描述：角色扮演游戏的战斗场景，敌人正在释放技能",
+]
+
+
+def record(role, content):
+    return history.Record.from_message({"role": role, "content": content})
+
+
+def session(turns=30):
+    """画面描述与对话交替的历史；第 0 轮提到用户最喜欢的英雄"""
+    records = [record("user", "我最喜欢的英雄是鲁班七号"), record("assistant", "鲁班七号超可爱，射程也远！")]
+    for i in range(turns):
+        records.append(record("assistant", FRAMES[i % len(FRAMES)] + f"，第 {i} 帧"))
+        records.append(record("user", f"这一局打得怎么样 {i}"))
+        records.append(record("assistant", f"打得很棒，继续加油 {i}"))
+    return records
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestUnits:
+    """检索单元"""
+
+    def test_pairs_and_standalone(self):
+        records = [record("assistant", "画面"), record("user", "问"), record("assistant", "答")]
+        units, texts, pending = retrieval.build_units(records, 0, None)
+        assert units == [(0,), (1, 2)]
+        assert texts == ["画面", "问\n答"]
+        assert pending is None
+
+    def test_unanswered_user_kept(self):
+        records = [record("user", "第一句"), record("user", "第二句"), record("assistant", "回复")]
+        units, _, _ = retrieval.build_units(records, 10, None)
+        assert units == [(10,), (11, 12)]
+
+    def test_pending_across_chunks(self):
+        units, _, pending = retrieval.build_units([record("user", "问")], 5, None)
+        assert units == [] and pending == 5
+        units, _, pending = retrieval.build_units([record("assistant", "答")], 6, pending)
+        assert units == [(5, 6)] and pending is None
+
+
+class TestHashingEmbedder:
+    """哈希向量"""
+
+    def test_normalized(self):
+        vectors = retrieval.HashingEmbedder(dim=256).embed(["你好呀", "斗地主"])
+        assert vectors.shape == (2, 256)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-5)
+
+    def test_overlap_scores_higher(self):
+        q, near, far = retrieval.HashingEmbedder().embed(["我最喜欢哪个英雄", "我最喜欢的英雄是鲁班七号", FRAMES[1]])
+        assert q @ near > q @ far
+
+    def test_empty_text(self):
+        assert not retrieval.HashingEmbedder(dim=8).embed([""]).any()
+
+
+class TestRetrievalIndex:
+    """选择发送的历史"""
+
+    def _index(self, **kwargs):
+        kwargs.setdefault("recent", 20)
+        kwargs.setdefault("top_k", 3)
+        return retrieval.RetrievalIndex(embedder=retrieval.HashingEmbedder(), **kwargs)
+
+    def test_short_history_uses_window(self):
+        async def scenario():
+            return await self._index().select("ctx", session(3), 0, "你好")
+
+        assert run(scenario()) is None
+
+    def test_first_call_indexes_in_background(self):
+        records = session()
+
+        async def scenario():
+            index = self._index()
+            first = await index.select("ctx", records, 0, "我最喜欢哪个英雄")
+            await index.drain()
+            second = await index.select("ctx", records, 0, "我最喜欢哪个英雄")
+            return index, first, second
+
+        index, first, second = run(scenario())
+        assert first is None
+        assert index._sessions["ctx"].next_record == len(records)
+        # 最近 20 条原样发送，较早的第 0 轮问答被检索回来
+        assert second[-20:] == list(range(len(records) - 20, len(records)))
+        assert second[:2] == [0, 1]
+        assert len(second) <= 20 + 3 * 2
+        assert second == sorted(second)
+
+    def test_prompt_bytes_reduced(self):
+        records = session(60)
+
+        async def scenario():
+            index = self._index()
+            index.schedule("ctx", records)
+            await index.drain()
+            window = retrieval.PROMPT_BYTES.value(kind="window")
+            sent = retrieval.PROMPT_BYTES.value(kind="sent")
+            await index.select("ctx", records, 0, "麻将")
+            return retrieval.PROMPT_BYTES.value(kind="window") - window, retrieval.PROMPT_BYTES.value(kind="sent") - sent
+
+        window, sent = run(scenario())
+        assert 0 < sent < window / 3
+
+    def test_incremental_after_append(self):
+        records = session(10)
+
+        async def scenario():
+            index = self._index(recent=10)
+            index.schedule("ctx", records)
+            await index.drain()
+            before = len(index._sessions["ctx"].units)
+            records.extend([record("user", "新问题"), record("assistant", "新回答")])
+            index.schedule("ctx", records)
+            await index.drain()
+            return before, index._sessions["ctx"]
+
+        before, session_index = run(scenario())
+        assert len(session_index.units) == before + 1
+        assert session_index.units[-1] == (len(records) - 2, len(records) - 1)
+
+    def test_rebuilt_history_reindexed(self):
+        async def scenario():
+            index = self._index(recent=10)
+            index.schedule("ctx", session(20))
+            await index.drain()
+            shorter = session(5)
+            index.schedule("ctx", shorter)
+            await index.drain()
+            return index._sessions["ctx"].next_record, len(shorter)
+
+        indexed, total = run(scenario())
+        assert indexed == total
+
+    def test_capacity(self):
+        async def scenario():
+            index = self._index(max_contexts=2)
+            for i in range(3):
+                index.schedule(f"ctx{i}", session(2))
+                await index.drain()
+            return list(index._sessions)
+
+        assert run(scenario()) == ["ctx1", "ctx2"]
@@ -0,0 +1,116 @@
+"""
+HGDoll 结构化画面状态测试
+测试 VLM 输出的 JSON 解析、逐帧增量合并与变化检测，以及放进提示词的状态文本
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import scene_state
+
+
+def frame(**fields):
+    return json.dumps(fields, ensure_ascii=False)
+
+
+class TestParse:
+    """解析 VLM 输出"""
+
+    def test_plain_json(self):
+        state = scene_state.parse(frame(game="斗地主", phase="出牌阶段", role="地主", resources={"手牌": "12张"}))
+        assert state == {"game": "斗地主", "phase": "出牌阶段", "role": "地主", "resources": {"手牌": "12张"}}
+
+    def test_code_fence_and_unknown_values(self):
+        text = "```json\n" + frame(game="麻将", phase=None, role="未知", hint="", extra="x") + "\n```"
+        assert scene_state.parse(text) == {"game": "麻将"}
+
+    def test_null_resource_kept_for_removal(self):
+        assert scene_state.parse(frame(resources={"炸弹": None}))["resources"] == {"炸弹": None}
+
+    def test_long_values_truncated(self):
+        state = scene_state.parse(frame(notes="很" * 100))
+        assert len(state["notes"]) == scene_state.MAX_VALUE_CHARS
+
+    @pytest.mark.parametrize("text", ["这是一个斗地主游戏的出牌界面", "[1, 2]", "{不是 JSON}", frame(game=None)])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError):
+            scene_state.parse(text)
+
+
+class TestMerge:
+    """增量合并与变化检测"""
+
+    def test_first_frame_is_new(self):
+        state = scene_state.SceneState()
+        update = state.merge({"game": "斗地主", "role": "农民"})
+        assert update.novelty == 1.0
+        assert not state.deltas
+
+    def test_unchanged_frame(self):
+        state = scene_state.SceneState()
+        state.merge({"game": "斗地主", "resources": {"手牌": "17张"}})
+        update = state.merge({"game": "斗地主", "resources": {"手牌": "17张"}})
+        assert update.changes == {} and update.novelty == 0.0
+
+    def test_missing_fields_keep_previous(self):
+        state = scene_state.SceneState()
+        state.merge({"game": "斗地主", "role": "地主"})
+        update = state.merge({"phase": "出牌阶段"})
+        assert state.fields == {"game": "斗地主", "role": "地主", "phase": "出牌阶段"}
+        assert update.changes == {"phase": (None, "出牌阶段")}
+        assert update.novelty == pytest.approx(1 / 3)
+
+    def test_resources_merged_per_key(self):
+        state = scene_state.SceneState()
+        state.merge({"resources": {"手牌": "17张", "炸弹": "1个"}})
+        update = state.merge({"resources": {"手牌": "12张", "炸弹": None}})
+        assert state.resources == {"手牌": "12张"}
+        assert update.changes == {"resources.手牌": ("17张", "12张"), "resources.炸弹": ("1个", None)}
+
+    def test_deltas_bounded(self):
+        state = scene_state.SceneState()
+        for i in range(scene_state.MAX_DELTAS + 3):
+            state.merge({"phase": f"第{i}轮"})
+        assert len(state.deltas) == scene_state.MAX_DELTAS
+        assert state.deltas[-1][1] == {"phase": (f"第{scene_state.MAX_DELTAS + 1}轮", f"第{scene_state.MAX_DELTAS + 2}轮")}
+
+
+class TestStore:
+    """会话状态与提示词文本"""
+
+    def test_unparsed_returns_none(self):
+        store = scene_state.SceneStore()
+        before = scene_state.SCENE_UPDATES.value(outcome="unparsed")
+        assert store.update("ctx", "这是一个斗地主游戏的出牌界面") is None
+        assert store.render("ctx") is None
+        assert scene_state.SCENE_UPDATES.value(outcome="unparsed") == before + 1
+
+    def test_render_state_and_deltas(self):
+        store = scene_state.SceneStore()
+        store.update("ctx", frame(game="斗地主", phase="叫地主", resources={"手牌": "17张"}))
+        store.update("ctx", frame(phase="出牌阶段", role="地主", resources={"手牌": "20张"}))
+        text = store.render("ctx")
+        assert text.splitlines()[0] == "当前画面状态：游戏：斗地主；阶段：出牌阶段；身份：地主；资源：手牌 20张"
+        assert "阶段：叫地主 → 出牌阶段" in text
+        assert "身份：地主" in text.splitlines()[-1]
+
+    def test_state_much_smaller_than_descriptions(self):
+        store = scene_state.SceneStore()
+        descriptions = []
+        for i in range(60):
+            store.update("ctx", frame(game="斗地主", phase="出牌阶段", role="地主", resources={"手牌": f"{20 - i % 10}张"}))
+            descriptions.append(
+                f"视频帧描述：这是一个斗地主游戏的出牌界面\n玩家当前是地主身份\n手牌还剩{20 - i % 10}张，有炸弹和顺子\n可以点击出牌按钮"
+            )
+        assert len(store.render("ctx")) * 10 < len("".join(descriptions))
+
+    def test_capacity(self):
+        store = scene_state.SceneStore(max_contexts=2)
+        for i in range(3):
+            store.update(f"ctx{i}", frame(game="斗地主"))
+        assert store.get("ctx0") is None and store.get("ctx2") is not None
@@ -0,0 +1,208 @@
+"""
+HGDoll /ws/session 测试
+使用内存中的假 WebSocket 测试消息分发、对话轮次、截图提交与 ASR 协议编解码
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import admission
+import asr
+import session
+
+
+class FakeWebSocket:
+    """ASGI 风格的假连接：incoming 为客户端发来的消息，sent 记录服务端发出的消息"""
+
+    def __init__(self, incoming):
+        self.incoming = asyncio.Queue()
+        for message in incoming:
+            self.incoming.put_nowait(message)
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect"})
+
+
+def text(message):
+    return {"type": "websocket.receive", "text": json.dumps(message)}
+
+
+def binary(data):
+    return {"type": "websocket.receive", "bytes": data}
+
+
+async def no_frames(context_id, image):
+    raise AssertionError("不应收到截图")
+
+
+async def echo_chat(context_id, user_text, reqid):
+    yield f"收到:{user_text}", b"mp3-1"
+    yield "", b"mp3-2"
+
+
+class TestSessionMessages:
+    """消息分发"""
+
+    def _run(self, incoming, on_frame=no_frames, on_chat=echo_chat, wait=0.05):
+        async def run():
+            ws = FakeWebSocket(incoming)
+            conn = session.Session(ws, "ctx", on_frame=on_frame, on_chat=on_chat)
+            runner = asyncio.create_task(conn.run())
+            await asyncio.sleep(wait)
+            ws.disconnect()
+            await runner
+            return ws.sent
+
+        return asyncio.run(run())
+
+    def test_ready_and_ping(self):
+        sent = self._run([text({"type": "control", "action": "ping"})])
+        assert sent[0] == {"type": "control", "event": "ready", "context_id": "ctx"}
+        assert sent[1] == {"type": "control", "event": "pong"}
+
+    def test_chat_turn_streams_text_and_audio(self):
+        sent = self._run([text({"type": "chat", "text": "你好"})])
+        events = [m for m in sent if isinstance(m, dict) and m["type"] == "control"]
+        assert [e["event"] for e in events] == ["ready", "turn_start", "turn_end"]
+        transcripts = [m for m in sent if isinstance(m, dict) and m["type"] == "transcript"]
+        assert transcripts == [{"type": "transcript", "source": "bot", "turn": 1, "text": "收到:你好"}]
+        audio = [m for m in sent if isinstance(m, bytes)]
+        assert audio == [session.encode_audio_out(1, b"mp3-1"), session.encode_audio_out(1, b"mp3-2")]
+        assert audio[0][0] == session.KIND_AUDIO_OUT
+        assert struct.unpack(">I", audio[0][1:5])[0] == 1
+
+    def test_new_turn_supersedes_previous(self):
+        order = []
+
+        async def slow_chat(context_id, user_text, reqid):
+            order.append(("start", user_text))
+            await asyncio.sleep(0.01)
+            order.append(("end", user_text))
+            yield user_text, b""
+
+        async def run():
+            ws = FakeWebSocket([])
+            conn = session.Session(ws, "ctx", on_frame=no_frames, on_chat=slow_chat)
+            conn.start_turn("一")
+            await asyncio.sleep(0.005)
+            await conn.start_turn("二")
+            return ws.sent
+
+        sent = asyncio.run(run())
+        # 第一轮未完成即被取代，第二轮在其结束后才开始
+        assert order == [("start", "一"), ("start", "二"), ("end", "二")]
+        ends = [m for m in sent if isinstance(m, dict) and m.get("event") == "turn_end"]
+        assert ends == [
+            {"type": "control", "event": "turn_end", "turn": 1, "superseded": True},
+            {"type": "control", "event": "turn_end", "turn": 2},
+        ]
+
+    def test_duplicate_turn_not_repeated(self):
+        calls = []
+
+        async def slow_chat(context_id, user_text, reqid):
+            calls.append(user_text)
+            await asyncio.sleep(0.01)
+            yield user_text, b""
+
+        self._run([text({"type": "chat", "text": "一"}), text({"type": "chat", "text": "一"})], on_chat=slow_chat)
+        assert calls == ["一"]
+
+    def test_binary_frame_submitted_with_capture_delay(self):
+        frames = []
+
+        async def on_frame(context_id, image):
+            frames.append((context_id, image))
+
+        sent = self._run([binary(bytes([session.KIND_FRAME]) + b"jpeg")], on_frame=on_frame)
+        assert frames == [("ctx", b"jpeg")]
+        assert sent[-1]["event"] == "capture_delay" and sent[-1]["ms"] > 0
+
+    def test_invalid_messages_reported(self):
+        sent = self._run([
+            {"type": "websocket.receive", "text": "not json"},
+            text({"type": "nope"}),
+            binary(b"\x7fxyz"),
+            text({"type": "audio", "data": "AAAA"}),
+        ])
+        errors = [m["message"] for m in sent if isinstance(m, dict) and m.get("event") == "error"]
+        assert len(errors) == 4
+        assert "ASR 未启动" in errors[-1]
+
+    def test_chat_error_ends_turn(self):
+        async def failing_chat(context_id, user_text, reqid):
+            raise RuntimeError("boom")
+            yield  # pragma: no cover
+
+        sent = self._run([text({"type": "chat", "text": "hi"})], on_chat=failing_chat)
+        events = [m["event"] for m in sent if isinstance(m, dict) and m["type"] == "control"]
+        assert events == ["ready", "turn_start", "error", "turn_end"]
+
+
+    def test_rejected_turn_reports_busy(self):
+        async def rejected_chat(context_id, user_text, reqid):
+            raise admission.Rejected("context", 429, 2)
+            yield  # pragma: no cover
+
+        sent = self._run([text({"type": "chat", "text": "hi"})], on_chat=rejected_chat)
+        controls = [m for m in sent if isinstance(m, dict) and m["type"] == "control"]
+        assert [m["event"] for m in controls] == ["ready", "turn_start", "busy", "turn_end"]
+        assert controls[2] == {
+            "type": "control", "event": "busy", "turn": 1, "status": 429, "retry_after": 2, "reason": "context",
+        }
+
+
+class TestSessionRegistry:
+    """会话登记"""
+
+    def test_latest_connection_wins(self):
+        first = session.Session(None, "reg", on_frame=no_frames, on_chat=echo_chat)
+        second = session.Session(None, "reg", on_frame=no_frames, on_chat=echo_chat)
+        session.register(first)
+        session.register(second)
+        session.unregister(first)
+        assert session.get_session("reg") is second
+        session.unregister(second)
+        assert session.get_session("reg") is None
+
+
+class TestAsrProtocol:
+    """ASR 二进制协议"""
+
+    def test_init_message_layout(self):
+        msg = asr.init_message()
+        assert (msg[1] >> 4) == asr.FULL_CLIENT_REQUEST
+        assert struct.unpack(">I", msg[4:8])[0] == 1
+        size = struct.unpack(">I", msg[8:12])[0]
+        assert json.loads(gzip.decompress(msg[12:12 + size]))["audio"]["sample_rate"] == 16000
+
+    def test_audio_message_layout(self):
+        msg = asr.audio_message(b"\x01\x02", 7)
+        assert (msg[1] >> 4) == asr.AUDIO_ONLY_REQUEST
+        assert msg[2] == 0
+        assert struct.unpack(">II", msg[4:12]) == (7, 2)
+        assert msg[12:] == b"\x01\x02"
+
+    def test_parse_server_response(self):
+        payload = gzip.compress(json.dumps({"result": [{"text": "你好", "definite": True}]}).encode())
+        header = bytes([0x11, (asr.FULL_SERVER_RESPONSE << 4) | 0x01, 0x11, 0x00])
+        msg = header + struct.pack(">I", 1) + struct.pack(">I", len(payload)) + payload
+        assert asr.parse_response(msg) == {"text": "你好", "is_final": True}
+        assert asr.parse_response(bytes([0x11, asr.SERVER_ACK << 4, 0, 0])) == {"type": "ack"}
+        assert asr.parse_response(b"\x00") is None
@@ -0,0 +1,165 @@
+"""
+HGDoll 会话快照测试
+测试变更日志的写入与重放、压缩重写、不完整帧的处理，以及多进程下的日志路径
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import history
+import snapshot
+
+LONG = "视频帧描述：角色站在城门前，血量还剩一半。" * 20
+
+
+def record(role, content):
+    return history.Record.from_message({"role": role, "content": content})
+
+
+def dump(entries):
+    return {key: (created_at, [(r.role, r.content) for r in records]) for key, created_at, records in entries}
+
+
+class TestJournal:
+    """追加日志"""
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def scenario():
+            journal = snapshot.Journal(path)
+            journal.set("a", 100.0, [record("user", "你好")])
+            journal.append("a", record("assistant", "hi"))
+            journal.set("b", 200.0, [])
+            journal.append("b", record("user", "x"))
+            await journal.flush()
+            journal.delete("b")
+            journal.append("a", record("user", "再见"))
+            await journal.close()
+
+        asyncio.run(scenario())
+        assert dump(snapshot.load(path)) == {
+            "a": (100.0, [("user", "你好"), ("assistant", "hi"), ("user", "再见")]),
+        }
+
+    def test_compressed_records_survive(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+        packed = record("assistant", LONG).compressed_copy()
+
+        async def scenario():
+            journal = snapshot.Journal(path)
+            journal.set("a", 1.0, [packed])
+            await journal.close()
+
+        asyncio.run(scenario())
+        (_, _, records), = snapshot.load(path)
+        assert records[0].compressed
+        assert records[0].content == LONG
+
+    def test_set_replaces_history(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def scenario():
+            journal = snapshot.Journal(path)
+            journal.set("a", 1.0, [record("user", "旧")])
+            journal.set("a", 2.0, [record("user", "新")])
+            await journal.close()
+
+        asyncio.run(scenario())
+        assert dump(snapshot.load(path)) == {"a": (2.0, [("user", "新")])}
+
+    def test_torn_tail_is_ignored(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def scenario():
+            journal = snapshot.Journal(path)
+            journal.set("a", 1.0, [record("user", "完整")])
+            await journal.close()
+
+        asyncio.run(scenario())
+        with open(path, "ab") as f:
+            f.write(snapshot.encode_append("a", record("user", "写了一半"))[:-3])
+        assert dump(snapshot.load(path)) == {"a": (1.0, [("user", "完整")])}
+
+    def test_reopen_appends(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def write(events):
+            journal = snapshot.Journal(path)
+            for key, content in events:
+                journal.append(key, record("user", content))
+            await journal.close()
+
+        async def first():
+            journal = snapshot.Journal(path)
+            journal.set("a", 1.0, [])
+            await journal.close()
+
+        asyncio.run(first())
+        asyncio.run(write([("a", "一")]))
+        asyncio.run(write([("a", "二")]))
+        assert dump(snapshot.load(path)) == {"a": (1.0, [("user", "一"), ("user", "二")])}
+
+    def test_rejects_foreign_file(self, tmp_path):
+        path = tmp_path / "other.log"
+        path.write_bytes(b"not a snapshot")
+        with pytest.raises(ValueError):
+            snapshot.load(str(path))
+
+
+class TestCompaction:
+    """压缩重写"""
+
+    def test_compact_rewrites_live_state(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def scenario():
+            journal = snapshot.Journal(path)
+            for i in range(50):
+                journal.set(f"old-{i}", 1.0, [record("user", LONG)])
+                journal.delete(f"old-{i}")
+            await journal.flush()
+            before = journal.size
+            # 尚未写盘的变更已包含在 state 中
+            journal.append("a", record("user", "pending"))
+            await journal.compact([("a", 5.0, [record("user", "pending")])])
+            journal.append("a", record("assistant", "after"))
+            await journal.close()
+            return before, journal.compacted_size
+
+        before, compacted = asyncio.run(scenario())
+        assert compacted < before
+        assert not os.path.exists(path + ".tmp")
+        assert dump(snapshot.load(path)) == {"a": (5.0, [("user", "pending"), ("assistant", "after")])}
+
+    def test_background_loop_writes(self, tmp_path):
+        path = str(tmp_path / "contexts.log")
+
+        async def scenario():
+            journal = snapshot.Journal(path, interval=0.01)
+            journal.start(lambda: [])
+            journal.set("a", 1.0, [record("user", "x")])
+            await asyncio.sleep(0.1)
+            loaded = snapshot.load(path)
+            await journal.close()
+            return loaded
+
+        assert dump(asyncio.run(scenario())) == {"a": (1.0, [("user", "x")])}
+
+
+class TestPath:
+    """日志路径"""
+
+    def test_worker_suffix(self, monkeypatch):
+        monkeypatch.setenv("HGDOLL_WORKER_INDEX", "2")
+        assert snapshot.snapshot_path("/data/contexts.log") == "/data/contexts.log.2"
+        assert snapshot.snapshot_path("") == ""
+
+    def test_single_process(self, monkeypatch):
+        monkeypatch.delenv("HGDOLL_WORKER_INDEX", raising=False)
+        assert snapshot.snapshot_path("/data/contexts.log") == "/data/contexts.log"
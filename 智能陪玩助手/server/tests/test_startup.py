@@ -0,0 +1,57 @@
+"""
+HGDoll 冷启动测试
+测试延迟导入在第一次调用前不加载模块，以及启动阶段耗时指标
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import metrics
+import startup
+
+
+class TestLazyImport:
+    """延迟导入"""
+
+    def test_module_not_imported_until_called(self):
+        sys.modules.pop("colorsys", None)
+        lazy = startup.lazy_import("colorsys", "rgb_to_hsv")
+        assert "colorsys" not in sys.modules
+        assert lazy(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+        assert "colorsys" in sys.modules
+
+    def test_resolve_cached(self):
+        lazy = startup.lazy_import("json", "dumps")
+        assert lazy.resolve() is lazy.resolve()
+        assert "json.dumps" in repr(lazy)
+
+    def test_missing_attribute_raises_on_use(self):
+        lazy = startup.lazy_import("json", "does_not_exist")
+        try:
+            lazy()
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError("应在调用时抛出 AttributeError")
+
+
+class TestStartupMetrics:
+    """启动阶段耗时"""
+
+    def test_mark_records_phase(self):
+        elapsed = startup.mark("test_phase")
+        assert elapsed >= 0
+        assert 'hgdoll_startup_seconds{phase="test_phase"}' in metrics.render()
+
+    def test_warm_up_imports_in_background(self):
+        sys.modules.pop("colorsys", None)
+
+        async def run():
+            await startup.warm_up_in_background(["colorsys", "no_such_module_for_test"])
+
+        asyncio.run(run())
+        assert "colorsys" in sys.modules
+        assert 'phase="warm_up"' in metrics.render()
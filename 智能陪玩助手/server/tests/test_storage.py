@@ -0,0 +1,151 @@
+"""
+HGDoll 上下文存储测试
+测试 CoroutineSafeMap 的增量聚合计数与游标分页（供 /debug/status 使用）
+"""
+
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+utils = pytest.importorskip("utils", reason="arkitect SDK 未安装，跳过存储测试")
+from arkitect.types.llm.model import ArkMessage  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def clean_map():
+    run(utils.CoroutineSafeMap.clear())
+    yield
+    run(utils.CoroutineSafeMap.clear())
+
+
+class TestAggregates:
+    """聚合计数随写入增量更新"""
+
+    def test_append_updates_counters(self):
+        m = utils.CoroutineSafeMap
+
+        async def scenario():
+            await m.set("a", utils.Context())
+            await m.append("a", ArkMessage(role="user", content="你好"))
+            await m.append("a", ArkMessage(role="assistant", content="hi"))
+
+        run(scenario())
+        stats = m.stats()
+        assert stats["active_contexts"] == 1
+        assert stats["total_messages"] == 2
+        assert stats["total_bytes"] == len("你好".encode()) + 2
+        assert m.peek("a").content_bytes == stats["total_bytes"]
+
+    def test_delete_and_replace(self):
+        m = utils.CoroutineSafeMap
+
+        async def scenario():
+            await m.set("a", utils.Context())
+            await m.append("a", ArkMessage(role="user", content="abc"))
+            await m.set("b", utils.Context())
+            await m.append("b", ArkMessage(role="user", content="de"))
+            await m.set("a", utils.Context())  # 覆盖：旧历史应被扣除
+            await m.delete("b")
+
+        run(scenario())
+        assert m.stats() == {"active_contexts": 1, "total_messages": 0, "total_bytes": 0}
+
+
+class TestPagination:
+    """按 key 游标分页"""
+
+    def test_cursor_walks_all_keys(self):
+        m = utils.CoroutineSafeMap
+
+        async def scenario():
+            for i in range(7):
+                await m.set(f"ctx-{i}", utils.Context())
+
+        run(scenario())
+        seen, cursor = [], ""
+        while True:
+            keys, cursor = m.page(cursor, 3)
+            seen.extend(keys)
+            if cursor is None:
+                break
+        assert seen == [f"ctx-{i}" for i in range(7)]
+
+    def test_missing_context(self):
+        assert utils.CoroutineSafeMap.peek("nope") is None
+        assert utils.CoroutineSafeMap.page("", 5) == ([], None)
+
+
+class TestRecords:
+    """历史以紧凑记录保存，读取时转换回 ArkMessage"""
+
+    def test_append_stores_serialized_records(self):
+        import json
+
+        m = utils.CoroutineSafeMap
+
+        async def scenario():
+            await m.set("a", utils.Context())
+            await m.append("a", ArkMessage(role="user", content="你好"))
+            await m.append("a", ArkMessage(role="assistant", content="hi"))
+            return await m.get_history("a"), await m.get_records("a")
+
+        history, records = run(scenario())
+        assert len(records) == len(history) == 2
+        assert json.loads(records[0].serialized) == {"role": "user", "content": "你好"}
+        assert isinstance(history[1], ArkMessage)
+        assert (history[1].role, history[1].content) == ("assistant", "hi")
+
+    def test_set_converts_existing_history(self):
+        m = utils.CoroutineSafeMap
+        ctx = utils.Context()
+        ctx.history = [ArkMessage(role="user", content="x")]
+
+        async def scenario():
+            await m.set("a", ctx)
+            return await m.get_records("a")
+
+        records = run(scenario())
+        assert [r.role for r in records] == ["user"]
+        assert m.stats()["total_bytes"] == 1
+        assert run(m.get_records("missing")) == []
+
+
+class TestSnapshot:
+    """存储变更写入快照日志，重启后恢复"""
+
+    def test_journal_and_restore(self, tmp_path):
+        import snapshot
+
+        m = utils.CoroutineSafeMap
+        path = str(tmp_path / "contexts.log")
+
+        async def write():
+            journal = snapshot.Journal(path)
+            m.journal = journal
+            try:
+                await m.set("a", utils.Context())
+                await m.append("a", ArkMessage(role="user", content="你好"))
+                await m.set("b", utils.Context())
+                await m.delete("b")
+            finally:
+                m.journal = None
+            await journal.close()
+
+        async def restore():
+            await m.clear()
+            restored = await m.restore(snapshot.load(path))
+            return restored, await m.get_history("a"), await m.contains("b")
+
+        run(write())
+        restored, history, has_b = run(restore())
+        assert restored == 1
+        assert [(h.role, h.content) for h in history] == [("user", "你好")]
+        assert not has_b
+        assert m.stats()["total_messages"] == 1
@@ -0,0 +1,196 @@
+"""
+HGDoll 对话轮次测试
+测试同一会话中新一轮取代旧一轮、相同请求的合并，以及按轮次顺序保存历史
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import turns
+
+
+class TestSupersede:
+    """取代"""
+
+    def test_new_turn_supersedes_in_flight(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            first, _ = sequencer.begin("ctx", "一")
+            second, following = sequencer.begin("ctx", "二")
+            return first, second, following
+
+        before = turns.TURNS.value(outcome="superseded")
+        first, second, following = asyncio.run(scenario())
+        assert first.superseded and not second.superseded
+        assert not following
+        assert second.seq == first.seq + 1
+        assert turns.TURNS.value(outcome="superseded") == before + 1
+
+    def test_finished_turn_not_superseded(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            first, _ = sequencer.begin("ctx", "一")
+            sequencer.end("ctx", first)
+            sequencer.begin("ctx", "二")
+            return first
+
+        assert not asyncio.run(scenario()).superseded
+
+    def test_contexts_independent(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            a, _ = sequencer.begin("a", "一")
+            sequencer.begin("b", "二")
+            return a
+
+        assert not asyncio.run(scenario()).superseded
+
+    def test_guard_cancels_upstream(self):
+        cancelled = []
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            first, _ = sequencer.begin("ctx", "一")
+            waiting = asyncio.create_task(first.guard(upstream()))
+            await asyncio.sleep(0)
+            sequencer.begin("ctx", "二")
+            with pytest.raises(turns.Superseded):
+                await waiting
+            await asyncio.sleep(0)
+
+        asyncio.run(scenario())
+        assert cancelled == [True]
+
+    def test_guard_returns_result(self):
+        async def upstream():
+            await asyncio.sleep(0)
+            return "stream"
+
+        async def scenario():
+            turn, _ = turns.TurnSequencer().begin("ctx", "一")
+            return await turn.guard(upstream())
+
+        assert asyncio.run(scenario()) == "stream"
+
+    def test_disabled(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer(enabled=False)
+            first, _ = sequencer.begin("ctx", "一")
+            second, following = sequencer.begin("ctx", "一")
+            return first, second, following
+
+        first, second, following = asyncio.run(scenario())
+        assert first is not second
+        assert not first.superseded and not following
+
+
+class TestCoalesce:
+    """合并相同请求"""
+
+    def test_identical_request_follows(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            leader, _ = sequencer.begin("ctx", ("你好", True))
+            leader.publish("a")
+            follower, following = sequencer.begin("ctx", ("你好", True))
+            assert following and follower is leader
+
+            async def collect():
+                return [chunk async for chunk in follower.follow()]
+
+            task = asyncio.create_task(collect())
+            await asyncio.sleep(0)
+            leader.publish("b")
+            sequencer.end("ctx", leader)
+            return await task
+
+        before = turns.TURNS.value(outcome="coalesced")
+        assert asyncio.run(scenario()) == ["a", "b"]
+        assert turns.TURNS.value(outcome="coalesced") == before + 1
+
+    def test_follower_stops_when_superseded(self):
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            leader, _ = sequencer.begin("ctx", "一")
+            follower, _ = sequencer.begin("ctx", "一")
+            task = asyncio.create_task(_collect(follower))
+            await asyncio.sleep(0)
+            sequencer.begin("ctx", "二")
+            return await asyncio.wait_for(task, 1)
+
+        assert asyncio.run(scenario()) == []
+
+
+async def _collect(turn):
+    return [chunk async for chunk in turn.follow()]
+
+
+class TestOrderedSave:
+    """按轮次顺序保存"""
+
+    def test_later_turn_waits_for_earlier_save(self):
+        saved = []
+
+        async def save(name, delay):
+            await asyncio.sleep(delay)
+            saved.append(name)
+
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            first, _ = sequencer.begin("ctx", "一")
+            second, _ = sequencer.begin("ctx", "二")
+            # 第二轮先结束，仍然排在第一轮之后保存
+            sequencer.end("ctx", second)
+            later = asyncio.create_task(second.save_in_order(save("二", 0)))
+            await asyncio.sleep(0.01)
+            sequencer.end("ctx", first)
+            await first.save_in_order(save("一", 0.01))
+            await later
+
+        asyncio.run(scenario())
+        assert saved == ["一", "二"]
+
+    def test_nothing_to_save_still_releases_next(self):
+        saved = []
+
+        async def save():
+            saved.append("二")
+
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            first, _ = sequencer.begin("ctx", "一")
+            second, _ = sequencer.begin("ctx", "二")
+            later = asyncio.create_task(second.save_in_order(save()))
+            await first.save_in_order(None)
+            await asyncio.wait_for(later, 1)
+
+        asyncio.run(scenario())
+        assert saved == ["二"]
+
+    def test_wait_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(turns, "SAVE_WAIT_SECONDS", 0.01)
+        saved = []
+
+        async def save():
+            saved.append("二")
+
+        async def scenario():
+            sequencer = turns.TurnSequencer()
+            sequencer.begin("ctx", "一")
+            second, _ = sequencer.begin("ctx", "二")
+            await second.save_in_order(save())
+
+        asyncio.run(scenario())
+        assert saved == ["二"]
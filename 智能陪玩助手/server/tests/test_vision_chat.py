@@ -0,0 +1,128 @@
+"""
+HGDoll 带画面对话的路由测试
+测试消息内容拆分、最近一帧缓存的过期与容量、路由选择以及单次 VLM 调用的图片数量上限
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import vision_chat
+
+
+def image(name):
+    return {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{name}"}}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(vision_chat, "_frames", vision_chat.FrameCache(max_age=5))
+
+
+class TestSplitContent:
+    """消息内容拆分"""
+
+    def test_plain_text(self):
+        assert vision_chat.split_content("你好") == ("你好", [])
+        assert vision_chat.split_content(None) == ("", [])
+
+    def test_frame_request(self):
+        text, images = vision_chat.split_content([{"type": "text", "text": ""}, image("a")])
+        assert text == "" and images == [image("a")]
+
+    def test_mixed_multi_image_any_order(self):
+        text, images = vision_chat.split_content(
+            [image("a"), {"type": "text", "text": "这关"}, image("b"), {"type": "text", "text": "怎么过"}]
+        )
+        assert text == "这关怎么过"
+        assert images == [image("a"), image("b")]
+
+    def test_pydantic_parts(self):
+        class Part(SimpleNamespace):
+            def model_dump(self, exclude_none=False):
+                return dict(self.__dict__)
+
+        text, images = vision_chat.split_content(
+            [Part(type="text", text="看看"), Part(type="image_url", image_url={"url": "x"})]
+        )
+        assert text == "看看"
+        assert images == [{"type": "image_url", "image_url": {"url": "x"}}]
+
+
+class TestFrameCache:
+    """最近一帧缓存"""
+
+    def test_recent_within_age(self):
+        cache = vision_chat.FrameCache(max_age=5)
+        cache.remember("ctx", [image("a")], now=100)
+        assert cache.recent("ctx", now=104) == [image("a")]
+        assert cache.recent("ctx", now=106) is None
+        assert len(cache) == 0
+
+    def test_newer_frame_replaces(self):
+        cache = vision_chat.FrameCache(max_age=5)
+        cache.remember("ctx", [image("a")], now=100)
+        cache.remember("ctx", [image("b")], now=101)
+        assert cache.recent("ctx", now=101) == [image("b")]
+
+    def test_expired_frames_pruned_on_write(self):
+        cache = vision_chat.FrameCache(max_age=5)
+        cache.remember("old", [image("a")], now=100)
+        cache.remember("new", [image("b")], now=110)
+        assert len(cache) == 1
+
+    def test_capacity(self):
+        cache = vision_chat.FrameCache(max_age=60, max_contexts=2)
+        for i in range(3):
+            cache.remember(f"ctx{i}", [image(str(i))], now=100 + i)
+        assert cache.recent("ctx0", now=103) is None
+        assert cache.recent("ctx2", now=103) == [image("2")]
+
+    def test_empty_images_ignored(self):
+        cache = vision_chat.FrameCache()
+        cache.remember("ctx", [])
+        assert len(cache) == 0
+
+
+class TestRoute:
+    """路由选择"""
+
+    def test_fresh_images_use_vision(self):
+        route = vision_chat.route("ctx", [image("a")], enabled=True, now=100)
+        assert (route.path, route.reason, route.images) == (vision_chat.VISION, "fresh", [image("a")])
+        # 自带的图片也作为紧随其后追问的画面
+        follow_up = vision_chat.route("ctx", [], enabled=True, now=102)
+        assert (follow_up.path, follow_up.reason) == (vision_chat.VISION, "recent")
+
+    def test_recent_frame(self):
+        vision_chat.get_frames().remember("ctx", [image("a")], now=100)
+        assert vision_chat.route("ctx", [], enabled=True, now=103).path == vision_chat.VISION
+        stale = vision_chat.route("ctx", [], enabled=True, now=106)
+        assert (stale.path, stale.reason) == (vision_chat.TEXT, "no_frame")
+
+    def test_disabled(self):
+        vision_chat.get_frames().remember("ctx", [image("a")], now=100)
+        assert vision_chat.route("ctx", [], enabled=False, now=101).path == vision_chat.TEXT
+        assert vision_chat.route("ctx", [image("b")], enabled=False, now=101).path == vision_chat.TWO_HOP
+
+    def test_counted(self):
+        before = vision_chat.CHAT_ROUTES.value(path=vision_chat.TEXT, reason="no_frame")
+        vision_chat.route("nobody", [], enabled=True)
+        assert vision_chat.CHAT_ROUTES.value(path=vision_chat.TEXT, reason="no_frame") == before + 1
+
+
+class TestUserContent:
+    """单次 VLM 调用的 user 消息"""
+
+    def test_images_before_text(self):
+        content = vision_chat.user_content("这是什么", [image("a")])
+        assert content == [image("a"), {"type": "text", "text": "这是什么"}]
+
+    def test_keeps_last_images(self, monkeypatch):
+        monkeypatch.setattr(vision_chat, "MAX_IMAGES", 2)
+        content = vision_chat.user_content("比较一下", [image("a"), image("b"), image("c")])
+        assert content[:2] == [image("b"), image("c")]
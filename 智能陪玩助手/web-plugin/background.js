@@ -17,13 +17,17 @@ let config = {
 let contextId = '';
 let isRunning = false;
 let screenshotTimer = null;
+let screenshotLoopId = 0; // 每次启动截图循环递增，避免停止/重启后旧的定时链继续运行
+let nextCaptureDelayMs = null; // 服务端建议的下一次截图间隔（X-Next-Capture-Delay-Ms）
+const MIN_CAPTURE_DELAY_MS = 1000;
+const MAX_CAPTURE_DELAY_MS = 60000;
 let isProcessingScreenshot = false;
 let isProcessingChat = false;
 let chatProcessingStartTime = 0; // 记录开始处理的时间，用于超时保护
 const CHAT_TIMEOUT_MS = 30000; // 聊天请求超时时间 30 秒
 const CHAT_STUCK_TIMEOUT_MS = 60000; // isProcessingChat 卡住超时保护 60 秒
 let screenshotCount = 0;
-const PROACTIVE_CHAT_INTERVAL = 5; // 每 5 次截图后主动发起对话
+const PROACTIVE_CHAT_INTERVAL = 5; // 服务端推送通道不可用时，每 5 次截图后主动发起对话
 let pendingUserMessage = null; // 用户消息队列，避免 isProcessingChat 时丢弃用户输入
 
 // ========== ASR 相关常量（同 Android AsrService） ==========
@@ -172,6 +176,9 @@ async function startService() {
 
   // 开始定时截图
   startScreenshotLoop();
+
+  // 连接服务端推送通道，由服务端决定何时主动发言
+  connectSessionChannel();
 }
 
 function stopService() {
@@ -185,11 +192,15 @@ function stopService() {
   stopKeepAlive();
 
   // 停止截图
+  screenshotLoopId++;
   if (screenshotTimer) {
-    clearInterval(screenshotTimer);
+    clearTimeout(screenshotTimer);
     screenshotTimer = null;
   }
 
+  // 关闭服务端推送通道
+  closeSessionChannel();
+
   // 停止 ASR
   stopMicrophone();
 
@@ -205,19 +216,43 @@ function stopService() {
 }
 
 // ========== 截图模块（对应 Android ScreenshotService） ==========
+// 截图间隔由服务端通过响应头动态调整：负载高或画面静止时放慢，对话活跃时加快
 function startScreenshotLoop() {
   if (screenshotTimer) {
-    clearInterval(screenshotTimer);
+    clearTimeout(screenshotTimer);
   }
 
+  const loopId = ++screenshotLoopId;
   const intervalMs = (config.screenshotInterval || 3) * 1000;
+  nextCaptureDelayMs = null;
+  scheduleNextScreenshot(loopId, intervalMs);
 
-  screenshotTimer = setInterval(async () => {
-    if (!isRunning || isProcessingScreenshot) return;
-    await captureAndUploadScreenshot();
-  }, intervalMs);
+  console.log(`HGDoll: 截图循环已启动, 初始间隔=${intervalMs}ms`);
+}
 
-  console.log(`HGDoll: 截图循环已启动, 间隔=${intervalMs}ms`);
+function scheduleNextScreenshot(loopId, delayMs) {
+  screenshotTimer = setTimeout(async () => {
+    screenshotTimer = null;
+    if (!isRunning || loopId !== screenshotLoopId) return;
+    if (!isProcessingScreenshot) {
+      await captureAndUploadScreenshot();
+    }
+    if (isRunning && loopId === screenshotLoopId) {
+      scheduleNextScreenshot(loopId, getNextCaptureDelay());
+    }
+  }, delayMs);
+}
+
+function getNextCaptureDelay() {
+  if (nextCaptureDelayMs !== null) return nextCaptureDelayMs;
+  return (config.screenshotInterval || 3) * 1000;
+}
+
+function updateCaptureDelay(response) {
+  const hint = parseInt(response.headers.get('X-Next-Capture-Delay-Ms'), 10);
+  if (Number.isFinite(hint)) {
+    nextCaptureDelayMs = Math.min(MAX_CAPTURE_DELAY_MS, Math.max(MIN_CAPTURE_DELAY_MS, hint));
+  }
 }
 
 async function captureAndUploadScreenshot() {
@@ -279,9 +314,10 @@ async function uploadScreenshot(base64Image) {
       },
       body: JSON.stringify(body),
     });
+    updateCaptureDelay(response);
 
     if (response.ok) {
-      console.log('HGDoll: 截图上传成功');
+      console.log(`HGDoll: 截图上传成功, 下次间隔=${getNextCaptureDelay()}ms`);
       // 每 N 次截图后主动触发 AI 对话，让 AI 基于已分析的画面主动说话
       screenshotCount++;
       // 超时保护：如果 isProcessingChat 卡住超过 60 秒，强制重置
@@ -291,7 +327,8 @@ async function uploadScreenshot(base64Image) {
         isProcessingChat = false;
         chatProcessingStartTime = 0;
       }
-      if (screenshotCount >= PROACTIVE_CHAT_INTERVAL && !isProcessingChat) {
+      // 已连接服务端推送通道时由服务端主动发言，这里只作为旧版服务端的回退
+      if (!serverProactive && screenshotCount >= PROACTIVE_CHAT_INTERVAL && !isProcessingChat) {
         screenshotCount = 0;
         console.log('HGDoll: 触发主动对话 (screenshotCount reached interval)');
         sendChatMessage('根据你刚才看到的画面，和我聊聊吧');
@@ -304,6 +341,102 @@ async function uploadScreenshot(base64Image) {
   }
 }
 
+// ========== 服务端推送通道（/ws/session） ==========
+// 服务端根据画面变化与用户沉默时间决定何时主动发言，生成好文字和音频后整轮推送过来
+let sessionSocket = null;
+let sessionReconnectTimer = null;
+let serverProactive = false;
+let pushedTurn = null; // 正在接收的推送轮次 { turn, text, audio: [] }
+const SESSION_RECONNECT_MS = 5000;
+
+function connectSessionChannel() {
+  if (!isRunning || !config.serverIp || !contextId) return;
+  closeSessionChannel();
+
+  const url = `ws://${config.serverIp}/ws/session?context_id=${encodeURIComponent(contextId)}`;
+  const socket = new WebSocket(url);
+  socket.binaryType = 'arraybuffer';
+  sessionSocket = socket;
+
+  socket.onmessage = (event) => handleSessionMessage(event);
+  socket.onclose = () => {
+    if (sessionSocket !== socket) return;
+    sessionSocket = null;
+    serverProactive = false;
+    pushedTurn = null;
+    // 服务端不支持或连接中断：回退到按截图数触发，稍后重连
+    if (isRunning) {
+      sessionReconnectTimer = setTimeout(connectSessionChannel, SESSION_RECONNECT_MS);
+    }
+  };
+  socket.onerror = () => {
+    console.warn('HGDoll: 服务端推送通道连接失败');
+  };
+}
+
+function closeSessionChannel() {
+  if (sessionReconnectTimer) {
+    clearTimeout(sessionReconnectTimer);
+    sessionReconnectTimer = null;
+  }
+  if (sessionSocket) {
+    const socket = sessionSocket;
+    sessionSocket = null;
+    socket.close();
+  }
+  serverProactive = false;
+  pushedTurn = null;
+}
+
+function handleSessionMessage(event) {
+  if (event.data instanceof ArrayBuffer) {
+    // 0x03 audio-out：1 字节类型 + 4 字节轮次号 + MP3
+    const view = new DataView(event.data);
+    if (pushedTurn && view.getUint8(0) === 0x03 && view.getUint32(1) === pushedTurn.turn) {
+      pushedTurn.audio.push(new Uint8Array(event.data, 5));
+    }
+    return;
+  }
+
+  let message;
+  try {
+    message = JSON.parse(event.data);
+  } catch (e) {
+    return;
+  }
+
+  if (message.type === 'transcript' && pushedTurn && message.turn === pushedTurn.turn) {
+    pushedTurn.text += message.text;
+  } else if (message.type === 'control') {
+    if (message.event === 'ready') {
+      serverProactive = true;
+      console.log('HGDoll: 服务端推送通道已连接，主动发言由服务端调度');
+    } else if (message.event === 'turn_start' && message.source === 'proactive') {
+      pushedTurn = { turn: message.turn, text: '', audio: [] };
+    } else if (message.event === 'turn_end' && pushedTurn && message.turn === pushedTurn.turn) {
+      const { text, audio } = pushedTurn;
+      pushedTurn = null;
+      console.log('HGDoll: 收到服务端主动发言:', text);
+      if (text) {
+        broadcastToTabs({ type: 'AI_RESPONSE', text });
+      }
+      if (audio.length > 0) {
+        broadcastToTabs({ type: 'PLAY_AUDIO', audioData: bytesToBase64(audio) });
+      }
+    }
+  }
+}
+
+function bytesToBase64(chunks) {
+  let binary = '';
+  for (const chunk of chunks) {
+    for (let i = 0; i < chunk.length; i += 0x8000) {
+      binary += String.fromCharCode.apply(null, chunk.subarray(i, i + 0x8000));
+    }
+  }
+  return btoa(binary);
+}
+
 // ========== 聊天/语音消息模块（对应 Android AsrService 的 sendToServer） ==========
 async function sendChatMessage(text) {
   if (!config.serverIp || !contextId) {
@@ -371,8 +504,15 @@ async function sendChatMessage(text) {
     } else {
       const errBody = await response.text().catch(() => '');
       console.error('HGDoll: 聊天请求失败', response.status, errBody.substring(0, 200));
-      broadcastToTabs({ type: 'AI_RESPONSE', text: `[请求失败] HTTP ${response.status}，请检查服务器是否运行` });
-      broadcastToTabs({ type: 'STATUS_UPDATE', text: `请求失败: HTTP ${response.status}` });
+      if (response.status === 429 || response.status === 503) {
+        // 服务端准入控制拒绝：服务繁忙，按 Retry-After 提示稍后重试
+        const retryAfter = parseInt(response.headers.get('Retry-After') || '', 10) || 2;
+        broadcastToTabs({ type: 'AI_RESPONSE', text: `[服务繁忙] 请 ${retryAfter} 秒后再试` });
+        broadcastToTabs({ type: 'STATUS_UPDATE', text: `服务繁忙，${retryAfter} 秒后可重试` });
+      } else {
+        broadcastToTabs({ type: 'AI_RESPONSE', text: `[请求失败] HTTP ${response.status}，请检查服务器是否运行` });
+        broadcastToTabs({ type: 'STATUS_UPDATE', text: `请求失败: HTTP ${response.status}` });
+      }
     }
   } catch (err) {
     clearTimeout(timeoutId);